@@ -1,21 +1,238 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List, Optional
+import time
+
+_import_started = time.perf_counter()
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Header, Query, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from typing import TYPE_CHECKING, List, Optional, Tuple
+from dataclasses import asdict, dataclass
+from datetime import datetime
 import os
+import json
+import hashlib
+import uuid
 import logging
 import asyncio
 
 # 配置 Root Logger 為 INFO
 logging.basicConfig(level=logging.INFO)
 
-from sidecar.domain.models import Source, DownloadMode, TaskStatus, Task, Metadata
+# 這裡只載入輕量模組；httpx、yt-dlp、bs4 與下載器由 Subsystem 在第一次使用時才載入
+from sidecar.domain.models import Source, DownloadMode, DMHYSearchMode, TaskStatus, Task, Metadata, PostProcessOptions
 from sidecar.application.use_cases import DownloadTaskUseCase, SearchMetadataUseCase
-from sidecar.infrastructure.metadata_provider import BangumiMetadataProvider
-from sidecar.infrastructure.youtube_downloader import YouTubeDownloader
-from sidecar.infrastructure.dmhy_downloader import DMHYDownloader
+from sidecar.application.download_scheduler import DownloadScheduler, SchedulerFullError
 from sidecar.infrastructure.task_manager import TaskManager
+from sidecar.infrastructure.task_events import TaskEventBus, task_to_dict
+from sidecar.infrastructure.task_journal import JsonTaskJournal
+from sidecar.infrastructure.metrics import LoopLagMonitor, SidecarMetrics
+from sidecar.infrastructure.profiler import SamplingProfiler
+from sidecar.infrastructure.task_trace import chrome_trace
+from sidecar.app.startup import StartupReport, Subsystem, import_module, prewarm
+
+if TYPE_CHECKING:
+    from sidecar.infrastructure.bandwidth import BandwidthLimiter
+    from sidecar.infrastructure.http_client import HttpClientPool
+    from sidecar.infrastructure.library_index import SQLiteLibraryIndex
+    from sidecar.infrastructure.postprocess import PostProcessPool
+    from sidecar.infrastructure.resolution_cache import SQLiteResolutionCache
+    from sidecar.infrastructure.ytdlp_pool import YtdlpProcessPool
+
+startup_report = StartupReport(origin=_import_started)
+startup_report.record("import:app", time.perf_counter() - _import_started, _import_started)
+_init_started = time.perf_counter()
+
+BANGUMI_BASE_URL = os.environ.get("OPUSED_BANGUMI_BASE_URL", "https://api.bgm.tv")
+DMHY_BASE_URL = os.environ.get("OPUSED_DMHY_BASE_URL", "https://share.dmhy.org")
+DATA_DIR = os.environ.get(
+    "OPUSED_DATA_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+)
+# 由 python -m sidecar.infrastructure.bangumi_index 匯入的本機索引；存在時預設為 hybrid 模式
+BANGUMI_INDEX = os.environ.get("OPUSED_BANGUMI_INDEX", os.path.join(DATA_DIR, "bangumi_index.sqlite3"))
+METADATA_MODE = os.environ.get("OPUSED_METADATA_MODE") or ("hybrid" if os.path.exists(BANGUMI_INDEX) else "online")
+METADATA_CACHE_TTL = float(os.environ.get("OPUSED_METADATA_CACHE_TTL", 24 * 3600))
+METADATA_BATCH_CONCURRENCY = int(os.environ.get("OPUSED_METADATA_BATCH_CONCURRENCY", 8))
+DOWNLOAD_CONCURRENCY = int(os.environ.get("OPUSED_DOWNLOAD_CONCURRENCY", 4))
+YOUTUBE_CONCURRENCY = int(os.environ.get("OPUSED_YOUTUBE_CONCURRENCY", 2))
+DMHY_CONCURRENCY = int(os.environ.get("OPUSED_DMHY_CONCURRENCY", 3))
+DOWNLOAD_QUEUE_SIZE = int(os.environ.get("OPUSED_DOWNLOAD_QUEUE_SIZE", 1000))
+YTDLP_WORKERS = int(os.environ.get("OPUSED_YTDLP_WORKERS", YOUTUBE_CONCURRENCY))
+YTDLP_MAX_JOBS_PER_WORKER = int(os.environ.get("OPUSED_YTDLP_MAX_JOBS_PER_WORKER", 20))
+YTDLP_WARM_TIMEOUT = float(os.environ.get("OPUSED_YTDLP_WARM_TIMEOUT", 60))
+RESOLUTION_CACHE_TTL = float(os.environ.get("OPUSED_RESOLUTION_CACHE_TTL", 30 * 24 * 3600))
+RESOLVE_CONCURRENCY = int(os.environ.get("OPUSED_RESOLVE_CONCURRENCY", 4))
+BT_MAX_PEERS = int(os.environ.get("OPUSED_BT_MAX_PEERS", 30))
+TASK_EVENTS_PER_SECOND = float(os.environ.get("OPUSED_TASK_EVENTS_PER_SECOND", 4))
+TASK_STREAM_MAX_BACKLOG = int(os.environ.get("OPUSED_TASK_STREAM_MAX_BACKLOG", 500))
+FINISHED_TASK_TTL = float(os.environ.get("OPUSED_FINISHED_TASK_TTL", 3600))
+MAX_FINISHED_TASKS = int(os.environ.get("OPUSED_MAX_FINISHED_TASKS", 1000))
+# 服務開始監聽後在背景預先載入所有子系統；設為 0 則全部延到第一次使用
+PREWARM = os.environ.get("OPUSED_PREWARM", "1").lower() not in ("0", "false", "no")
+PREWARM_DELAY = float(os.environ.get("OPUSED_PREWARM_DELAY", 0.5))
+LOOP_LAG_INTERVAL = float(os.environ.get("OPUSED_LOOP_LAG_INTERVAL", 0.5))
+# 取樣式分析器預設關閉；設為 1 時啟動即開始取樣，也可用 POST /profiler 切換
+PROFILER = os.environ.get("OPUSED_PROFILER", "0").lower() in ("1", "true", "yes")
+PROFILER_INTERVAL = float(os.environ.get("OPUSED_PROFILER_INTERVAL", 0.005))
+# 全域下載頻寬上限 (bytes/s)，0 表示不限
+BANDWIDTH_LIMIT = int(os.environ.get("OPUSED_BANDWIDTH_LIMIT", 0))
+HTTP_CONNECTIONS = int(os.environ.get("OPUSED_HTTP_CONNECTIONS", 4))
+YTDLP_FRAGMENTS = int(os.environ.get("OPUSED_YTDLP_FRAGMENTS", 4))
+# 同一下載資料夾兩次掃描的最短間隔 (秒)
+LIBRARY_REFRESH_INTERVAL = float(os.environ.get("OPUSED_LIBRARY_REFRESH_INTERVAL", 30))
+# 下載前比對已下載歌曲時最多等待掃描的秒數，逾時以目前的索引比對
+LIBRARY_SCAN_WAIT = float(os.environ.get("OPUSED_LIBRARY_SCAN_WAIT", 2))
+# 轉檔、寫入標籤的工作行程數；與下載並行，預設使用一半的 CPU
+POSTPROCESS_WORKERS = int(os.environ.get("OPUSED_POSTPROCESS_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+
+@dataclass
+class DownloadServices:
+    use_case: DownloadTaskUseCase
+    ytdlp_pool: "YtdlpProcessPool"
+    resolution_cache: "SQLiteResolutionCache"
+    postprocess_pool: "PostProcessPool"
+    bandwidth: "BandwidthLimiter"
+    library: "SQLiteLibraryIndex"
+
+async def _build_http_clients() -> "HttpClientPool":
+    # 每個上游主機一個長連線 client，由 lifespan 負責關閉
+    module = await import_module("sidecar.infrastructure.http_client", startup_report)
+    rate_limit = await import_module("sidecar.infrastructure.rate_limit", startup_report)
+    return module.HttpClientPool(
+        module.HttpClientConfig.from_env(),
+        event_hooks=sidecar_metrics.http_event_hooks(),
+        rate_limiter=rate_limit.AdaptiveRateLimiter(rate_limit.RateLimitConfig.from_env()),
+    )
 
-app = FastAPI(title="OpusED Sidecar API (Stateless)")
+async def _build_metadata() -> SearchMetadataUseCase:
+    clients = await http_clients.get()
+    provider_module = await import_module("sidecar.infrastructure.metadata_provider", startup_report)
+    cache_module = await import_module("sidecar.infrastructure.metadata_cache", startup_report)
+    store = await asyncio.to_thread(
+        cache_module.SQLiteMetadataStore, os.path.join(DATA_DIR, "metadata_cache.sqlite3")
+    )
+    index = None
+    if METADATA_MODE != "online":
+        index_module = await import_module("sidecar.infrastructure.bangumi_index", startup_report)
+        index = await asyncio.to_thread(index_module.BangumiIndex, BANGUMI_INDEX)
+    provider = cache_module.CachedMetadataProvider(
+        provider_module.BangumiMetadataProvider(
+            base_url=BANGUMI_BASE_URL,
+            client=clients.get_client(BANGUMI_BASE_URL, headers=provider_module.DEFAULT_HEADERS, read_timeout=12.0),
+            index=index,
+            mode=METADATA_MODE,
+        ),
+        store=store,
+        ttl=METADATA_CACHE_TTL,
+    )
+    return SearchMetadataUseCase(provider)
+
+async def _build_downloads() -> DownloadServices:
+    clients = await http_clients.get()
+    youtube = await import_module("sidecar.infrastructure.youtube_downloader", startup_report)
+    pool_module = await import_module("sidecar.infrastructure.ytdlp_pool", startup_report)
+    dmhy = await import_module("sidecar.infrastructure.dmhy_downloader", startup_report)
+    bittorrent = await import_module("sidecar.infrastructure.bittorrent", startup_report)
+    cache_module = await import_module("sidecar.infrastructure.resolution_cache", startup_report)
+    postprocess = await import_module("sidecar.infrastructure.postprocess", startup_report)
+    bandwidth_module = await import_module("sidecar.infrastructure.bandwidth", startup_report)
+    library_module = await import_module("sidecar.infrastructure.library_index", startup_report)
+    provider_module = await import_module("sidecar.infrastructure.metadata_provider", startup_report)
+
+    bandwidth = bandwidth_module.BandwidthLimiter(BANDWIDTH_LIMIT or None)
+    ytdlp_options = youtube.ytdlp_options(YTDLP_FRAGMENTS)
+    # 工作行程在 ytdlp 子系統預熱或第一次下載時才啟動
+    pool = pool_module.YtdlpProcessPool(
+        workers=YTDLP_WORKERS, max_jobs_per_worker=YTDLP_MAX_JOBS_PER_WORKER, warm_opts=ytdlp_options
+    )
+    downloaders = [
+        youtube.YouTubeDownloader(pool=pool, options=ytdlp_options, bandwidth=bandwidth),
+        dmhy.DMHYDownloader(
+            base_url=DMHY_BASE_URL,
+            client=clients.get_client(DMHY_BASE_URL),
+            bt_client=bittorrent.BitTorrentClient(client=clients.get_client(DMHY_BASE_URL), max_peers=BT_MAX_PEERS),
+            bandwidth=bandwidth,
+            max_connections=HTTP_CONNECTIONS,
+        ),
+    ]
+    resolution_cache = await asyncio.to_thread(
+        cache_module.SQLiteResolutionCache,
+        os.path.join(DATA_DIR, "resolution_cache.sqlite3"),
+        ttl=RESOLUTION_CACHE_TTL,
+    )
+    library = await asyncio.to_thread(
+        library_module.SQLiteLibraryIndex,
+        os.path.join(DATA_DIR, "library.sqlite3"),
+        refresh_interval=LIBRARY_REFRESH_INTERVAL,
+        scan_wait=LIBRARY_SCAN_WAIT,
+    )
+    # 行程池在第一個需要後處理的任務時才建立
+    postprocess_pool = postprocess.PostProcessPool(
+        workers=POSTPROCESS_WORKERS,
+        # 與 Bangumi 元數據共用同一個 client，設定需一致
+        client=clients.get_client(BANGUMI_BASE_URL, headers=provider_module.DEFAULT_HEADERS, read_timeout=12.0),
+        cover_base_url=BANGUMI_BASE_URL,
+        cover_dir=os.path.join(DATA_DIR, "covers"),
+    )
+    use_case = DownloadTaskUseCase(
+        downloaders,
+        scheduler=download_scheduler,
+        journal=task_journal,
+        resolution_cache=resolution_cache,
+        metrics=sidecar_metrics,
+        postprocessor=postprocess_pool,
+        library=library,
+    )
+    return DownloadServices(
+        use_case=use_case,
+        ytdlp_pool=pool,
+        resolution_cache=resolution_cache,
+        postprocess_pool=postprocess_pool,
+        bandwidth=bandwidth,
+        library=library,
+    )
+
+async def _warm_ytdlp() -> "YtdlpProcessPool":
+    pool = (await downloads.get()).ytdlp_pool
+    pool.start()
+    if await pool.wait_warm(timeout=YTDLP_WARM_TIMEOUT) == 0:
+        raise RuntimeError("yt-dlp 工作行程預熱逾時")
+    return pool
+
+http_clients: Subsystem["HttpClientPool"] = Subsystem("http", _build_http_clients, startup_report)
+metadata: Subsystem[SearchMetadataUseCase] = Subsystem("metadata", _build_metadata, startup_report)
+downloads: Subsystem[DownloadServices] = Subsystem("downloads", _build_downloads, startup_report)
+ytdlp: Subsystem["YtdlpProcessPool"] = Subsystem("ytdlp", _warm_ytdlp, startup_report)
+SUBSYSTEMS = [http_clients, metadata, downloads, ytdlp]
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 預熱在背景進行，lifespan 立即結束讓伺服器開始監聽
+    prewarm_task = asyncio.create_task(prewarm(SUBSYSTEMS, startup_report, delay=PREWARM_DELAY)) if PREWARM else None
+    loop_lag_monitor.start()
+    if PROFILER:
+        profiler.start()
+    startup_report.record("lifespan", 0.0)
+    yield
+    if prewarm_task:
+        prewarm_task.cancel()
+    await loop_lag_monitor.stop()
+    await asyncio.to_thread(profiler.stop)
+    await download_scheduler.stop()
+    services = downloads.peek()
+    if services:
+        services.ytdlp_pool.shutdown()
+        services.postprocess_pool.shutdown()
+        await asyncio.to_thread(services.resolution_cache.close)
+        await asyncio.to_thread(services.library.close)
+    search = metadata.peek()
+    if search:
+        await search.metadata_provider.aclose()
+    clients = http_clients.peek()
+    if clients:
+        await clients.aclose()
+
+app = FastAPI(title="OpusED Sidecar API (Stateless)", lifespan=lifespan)
 
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -27,19 +244,62 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 基礎設施實例
-metadata_provider = BangumiMetadataProvider()
-downloaders = [YouTubeDownloader(), DMHYDownloader()]
+# 基礎設施實例（輕量，立即建立）
 task_manager = TaskManager.get_instance()
+task_manager.configure(terminal_ttl=FINISHED_TASK_TTL, max_terminal=MAX_FINISHED_TASKS)
+task_events = TaskEventBus(
+    task_manager,
+    max_events_per_second=TASK_EVENTS_PER_SECOND,
+    max_client_backlog=TASK_STREAM_MAX_BACKLOG,
+)
+task_journal = JsonTaskJournal(os.path.join(DATA_DIR, "tasks"))
+sidecar_metrics = SidecarMetrics()
+loop_lag_monitor = LoopLagMonitor(sidecar_metrics.loop_lag.observe, interval=LOOP_LAG_INTERVAL)
+profiler = SamplingProfiler(interval=PROFILER_INTERVAL)
 
-# 用例實例
-download_task_use_case = DownloadTaskUseCase(downloaders)
-search_metadata_use_case = SearchMetadataUseCase(metadata_provider)
+# 排程器立即建立，下載用例在第一次使用時才組裝
+download_scheduler = DownloadScheduler(
+    max_concurrency=DOWNLOAD_CONCURRENCY,
+    per_source_limits={Source.YOUTUBE: YOUTUBE_CONCURRENCY, Source.DMHY: DMHY_CONCURRENCY},
+    max_queue_size=DOWNLOAD_QUEUE_SIZE,
+    metrics=sidecar_metrics,
+)
+
+def _collect_metrics() -> None:
+    # 只讀取已建立的子系統，/metrics 不會觸發載入
+    sidecar_metrics.record_scheduler(download_scheduler.stats())
+    clients = http_clients.peek()
+    if clients and clients.rate_limiter:
+        sidecar_metrics.record_rate_limits(clients.rate_limiter.stats())
+    search = metadata.peek()
+    if search:
+        stats = search.metadata_provider.get_stats()
+        sidecar_metrics.record_cache("metadata", stats["memory_hits"] + stats["disk_hits"], stats["misses"])
+        index = search.metadata_provider.provider.index
+        if index is not None:
+            sidecar_metrics.record_cache("bangumi_index", index.stats.hits, index.stats.misses)
+    services = downloads.peek()
+    if services:
+        stats = services.resolution_cache.get_stats()
+        sidecar_metrics.record_cache("resolution", stats["hits"], stats["misses"])
+        stats = services.library.get_stats()
+        sidecar_metrics.record_cache("library", stats["hits"], stats["misses"])
+        sidecar_metrics.record_postprocess(services.postprocess_pool.stats())
+        sidecar_metrics.record_bandwidth(services.bandwidth.stats())
+
+sidecar_metrics.add_collector(_collect_metrics)
+startup_report.record("init:app", time.perf_counter() - _init_started, _init_started)
 
 class SearchRequest(BaseModel):
     title: str
     token: Optional[str] = None
 
+class BatchSearchRequest(BaseModel):
+    titles: List[str] = Field(..., min_length=1)
+    token: Optional[str] = None
+    # 未指定時使用 OPUSED_METADATA_BATCH_CONCURRENCY，且不可超過該上限
+    concurrency: Optional[int] = Field(None, ge=1)
+
 class DownloadRequest(BaseModel):
     # 此 Request 結構應與 Task Domain Model 保持一致
     task_id: str  # 由 Electron 傳入，確保兩端 ID 一致
@@ -47,61 +307,368 @@ class DownloadRequest(BaseModel):
     target_dir: str
     source: str
     dmhy_mode: str = "video"
+    dmhy_search: str = "rss"  # "rss" 或 "html"
     metadata: Optional[dict] = None
     custom_keywords: Optional[str] = None
+    priority: int = 0
+    batch_id: Optional[str] = None
+    # 後處理設定，欄位同 PostProcessOptions，例如 {"audio_codec": "mp3", "filename_template": "{song_title}"}
+    postprocess: Optional[dict] = None
+    # 此任務的下載頻寬上限 (bytes/s)
+    bandwidth_limit: Optional[int] = Field(None, gt=0)
+    # 下載資料夾中已有這首歌時直接標記為完成，不再下載
+    skip_existing: bool = True
+
+class PriorityRequest(BaseModel):
+    priority: int
+
+class ProfilerRequest(BaseModel):
+    enabled: bool
+    interval: Optional[float] = Field(None, gt=0, le=1)
+    # 幾秒後自動停止；未指定時持續取樣直到關閉
+    duration: Optional[float] = Field(None, gt=0)
+
+class ResolveBatchRequest(BaseModel):
+    tasks: List[DownloadRequest] = Field(..., min_length=1)
+    # 未指定時使用 OPUSED_RESOLVE_CONCURRENCY，且不可超過該上限
+    concurrency: Optional[int] = Field(None, ge=1)
+
+class DownloadBatchRequest(BaseModel):
+    # 各項目個別驗證，格式錯誤只會讓該項目失敗，不影響其他項目
+    tasks: List[dict] = Field(..., min_length=1)
+    # 整批共用的批次 ID，會覆寫各項目的 batch_id；未指定時自動產生
+    batch_id: Optional[str] = None
+
+def _task_from_request(req: DownloadRequest) -> Task:
+    """由請求重建 Task 實體；欄位不合法時拋出例外。"""
+    task_metadata = None
+    if req.metadata:
+        task_metadata = Metadata(**req.metadata)
+
+    return Task(
+        id=req.task_id,  # 使用客戶端傳入的 ID
+        anime_title=req.anime_title,
+        target_dir=req.target_dir,
+        source=Source(req.source),
+        dmhy_mode=DownloadMode(req.dmhy_mode),
+        dmhy_search=DMHYSearchMode(req.dmhy_search),
+        metadata=task_metadata,
+        custom_keywords=req.custom_keywords,
+        priority=req.priority,
+        batch_id=req.batch_id,
+        postprocess=PostProcessOptions(**req.postprocess) if req.postprocess else None,
+        bandwidth_limit=req.bandwidth_limit,
+    )
+
+def _build_task(req: DownloadRequest) -> Task:
+    """由請求重建 Task 實體；欄位不合法時拋出 HTTP 400。"""
+    try:
+        return _task_from_request(req)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _validate_batch(req: DownloadBatchRequest, batch_id: str) -> Tuple[List[Task], List[dict], List[Task]]:
+    """
+    一次驗證整批項目，回傳 (可排入的任務, 錯誤清單, 其中需先比對下載資料夾的任務)。
+    錯誤包含欄位不合法、同一批內重複的 task_id，以及已在排程中的任務。
+    """
+    tasks: List[Task] = []
+    errors: List[dict] = []
+    check_existing: List[Task] = []
+    seen = set()
+    for index, item in enumerate(req.tasks):
+        task_id = item.get("task_id")
+        try:
+            item_req = DownloadRequest.model_validate({**item, "batch_id": batch_id})
+            task = _task_from_request(item_req)
+        except ValidationError as e:
+            errors.append({"index": index, "task_id": task_id, "error": _validation_message(e)})
+            continue
+        except Exception as e:
+            errors.append({"index": index, "task_id": task_id, "error": str(e)})
+            continue
+        if task.id in seen:
+            errors.append({"index": index, "task_id": task.id, "error": f"Task {task.id} 在同一批次中重複"})
+        elif download_scheduler.is_active(task.id):
+            errors.append({"index": index, "task_id": task.id, "error": f"Task {task.id} 已在排程中"})
+        else:
+            seen.add(task.id)
+            tasks.append(task)
+            if item_req.skip_existing:
+                check_existing.append(task)
+    return tasks, errors, check_existing
+
+def _validation_message(e: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(p) for p in err['loc']) or 'body'}: {err['msg']}" for err in e.errors()
+    )
 
 @app.get("/metadata/search")
 async def search_metadata(title: str, token: Optional[str] = None):
     """提供搜尋服務介面"""
-    return await search_metadata_use_case.execute(title, token=token)
+    return await (await metadata.get()).execute(title, token=token)
 
-async def _execute_download_background(task: Task) -> None:
-    """背景執行下載任務。"""
-    logger = logging.getLogger(__name__)
-    logger.info(f"[Background] Starting download for task {task.id}")
-    try:
-        await download_task_use_case.execute(task)
-        logger.info(f"[Background] Download completed for task {task.id}, status={task.status.value}")
-    except Exception as e:
-        logger.error(f"[Background] Download failed for task {task.id}: {e}")
-        task.update_status(TaskStatus.FAILED, error=str(e))
+@app.post("/metadata/search/batch")
+async def search_metadata_batch(req: BatchSearchRequest):
+    """
+    批次搜尋，以 NDJSON 串流回傳：每完成一個標題即輸出一行
+    {"index", "title", "results", "error"}，順序為完成順序。
+    """
+    concurrency = min(req.concurrency or METADATA_BATCH_CONCURRENCY, METADATA_BATCH_CONCURRENCY)
+    search_metadata_use_case = await metadata.get()
+
+    async def _stream():
+        async for item in search_metadata_use_case.execute_batch(
+            req.titles, token=req.token, concurrency=concurrency
+        ):
+            yield json.dumps(asdict(item), ensure_ascii=False) + "\n"
 
+    return StreamingResponse(_stream(), media_type="application/x-ndjson")
+
+@app.get("/metadata/cache/stats")
+async def metadata_cache_stats():
+    """元數據快取命中/未命中統計。"""
+    return (await metadata.get()).metadata_provider.get_stats()
+
+@app.get("/metadata/index/stats")
+async def metadata_index_stats():
+    """本機 Bangumi 索引的模式、收錄數量與命中統計。"""
+    provider = (await metadata.get()).metadata_provider.provider
+    if provider.index is None:
+        return {"mode": provider.mode}
+    return {"mode": provider.mode, **await asyncio.to_thread(provider.index.get_stats)}
 
 @app.post("/download")
 async def execute_download(req: DownloadRequest):
     """
     啟動下載任務（異步）。
-    立即返回 task_id，客戶端可通過 GET /tasks/{task_id}/status 輪詢進度。
+    任務交由排程器排隊執行，立即返回 task_id，
+    客戶端可通過 GET /tasks/{task_id}/status 輪詢進度。
     """
+    # 重建 Task 實體用於下載器
+    task = _build_task(req)
+    download_task_use_case = (await downloads.get()).use_case
+
+    # 下載資料夾中已有這首歌時直接完成，不佔用排程名額
+    if req.skip_existing and not download_scheduler.is_active(task.id):
+        if await download_task_use_case.find_existing(task):
+            task_manager.add_task(task)
+            logging.info(f"[/download] Task {task.id} already present: {task.output_files}")
+            return {"task_id": task.id, "status": task.status.value}
+
+    # 交給排程器（不等待完成）；佇列已滿時拒絕，不登記到管理器
     try:
-        # 重建 Task 實體用於下載器
-        task_metadata = None
-        if req.metadata:
-            task_metadata = Metadata(**req.metadata)
-
-        task = Task(
-            id=req.task_id,  # 使用客戶端傳入的 ID
-            anime_title=req.anime_title,
-            target_dir=req.target_dir,
-            source=Source(req.source),
-            dmhy_mode=DownloadMode(req.dmhy_mode),
-            metadata=task_metadata,
-            custom_keywords=req.custom_keywords
-        )
-
-        # 將任務加入管理器
+        download_task_use_case.submit(task)
+    except SchedulerFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    task_manager.add_task(task)
+    logging.info(f"[/download] Task {task.id} queued, total tasks: {len(task_manager.get_all_tasks())}")
+
+    return {
+        "task_id": task.id,
+        "status": task.status.value
+    }
+
+@app.post("/download/batch")
+async def execute_download_batch(req: DownloadBatchRequest):
+    """
+    一次排入多個下載任務。所有項目先經過同一次驗證，合法的任務整批交給排程器並登記到管理器，
+    不合法的項目列在 errors ({"index", "task_id", "error"})，不影響其他項目。
+    佇列容量不足以容納整批時整批拒絕 (503)，不會只排入一部分。
+    下載資料夾中已有的歌曲直接完成，不進入排程，列在 present。
+    """
+    batch_id = req.batch_id or uuid.uuid4().hex
+    tasks, errors, check_existing = _validate_batch(req, batch_id)
+    present: List[Task] = []
+    if tasks:
+        download_task_use_case = (await downloads.get()).use_case
+        found = await asyncio.gather(*(download_task_use_case.find_existing(t) for t in check_existing))
+        present = [t for t, hit in zip(check_existing, found) if hit]
+        present_ids = {t.id for t in present}
+        try:
+            download_task_use_case.submit_batch([t for t in tasks if t.id not in present_ids])
+        except SchedulerFullError as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+        except ValueError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        task_manager.add_tasks(tasks)
+    logging.info(
+        f"[/download/batch] Batch {batch_id}: {len(tasks) - len(present)} queued, {len(present)} already present, "
+        f"{len(errors)} rejected, total tasks: {len(task_manager.get_all_tasks())}"
+    )
+
+    return {
+        "batch_id": batch_id,
+        "task_ids": [t.id for t in tasks],
+        "present": [t.id for t in present],
+        "errors": errors,
+    }
+
+@app.get("/download/batch/{batch_id}")
+async def get_download_batch(batch_id: str):
+    """批次內各任務的狀態與依狀態統計的數量。"""
+    tasks = task_manager.get_batch(batch_id)
+    if not tasks:
+        raise HTTPException(status_code=404, detail=f"Batch {batch_id} not found")
+    counts: dict = {}
+    for t in tasks:
+        counts[t.status.value] = counts.get(t.status.value, 0) + 1
+    return {
+        "batch_id": batch_id,
+        "total": len(tasks),
+        "counts": counts,
+        "tasks": [task_to_dict(t) for t in tasks],
+    }
+
+@app.delete("/download/batch/{batch_id}")
+async def remove_download_batch(batch_id: str, keep_partial: bool = False):
+    """取消並移除整個批次，每個任務的處理與 DELETE /tasks/{task_id} 相同。"""
+    tasks = task_manager.get_batch(batch_id)
+    if not tasks:
+        raise HTTPException(status_code=404, detail=f"Batch {batch_id} not found")
+    download_task_use_case = (await downloads.get()).use_case
+    # 先移出佇列，中斷執行中的任務時不會讓同批次的下一個任務開始
+    for t in tasks:
+        download_scheduler.discard(t.id)
+    await asyncio.gather(*(download_task_use_case.cancel(t, keep_partial=keep_partial) for t in tasks))
+    for t in tasks:
+        task_manager.remove_task(t.id)
+    return {"success": True, "removed": len(tasks)}
+
+@app.post("/download/resolve")
+async def resolve_downloads(req: ResolveBatchRequest):
+    """
+    預先解析整批任務的下載來源並寫入解析快取，之後的 POST /download 不必再搜尋。
+    以 NDJSON 串流回傳 {"index", "task_id", "resolved_url", "cached", "error"}，順序為完成順序。
+    """
+    tasks = [_build_task(r) for r in req.tasks]
+    concurrency = min(req.concurrency or RESOLVE_CONCURRENCY, RESOLVE_CONCURRENCY)
+    download_task_use_case = (await downloads.get()).use_case
+
+    async def _stream():
+        async for item in download_task_use_case.resolve_batch(tasks, concurrency=concurrency):
+            yield json.dumps(asdict(item), ensure_ascii=False) + "\n"
+
+    return StreamingResponse(_stream(), media_type="application/x-ndjson")
+
+@app.get("/download/resolve/stats")
+async def resolution_cache_stats():
+    """解析快取命中/未命中統計。"""
+    return (await downloads.get()).resolution_cache.get_stats()
+
+@app.get("/library")
+async def get_library(
+    target_dir: Optional[str] = None,
+    q: Optional[str] = None,
+    refresh: bool = True,
+    limit: int = Query(200, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+):
+    """
+    下載資料夾的索引：已掃描的資料夾 (roots) 與其中的檔案 (files)，可用 q 依歌名或檔名過濾。
+    指定 target_dir 時先掃描該資料夾的變更 (只處理 size / mtime 改變的檔案)。
+    """
+    library = (await downloads.get()).library
+    scan = await library.refresh(target_dir) if target_dir and refresh else None
+    return {
+        "roots": await library.list_roots(),
+        "files": await library.list_files(target_dir, query=q, limit=limit, offset=offset),
+        "scan": asdict(scan) if scan else None,
+        "stats": library.get_stats(),
+    }
+
+@app.get("/tasks/queue")
+async def get_queue_stats():
+    """查詢排程器的佇列深度與執行中數量、附加到相同下載的任務數、後處理的佇列與處理量，以及頻寬上限的使用情形。"""
+    services = downloads.peek()
+    return {
+        **download_scheduler.stats(),
+        "attached": services.use_case.attached if services else 0,
+        "postprocess": services.postprocess_pool.stats() if services else None,
+        "bandwidth": services.bandwidth.stats() if services else None,
+    }
+
+@app.post("/tasks/{task_id}/priority")
+async def set_task_priority(task_id: str, req: PriorityRequest):
+    """調整尚在佇列中的任務優先序。"""
+    if not download_scheduler.set_priority(task_id, req.priority):
+        raise HTTPException(status_code=409, detail=f"Task {task_id} is not queued")
+    return {"task_id": task_id, "priority": req.priority}
+
+@app.get("/tasks/resumable")
+async def list_resumable_tasks():
+    """列出有未完成紀錄、可透過 POST /tasks/{task_id}/resume 續傳的任務。"""
+    return {"task_ids": await task_journal.list_ids()}
+
+@app.post("/tasks/{task_id}/pause")
+async def pause_task(task_id: str):
+    """
+    暫停下載中或排隊中的任務：立即中斷傳輸並歸還排程名額，已下載的部分保留，
+    之後以 POST /tasks/{task_id}/resume 從中斷處續傳。
+    """
+    task = task_manager.get_task(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail=f"Task {task_id} not found")
+    download_task_use_case = (await downloads.get()).use_case
+    if not await download_task_use_case.pause(task):
+        raise HTTPException(status_code=409, detail=f"Task {task_id} is not queued or downloading")
+    return {"task_id": task.id, "status": task.status.value, "downloaded_bytes": task.downloaded_bytes}
+
+@app.post("/tasks/{task_id}/resume")
+async def resume_task(task_id: str):
+    """
+    重新排入失敗或暫停的任務，從已下載的部分續傳。
+    任務不在記憶體中時（例如 Sidecar 重啟後）會從任務紀錄還原。
+    """
+    if download_scheduler.is_active(task_id):
+        raise HTTPException(status_code=409, detail=f"Task {task_id} is already queued or running")
+
+    download_task_use_case = (await downloads.get()).use_case
+    task = task_manager.get_task(task_id)
+    if task is not None and task.status not in (TaskStatus.FAILED, TaskStatus.PAUSED):
+        raise HTTPException(status_code=409, detail=f"Task {task_id} is {task.status.value}, not failed or paused")
+    # 紀錄中還原的任務都是未完成就中斷的
+    task = task or await download_task_use_case.load_task(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail=f"Task {task_id} not found")
+
+    previous = (task.status, task.progress, task.error_message)
+    task.update_status(TaskStatus.PENDING, progress=task.progress)
+    try:
+        download_task_use_case.submit(task)
+    except SchedulerFullError as e:
+        # 沒有排入佇列，恢復原本的狀態，之後仍可再續傳
+        task.update_status(previous[0], progress=previous[1], error=previous[2])
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    if task_manager.get_task(task_id) is not task:
         task_manager.add_task(task)
-        logging.info(f"[/download] Task {task.id} added to TaskManager, total tasks: {len(task_manager.get_all_tasks())}")
+    return {"task_id": task.id, "status": task.status.value}
 
-        # 異步啟動下載（不等待完成）
-        asyncio.create_task(_execute_download_background(task))
+@app.get("/tasks/trace")
+async def export_trace(batch_id: Optional[str] = None, task_id: Optional[List[str]] = Query(None)):
+    """
+    將任務時間軸匯出為 Chrome trace-event JSON (chrome://tracing、Perfetto 可直接開啟)。
+    以 batch_id 或一至多個 task_id 指定任務；都未指定時匯出所有仍在記憶體中的任務。
+    """
+    if task_id:
+        tasks = [t for t in (task_manager.get_task(i) for i in task_id) if t is not None]
+    else:
+        tasks = [t for t in task_manager.get_all_tasks() if batch_id is None or t.batch_id == batch_id]
+    if not tasks:
+        raise HTTPException(status_code=404, detail="No matching tasks")
+    filename = f"opused-trace-{batch_id or 'tasks'}.json"
+    return JSONResponse(chrome_trace(tasks), headers={"Content-Disposition": f'attachment; filename="{filename}"'})
 
-        return {
-            "task_id": task.id,
-            "status": task.status.value
-        }
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+@app.get("/tasks/{task_id}/timeline")
+async def get_task_timeline(task_id: str):
+    """單個任務各階段的耗時 (queued、search、detail、resolve、http、transfer、postprocess ...)，start 為相對於任務建立的秒數。"""
+    task = task_manager.get_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail=f"Task {task_id} not found")
+    return {"task_id": task.id, "status": task.status.value, **task.timeline.to_dict()}
 
 @app.get("/tasks/{task_id}/status")
 async def get_task_status(task_id: str):
@@ -114,44 +681,159 @@ async def get_task_status(task_id: str):
         "task_id": task.id,
         "status": task.status.value,
         "progress": task.progress,
+        "downloaded_bytes": task.downloaded_bytes,
+        "total_bytes": task.total_bytes,
         "error_message": task.error_message
     }
 
 
+def _parse_enum_list(enum_cls, values: Optional[List[str]]):
+    """支援重複參數與逗號分隔兩種寫法，例如 ?status=failed&status=completed 或 ?status=failed,completed。"""
+    if not values:
+        return None
+    try:
+        return [enum_cls(v.strip()) for raw in values for v in raw.split(",") if v.strip()]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _tasks_etag(statuses, sources, updated_since, cursor, limit, batch_id) -> str:
+    """
+    GET /tasks 的 ETag：啟動批次 + 任務版本號 + 查詢條件的雜湊。
+    不同的過濾或分頁條件各自快取；Sidecar 重啟後版本號歸零也不會與重啟前的 ETag 相同。
+    """
+    query = json.dumps(
+        [
+            sorted({s.value for s in statuses or ()}),
+            sorted({s.value for s in sources or ()}),
+            updated_since.isoformat() if updated_since else None,
+            cursor, limit, batch_id,
+        ]
+    )
+    digest = hashlib.blake2b(query.encode(), digest_size=6).hexdigest()
+    return f'W/"tasks-{task_manager.epoch}-{task_manager.version}-{digest}"'
+
+
 @app.get("/tasks")
-async def get_all_tasks():
-    """查詢所有活躍任務的狀態。"""
-    tasks = task_manager.get_all_tasks()
-    logging.info(f"[/tasks] Returning {len(tasks)} tasks")
-    return [
-        {
-            "task_id": t.id,
-            "anime_title": t.anime_title,
-            "status": t.status.value,
-            "progress": t.progress,
-            "error_message": t.error_message,
-            "source": t.source.value,
-            "target_dir": t.target_dir,
-            "metadata": {
-                "anime_title": t.metadata.anime_title,
-                "song_title": t.metadata.song_title,
-                "artist": t.metadata.artist,
-                "type": t.metadata.type,
-            } if t.metadata else None
-        }
-        for t in tasks
-    ]
+async def get_all_tasks(
+    request: Request,
+    status: Optional[List[str]] = Query(None),
+    source: Optional[List[str]] = Query(None),
+    updated_since: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    batch_id: Optional[str] = None,
+):
+    """
+    查詢任務狀態，可依 status / source / batch_id / updated_since 過濾並以游標分頁。
+    下一頁游標放在 X-Next-Cursor 標頭；內容未變時回應 304 (依 ETag)。
+    """
+    if cursor is not None and not cursor.isdigit():
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    statuses = _parse_enum_list(TaskStatus, status)
+    sources = _parse_enum_list(Source, source)
+    task_manager.evict_expired()
+    etag = _tasks_etag(statuses, sources, updated_since, cursor, limit, batch_id)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    page = task_manager.query(
+        statuses=statuses,
+        sources=sources,
+        updated_since=updated_since,
+        cursor=cursor,
+        limit=limit,
+        batch_id=batch_id,
+    )
+    logging.debug(f"[/tasks] Returning {len(page.tasks)} tasks")
+    headers = {"ETag": etag}
+    if page.next_cursor is not None:
+        headers["X-Next-Cursor"] = page.next_cursor
+    return JSONResponse([task_to_dict(t) for t in page.tasks], headers=headers)
+
+
+@app.get("/tasks/stream")
+async def stream_tasks(since: Optional[str] = None, last_event_id: Optional[str] = Header(None)):
+    """
+    以 Server-Sent Events 推送任務變更，取代輪詢 /tasks。
+    先送出 snapshot，之後只送 added / updated / removed。
+    事件 id 為「啟動批次-版本號」；重新連線時帶 Last-Event-ID（或 ?since=）即可續傳，
+    Sidecar 重啟過 (批次不同) 時改送 snapshot。
+    """
+    version = task_events.parse_event_id(since or last_event_id)
+
+    async def _stream():
+        async for event in task_events.subscribe(since=version):
+            if event is None:
+                yield ": keepalive\n\n"
+                continue
+            data = json.dumps(event.data, ensure_ascii=False)
+            yield f"id: {task_events.event_id(event)}\nevent: {event.kind}\ndata: {data}\n\n"
+
+    return StreamingResponse(
+        _stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.delete("/tasks/{task_id}")
-async def remove_task(task_id: str):
-    """從管理器中移除任務。"""
-    success = task_manager.remove_task(task_id)
-    if not success:
+async def remove_task(task_id: str, keep_partial: bool = False):
+    """
+    取消並移除任務：尚未開始的移出佇列，下載中的立即中斷 (HTTP 連線、BT、yt-dlp 一併停止) 並歸還排程名額。
+    keep_partial 為 false 時刪除已下載的暫存檔與任務紀錄；為 true 時保留，之後仍可透過 POST /tasks/{task_id}/resume 續傳。
+    """
+    download_task_use_case = (await downloads.get()).use_case
+    task = task_manager.get_task(task_id) or await download_task_use_case.load_task(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail=f"Task {task_id} not found")
+    await download_task_use_case.cancel(task, keep_partial=keep_partial)
+    task_manager.remove_task(task_id)
     return {"success": True}
 
 
 @app.get("/health")
 def health_check():
     return {"status": "healthy", "service": "OpusED-Sidecar"}
+
+
+@app.get("/ready")
+def readiness_check():
+    """各子系統是否已載入完成；全部就緒前回應 503，可用來決定何時顯示搜尋與下載功能。"""
+    subsystems = {s.name: s.status() for s in SUBSYSTEMS}
+    ready = all(s.ready for s in SUBSYSTEMS)
+    return JSONResponse({"ready": ready, "subsystems": subsystems}, status_code=200 if ready else 503)
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus 文字格式的指標：上游延遲、任務各階段耗時、傳輸速率、佇列深度、快取命中率與事件迴圈延遲。"""
+    return PlainTextResponse(sidecar_metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/profiler")
+def profiler_stats(limit: int = Query(20, ge=1, le=500)):
+    """取樣式分析器的狀態與最常出現的堆疊。"""
+    return profiler.stats(limit=limit)
+
+
+@app.post("/profiler")
+async def toggle_profiler(req: ProfilerRequest):
+    """開啟 (清除上次結果) 或關閉取樣式分析器。"""
+    if req.enabled:
+        profiler.start(interval=req.interval, duration=req.duration)
+    else:
+        await asyncio.to_thread(profiler.stop)
+    return profiler.stats(limit=0)
+
+
+@app.get("/profiler/folded")
+def profiler_folded():
+    """collapsed stack 格式的取樣結果，可用 speedscope 或 flamegraph.pl 畫成火焰圖。"""
+    return PlainTextResponse(profiler.folded())
+
+
+@app.get("/startup")
+def startup_breakdown():
+    """啟動各階段的載入 (import:*) 與初始化 (init:*) 耗時，用來發現啟動時間的退化。"""
+    return startup_report.to_dict()
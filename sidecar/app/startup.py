@@ -0,0 +1,120 @@
+"""
+啟動成本控制：重量級子系統 (httpx、yt-dlp、bs4 與各下載器) 延後到第一次使用才載入，
+可選擇在服務開始監聽後於背景預熱；StartupReport 記錄各階段的載入與初始化耗時。
+"""
+
+import asyncio
+import importlib
+import logging
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from types import ModuleType
+from typing import Any, Awaitable, Callable, Dict, Generic, Iterator, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+@dataclass
+class StartupPhase:
+    name: str
+    seconds: float
+    # 相對於報告建立 (行程載入 main 模組) 的開始時間
+    started_at: float
+
+
+class StartupReport:
+    """依發生順序記錄 import:* 與 init:* 階段；init 的耗時包含其中的 import。"""
+
+    def __init__(self, origin: Optional[float] = None):
+        self.origin = origin if origin is not None else time.perf_counter()
+        self.phases: List[StartupPhase] = []
+
+    def record(self, name: str, seconds: float, started: Optional[float] = None) -> None:
+        started = started if started is not None else time.perf_counter() - seconds
+        self.phases.append(StartupPhase(name, round(seconds, 4), round(started - self.origin, 4)))
+
+    @contextmanager
+    def measure(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started, started)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "uptime": round(time.perf_counter() - self.origin, 4),
+            "phases": [asdict(p) for p in self.phases],
+        }
+
+
+class Subsystem(Generic[T]):
+    """
+    延遲建立的子系統：第一次 get() 時才執行 factory，之後共用同一個實例。
+    factory 在事件迴圈上執行，阻塞的載入應透過 import_module 交給執行緒。
+    建立失敗不會快取，下次 get() 重試。
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Awaitable[T]], report: StartupReport):
+        self.name = name
+        self.report = report
+        self._factory = factory
+        self._value: Optional[T] = None
+        self._lock = asyncio.Lock()
+        self.seconds: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._value is not None
+
+    def peek(self) -> Optional[T]:
+        """已建立時回傳實例，不觸發建立（例如關閉時）。"""
+        return self._value
+
+    async def get(self) -> T:
+        if self._value is not None:
+            return self._value
+        async with self._lock:
+            if self._value is None:
+                started = time.perf_counter()
+                try:
+                    self._value = await self._factory()
+                    self.error = None
+                except Exception as e:
+                    self.error = str(e)
+                    raise
+                finally:
+                    self.seconds = round(time.perf_counter() - started, 4)
+                    self.report.record(f"init:{self.name}", self.seconds, started)
+        return self._value
+
+    def status(self) -> Dict[str, Any]:
+        return {"ready": self.ready, "seconds": self.seconds, "error": self.error}
+
+
+async def import_module(name: str, report: StartupReport) -> ModuleType:
+    """在執行緒中載入模組，避免大型套件的 import 阻塞事件迴圈。"""
+    started = time.perf_counter()
+    module = await asyncio.to_thread(importlib.import_module, name)
+    report.record(f"import:{name}", time.perf_counter() - started, started)
+    return module
+
+
+async def prewarm(subsystems: List[Subsystem], report: StartupReport, delay: float = 0.0) -> None:
+    """
+    依序建立所有子系統。先等待 delay 讓伺服器完成監聽，/health 不受影響；
+    單一子系統失敗只記錄下來，第一次實際使用時會再重試。
+    """
+    await asyncio.sleep(delay)
+    with report.measure("prewarm"):
+        for subsystem in subsystems:
+            try:
+                await subsystem.get()
+            except Exception as e:
+                logger.warning(f"[Startup] Prewarm of {subsystem.name} failed: {e}")
+    summary = ", ".join(f"{p.name}={p.seconds:.3f}s" for p in report.phases)
+    logger.info(f"[Startup] Ready after {report.to_dict()['uptime']:.3f}s ({summary})")
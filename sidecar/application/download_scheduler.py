@@ -0,0 +1,270 @@
+"""
+DownloadScheduler: 下載任務的優先佇列與並行控制。
+
+- 全域並行上限與每個 Source 各自的上限
+- 有上限的等待佇列，滿了即拒絕新任務
+- 優先序可由客戶端調整；同優先序下以批次輪替 (fair queuing) 維持 FIFO 公平性
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from sidecar.domain.models import Source, Task, TaskStatus
+from sidecar.domain.repositories import ITaskMetrics
+from sidecar.domain.stages import QUEUED
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[Task], Awaitable[Any]]
+
+
+class SchedulerFullError(Exception):
+    """等待佇列已滿。"""
+
+
+@dataclass(order=True)
+class _QueueEntry:
+    # (-priority, round, seq)：優先序高者先；同優先序下各批次輪流；最後依提交順序
+    sort_key: Tuple[int, int, int]
+    task: Task = field(compare=False)
+    job: Job = field(compare=False)
+    removed: bool = field(default=False, compare=False)
+    enqueued_at: float = field(default_factory=time.perf_counter, compare=False)
+
+
+class DownloadScheduler:
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        per_source_limits: Optional[Dict[Source, int]] = None,
+        max_queue_size: int = 1000,
+        metrics: Optional[ITaskMetrics] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.per_source_limits = per_source_limits or {}
+        self.max_queue_size = max_queue_size
+        self.metrics = metrics
+
+        self._heaps: Dict[Source, List[_QueueEntry]] = {}
+        self._entries: Dict[str, _QueueEntry] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+        self._running_by_source: Dict[Source, int] = {}
+        # 仍在執行但已讓出下載名額的任務 (例如後處理中)
+        self._detached: Set[str] = set()
+        # 執行中任務的來源，detach 時用來歸還該來源的名額
+        self._sources: Dict[str, Source] = {}
+        self._seq = itertools.count()
+        self._batch_next_round: Dict[str, int] = {}
+        # 各批次仍在佇列中或執行中的任務數，歸零時刪除該批次的輪次紀錄
+        self._batch_live: Dict[str, int] = {}
+        self._virtual_round = 0
+        self._wakeup = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    # ---- 對外介面 ----
+
+    def submit(self, task: Task, job: Job) -> None:
+        """排入任務；佇列已滿時拋出 SchedulerFullError。"""
+        self.submit_many([task], job)
+
+    def submit_many(self, tasks: List[Task], job: Job) -> None:
+        """
+        整批排入：先檢查整批再一次排入，佇列容量不足 (SchedulerFullError) 或有重複的任務 (ValueError)
+        時整批拒絕，不會只排入一部分。
+        """
+        if len(self._entries) + len(tasks) > self.max_queue_size:
+            raise SchedulerFullError(f"下載佇列已滿 ({self.max_queue_size})")
+        seen: Set[str] = set()
+        for task in tasks:
+            if task.id in self._entries or task.id in self._running or task.id in seen:
+                raise ValueError(f"Task {task.id} 已在排程中")
+            seen.add(task.id)
+
+        for task in tasks:
+            # 新批次從目前的虛擬輪次開始，避免晚到的小批次被大批次餓死，也不會插隊太多
+            batch_key = task.batch_id or task.id
+            round_ = max(self._batch_next_round.get(batch_key, 0), self._virtual_round)
+            self._batch_next_round[batch_key] = round_ + 1
+            self._batch_live[batch_key] = self._batch_live.get(batch_key, 0) + 1
+            self._push(_QueueEntry((-task.priority, round_, next(self._seq)), task, job))
+        self._ensure_dispatcher()
+
+    def set_priority(self, task_id: str, priority: int) -> bool:
+        """調整尚在佇列中的任務優先序。任務已開始或不存在時回傳 False。"""
+        entry = self._entries.get(task_id)
+        if entry is None:
+            return False
+        entry.removed = True
+        entry.task.priority = priority
+        _, round_, seq = entry.sort_key
+        self._push(_QueueEntry((-priority, round_, seq), entry.task, entry.job, enqueued_at=entry.enqueued_at))
+        return True
+
+    def discard(self, task_id: str) -> bool:
+        """將尚未開始的任務移出佇列。"""
+        entry = self._entries.pop(task_id, None)
+        if entry is None:
+            return False
+        entry.removed = True
+        self._release_batch(entry.task)
+        return True
+
+    def detach(self, task_id: str) -> bool:
+        """
+        執行中的任務不再佔用下載名額 (傳輸已結束，只剩後處理)，讓下一個任務開始。
+        任務仍視為 active，stop() 時一樣會被取消。
+        """
+        task = self._running.get(task_id)
+        if task is None or task_id in self._detached:
+            return False
+        self._detached.add(task_id)
+        source = self._sources[task_id]
+        self._running_by_source[source] -= 1
+        self._wakeup.set()
+        return True
+
+    async def cancel(self, task_id: str) -> bool:
+        """
+        取消任務：尚未開始的移出佇列；執行中的立即歸還下載名額並中斷其協程，
+        等到它結束 (關閉連線、保存續傳資訊) 才返回。任務不在排程中時回傳 False。
+        """
+        if self.discard(task_id):
+            return True
+        running = self._running.get(task_id)
+        if running is None:
+            return False
+        self.detach(task_id)
+        running.cancel()
+        await asyncio.gather(running, return_exceptions=True)
+        return True
+
+    def is_queued(self, task_id: str) -> bool:
+        return task_id in self._entries
+
+    def is_active(self, task_id: str) -> bool:
+        """任務是否仍在佇列中或執行中。"""
+        return task_id in self._entries or task_id in self._running
+
+    def stats(self) -> Dict[str, Any]:
+        queued_by_source: Dict[str, int] = {}
+        for entry in self._entries.values():
+            key = entry.task.source.value
+            queued_by_source[key] = queued_by_source.get(key, 0) + 1
+        return {
+            "queued": len(self._entries),
+            "running": len(self._running) - len(self._detached),
+            "detached": len(self._detached),
+            "max_concurrency": self.max_concurrency,
+            "max_queue_size": self.max_queue_size,
+            "sources": {
+                source.value: {
+                    "queued": queued_by_source.get(source.value, 0),
+                    "running": self._running_by_source.get(source, 0),
+                    "limit": self.per_source_limits.get(source),
+                }
+                for source in Source
+            },
+        }
+
+    async def stop(self) -> None:
+        """停止派發並取消執行中的任務。"""
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+        running = list(self._running.values())
+        for t in running:
+            t.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+    # ---- 內部實作 ----
+
+    def _push(self, entry: _QueueEntry) -> None:
+        heapq.heappush(self._heaps.setdefault(entry.task.source, []), entry)
+        self._entries[entry.task.id] = entry
+        self._wakeup.set()
+
+    def _ensure_dispatcher(self) -> None:
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    def _has_capacity(self, source: Source) -> bool:
+        limit = self.per_source_limits.get(source)
+        return limit is None or self._running_by_source.get(source, 0) < limit
+
+    def _pop_next(self) -> Optional[_QueueEntry]:
+        """在仍有名額的來源中，取出排序最前面的任務。"""
+        best: Optional[List[_QueueEntry]] = None
+        for source, heap in self._heaps.items():
+            while heap and heap[0].removed:
+                heapq.heappop(heap)
+            if not heap or not self._has_capacity(source):
+                continue
+            if best is None or heap[0] < best[0]:
+                best = heap
+        if best is None:
+            return None
+        entry = heapq.heappop(best)
+        del self._entries[entry.task.id]
+        return entry
+
+    async def _dispatch_loop(self) -> None:
+        while True:
+            self._wakeup.clear()
+            while len(self._running) - len(self._detached) < self.max_concurrency:
+                entry = self._pop_next()
+                if entry is None:
+                    break
+                self._start(entry)
+            await self._wakeup.wait()
+
+    def _start(self, entry: _QueueEntry) -> None:
+        task = entry.task
+        self._virtual_round = max(self._virtual_round, entry.sort_key[1])
+        now = time.perf_counter()
+        task.timeline.add(QUEUED, entry.enqueued_at, now)
+        if self.metrics is not None:
+            self.metrics.observe_stage(task, QUEUED, now - entry.enqueued_at)
+        self._running_by_source[task.source] = self._running_by_source.get(task.source, 0) + 1
+        self._sources[task.id] = task.source
+        running = self._running[task.id] = asyncio.create_task(self._run(entry))
+        # 以 done callback 歸還名額：任務在協程開始執行前就被取消時 _run 不會執行
+        running.add_done_callback(lambda _t: self._finish(task))
+
+    async def _run(self, entry: _QueueEntry) -> None:
+        task = entry.task
+        logger.info(f"[Scheduler] Starting download for task {task.id}")
+        try:
+            await entry.job(task)
+            logger.info(f"[Scheduler] Download finished for task {task.id}, status={task.status.value}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"[Scheduler] Download failed for task {task.id}: {e}")
+            task.update_status(TaskStatus.FAILED, error=str(e))
+
+    def _finish(self, task: Task) -> None:
+        """任務結束 (完成、失敗或取消)：移出執行中並歸還名額。"""
+        self._running.pop(task.id, None)
+        source = self._sources.pop(task.id)
+        if task.id in self._detached:
+            self._detached.discard(task.id)
+        else:
+            self._running_by_source[source] -= 1
+        self._release_batch(task)
+        self._wakeup.set()
+
+    def _release_batch(self, task: Task) -> None:
+        """任務離開排程器 (完成或移出佇列)；批次已沒有任務時刪除其輪次紀錄。"""
+        batch_key = task.batch_id or task.id
+        live = self._batch_live.get(batch_key, 0) - 1
+        if live > 0:
+            self._batch_live[batch_key] = live
+        else:
+            self._batch_live.pop(batch_key, None)
+            self._batch_next_round.pop(batch_key, None)
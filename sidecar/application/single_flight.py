@@ -0,0 +1,49 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Generic, Hashable, TypeVar
+
+R = TypeVar("R")
+
+@dataclass
+class _Call:
+    task: asyncio.Task
+    waiters: int = 0
+
+class SingleFlight(Generic[R]):
+    """
+    相同鍵的並行呼叫只執行一次，其餘呼叫等待並共用同一個結果 (或例外)。
+    完成後立即移除，之後的呼叫會重新執行；快取由呼叫端自行負責。
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self.shared = 0  # 直接共用進行中呼叫的次數
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[R]]) -> R:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _t: self._forget(key, call))
+        else:
+            self.shared += 1
+        call.waiters += 1
+        try:
+            # 單一等待者被取消時不影響其他等待者；全部取消才取消底層呼叫
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key: Hashable, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
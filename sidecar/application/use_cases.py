@@ -1,30 +1,417 @@
-from typing import List, Optional
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple, TypeVar
 from sidecar.domain.models import Task, Metadata, Source, DownloadMode, TaskStatus
-from sidecar.domain.repositories import IMetadataProvider, IDownloader
+from sidecar.domain.repositories import (
+    IMetadataProvider, IDownloader, ITaskJournal, IResolutionCache, ITaskMetrics, IPostProcessor, ILibraryIndex,
+)
+from sidecar.domain.stages import LIBRARY, POSTPROCESS, RESOLVE, TRANSFER, WRITE, bind_timeline, measure_writes
+from sidecar.application.download_scheduler import DownloadScheduler
+from sidecar.application.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+async def _stream_bounded(
+    items: List[T], fn: Callable[[int, T], Awaitable[R]], concurrency: int
+) -> AsyncIterator[R]:
+    """以有上限的並行度對每個項目執行 fn，依完成順序產出結果。fn 需自行處理錯誤。"""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    done: asyncio.Queue = asyncio.Queue()
+
+    async def _run(index: int, item: T) -> None:
+        async with semaphore:
+            result = await fn(index, item)
+        await done.put(result)
+
+    workers = [asyncio.create_task(_run(i, item)) for i, item in enumerate(items)]
+    try:
+        for _ in workers:
+            yield await done.get()
+    finally:
+        # 客戶端中途斷線時取消尚未完成的工作
+        for w in workers:
+            w.cancel()
+
+def _query_key(task: Task) -> Hashable:
+    """任務的搜尋條件；相同條件的任務會解析到相同的下載來源。"""
+    mode = task.dmhy_mode if task.source == Source.DMHY else None
+    return (task.source, mode, task.custom_keywords, task.metadata, task.anime_title)
+
+def _transfer_key(task: Task) -> Hashable:
+    """實際傳輸的識別：來源、解析後的網址 (未解析時用搜尋條件)、目的地與後處理設定。"""
+    mode = task.dmhy_mode if task.source == Source.DMHY else None
+    origin = task.resolved_url or _query_key(task)
+    return (task.source, mode, origin, os.path.normcase(os.path.abspath(task.target_dir or ".")), task.postprocess)
+
+def _remove_files(paths: List[str]) -> int:
+    """刪除存在的檔案，回傳刪除的數量；找不到或無法刪除的略過。"""
+    removed = 0
+    for path in paths:
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+@dataclass
+class _Transfer:
+    """
+    進行中的下載；附加的任務等待 result 並鏡像 task 的狀態。
+    result 為 None 表示實際下載的任務被取消，附加的任務需接手下載。
+    """
+    task: Task
+    result: asyncio.Future
+    followers: int = 0
+
+@dataclass
+class BatchSearchResult:
+    """批次搜尋中單一標題的結果；error 不為 None 時 results 為空。"""
+    index: int
+    title: str
+    results: List[Metadata] = field(default_factory=list)
+    error: Optional[str] = None
+
+@dataclass
+class ResolveResult:
+    """預先解析中單一任務的結果；cached 表示直接取自解析快取。"""
+    index: int
+    task_id: str
+    resolved_url: Optional[str] = None
+    cached: bool = False
+    error: Optional[str] = None
 
 class SearchMetadataUseCase:
     def __init__(self, metadata_provider: IMetadataProvider):
         self.metadata_provider = metadata_provider
+        self._inflight: SingleFlight[List[Metadata]] = SingleFlight()
 
     async def execute(self, title: str, token: Optional[str] = None) -> List[Metadata]:
-        """純搜尋動畫元數據"""
-        return await self.metadata_provider.get_metadata(title, token=token)
+        """純搜尋動畫元數據；相同標題的並行搜尋共用同一次上游呼叫。"""
+        key = (" ".join(title.split()).casefold(), token)
+        results = await self._inflight.do(key, lambda: self.metadata_provider.get_metadata(title, token=token))
+        # 每個呼叫端拿到各自的串列，避免互相修改
+        return list(results)
+
+    async def execute_batch(
+        self, titles: List[str], token: Optional[str] = None, concurrency: int = 8
+    ) -> AsyncIterator[BatchSearchResult]:
+        """
+        以有上限的並行度搜尋多個標題，依完成順序逐筆產出結果。
+        單一標題失敗只會反映在該筆的 error，不影響其他標題。
+        """
+        async def _search(index: int, title: str) -> BatchSearchResult:
+            try:
+                results = await self.execute(title, token=token)
+                return BatchSearchResult(index=index, title=title, results=results)
+            except Exception as e:
+                return BatchSearchResult(index=index, title=title, error=str(e))
+
+        async for item in _stream_bounded(titles, _search, concurrency):
+            yield item
 
 class DownloadTaskUseCase:
-    def __init__(self, downloaders: List[IDownloader]):
+    def __init__(
+        self,
+        downloaders: List[IDownloader],
+        scheduler: Optional[DownloadScheduler] = None,
+        journal: Optional[ITaskJournal] = None,
+        resolution_cache: Optional[IResolutionCache] = None,
+        metrics: Optional[ITaskMetrics] = None,
+        postprocessor: Optional[IPostProcessor] = None,
+        library: Optional[ILibraryIndex] = None,
+    ):
         self.downloaders = {d.get_source(): d for d in downloaders}
+        self.scheduler = scheduler or DownloadScheduler()
+        self.journal = journal
+        self.resolution_cache = resolution_cache
+        self.metrics = metrics
+        self.postprocessor = postprocessor
+        self.library = library
+        self._resolutions: SingleFlight[Optional[str]] = SingleFlight()
+        self._transfers: Dict[Hashable, _Transfer] = {}
+        self.attached = 0  # 附加到進行中下載的任務數
+
+    def submit(self, task: Task) -> None:
+        """將任務交給排程器，依優先序與並行上限在背景執行 execute。"""
+        self.scheduler.submit(task, self.execute)
+
+    def submit_batch(self, tasks: List[Task]) -> None:
+        """整批交給排程器；無法全部排入時整批拒絕。"""
+        self.scheduler.submit_many(tasks, self.execute)
+
+    async def find_existing(self, task: Task) -> bool:
+        """
+        排程前比對下載資料夾的索引：歌曲已存在時任務直接標記為完成，output_files 指向既有檔案。
+        索引讀取失敗時當作不存在，照常下載。
+        """
+        if self.library is None or not task.metadata or not task.metadata.song_title:
+            return False
+        started = time.perf_counter()
+        try:
+            paths = await self.library.find(task.target_dir, task.metadata)
+        except Exception as e:
+            logger.warning(f"下載資料夾索引比對失敗 ({task.target_dir}): {e}")
+            paths = []
+        self._observe(task, LIBRARY, started, found=bool(paths))
+        if not paths:
+            return False
+        task.output_files = paths
+        task.update_status(TaskStatus.COMPLETED, progress=100.0)
+        return True
+
+    async def load_task(self, task_id: str) -> Optional[Task]:
+        """從任務紀錄還原尚未完成的任務（例如 Sidecar 重啟後）。"""
+        if not self.journal:
+            return None
+        return await self.journal.load(task_id)
+
+    async def forget(self, task_id: str) -> None:
+        """刪除任務紀錄，之後無法再續傳。"""
+        if self.journal:
+            await self.journal.delete(task_id)
+
+    async def pause(self, task: Task) -> bool:
+        """
+        暫停任務：中斷進行中的傳輸、歸還排程名額，保留已下載的部分與任務紀錄，
+        之後重新 submit 即從中斷處續傳。任務不在排程中或已在後處理時回傳 False。
+        """
+        if task.status == TaskStatus.POSTPROCESSING or not await self.scheduler.cancel(task.id):
+            return False
+        task.update_status(TaskStatus.PAUSED, progress=task.progress)
+        if self.journal:
+            # 傳輸中確定的 resolved_url 與暫存檔一併保存，重啟後仍可續傳
+            await self.journal.save(task)
+        return True
+
+    async def cancel(self, task: Task, keep_partial: bool = False) -> bool:
+        """
+        取消任務並停止進行中的傳輸，回傳任務原本是否仍在排程中。
+        keep_partial 為 True 時保留已下載的部分與任務紀錄，之後仍可續傳；否則兩者一併刪除。
+        """
+        active = await self.scheduler.cancel(task.id)
+        if keep_partial:
+            if active and self.journal:
+                await self.journal.save(task)
+            return active
+        await self.forget(task.id)
+        removed = await asyncio.to_thread(_remove_files, task.partial_files)
+        if removed:
+            logger.info(f"已刪除任務 {task.id} 的 {removed} 個暫存檔")
+        task.partial_files = []
+        return active
+
+    async def list_resumable(self) -> List[str]:
+        return await self.journal.list_ids() if self.journal else []
+
+    async def resolve(self, task: Task) -> Tuple[Optional[str], bool]:
+        """
+        只解析下載來源並寫入快取，不下載。回傳 (下載來源, 是否取自快取)。
+        """
+        if self.resolution_cache:
+            cached = await self.resolution_cache.get(task)
+            if cached:
+                return cached, True
+        downloader = self.downloaders.get(task.source)
+        if not downloader:
+            raise ValueError(f"未支援的下載來源: {task.source}")
+        resolved_url = await downloader.resolve(task)
+        if resolved_url and self.resolution_cache:
+            await self.resolution_cache.put(task, resolved_url)
+        return resolved_url, False
+
+    async def resolve_batch(self, tasks: List[Task], concurrency: int = 4) -> AsyncIterator[ResolveResult]:
+        """預先解析整批任務，依完成順序逐筆產出；單一任務失敗只反映在該筆的 error。"""
+        async def _resolve(index: int, task: Task) -> ResolveResult:
+            try:
+                resolved_url, cached = await self.resolve(task)
+            except Exception as e:
+                return ResolveResult(index=index, task_id=task.id, error=str(e))
+            if resolved_url is None:
+                return ResolveResult(index=index, task_id=task.id, error="找不到符合的下載來源")
+            return ResolveResult(index=index, task_id=task.id, resolved_url=resolved_url, cached=cached)
+
+        async for item in _stream_bounded(tasks, _resolve, concurrency):
+            yield item
 
     async def execute(self, task: Task) -> bool:
-        """執行單個下載任務。Sidecar 現在僅負責執行，不負責狀態管理或儲存。"""
+        """
+        執行單個下載任務。
+        執行期間任務會記錄在 journal 中，完成後刪除；失敗時保留，供之後續傳。
+        各階段的耗時記錄在 task.timeline。
+        """
+        with bind_timeline(task.timeline):
+            return await self._execute(task)
+
+    async def _execute(self, task: Task) -> bool:
         downloader = self.downloaders.get(task.source)
         if not downloader:
             task.update_status(TaskStatus.FAILED, error=f"未支援的下載來源: {task.source}")
             return False
 
+        if self.resolution_cache and not task.resolved_url:
+            # 相同搜尋條件已解析過時直接使用，下載器會跳過搜尋
+            task.resolved_url = await self.resolution_cache.get(task)
+        if not task.resolved_url:
+            # 先解析來源才能辨識指向同一份檔案的任務；相同搜尋條件只搜尋一次
+            started = time.perf_counter()
+            # 共用其他任務的搜尋時，搜尋細節記錄在發起搜尋的任務上
+            shared = _query_key(task) in self._resolutions
+            try:
+                task.resolved_url = await self._resolutions.do(_query_key(task), lambda: downloader.resolve(task))
+            except Exception:
+                # 交給下載器自行搜尋並回報錯誤
+                task.resolved_url = None
+            self._observe(task, RESOLVE, started, shared=shared, found=task.resolved_url is not None)
+
+        if self.journal:
+            await self.journal.save(task)
+        key = _transfer_key(task)
+        while True:
+            transfer = self._transfers.get(key)
+            if transfer is None:
+                break
+            success = await self._follow(transfer, task)
+            if success is not None:
+                break
+            # 原本下載的任務已取消或暫停：由第一個醒來的附加任務接手，其餘附加到它
+        if transfer is None:
+            success = await self._lead(key, downloader, task)
+            if self.resolution_cache:
+                if success and task.resolved_url:
+                    await self.resolution_cache.put(task, task.resolved_url)
+                elif not success and not task.output_files:
+                    # 來源可能已失效，下次重新搜尋 (後處理失敗時檔案已下載，來源仍有效)
+                    await self.resolution_cache.invalidate(task)
+            if success and self.library and task.output_files:
+                try:
+                    await self.library.record(task)
+                except Exception as e:
+                    logger.warning(f"登記下載檔案到索引失敗 ({task.id}): {e}")
+
+        if self.journal:
+            if success:
+                await self.journal.delete(task.id)
+            else:
+                # 重新寫入以保留下載過程中確定的 resolved_url
+                await self.journal.save(task)
+        return success
+
+    async def _lead(self, key: Hashable, downloader: IDownloader, task: Task) -> bool:
+        """實際執行下載，期間相同來源與目的地的任務會附加到這次傳輸。"""
+        transfer = _Transfer(task, asyncio.get_running_loop().create_future())
+        self._transfers[key] = transfer
+        success = False
+        started = time.perf_counter()
+        # 只計算實際下載的任務；附加的任務同步同一份進度，不重複計入傳輸量
+        counted = [task.downloaded_bytes]
+
+        def _count_bytes(source: Task) -> None:
+            if source.downloaded_bytes > counted[0]:
+                self.metrics.observe_bytes(source, source.downloaded_bytes - counted[0])
+            counted[0] = source.downloaded_bytes
+
+        if self.metrics is not None:
+            task.subscribe(_count_bytes)
+        cancelled = False
+        try:
+            # transfer 包含寫入磁碟的時間，write 另外記錄其中花在寫入的部分
+            with measure_writes() as writes:
+                try:
+                    # 執行下載
+                    success = await downloader.download(task)
+                except Exception as e:
+                    task.update_status(TaskStatus.FAILED, error=str(e))
+                finally:
+                    task.unsubscribe(_count_bytes)
+                    self._observe(task, TRANSFER, started, success=success, write_seconds=round(writes[0], 6))
+                    if self.metrics is not None:
+                        self.metrics.observe_stage(task, WRITE, writes[0])
+            if success and task.status == TaskStatus.POSTPROCESSING:
+                success = await self._postprocess(task)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            del self._transfers[key]
+            if cancelled and transfer.followers:
+                # 取消只屬於這個任務：交給附加的任務接手，已下載的暫存檔改由接手的任務登記，取消時不刪除
+                task.partial_files = []
+                transfer.result.set_result(None)
+            else:
+                transfer.result.set_result(success)
+        return success
+
+    async def _postprocess(self, task: Task) -> bool:
+        """轉檔、寫入標籤與改名；失敗時任務標記為失敗，但已下載的檔案保留。"""
+        if self.postprocessor is None or not task.output_files:
+            task.update_status(TaskStatus.COMPLETED, progress=100.0)
+            return True
+        # 傳輸已結束，讓出下載名額：轉檔與批次中其餘任務的下載同時進行
+        self.scheduler.detach(task.id)
+        started = time.perf_counter()
         try:
-            # 執行下載
-            success = await downloader.download(task)
-            return success
+            task.output_files = await self.postprocessor.process(task)
         except Exception as e:
-            task.update_status(TaskStatus.FAILED, error=str(e))
+            task.update_status(TaskStatus.FAILED, progress=100.0, error=f"後處理失敗: {e}")
+            self._observe(task, POSTPROCESS, started, success=False)
             return False
+        task.update_status(TaskStatus.COMPLETED, progress=100.0)
+        self._observe(task, POSTPROCESS, started, success=True, files=len(task.output_files))
+        return True
+
+    def _observe(self, task: Task, stage: str, started: float, **attrs) -> None:
+        """記錄從 started 到現在的階段耗時：寫入任務時間軸與指標。"""
+        now = time.perf_counter()
+        task.timeline.add(stage, started, now, **attrs)
+        if self.metrics is not None:
+            self.metrics.observe_stage(task, stage, now - started)
+
+    async def _follow(self, transfer: _Transfer, task: Task) -> Optional[bool]:
+        """
+        不重複下載，等待進行中的傳輸完成並同步其進度與結果。
+        實際下載的任務被取消時回傳 None，由呼叫端接手下載。
+        """
+        self.attached += 1
+        transfer.followers += 1
+        leader = transfer.task
+
+        def _mirror(source: Task) -> None:
+            if source.status == TaskStatus.POSTPROCESSING:
+                # 傳輸已結束，附加的任務同樣讓出下載名額
+                self.scheduler.detach(task.id)
+            task.update_status(
+                source.status,
+                progress=source.progress,
+                error=source.error_message,
+                downloaded_bytes=source.downloaded_bytes,
+                total_bytes=source.total_bytes,
+            )
+
+        _mirror(leader)
+        leader.subscribe(_mirror)
+        started = time.perf_counter()
+        try:
+            success = await asyncio.shield(transfer.result)
+        finally:
+            transfer.followers -= 1
+            leader.unsubscribe(_mirror)
+            # 傳輸細節記錄在實際下載的任務上
+            task.timeline.add("attached", started, time.perf_counter(), leader=leader.id)
+        task.resolved_url = task.resolved_url or leader.resolved_url
+        if success is None:
+            return None
+        if success:
+            # 共用同一份檔案；暫存檔已由實際下載的任務完成改名
+            task.output_files = list(leader.output_files)
+            task.partial_files = []
+        _mirror(leader)
+        if not success and task.status != TaskStatus.FAILED:
+            task.update_status(TaskStatus.FAILED, progress=task.progress, error="共用的下載已中斷")
+        return success
@@ -0,0 +1,6 @@
+"""
+端到端基準測試套件：以本機替身伺服器重播 Bangumi / DMHY 回應，驅動真正的 Sidecar。
+
+    python -m sidecar.benchmarks --titles 50 --downloads 20
+    python -m sidecar.benchmarks --save-baseline      # 更新 baselines.json
+"""
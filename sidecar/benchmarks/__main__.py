@@ -0,0 +1,65 @@
+import argparse
+import asyncio
+import json
+import sys
+
+from sidecar.benchmarks.runner import BenchmarkConfig, compare, load_baselines, run, save_baseline
+from sidecar.benchmarks.stand_ins import StandInConfig
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m sidecar.benchmarks", description="OpusED Sidecar 端到端基準測試")
+    parser.add_argument("--titles", type=int, default=50, help="搜尋的標題數")
+    parser.add_argument("--downloads", type=int, default=20, help="下載的任務數")
+    parser.add_argument("--concurrency", type=int, default=8, help="客戶端同時送出的搜尋請求數")
+    parser.add_argument("--latency", type=float, default=20, help="替身伺服器每個回應的延遲 (毫秒)")
+    parser.add_argument("--jitter", type=float, default=0, help="額外隨機延遲的上限 (毫秒)")
+    parser.add_argument("--bandwidth", type=float, default=None, help="替身伺服器的傳輸速率 (KiB/s)，預設不限")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="替身伺服器回應 503 的機率")
+    parser.add_argument("--torrent-size", type=int, default=64, help="種子檔大小 (KiB)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--profile", default="default", help="基準值的名稱，不同參數組合應使用不同名稱")
+    parser.add_argument("--save-baseline", action="store_true", help="將結果存為基準值")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允許的退化比例")
+    parser.add_argument("--output", help="另外將報告寫入此 JSON 檔")
+    parser.add_argument("--verbose", action="store_true", help="顯示 Sidecar 的日誌")
+    args = parser.parse_args()
+
+    config = BenchmarkConfig(
+        titles=args.titles,
+        downloads=args.downloads,
+        concurrency=args.concurrency,
+        stand_in=StandInConfig(
+            latency=args.latency / 1000,
+            jitter=args.jitter / 1000,
+            bandwidth=args.bandwidth * 1024 if args.bandwidth else None,
+            error_rate=args.error_rate,
+            torrent_size=args.torrent_size * 1024,
+            seed=args.seed,
+        ),
+    )
+    report = asyncio.run(run(config, verbose=args.verbose))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.save_baseline:
+        save_baseline(args.profile, report)
+        print(f"已儲存基準值: {args.profile}", file=sys.stderr)
+        return 0
+
+    baseline = load_baselines().get(args.profile)
+    if baseline is None:
+        print(f"沒有 {args.profile} 的基準值，以 --save-baseline 建立", file=sys.stderr)
+        return 0
+    if baseline.get("config") != report["config"]:
+        print("警告：參數與基準值不同，比較結果僅供參考", file=sys.stderr)
+    regressions = compare(report, baseline, tolerance=args.tolerance)
+    for line in regressions:
+        print(f"退化: {line}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
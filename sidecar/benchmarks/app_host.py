@@ -0,0 +1,47 @@
+"""
+在獨立行程中執行真正的 Sidecar app，與 Electron 啟動的方式相同 (uvicorn + sidecar.app.main:app)，
+另外掛上 /__bench__/stats 回報事件迴圈延遲與峰值記憶體。設定由環境變數傳入。
+
+    python -m sidecar.benchmarks.app_host --port 8765
+"""
+
+import argparse
+import asyncio
+
+import uvicorn
+
+from sidecar.benchmarks.metrics import LoopLagMonitor, peak_rss_bytes
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True)
+    args = parser.parse_args()
+
+    from sidecar.app.main import app
+
+    monitor = LoopLagMonitor()
+
+    @app.get("/__bench__/stats", include_in_schema=False)
+    def bench_stats():
+        return {"loop_lag": monitor.summary(), "peak_rss": peak_rss_bytes()}
+
+    @app.post("/__bench__/reset", include_in_schema=False)
+    def bench_reset():
+        monitor.reset()
+        return {"ok": True}
+
+    async def _serve() -> None:
+        monitor.start()
+        server = uvicorn.Server(uvicorn.Config(app, host=args.host, port=args.port, log_level="warning"))
+        try:
+            await server.serve()
+        finally:
+            await monitor.stop()
+
+    asyncio.run(_serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""量測工具：延遲分位數、事件迴圈延遲與行程的峰值記憶體。"""
+
+import math
+import sys
+from typing import Dict, List, Optional
+
+from sidecar.infrastructure import metrics as infra_metrics
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """最近序位法 (nearest-rank)；空列表回傳 None。"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(latencies: List[float], elapsed: float, errors: int = 0) -> Dict[str, Optional[float]]:
+    """一組請求的吞吐量與延遲分位數 (秒)。"""
+    count = len(latencies) + errors
+    return {
+        "count": count,
+        "errors": errors,
+        "elapsed": round(elapsed, 4),
+        "throughput": round(len(latencies) / elapsed, 3) if elapsed > 0 else None,
+        "p50": _round(percentile(latencies, 50)),
+        "p95": _round(percentile(latencies, 95)),
+        "p99": _round(percentile(latencies, 99)),
+    }
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 4) if value is not None else None
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """目前行程至今的最大常駐記憶體；無法取得時回傳 None。"""
+    try:
+        import resource
+    except ImportError:
+        # Windows 沒有 resource 模組，有安裝 psutil 時改用它
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return getattr(psutil.Process().memory_info(), "peak_wset", None)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KiB 為單位，macOS 以 bytes 為單位
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class LoopLagMonitor(infra_metrics.LoopLagMonitor):
+    """保留每個樣本以計算分位數；正式服務改用 /metrics 的直方圖。"""
+
+    def __init__(self, interval: float = 0.01):
+        super().__init__(self._record, interval)
+        self.samples: List[float] = []
+
+    def _record(self, lag: float) -> None:
+        self.samples.append(lag)
+
+    def reset(self) -> None:
+        self.samples = []
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        return {
+            "samples": len(self.samples),
+            "p50": _round(percentile(self.samples, 50)),
+            "p99": _round(percentile(self.samples, 99)),
+            "max": _round(max(self.samples)) if self.samples else None,
+        }
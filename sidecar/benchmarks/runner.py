@@ -0,0 +1,271 @@
+"""
+端到端基準測試：啟動替身伺服器與真正的 Sidecar，對搜尋與下載路徑施加負載並與基準值比較。
+"""
+
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from sidecar.benchmarks import stand_ins
+from sidecar.benchmarks.metrics import summarize
+from sidecar.benchmarks.stand_ins import StandInConfig
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+# 低於這個絕對差距的延遲變化視為雜訊，不算退化 (秒)
+LATENCY_NOISE_FLOOR = 0.01
+
+
+@dataclass
+class BenchmarkConfig:
+    titles: int = 50
+    downloads: int = 20
+    # 客戶端同時送出的搜尋請求數；下載一次全部送出，由 Sidecar 的排程器限流
+    concurrency: int = 8
+    timeout: float = 120.0
+    stand_in: StandInConfig = field(default_factory=StandInConfig)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _wait_until(client: httpx.AsyncClient, url: str, timeout: float, ok=lambda r: r.status_code == 200) -> float:
+    """輪詢直到 url 回應符合條件，回傳等待的秒數。"""
+    started = time.perf_counter()
+    while True:
+        try:
+            if ok(await client.get(url)):
+                return time.perf_counter() - started
+        except httpx.TransportError:
+            pass
+        if time.perf_counter() - started > timeout:
+            raise TimeoutError(f"等待 {url} 逾時")
+        await asyncio.sleep(0.02)
+
+
+class BenchmarkEnvironment:
+    """替身伺服器 (子行程) + Sidecar (子行程) + 暫存資料夾；離開時全部清除。"""
+
+    def __init__(self, config: BenchmarkConfig, verbose: bool = False):
+        self.config = config
+        self.verbose = verbose
+        self.workdir = tempfile.mkdtemp(prefix="opused-bench-")
+        self.bangumi_port, self.dmhy_port, self.app_port = _free_port(), _free_port(), _free_port()
+        self.app_url = f"http://127.0.0.1:{self.app_port}"
+        self.startup: Dict[str, float] = {}
+        self._stand_ins: Optional[multiprocessing.Process] = None
+        self._app: Optional[subprocess.Popen] = None
+
+    async def __aenter__(self) -> "BenchmarkEnvironment":
+        ctx = multiprocessing.get_context("spawn")
+        self._stand_ins = ctx.Process(
+            target=stand_ins.serve,
+            args=(self.config.stand_in, self.bangumi_port, self.dmhy_port),
+            name="bench-stand-ins",
+            daemon=True,
+        )
+        self._stand_ins.start()
+        env = {
+            # 替身伺服器不限流；從高速率起跳，只量測限流本身的成本而非 AIMD 爬升期。可由環境變數覆寫
+            "OPUSED_RATE_INITIAL": "500",
+            "OPUSED_RATE_MAX": "1000",
+            **os.environ,
+            "OPUSED_BANGUMI_BASE_URL": f"http://127.0.0.1:{self.bangumi_port}",
+            "OPUSED_DMHY_BASE_URL": f"http://127.0.0.1:{self.dmhy_port}",
+            "OPUSED_DATA_DIR": os.path.join(self.workdir, "data"),
+        }
+        async with httpx.AsyncClient(timeout=5) as client:
+            for port in (self.bangumi_port, self.dmhy_port):
+                await _wait_until(client, f"http://127.0.0.1:{port}/__stand_in__/stats", timeout=30)
+            started = time.perf_counter()
+            self._app = subprocess.Popen(
+                [sys.executable, "-m", "sidecar.benchmarks.app_host", "--port", str(self.app_port)],
+                env=env,
+                # Sidecar 的日誌照常產生 (屬於被量測的成本)，只是預設不顯示
+                stdout=None if self.verbose else subprocess.DEVNULL,
+                stderr=None if self.verbose else subprocess.DEVNULL,
+            )
+            await _wait_until(client, f"{self.app_url}/health", timeout=60)
+            self.startup["health"] = round(time.perf_counter() - started, 4)
+            await _wait_until(client, f"{self.app_url}/ready", timeout=120)
+            self.startup["ready"] = round(time.perf_counter() - started, 4)
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        if self._app is not None:
+            self._app.terminate()
+            try:
+                await asyncio.to_thread(self._app.wait, 15)
+            except subprocess.TimeoutExpired:
+                self._app.kill()
+        if self._stand_ins is not None:
+            self._stand_ins.kill()
+            self._stand_ins.join(5)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+async def _app_stats(client: httpx.AsyncClient) -> Dict[str, Any]:
+    return (await client.get("/__bench__/stats")).json()
+
+
+async def run_search(client: httpx.AsyncClient, config: BenchmarkConfig) -> Dict[str, Any]:
+    """N 個不同標題的 GET /metadata/search，冷快取。"""
+    semaphore = asyncio.Semaphore(config.concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def _one(i: int) -> None:
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                resp = await client.get("/metadata/search", params={"title": f"Bench Title {i}"})
+                ok = resp.status_code == 200 and bool(resp.json())
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(_one(i) for i in range(config.titles)))
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+async def run_downloads(client: httpx.AsyncClient, config: BenchmarkConfig, target_root: str) -> Dict[str, Any]:
+    """N 個 DMHY 種子檔下載，以 /tasks/stream 的事件記錄完成時間。"""
+    finished: Dict[str, float] = {}
+    failed: set = set()
+    all_done = asyncio.Event()
+    task_ids = [f"bench-{i}" for i in range(config.downloads)]
+    submitted: Dict[str, float] = {}
+    subscribed = asyncio.Event()
+
+    async def _watch() -> None:
+        async with client.stream("GET", "/tasks/stream", timeout=None) as resp:
+            data_lines: List[str] = []
+            async for line in resp.aiter_lines():
+                subscribed.set()
+                if line.startswith("data:"):
+                    data_lines.append(line[5:].strip())
+                    continue
+                if line or not data_lines:
+                    continue
+                event = json.loads("".join(data_lines))
+                data_lines = []
+                for item in event.get("tasks", [event]):
+                    task_id, status = item.get("task_id"), item.get("status")
+                    if task_id in submitted and task_id not in finished and status in ("completed", "failed"):
+                        finished[task_id] = time.perf_counter()
+                        if status == "failed":
+                            failed.add(task_id)
+                if len(finished) == len(task_ids):
+                    all_done.set()
+                    return
+
+    watcher = asyncio.create_task(_watch())
+    await asyncio.wait_for(subscribed.wait(), 10)
+    started = time.perf_counter()
+    for i, task_id in enumerate(task_ids):
+        submitted[task_id] = time.perf_counter()
+        resp = await client.post("/download", json={
+            "task_id": task_id,
+            "anime_title": f"Bench Anime {i}",
+            "target_dir": os.path.join(target_root, str(i)),
+            "source": "dmhy",
+            "dmhy_mode": "torrent",
+            "dmhy_search": "rss",
+            "metadata": {"anime_title": f"Bench Anime {i}", "song_title": f"Song{i}", "artist": "a", "type": "OP"},
+        })
+        if resp.status_code != 200:
+            finished[task_id] = time.perf_counter()
+            failed.add(task_id)
+    if len(finished) == len(task_ids):
+        all_done.set()
+    try:
+        await asyncio.wait_for(all_done.wait(), config.timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        watcher.cancel()
+    elapsed = (max(finished.values()) if all_done.is_set() else time.perf_counter()) - started
+    latencies = [finished[t] - submitted[t] for t in task_ids if t in finished and t not in failed]
+    return summarize(latencies, elapsed, errors=len(task_ids) - len(latencies))
+
+
+async def run(config: BenchmarkConfig, verbose: bool = False) -> Dict[str, Any]:
+    async with BenchmarkEnvironment(config, verbose=verbose) as env:
+        async with httpx.AsyncClient(base_url=env.app_url, timeout=30) as client:
+            scenarios: Dict[str, Any] = {}
+            for name, scenario in (
+                ("search", lambda: run_search(client, config)),
+                ("download", lambda: run_downloads(client, config, os.path.join(env.workdir, "downloads"))),
+            ):
+                await client.post("/__bench__/reset")
+                result = await scenario()
+                stats = await _app_stats(client)
+                scenarios[name] = {**result, "loop_lag": stats["loop_lag"], "peak_rss": stats["peak_rss"]}
+        return {
+            "config": {**asdict(config), "stand_in": config.stand_in.to_dict()},
+            "environment": {"python": platform.python_version(), "platform": platform.platform()},
+            "startup": env.startup,
+            "scenarios": scenarios,
+        }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.2) -> List[str]:
+    """回傳超出容許範圍的退化項目；空列表表示沒有退化。"""
+    regressions: List[str] = []
+
+    def _worse(label: str, current: Optional[float], base: Optional[float], higher_is_better: bool, floor: float = 0.0) -> None:
+        if current is None or base is None:
+            return
+        if higher_is_better and current < base * (1 - tolerance):
+            regressions.append(f"{label}: {current} < {base} (-{tolerance:.0%})")
+        elif not higher_is_better and current > base * (1 + tolerance) + floor:
+            regressions.append(f"{label}: {current} > {base} (+{tolerance:.0%})")
+
+    for label in ("health", "ready"):
+        _worse(f"startup.{label}", report["startup"].get(label), baseline.get("startup", {}).get(label), False, 0.2)
+    for name, current in report["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        if current["errors"] > base["errors"]:
+            regressions.append(f"{name}.errors: {current['errors']} > {base['errors']}")
+        _worse(f"{name}.throughput", current["throughput"], base["throughput"], True)
+        for pct in ("p50", "p95", "p99"):
+            _worse(f"{name}.{pct}", current[pct], base[pct], False, LATENCY_NOISE_FLOOR)
+        _worse(f"{name}.loop_lag.p99", current["loop_lag"]["p99"], base["loop_lag"]["p99"], False, LATENCY_NOISE_FLOOR)
+        _worse(f"{name}.peak_rss", current["peak_rss"], base["peak_rss"], False)
+    return regressions
+
+
+def load_baselines(path: str = BASELINE_PATH) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(profile: str, report: Dict[str, Any], path: str = BASELINE_PATH) -> None:
+    baselines = load_baselines(path)
+    baselines[profile] = report
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baselines, f, ensure_ascii=False, indent=2)
+        f.write("\n")
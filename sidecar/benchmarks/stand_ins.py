@@ -0,0 +1,232 @@
+"""
+Bangumi / DMHY 的本機替身伺服器，重播 recordings/ 中錄下的回應。
+
+每個標題都會得到穩定但不同的條目 id 與 info hash，避免 Sidecar 的快取把整批請求合併成一次；
+延遲、頻寬與錯誤率可設定，錯誤注入使用固定亂數種子，結果可重現。
+"""
+
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import random
+import urllib.parse
+from dataclasses import dataclass
+from string import Template
+from typing import AsyncIterator, Dict, Optional
+from xml.sax.saxutils import escape
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from sidecar.infrastructure.bencode import encode
+
+RECORDINGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings")
+CHUNK_SIZE = 16 * 1024
+
+
+@dataclass
+class StandInConfig:
+    latency: float = 0.02  # 每個回應的基本延遲 (秒)
+    jitter: float = 0.0  # 額外延遲的上限 (秒)，均勻分布
+    bandwidth: Optional[float] = None  # 回應本文的傳輸速率 (bytes/s)，None 表示不限
+    error_rate: float = 0.0  # 回應 503 的機率
+    torrent_size: int = 64 * 1024  # 種子檔大小，用來量測下載路徑
+    seed: int = 0
+
+    def to_dict(self) -> Dict[str, object]:
+        return dict(self.__dict__)
+
+
+def _load(name: str) -> str:
+    with open(os.path.join(RECORDINGS_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def _digest(text: str) -> bytes:
+    return hashlib.sha1(text.encode("utf-8")).digest()
+
+
+def subject_id(title: str) -> int:
+    """標題對應的穩定條目 id。"""
+    return 100_000 + int.from_bytes(_digest(title)[:4], "big") % 900_000
+
+
+def info_hash(keyword: str) -> str:
+    return _digest(f"dmhy:{keyword}").hex()
+
+
+def topic_id(keyword: str) -> str:
+    return f"{subject_id(keyword)}_{info_hash(keyword)[:8]}"
+
+
+def torrent_bytes(keyword: str, size: int) -> bytes:
+    """產生大小約為 size 的合法種子檔；以 comment 欄位補足長度。"""
+    name = f"{keyword}.mkv"
+    info = {"name": name, "piece length": 256 * 1024, "length": 1, "pieces": _digest(keyword)}
+    meta = {"announce": "http://tracker.invalid/announce", "info": info, "comment": ""}
+    padding = max(0, size - len(encode(meta)))
+    meta["comment"] = "x" * padding
+    return encode(meta)
+
+
+class _Injector:
+    """延遲、頻寬與錯誤注入，所有替身共用同一組設定。"""
+
+    def __init__(self, config: StandInConfig):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.requests = 0
+        self.errors = 0
+
+    async def delay(self) -> None:
+        self.requests += 1
+        wait = self.config.latency + (self.random.uniform(0, self.config.jitter) if self.config.jitter else 0.0)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def should_fail(self) -> bool:
+        if self.config.error_rate and self.random.random() < self.config.error_rate:
+            self.errors += 1
+            return True
+        return False
+
+    def respond(self, body: bytes, media_type: str, headers: Optional[Dict[str, str]] = None) -> Response:
+        if self.config.bandwidth is None:
+            return Response(body, media_type=media_type, headers=headers)
+        bandwidth = self.config.bandwidth
+
+        async def _paced() -> AsyncIterator[bytes]:
+            for start in range(0, len(body), CHUNK_SIZE):
+                chunk = body[start:start + CHUNK_SIZE]
+                await asyncio.sleep(len(chunk) / bandwidth)
+                yield chunk
+
+        headers = {**(headers or {}), "Content-Length": str(len(body))}
+        return StreamingResponse(_paced(), media_type=media_type, headers=headers)
+
+
+def _unavailable() -> Response:
+    return Response("injected failure", status_code=503, headers={"Retry-After": "0"})
+
+
+def bangumi_app(config: StandInConfig) -> Starlette:
+    recording = json.loads(_load("bangumi.json"))
+    injector = _Injector(config)
+
+    async def search(request: Request) -> Response:
+        await injector.delay()
+        if injector.should_fail():
+            return _unavailable()
+        title = urllib.parse.unquote(request.path_params["title"])
+        sid = subject_id(title)
+        etag = f'"{sid}"'
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        data = copy.deepcopy(recording["search"])
+        data["list"][0].update(id=sid, name=title, name_cn=title, url=f"http://bgm.tv/subject/{sid}")
+        return injector.respond(json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json", {"ETag": etag})
+
+    async def episodes(request: Request) -> Response:
+        await injector.delay()
+        if injector.should_fail():
+            return _unavailable()
+        sid = int(request.query_params.get("subject_id", 0))
+        page = copy.deepcopy(recording["episodes"].get(request.query_params.get("type", ""), {"data": [], "total": 0}))
+        for ep in page["data"]:
+            ep["subject_id"] = sid
+        return injector.respond(json.dumps(page, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    async def subject(request: Request) -> Response:
+        await injector.delay()
+        if injector.should_fail():
+            return _unavailable()
+        data = dict(recording["subject"], id=int(request.path_params["sid"]))
+        return JSONResponse(data)
+
+    async def stats(request: Request) -> Response:
+        return JSONResponse({"requests": injector.requests, "errors": injector.errors})
+
+    return Starlette(routes=[
+        Route("/search/subject/{title:path}", search),
+        Route("/v0/episodes", episodes),
+        Route("/v0/subjects/{sid:int}", subject),
+        Route("/__stand_in__/stats", stats),
+    ])
+
+
+def dmhy_app(config: StandInConfig, base_url: str) -> Starlette:
+    templates = {name: Template(_load(name)) for name in ("dmhy_rss.xml", "dmhy_list.html", "dmhy_detail.html")}
+    injector = _Injector(config)
+    # 細節頁與種子檔只有 topic id，記下搜尋時的關鍵字以便還原
+    keywords: Dict[str, str] = {}
+
+    def _render(name: str, keyword: str) -> bytes:
+        tid = topic_id(keyword)
+        keywords[tid] = keyword
+        magnet = f"magnet:?xt=urn:btih:{info_hash(keyword)}&dn={urllib.parse.quote(keyword)}"
+        # 關鍵字為「動畫名 歌名」，錄製的標題格式為 [字幕組] 動畫名 NCOP 歌名
+        title, _, song = keyword.rpartition(" ")
+        values = {"base_url": base_url, "topic_id": tid, "magnet": magnet, "title": title or keyword, "song": song}
+        values = {k: escape(v, {'"': "&quot;"}) for k, v in values.items()}
+        return templates[name].substitute(values).encode("utf-8")
+
+    async def rss(request: Request) -> Response:
+        await injector.delay()
+        if injector.should_fail():
+            return _unavailable()
+        return injector.respond(_render("dmhy_rss.xml", request.query_params.get("keyword", "")), "application/xml")
+
+    async def listing(request: Request) -> Response:
+        await injector.delay()
+        if injector.should_fail():
+            return _unavailable()
+        return injector.respond(_render("dmhy_list.html", request.query_params.get("keyword", "")), "text/html")
+
+    async def detail(request: Request) -> Response:
+        await injector.delay()
+        if injector.should_fail():
+            return _unavailable()
+        keyword = keywords.get(request.path_params["tid"])
+        if keyword is None:
+            return Response(status_code=404)
+        return injector.respond(_render("dmhy_detail.html", keyword), "text/html")
+
+    async def torrent(request: Request) -> Response:
+        await injector.delay()
+        if injector.should_fail():
+            return _unavailable()
+        keyword = keywords.get(request.path_params["tid"])
+        if keyword is None:
+            return Response(status_code=404)
+        return injector.respond(torrent_bytes(keyword, config.torrent_size), "application/x-bittorrent")
+
+    async def stats(request: Request) -> Response:
+        return JSONResponse({"requests": injector.requests, "errors": injector.errors})
+
+    return Starlette(routes=[
+        Route("/topics/rss/rss.xml", rss),
+        Route("/topics/list", listing),
+        Route("/topics/view/{tid}.html", detail),
+        Route("/dl/{tid}.torrent", torrent),
+        Route("/__stand_in__/stats", stats),
+    ])
+
+
+def serve(config: StandInConfig, bangumi_port: int, dmhy_port: int, host: str = "127.0.0.1") -> None:
+    """在目前行程中同時啟動兩個替身伺服器，直到行程被終止（替身沒有狀態，可直接 kill）。"""
+    import uvicorn
+
+    servers = [
+        uvicorn.Server(uvicorn.Config(bangumi_app(config), host=host, port=bangumi_port, log_level="warning")),
+        uvicorn.Server(uvicorn.Config(
+            dmhy_app(config, f"http://{host}:{dmhy_port}"), host=host, port=dmhy_port, log_level="warning"
+        )),
+    ]
+    async def _main() -> None:
+        await asyncio.gather(*(s.serve() for s in servers))
+
+    asyncio.run(_main())
@@ -1,9 +1,12 @@
 from dataclasses import dataclass, field
 from enum import Enum
-from typing import List, Optional
+from typing import Callable, List, Optional
 from datetime import datetime
+from string import Formatter
 import uuid
 
+from sidecar.domain.stages import TaskTimeline
+
 class Source(Enum):
     YOUTUBE = "youtube"
     DMHY = "dmhy"
@@ -12,11 +15,17 @@ class DownloadMode(Enum):
     VIDEO = "video"
     TORRENT = "torrent"  # 僅適用於 DMHY
 
+class DMHYSearchMode(Enum):
+    RSS = "rss"    # 單次 RSS 請求取得磁力連結
+    HTML = "html"  # 解析列表頁與細節頁
+
 class TaskStatus(Enum):
     PENDING = "pending"
     DOWNLOADING = "downloading"
+    POSTPROCESSING = "postprocessing"  # 傳輸已完成，等待或正在轉檔、寫入標籤
     COMPLETED = "completed"
     FAILED = "failed"
+    PAUSED = "paused"  # 傳輸已中斷，保留已下載的部分，可續傳
 
 @dataclass(frozen=True)
 class Metadata:
@@ -26,23 +35,100 @@ class Metadata:
     type: str  # e.g., "OP", "ED"
     bangumi_id: Optional[str] = None
 
-@dataclass
+# 後處理可轉換成的音訊格式
+AUDIO_CODECS = ("mp3", "m4a", "opus", "flac", "wav")
+# 檔名範本可使用的欄位，例如 "{anime_title} {type} - {song_title}"
+FILENAME_FIELDS = ("anime_title", "song_title", "artist", "type")
+
+@dataclass(frozen=True)
+class PostProcessOptions:
+    """下載完成後的後處理；audio_codec 為 None 時保留原始格式，filename_template 為 None 時不改名。"""
+    audio_codec: Optional[str] = None
+    audio_bitrate: Optional[str] = None  # 例如 "192k"；None 時使用編碼器預設值
+    embed_tags: bool = True
+    embed_cover: bool = False
+    filename_template: Optional[str] = None
+
+    def __post_init__(self):
+        if self.audio_codec is not None and self.audio_codec not in AUDIO_CODECS:
+            raise ValueError(f"不支援的音訊格式: {self.audio_codec}")
+        if self.filename_template is not None:
+            fields = {name for _, name, _, _ in Formatter().parse(self.filename_template) if name is not None}
+            unknown = fields - set(FILENAME_FIELDS)
+            if unknown or not self.filename_template.strip():
+                raise ValueError(f"檔名範本只能使用 {', '.join(FILENAME_FIELDS)}: {self.filename_template}")
+
+@dataclass(slots=True)
 class Task:
     id: str = field(default_factory=lambda: str(uuid.uuid4()))
     anime_title: str = ""
     target_dir: str = ""
     source: Source = Source.YOUTUBE
     dmhy_mode: DownloadMode = DownloadMode.VIDEO
+    dmhy_search: DMHYSearchMode = DMHYSearchMode.RSS
     metadata: Optional[Metadata] = None
     custom_keywords: Optional[str] = None
+    priority: int = 0  # 數值越大越早執行
+    batch_id: Optional[str] = None
+    # 搜尋後確定的下載來源 (影片網址 / 種子連結)，續傳時可跳過搜尋
+    resolved_url: Optional[str] = None
+    postprocess: Optional[PostProcessOptions] = None
+    # 此任務的下載頻寬上限 (bytes/s)，None 表示只受全域上限限制
+    bandwidth_limit: Optional[int] = None
+    # 下載 (與後處理) 產生的檔案路徑
+    output_files: List[str] = field(default_factory=list)
+    # 傳輸中的暫存檔 (.part、續傳紀錄)，取消且不保留已下載部分時刪除
+    partial_files: List[str] = field(default_factory=list)
     status: TaskStatus = TaskStatus.PENDING
     progress: float = 0.0
+    downloaded_bytes: int = 0
+    total_bytes: Optional[int] = None
     error_message: Optional[str] = None
     created_at: datetime = field(default_factory=datetime.now)
     updated_at: datetime = field(default_factory=datetime.now)
+    # 狀態變更觀察者（如事件串流），不屬於任務本身的資料
+    _listeners: List[Callable[["Task"], None]] = field(
+        default_factory=list, init=False, repr=False, compare=False
+    )
+    # 各階段的耗時，只存在記憶體中，不寫入任務紀錄
+    timeline: TaskTimeline = field(default_factory=TaskTimeline, init=False, repr=False, compare=False)
+
+    def subscribe(self, listener: Callable[["Task"], None]) -> None:
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener: Callable[["Task"], None]) -> None:
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def complete_transfer(self, output_files: List[str]) -> None:
+        """下載器傳輸完成時呼叫：有後處理時進入 POSTPROCESSING，否則直接 COMPLETED。"""
+        self.output_files = list(output_files)
+        self.partial_files = []
+        status = TaskStatus.POSTPROCESSING if self.postprocess else TaskStatus.COMPLETED
+        self.update_status(status, progress=100.0)
 
-    def update_status(self, status: TaskStatus, progress: float = 0.0, error: Optional[str] = None):
+    def update_status(
+        self,
+        status: TaskStatus,
+        progress: float = 0.0,
+        error: Optional[str] = None,
+        downloaded_bytes: Optional[int] = None,
+        total_bytes: Optional[int] = None,
+    ):
+        """更新狀態；未提供的位元組數沿用原值。"""
+        if downloaded_bytes is None:
+            downloaded_bytes = self.downloaded_bytes
+        if total_bytes is None:
+            total_bytes = self.total_bytes
+        changed = (self.status, self.progress, self.error_message, self.downloaded_bytes, self.total_bytes) != (
+            status, progress, error, downloaded_bytes, total_bytes
+        )
         self.status = status
         self.progress = progress
         self.error_message = error
+        self.downloaded_bytes = downloaded_bytes
+        self.total_bytes = total_bytes
         self.updated_at = datetime.now()
+        if changed:
+            for listener in list(self._listeners):
+                listener(self)
@@ -15,3 +15,73 @@ class IDownloader(ABC):
     @abstractmethod
     async def download(self, task: Task) -> bool:
         pass
+
+    async def resolve(self, task: Task) -> Optional[str]:
+        """只搜尋、不下載，回傳確定的下載來源；不支援或找不到時回傳 None。"""
+        return None
+
+class ITaskJournal(ABC):
+    """持久化未完成的下載任務，讓任務在失敗或 Sidecar 重啟後能以 task_id 還原。"""
+
+    @abstractmethod
+    async def save(self, task: Task) -> None:
+        pass
+
+    @abstractmethod
+    async def load(self, task_id: str) -> Optional[Task]:
+        pass
+
+    @abstractmethod
+    async def delete(self, task_id: str) -> None:
+        pass
+
+    @abstractmethod
+    async def list_ids(self) -> List[str]:
+        pass
+
+class IResolutionCache(ABC):
+    """以任務的搜尋條件為鍵，保存搜尋後確定的下載來源 (影片網址 / 磁力連結 / 種子連結)。"""
+
+    @abstractmethod
+    async def get(self, task: Task) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    async def put(self, task: Task, resolved_url: str) -> None:
+        pass
+
+    @abstractmethod
+    async def invalidate(self, task: Task) -> None:
+        pass
+
+class ITaskMetrics(ABC):
+    """記錄任務各階段 (sidecar.domain.stages) 的耗時與傳輸量；每次進度更新都會呼叫，實作必須夠輕量。"""
+
+    @abstractmethod
+    def observe_stage(self, task: Task, stage: str, seconds: float) -> None:
+        pass
+
+    @abstractmethod
+    def observe_bytes(self, task: Task, count: int) -> None:
+        pass
+
+class IPostProcessor(ABC):
+    """對傳輸完成的檔案轉檔、寫入標籤並改名 (Task.postprocess)；在下載名額之外執行。"""
+
+    @abstractmethod
+    async def process(self, task: Task) -> List[str]:
+        """處理 task.output_files，回傳處理後的檔案路徑；失敗時拋出例外，原檔保留。"""
+        pass
+
+class ILibraryIndex(ABC):
+    """下載資料夾中既有檔案的索引，用來在排程前跳過已經下載過的歌曲。"""
+
+    @abstractmethod
+    async def find(self, target_dir: str, metadata: Metadata) -> List[str]:
+        """回傳 target_dir 中符合此歌曲的檔案路徑；找不到時回傳空 list。"""
+        pass
+
+    @abstractmethod
+    async def record(self, task: Task) -> None:
+        """登記下載完成的任務的輸出檔案。"""
+        pass
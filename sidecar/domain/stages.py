@@ -0,0 +1,137 @@
+"""
+下載任務的階段名稱、每個任務的時間軸，以及寫入磁碟時間的累計。
+
+時間軸與寫入時間都以 ContextVar 傳遞：搜尋、HTTP 請求、寫檔發生在下載器深處，
+不必把任務或指標物件一路傳進 Infrastructure；asyncio 子任務與 to_thread 都會繼承同一個時間軸。
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+QUEUED = "queued"
+RESOLVE = "resolve"
+SEARCH = "search"
+DETAIL = "detail"
+TRANSFER = "transfer"
+WRITE = "write"
+POSTPROCESS = "postprocess"
+HTTP = "http"
+RATE_LIMIT = "rate_limit"
+RETRY = "retry"
+LIBRARY = "library"
+
+# 單一任務保留的 span 上限，避免長時間的 BT 下載無限累積
+MAX_SPANS = 500
+
+
+class Span:
+    __slots__ = ("name", "start", "end", "thread", "attrs")
+
+    def __init__(self, name: str, start: float, end: float, thread: str, attrs: Dict[str, Any]):
+        self.name = name
+        self.start = start  # time.perf_counter()
+        self.end = end
+        self.thread = thread
+        self.attrs = attrs
+
+
+class TaskTimeline:
+    """任務從建立起的各段耗時；時間以 perf_counter 記錄，輸出時換算成相對於 origin 的秒數。"""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.wall_origin = time.time()
+        self.spans: List[Span] = []
+        self.dropped = 0
+
+    def add(self, name: str, start: float, end: float, **attrs: Any) -> None:
+        if len(self.spans) >= MAX_SPANS:
+            self.dropped += 1
+            return
+        self.spans.append(Span(name, start, end, threading.current_thread().name, attrs))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "started_at": self.wall_origin,
+            "dropped": self.dropped,
+            "spans": [
+                {
+                    "name": s.name,
+                    "start": round(s.start - self.origin, 6),
+                    "duration": round(s.end - s.start, 6),
+                    "thread": s.thread,
+                    **s.attrs,
+                }
+                for s in sorted(self.spans, key=lambda s: s.start)
+            ],
+        }
+
+
+_timeline: ContextVar[Optional[TaskTimeline]] = ContextVar("opused_timeline", default=None)
+_write_clock: ContextVar[Optional[List[float]]] = ContextVar("opused_write_clock", default=None)
+
+
+@contextmanager
+def bind_timeline(timeline: TaskTimeline) -> Iterator[TaskTimeline]:
+    """區塊內 (含其建立的子任務與執行緒) 的 span 都記錄到 timeline。"""
+    token = _timeline.set(timeline)
+    try:
+        yield timeline
+    finally:
+        _timeline.reset(token)
+
+
+def current_timeline() -> Optional[TaskTimeline]:
+    return _timeline.get()
+
+
+def record_span(name: str, start: float, end: Optional[float] = None, **attrs: Any) -> None:
+    """把已結束的一段時間記到目前的時間軸；沒有綁定時間軸時不做任何事。"""
+    timeline = _timeline.get()
+    if timeline is not None:
+        timeline.add(name, start, time.perf_counter() if end is None else end, **attrs)
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Dict[str, Any]]:
+    """以區塊記錄一段時間；可在區塊內往回傳的 dict 補上屬性，例外會記為 error。"""
+    timeline = _timeline.get()
+    if timeline is None:
+        yield attrs
+        return
+    started = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        timeline.add(name, started, time.perf_counter(), **attrs)
+
+
+@contextmanager
+def measure_writes() -> Iterator[List[float]]:
+    """區塊內 timed_write 的總秒數累計在回傳列表的第一個元素。"""
+    clock = [0.0]
+    token = _write_clock.set(clock)
+    try:
+        yield clock
+    finally:
+        _write_clock.reset(token)
+
+
+@contextmanager
+def timed_write() -> Iterator[None]:
+    """包住一次磁碟寫入；不在 measure_writes 內時不做任何事。"""
+    clock = _write_clock.get()
+    if clock is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        clock[0] += time.perf_counter() - started
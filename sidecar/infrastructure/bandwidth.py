@@ -0,0 +1,96 @@
+"""
+下載頻寬上限。
+
+全域一個以位元組計的 token bucket，每個任務可再指定自己的上限；
+Sidecar 自己處理的串流 (分段 HTTP 下載、BT 區塊) 每收到一塊資料就向兩者取得額度，
+等待期間不再讀取 socket，由 TCP 流量控制讓上游放慢。
+yt-dlp 在子行程中下載，無法共用 bucket，改為在開始時給予固定的 ratelimit：
+任務上限與全域上限平分給進行中傳輸兩者取小。
+"""
+
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+
+class ByteBucket:
+    """以位元組計的 token bucket；一次取得超過容量時先借用，之後等待還清，大區塊也不會卡住。"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = float(rate)
+        # 預設可累積一秒的量，閒置後的第一個區塊不必等待
+        self.capacity = float(burst or rate)
+        self.tokens = self.capacity
+        self.updated = time.perf_counter()
+        # FIFO 排隊，避免多個串流同時醒來搶額度
+        self._lock = asyncio.Lock()
+
+    async def consume(self, n: int) -> float:
+        """取得 n 個位元組的額度，回傳等待的秒數。"""
+        started = time.perf_counter()
+        async with self._lock:
+            now = time.perf_counter()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= n
+            if self.tokens < 0:
+                await asyncio.sleep(-self.tokens / self.rate)
+        return time.perf_counter() - started
+
+
+class Throttle:
+    """單一任務的限速：先取得任務自己的額度，再取得全域額度。傳輸結束時呼叫 close() (或以 with 使用)。"""
+
+    def __init__(self, limiter: "BandwidthLimiter", task_id: str, rate: Optional[float] = None):
+        self.limiter = limiter
+        self.task_id = task_id
+        self.rate = rate
+        self.bucket = ByteBucket(rate) if rate else None
+
+    def __enter__(self) -> "Throttle":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self.limiter._active.get(self.task_id) is self:
+            del self.limiter._active[self.task_id]
+
+    async def consume(self, n: int) -> None:
+        waited = await self.bucket.consume(n) if self.bucket else 0.0
+        if self.limiter.bucket:
+            waited += await self.limiter.bucket.consume(n)
+        self.limiter.bytes += n
+        self.limiter.wait_seconds += waited
+
+    def share(self) -> Optional[int]:
+        """交給外部下載程式的固定上限 (bytes/s)；沒有任何上限時回傳 None。"""
+        rates = [self.rate] if self.rate else []
+        if self.limiter.rate:
+            rates.append(self.limiter.rate / max(1, len(self.limiter._active)))
+        return int(min(rates)) if rates else None
+
+
+class BandwidthLimiter:
+    """全域頻寬上限 (bytes/s)；rate 為 None 時不限，但仍可套用任務上限。"""
+
+    def __init__(self, rate: Optional[float] = None):
+        self.rate = rate or None
+        self.bucket = ByteBucket(rate) if rate else None
+        self._active: Dict[str, Throttle] = {}
+        self.bytes = 0
+        self.wait_seconds = 0.0
+
+    def throttle(self, task_id: str, rate: Optional[float] = None) -> Throttle:
+        """開始一個任務的傳輸；進行中的傳輸數用來計算交給 yt-dlp 的平分額度。"""
+        throttle = self._active[task_id] = Throttle(self, task_id, rate)
+        return throttle
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rate": self.rate,
+            "active": len(self._active),
+            "bytes": self.bytes,
+            "wait_seconds": round(self.wait_seconds, 3),
+        }
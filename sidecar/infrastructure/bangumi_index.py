@@ -0,0 +1,436 @@
+"""
+BangumiIndex: 以 Bangumi Archive 匯出檔建立的本機 SQLite 索引，不經網路查詢 標題 → OP/ED。
+
+- 只收錄動畫條目 (type=2) 與 OP/ED 集數 (type=2/3)
+- FTS5 trigram 索引中文名、日文原名、羅馬字與其他別名，查詢時再以相似度重新排序，容許錯字與部分標題
+- 每列保存內容摘要，重新匯入新的匯出檔時只寫入有變動的條目
+
+匯入：
+
+    python -m sidecar.infrastructure.bangumi_index dump.zip [--db data/bangumi_index.sqlite3]
+
+匯出檔可為 Archive 的 zip，或含 subject.jsonlines / episode.jsonlines 的資料夾。
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from difflib import SequenceMatcher
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sidecar.infrastructure.metadata_cache import normalize_title
+
+ANIME = 2
+# Bangumi episode 類型：2 為 OP，3 為 ED
+EPISODE_TYPES = {2: "OP", 3: "ED"}
+SUBJECT_FILE = "subject.jsonlines"
+EPISODE_FILE = "episode.jsonlines"
+# infobox 中視為作品名稱的欄位
+NAME_KEYS = {"中文名", "简体中文名", "繁体中文名", "别名", "英文名", "罗马字", "罗马名", "日文名", "原名"}
+# 低於此相似度的候選不算命中，交給網路查詢
+MIN_SCORE = 0.6
+MAX_CANDIDATES = 50
+BATCH_SIZE = 5000
+
+_NON_WORD = re.compile(r"[\W_]+")
+_LATIN = re.compile(r"^[\x00-\x7fÀ-ɏ̄́]+$")
+_INFOBOX_FIELD = re.compile(r"^\|\s*([^=\n]+?)\s*=\s*(.*)$")
+_INFOBOX_ITEM = re.compile(r"^\[(?:[^|\]]*\|)?([^\]]*)\]$")
+
+
+def compact(text: str) -> str:
+    """比對用的形式：NFKC、小寫並去除空白與標點，「Lycoris Recoil」與「lycoris-recoil」視為相同。"""
+    return _NON_WORD.sub("", normalize_title(text))
+
+
+def parse_infobox_names(infobox: Optional[str]) -> List[str]:
+    """從 wiki 格式的 infobox 取出中文名、別名等名稱欄位的值。"""
+    if not infobox:
+        return []
+    names: List[str] = []
+    current: Optional[str] = None
+    for raw in infobox.splitlines():
+        line = raw.strip()
+        if current is not None:
+            if line == "}":
+                current = None
+                continue
+            item = _INFOBOX_ITEM.match(line)
+            if item and item.group(1).strip():
+                names.append(item.group(1).strip())
+            continue
+        match = _INFOBOX_FIELD.match(line)
+        if not match or match.group(1) not in NAME_KEYS:
+            continue
+        value = match.group(2).strip()
+        if value == "{":
+            current = match.group(1)
+        elif value:
+            names.append(value)
+    return names
+
+
+@dataclass
+class IndexedEpisode:
+    type: str  # "OP" / "ED"
+    name: str
+    desc: str
+
+
+@dataclass
+class IndexedSubject:
+    subject_id: str
+    name: str
+    name_cn: str
+    score: float
+    episodes: List[IndexedEpisode] = field(default_factory=list)
+
+
+@dataclass
+class ImportStats:
+    subjects_added: int = 0
+    subjects_updated: int = 0
+    subjects_unchanged: int = 0
+    episodes_added: int = 0
+    episodes_updated: int = 0
+    episodes_unchanged: int = 0
+    skipped: int = 0  # 非動畫條目、非 OP/ED 集數或無法解析的列
+    seconds: float = 0.0
+
+
+@dataclass
+class IndexStats:
+    hits: int = 0
+    misses: int = 0
+
+
+def _digest(line: str) -> str:
+    return hashlib.blake2b(line.encode("utf-8"), digest_size=12).hexdigest()
+
+
+@contextmanager
+def _open_dump(path: str, name: str) -> Iterator[Optional[io.TextIOBase]]:
+    """開啟 zip 或資料夾中的指定檔案 (zip 內可在子資料夾)；不存在時產出 None。"""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zf:
+            member = next((m for m in zf.namelist() if os.path.basename(m) == name), None)
+            if member is None:
+                yield None
+                return
+            with zf.open(member) as raw:
+                yield io.TextIOWrapper(raw, encoding="utf-8")
+        return
+    file_path = os.path.join(path, name) if os.path.isdir(path) else path
+    if os.path.basename(file_path) != name or not os.path.exists(file_path):
+        yield None
+        return
+    with open(file_path, encoding="utf-8") as f:
+        yield f
+
+
+class BangumiIndex:
+    """
+    所有方法皆為同步呼叫，服務中需透過 asyncio.to_thread 執行。
+    匯入與查詢可同時進行 (WAL)，查詢看到的是上一次提交的內容。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.stats = IndexStats()
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS subjects (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                name_cn TEXT NOT NULL,
+                names TEXT NOT NULL,
+                score REAL NOT NULL DEFAULT 0,
+                digest TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS episodes (
+                id INTEGER PRIMARY KEY,
+                subject_id INTEGER NOT NULL,
+                type INTEGER NOT NULL,
+                sort REAL NOT NULL,
+                name TEXT NOT NULL,
+                description TEXT NOT NULL,
+                digest TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS episodes_subject ON episodes (subject_id, type, sort);
+            CREATE TABLE IF NOT EXISTS exact_names (
+                name TEXT NOT NULL,
+                subject_id INTEGER NOT NULL,
+                PRIMARY KEY (name, subject_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS exact_names_subject ON exact_names (subject_id);
+            CREATE VIRTUAL TABLE IF NOT EXISTS subject_names USING fts5(
+                name_cn, name_ja, romaji, aliases, tokenize = 'trigram'
+            );
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            """
+        )
+        self._conn.commit()
+
+    # ---- 匯入 ----
+
+    def import_dump(self, path: str, progress=None) -> ImportStats:
+        """
+        匯入 Archive 匯出檔。內容摘要相同的列會略過，可重複對新的匯出檔執行。
+        progress(檔名, 已讀列數) 每處理 BATCH_SIZE 列呼叫一次。
+        """
+        stats = ImportStats()
+        started = time.perf_counter()
+        with _open_dump(path, SUBJECT_FILE) as f:
+            if f is not None:
+                self._import_subjects(f, stats, progress)
+        with _open_dump(path, EPISODE_FILE) as f:
+            if f is not None:
+                self._import_episodes(f, stats, progress)
+        stats.seconds = round(time.perf_counter() - started, 3)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('imported_at', ?), ('source', ?)",
+                (str(time.time()), os.path.basename(path)),
+            )
+            self._conn.commit()
+        return stats
+
+    def _import_subjects(self, lines: io.TextIOBase, stats: ImportStats, progress) -> None:
+        with self._lock:
+            known = dict(self._conn.execute("SELECT id, digest FROM subjects"))
+        batch: List[Tuple[Dict[str, Any], str]] = []
+        for count, line in enumerate(lines, 1):
+            line = line.strip()
+            record = self._parse(line, stats)
+            if record is not None and record.get("type") == ANIME and "id" in record:
+                digest = _digest(line)
+                previous = known.get(record["id"])
+                if previous == digest:
+                    stats.subjects_unchanged += 1
+                else:
+                    if previous is None:
+                        stats.subjects_added += 1
+                    else:
+                        stats.subjects_updated += 1
+                    batch.append((record, digest))
+            elif record is not None:
+                stats.skipped += 1
+            if count % BATCH_SIZE == 0:
+                self._write_subjects(batch)
+                batch = []
+                if progress:
+                    progress(SUBJECT_FILE, count)
+        self._write_subjects(batch)
+
+    def _write_subjects(self, batch: List[Tuple[Dict[str, Any], str]]) -> None:
+        if not batch:
+            return
+        subject_rows, fts_rows, exact_rows = [], [], []
+        for record, digest in batch:
+            sid = record["id"]
+            name, name_cn = record.get("name") or "", record.get("name_cn") or ""
+            aliases = [n for n in parse_infobox_names(record.get("infobox")) if n not in (name, name_cn)]
+            names = list(dict.fromkeys(n for n in (name_cn, name, *aliases) if n))
+            romaji = [n for n in names if _LATIN.match(n)]
+            others = [n for n in aliases if n not in romaji]
+            subject_rows.append((sid, name, name_cn, json.dumps(names, ensure_ascii=False),
+                                 float(record.get("score") or 0), digest))
+            fts_rows.append((sid, compact(name_cn), compact(name),
+                             " ".join(compact(n) for n in romaji), " ".join(compact(n) for n in others)))
+            exact_rows.extend((compact(n), sid) for n in names if compact(n))
+        ids = [(row[0],) for row in subject_rows]
+        with self._lock:
+            conn = self._conn
+            conn.executemany("DELETE FROM subject_names WHERE rowid = ?", ids)
+            conn.executemany("DELETE FROM exact_names WHERE subject_id = ?", ids)
+            conn.executemany(
+                "INSERT OR REPLACE INTO subjects (id, name, name_cn, names, score, digest) VALUES (?, ?, ?, ?, ?, ?)",
+                subject_rows,
+            )
+            conn.executemany(
+                "INSERT INTO subject_names (rowid, name_cn, name_ja, romaji, aliases) VALUES (?, ?, ?, ?, ?)",
+                fts_rows,
+            )
+            conn.executemany("INSERT OR IGNORE INTO exact_names (name, subject_id) VALUES (?, ?)", exact_rows)
+            conn.commit()
+
+    def _import_episodes(self, lines: io.TextIOBase, stats: ImportStats, progress) -> None:
+        with self._lock:
+            known = dict(self._conn.execute("SELECT id, digest FROM episodes"))
+        batch: List[tuple] = []
+        for count, line in enumerate(lines, 1):
+            line = line.strip()
+            record = self._parse(line, stats)
+            if record is not None and record.get("type") in EPISODE_TYPES and "id" in record:
+                digest = _digest(line)
+                previous = known.get(record["id"])
+                if previous == digest:
+                    stats.episodes_unchanged += 1
+                else:
+                    if previous is None:
+                        stats.episodes_added += 1
+                    else:
+                        stats.episodes_updated += 1
+                    batch.append((
+                        record["id"], record.get("subject_id") or 0, record["type"],
+                        float(record.get("sort") or 0), record.get("name") or "",
+                        record.get("description") or record.get("desc") or "", digest,
+                    ))
+            elif record is not None:
+                stats.skipped += 1
+            if count % BATCH_SIZE == 0:
+                self._write_episodes(batch)
+                batch = []
+                if progress:
+                    progress(EPISODE_FILE, count)
+        self._write_episodes(batch)
+
+    def _write_episodes(self, batch: List[tuple]) -> None:
+        if not batch:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO episodes (id, subject_id, type, sort, name, description, digest) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                batch,
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def _parse(line: str, stats: ImportStats) -> Optional[Dict[str, Any]]:
+        if not line:
+            return None
+        try:
+            return json.loads(line)
+        except ValueError:
+            stats.skipped += 1
+            return None
+
+    # ---- 查詢 ----
+
+    def find_subject(self, title: str, min_score: float = MIN_SCORE) -> Optional[IndexedSubject]:
+        """以標題找出最相符的動畫條目與其 OP/ED；相似度不足時回傳 None。"""
+        matches = self.search(title, limit=1, min_score=min_score)
+        if not matches:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        subject = matches[0]
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT type, name, description FROM episodes WHERE subject_id = ? ORDER BY type, sort, id",
+                (int(subject.subject_id),),
+            ).fetchall()
+        subject.episodes = [IndexedEpisode(EPISODE_TYPES[t], name, desc) for t, name, desc in rows]
+        return subject
+
+    def search(self, title: str, limit: int = 5, min_score: float = MIN_SCORE) -> List[IndexedSubject]:
+        """模糊搜尋動畫條目，依相似度 (同分時依評分) 排序。"""
+        query = compact(title)
+        if not query:
+            return []
+        with self._lock:
+            ids = [row[0] for row in self._conn.execute(
+                "SELECT subject_id FROM exact_names WHERE name = ?", (query,)
+            )]
+            if not ids:
+                ids = self._candidates(query)
+            if not ids:
+                return []
+            placeholders = ",".join("?" * len(ids))
+            rows = self._conn.execute(
+                f"SELECT id, name, name_cn, names, score FROM subjects WHERE id IN ({placeholders})", ids
+            ).fetchall()
+        scored = []
+        for sid, name, name_cn, names, score in rows:
+            similarity = max(_similarity(query, compact(n)) for n in json.loads(names) or [name])
+            if similarity >= min_score:
+                scored.append((similarity, score, IndexedSubject(str(sid), name, name_cn, score)))
+        scored.sort(key=lambda item: (item[0], item[1]), reverse=True)
+        return [subject for _, _, subject in scored[:limit]]
+
+    def _candidates(self, query: str) -> List[int]:
+        if len(query) < 3:
+            # trigram 需要至少三個字元；兩字的中文標題直接比對子字串
+            pattern = f"%{query}%"
+            return [row[0] for row in self._conn.execute(
+                "SELECT rowid FROM subject_names WHERE name_cn LIKE ? OR name_ja LIKE ? OR romaji LIKE ? "
+                "OR aliases LIKE ? LIMIT ?",
+                (pattern, pattern, pattern, pattern, MAX_CANDIDATES),
+            )]
+        # 任一 trigram 相同即為候選，bm25 排序後取前段再以相似度重排，容許錯字
+        trigrams = dict.fromkeys(query[i:i + 3] for i in range(len(query) - 2))
+        expression = " OR ".join('"' + t.replace('"', '""') + '"' for t in trigrams)
+        return [row[0] for row in self._conn.execute(
+            "SELECT rowid FROM subject_names WHERE subject_names MATCH ? ORDER BY rank LIMIT ?",
+            (expression, MAX_CANDIDATES),
+        )]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            subjects = self._conn.execute("SELECT COUNT(*) FROM subjects").fetchone()[0]
+            episodes = self._conn.execute("SELECT COUNT(*) FROM episodes").fetchone()[0]
+            meta = dict(self._conn.execute("SELECT key, value FROM meta"))
+        imported_at = meta.get("imported_at")
+        return {
+            **asdict(self.stats),
+            "subjects": subjects,
+            "episodes": episodes,
+            "imported_at": float(imported_at) if imported_at else None,
+            "source": meta.get("source"),
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _similarity(query: str, name: str) -> float:
+    if not name:
+        return 0.0
+    if query == name:
+        return 1.0
+    ratio = SequenceMatcher(None, query, name).ratio()
+    if query in name:
+        # 部分標題 (例如省略副標題) 依涵蓋比例加分
+        ratio = max(ratio, 0.7 + 0.3 * len(query) / len(name))
+    return ratio
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m sidecar.infrastructure.bangumi_index", description="匯入 Bangumi Archive 匯出檔到本機索引"
+    )
+    parser.add_argument("dump", help="Archive 的 zip，或含 subject.jsonlines / episode.jsonlines 的資料夾")
+    parser.add_argument("--db", default=os.environ.get("OPUSED_BANGUMI_INDEX") or os.path.join(
+        os.environ.get("OPUSED_DATA_DIR") or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data"),
+        "bangumi_index.sqlite3",
+    ), help="索引檔路徑 (預設與 Sidecar 相同)")
+    args = parser.parse_args(argv)
+
+    index = BangumiIndex(args.db)
+    try:
+        stats = index.import_dump(args.dump, progress=lambda name, n: print(f"{name}: {n} 列", file=sys.stderr))
+        print(json.dumps({**asdict(stats), **index.get_stats()}, ensure_ascii=False, indent=2))
+    finally:
+        index.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+Bencode 編碼與解碼（BitTorrent 的 .torrent、tracker 回應與擴充訊息格式）。
+
+字串一律以 bytes 表示；字典鍵也是 bytes。
+"""
+
+from typing import Any, Tuple
+
+
+class BencodeError(ValueError):
+    """資料不是合法的 bencode。"""
+
+
+def decode(data: bytes) -> Any:
+    """解碼完整的 bencode 資料，結尾不可有多餘位元組。"""
+    value, end = decode_prefix(data)
+    if end != len(data):
+        raise BencodeError(f"結尾有多餘資料 (位置 {end})")
+    return value
+
+
+def decode_prefix(data: bytes, start: int = 0) -> Tuple[Any, int]:
+    """解碼從 start 開始的一個值，回傳 (值, 結束位置)。ut_metadata 訊息後面接著原始資料時使用。"""
+    try:
+        return _decode(data, start)
+    except (IndexError, ValueError) as e:
+        if isinstance(e, BencodeError):
+            raise
+        raise BencodeError(str(e)) from e
+
+
+def _decode(data: bytes, i: int) -> Tuple[Any, int]:
+    c = data[i:i + 1]
+    if c == b"i":
+        end = data.index(b"e", i)
+        return int(data[i + 1:end]), end + 1
+    if c == b"l":
+        i += 1
+        items = []
+        while data[i:i + 1] != b"e":
+            item, i = _decode(data, i)
+            items.append(item)
+        return items, i + 1
+    if c == b"d":
+        i += 1
+        result = {}
+        while data[i:i + 1] != b"e":
+            key, i = _decode(data, i)
+            if not isinstance(key, bytes):
+                raise BencodeError("字典鍵必須是字串")
+            result[key], i = _decode(data, i)
+        return result, i + 1
+    if c.isdigit():
+        colon = data.index(b":", i)
+        length = int(data[i:colon])
+        start = colon + 1
+        if start + length > len(data):
+            raise BencodeError("字串長度超出資料範圍")
+        return data[start:start + length], start + length
+    raise BencodeError(f"無法解析的位元組 {c!r} (位置 {i})")
+
+
+def encode(value: Any) -> bytes:
+    """編碼 int / bytes / str / list / dict；字典依鍵排序。"""
+    if isinstance(value, bool):
+        raise BencodeError("不支援布林值")
+    if isinstance(value, int):
+        return b"i%de" % value
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    if isinstance(value, (bytes, bytearray)):
+        return b"%d:%s" % (len(value), bytes(value))
+    if isinstance(value, (list, tuple)):
+        return b"l" + b"".join(encode(v) for v in value) + b"e"
+    if isinstance(value, dict):
+        items = sorted((k.encode("utf-8") if isinstance(k, str) else k, v) for k, v in value.items())
+        return b"d" + b"".join(encode(k) + encode(v) for k, v in items) + b"e"
+    raise BencodeError(f"不支援的型別: {type(value).__name__}")
@@ -0,0 +1,812 @@
+"""
+BitTorrent 下載引擎（純 asyncio，不依賴外部 BT 客戶端）。
+
+- 輸入為 .torrent 內容或磁力連結；磁力連結透過 ut_metadata (BEP 9/10) 向 peer 取得 metadata
+- 支援 HTTP (BEP 3/23) 與 UDP (BEP 15) tracker
+- 同時連線多個 peer，以 pipeline 請求區塊；優先下載最稀有的 piece，收尾時允許重複請求
+- 每個 piece 收齊即驗證 SHA-1，不符時重新下載，多次送出壞資料的 peer 會被排除
+- 可只選取部分檔案：只下載與選取檔案重疊的 piece，也只寫入選取的檔案
+- 選取的檔案先寫入 `.part`，重新開始時驗證既有內容後續傳，完成後才改名
+
+僅作為下載端：不接受傳入連線，也不做上傳。
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import secrets
+import struct
+from base64 import b32decode
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple, Union
+from urllib.parse import parse_qs, quote_from_bytes, urlsplit
+
+import httpx
+
+from sidecar.domain.stages import timed_write
+from sidecar.infrastructure import bencode
+from sidecar.infrastructure.bandwidth import Throttle
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL = b"BitTorrent protocol"
+BLOCK_SIZE = 16 * 1024
+METADATA_PIECE_SIZE = 16 * 1024
+MAX_METADATA_SIZE = 8 * 1024 * 1024
+MAX_MESSAGE_SIZE = 2 * 1024 * 1024
+UT_METADATA_ID = 3  # 我方宣告的 ut_metadata 擴充訊息編號
+MAX_BAD_PIECES = 3  # peer 送出幾個驗證失敗的 piece 後就不再使用
+
+# 訊息編號 (BEP 3 / BEP 10)
+CHOKE, UNCHOKE, INTERESTED, NOT_INTERESTED, HAVE, BITFIELD, REQUEST, PIECE, CANCEL = range(9)
+EXTENDED = 20
+
+Peer = Tuple[str, int]
+# (已完成位元組, 需下載的總位元組)
+ProgressCallback = Callable[[int, int], None]
+# 收到 torrent 的檔案清單後回傳要下載的檔案索引
+FileSelector = Callable[[Sequence["TorrentFile"]], Sequence[int]]
+
+
+class BitTorrentError(Exception):
+    """無法完成 BT 下載（metadata 無效、找不到 peer 等）。"""
+
+
+# 與單一 peer 或 tracker 通訊時可預期的錯誤，發生時只放棄該 peer / tracker
+_PEER_ERRORS = (
+    OSError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+    BitTorrentError, bencode.BencodeError, struct.error,
+)
+
+
+@dataclass(frozen=True)
+class TorrentFile:
+    path: str     # torrent 內的相對路徑，以 "/" 分隔
+    length: int
+    offset: int   # 在整個 torrent 資料中的起始位移
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.length
+
+
+@dataclass(frozen=True)
+class TorrentMeta:
+    info_hash: bytes
+    name: str
+    piece_length: int
+    piece_hashes: Tuple[bytes, ...]
+    files: Tuple[TorrentFile, ...]
+    trackers: Tuple[str, ...] = ()
+
+    @property
+    def total_length(self) -> int:
+        return self.files[-1].end if self.files else 0
+
+    def piece_size(self, index: int) -> int:
+        start = index * self.piece_length
+        return min(self.piece_length, self.total_length - start)
+
+    def pieces_for(self, files: Iterable[TorrentFile]) -> Set[int]:
+        """與指定檔案重疊的所有 piece。"""
+        pieces: Set[int] = set()
+        for f in files:
+            if f.length:
+                pieces.update(range(f.offset // self.piece_length, (f.end - 1) // self.piece_length + 1))
+        return pieces
+
+    @classmethod
+    def from_info(cls, info_bytes: bytes, trackers: Sequence[str] = ()) -> "TorrentMeta":
+        """由 bencode 的 info 字典建立；info_hash 為其 SHA-1。"""
+        try:
+            info = bencode.decode(info_bytes)
+            name = _text(info.get(b"name.utf-8") or info[b"name"])
+            piece_length = int(info[b"piece length"])
+            pieces = info[b"pieces"]
+            if piece_length <= 0 or len(pieces) % 20:
+                raise BitTorrentError("無效的 piece 資訊")
+
+            files: List[TorrentFile] = []
+            if b"files" in info:
+                offset = 0
+                for entry in info[b"files"]:
+                    parts = entry.get(b"path.utf-8") or entry[b"path"]
+                    length = int(entry[b"length"])
+                    files.append(TorrentFile("/".join(_text(p) for p in parts), length, offset))
+                    offset += length
+            else:
+                files.append(TorrentFile(name, int(info[b"length"]), 0))
+        except (KeyError, TypeError, AttributeError, ValueError) as e:
+            raise BitTorrentError(f"無效的 torrent metadata: {e}") from e
+
+        meta = cls(
+            info_hash=hashlib.sha1(info_bytes).digest(),
+            name=name,
+            piece_length=piece_length,
+            piece_hashes=tuple(pieces[i:i + 20] for i in range(0, len(pieces), 20)),
+            files=tuple(files),
+            trackers=tuple(_unique(trackers)),
+        )
+        if len(meta.piece_hashes) != -(-meta.total_length // piece_length):
+            raise BitTorrentError("piece 數量與檔案長度不符")
+        return meta
+
+    @classmethod
+    def from_torrent(cls, data: bytes, extra_trackers: Sequence[str] = ()) -> "TorrentMeta":
+        """解析 .torrent 檔。info_hash 取自原始位元組，不受重新編碼影響。"""
+        try:
+            top = bencode.decode(data)
+            info_bytes = _raw_dict_value(data, b"info")
+        except bencode.BencodeError as e:
+            raise BitTorrentError(f"無效的 torrent 檔: {e}") from e
+        if not isinstance(top, dict) or info_bytes is None:
+            raise BitTorrentError("torrent 檔缺少 info")
+
+        trackers: List[str] = []
+        for tier in top.get(b"announce-list") or []:
+            trackers.extend(_text(url) for url in tier if isinstance(url, bytes))
+        if isinstance(top.get(b"announce"), bytes):
+            trackers.append(_text(top[b"announce"]))
+        return cls.from_info(info_bytes, [*trackers, *extra_trackers])
+
+
+@dataclass(frozen=True)
+class MagnetLink:
+    info_hash: bytes
+    display_name: Optional[str] = None
+    trackers: Tuple[str, ...] = ()
+
+
+def parse_magnet(uri: str) -> MagnetLink:
+    parts = urlsplit(uri)
+    if parts.scheme.lower() != "magnet":
+        raise BitTorrentError(f"不是磁力連結: {uri}")
+    params = parse_qs(parts.query)
+    info_hash = None
+    for xt in params.get("xt", []):
+        if xt.lower().startswith("urn:btih:"):
+            value = xt[len("urn:btih:"):]
+            try:
+                if len(value) == 40:
+                    info_hash = bytes.fromhex(value)
+                elif len(value) == 32:
+                    info_hash = b32decode(value.upper())
+            except ValueError:
+                pass
+    if info_hash is None:
+        raise BitTorrentError(f"磁力連結缺少有效的 btih: {uri}")
+    names = params.get("dn")
+    return MagnetLink(info_hash, names[0] if names else None, tuple(_unique(params.get("tr", []))))
+
+
+def _text(value: bytes) -> str:
+    return value.decode("utf-8", errors="replace")
+
+
+def _unique(items: Iterable[str]) -> List[str]:
+    return list(dict.fromkeys(i for i in items if i))
+
+
+def _raw_dict_value(data: bytes, wanted: bytes) -> Optional[bytes]:
+    """回傳頂層字典中某個值的原始 bencode 位元組。"""
+    if data[:1] != b"d":
+        return None
+    i = 1
+    while data[i:i + 1] != b"e":
+        key, i = bencode.decode_prefix(data, i)
+        start = i
+        _, i = bencode.decode_prefix(data, i)
+        if key == wanted:
+            return data[start:i]
+    return None
+
+
+def _make_peer_id() -> bytes:
+    return b"-OE0100-" + secrets.token_hex(6).encode("ascii")
+
+
+# ---- Tracker ----
+
+async def announce(
+    client: httpx.AsyncClient,
+    tracker_url: str,
+    info_hash: bytes,
+    peer_id: bytes,
+    left: int,
+    port: int = 6881,
+    timeout: float = 10.0,
+) -> List[Peer]:
+    """向 tracker 宣告並回傳 peer 清單。"""
+    scheme = urlsplit(tracker_url).scheme.lower()
+    if scheme in ("http", "https"):
+        return await _announce_http(client, tracker_url, info_hash, peer_id, left, port, timeout)
+    if scheme == "udp":
+        return await _announce_udp(tracker_url, info_hash, peer_id, left, port, timeout)
+    raise BitTorrentError(f"不支援的 tracker: {tracker_url}")
+
+
+async def _announce_http(
+    client: httpx.AsyncClient, tracker_url: str, info_hash: bytes, peer_id: bytes, left: int, port: int, timeout: float
+) -> List[Peer]:
+    # info_hash 與 peer_id 是原始位元組，需自行百分比編碼
+    query = (
+        f"info_hash={quote_from_bytes(info_hash)}&peer_id={quote_from_bytes(peer_id)}"
+        f"&port={port}&uploaded=0&downloaded=0&left={left}&compact=1&event=started"
+    )
+    url = tracker_url + ("&" if "?" in tracker_url else "?") + query
+    resp = await client.get(url, timeout=timeout)
+    resp.raise_for_status()
+    data = bencode.decode(resp.content)
+    if not isinstance(data, dict):
+        raise BitTorrentError("tracker 回應格式錯誤")
+    if b"failure reason" in data:
+        raise BitTorrentError(f"tracker 拒絕: {_text(data[b'failure reason'])}")
+    return _parse_peers(data.get(b"peers", b""))
+
+
+def _parse_peers(value) -> List[Peer]:
+    if isinstance(value, bytes):
+        # compact 格式：每個 peer 6 bytes (IPv4 + port)
+        return [
+            (".".join(str(b) for b in value[i:i + 4]), struct.unpack(">H", value[i + 4:i + 6])[0])
+            for i in range(0, len(value) - len(value) % 6, 6)
+        ]
+    peers: List[Peer] = []
+    for entry in value or []:
+        if isinstance(entry, dict) and b"ip" in entry and b"port" in entry:
+            peers.append((_text(entry[b"ip"]), int(entry[b"port"])))
+    return peers
+
+
+class _UDPTrackerProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.responses: asyncio.Queue = asyncio.Queue()
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        self.responses.put_nowait(data)
+
+    def error_received(self, exc: Exception) -> None:
+        self.responses.put_nowait(exc)
+
+
+async def _announce_udp(
+    tracker_url: str, info_hash: bytes, peer_id: bytes, left: int, port: int, timeout: float
+) -> List[Peer]:
+    parts = urlsplit(tracker_url)
+    if not parts.hostname or not parts.port:
+        raise BitTorrentError(f"無效的 UDP tracker: {tracker_url}")
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        _UDPTrackerProtocol, remote_addr=(parts.hostname, parts.port)
+    )
+
+    async def _request(packet: bytes, action: int, transaction_id: int) -> bytes:
+        transport.sendto(packet)
+        while True:
+            reply = await asyncio.wait_for(protocol.responses.get(), timeout)
+            if isinstance(reply, Exception):
+                raise reply
+            if len(reply) < 8:
+                continue
+            got_action, got_tid = struct.unpack(">II", reply[:8])
+            if got_tid != transaction_id:
+                continue
+            if got_action == 3:
+                raise BitTorrentError(f"tracker 拒絕: {_text(reply[8:])}")
+            if got_action != action:
+                raise BitTorrentError("tracker 回應格式錯誤")
+            return reply[8:]
+
+    try:
+        tid = secrets.randbits(32)
+        body = await _request(struct.pack(">QII", 0x41727101980, 0, tid), 0, tid)
+        connection_id = struct.unpack(">Q", body[:8])[0]
+
+        tid = secrets.randbits(32)
+        packet = struct.pack(
+            ">QII20s20sQQQIIIiH",
+            connection_id, 1, tid, info_hash, peer_id,
+            0, left, 0, 2, 0, secrets.randbits(32), -1, port,
+        )
+        body = await _request(packet, 1, tid)
+        return _parse_peers(body[12:])
+    finally:
+        transport.close()
+
+
+# ---- Peer 連線 ----
+
+class PeerConnection:
+    """單一 peer 的 TCP 連線，負責 handshake 與訊息框架。"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, supports_extensions: bool):
+        self.reader = reader
+        self.writer = writer
+        self.supports_extensions = supports_extensions
+
+    @classmethod
+    async def open(cls, peer: Peer, info_hash: bytes, peer_id: bytes, timeout: float) -> "PeerConnection":
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(*peer), timeout)
+        try:
+            reserved = bytearray(8)
+            reserved[5] |= 0x10  # BEP 10 擴充協定
+            writer.write(bytes([len(PROTOCOL)]) + PROTOCOL + bytes(reserved) + info_hash + peer_id)
+            await writer.drain()
+            reply = await asyncio.wait_for(reader.readexactly(68), timeout)
+            if reply[0] != len(PROTOCOL) or reply[1:20] != PROTOCOL or reply[28:48] != info_hash:
+                raise BitTorrentError(f"peer {peer[0]}:{peer[1]} handshake 失敗")
+        except BaseException:
+            writer.close()
+            raise
+        return cls(reader, writer, supports_extensions=bool(reply[25] & 0x10))
+
+    async def send(self, msg_id: int, payload: bytes = b"") -> None:
+        self.writer.write(struct.pack(">IB", len(payload) + 1, msg_id) + payload)
+        await self.writer.drain()
+
+    async def send_extended(self, ext_id: int, message: dict) -> None:
+        await self.send(EXTENDED, bytes([ext_id]) + bencode.encode(message))
+
+    async def receive(self, timeout: float) -> Tuple[Optional[int], bytes]:
+        """讀取一則訊息，回傳 (訊息編號, 內容)；keep-alive 的編號為 None。"""
+        header = await asyncio.wait_for(self.reader.readexactly(4), timeout)
+        (length,) = struct.unpack(">I", header)
+        if length == 0:
+            return None, b""
+        if length > MAX_MESSAGE_SIZE:
+            raise BitTorrentError(f"訊息過大: {length} bytes")
+        body = await asyncio.wait_for(self.reader.readexactly(length), timeout)
+        return body[0], body[1:]
+
+    async def close(self) -> None:
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except Exception:
+            pass
+
+
+async def fetch_metadata(peer: Peer, info_hash: bytes, peer_id: bytes, timeout: float) -> bytes:
+    """透過 ut_metadata 向單一 peer 取得 info 字典並驗證雜湊。"""
+    conn = await PeerConnection.open(peer, info_hash, peer_id, timeout)
+    try:
+        if not conn.supports_extensions:
+            raise BitTorrentError("peer 不支援擴充協定")
+        await conn.send_extended(0, {"m": {"ut_metadata": UT_METADATA_ID}})
+        size = 0
+        count = 0
+        pieces: Dict[int, bytes] = {}
+        while True:
+            msg_id, payload = await conn.receive(timeout)
+            if msg_id != EXTENDED or not payload:
+                continue
+            ext_id, body = payload[0], payload[1:]
+            if ext_id == 0 and not size:
+                handshake = bencode.decode(body)
+                remote_id = (handshake.get(b"m") or {}).get(b"ut_metadata")
+                size = handshake.get(b"metadata_size") or 0
+                if not remote_id or not 0 < size <= MAX_METADATA_SIZE:
+                    raise BitTorrentError("peer 未提供 metadata")
+                count = -(-size // METADATA_PIECE_SIZE)
+                for i in range(count):
+                    await conn.send_extended(remote_id, {"msg_type": 0, "piece": i})
+            elif ext_id == UT_METADATA_ID and size:
+                message, end = bencode.decode_prefix(body)
+                if message.get(b"msg_type") == 2:
+                    raise BitTorrentError("peer 拒絕提供 metadata")
+                if message.get(b"msg_type") == 1:
+                    pieces[message.get(b"piece")] = body[end:]
+                if len(pieces) == count and all(i in pieces for i in range(count)):
+                    data = b"".join(pieces[i] for i in range(count))[:size]
+                    if hashlib.sha1(data).digest() != info_hash:
+                        raise BitTorrentError("metadata 雜湊不符")
+                    return data
+    finally:
+        await conn.close()
+
+
+# ---- 檔案儲存 ----
+
+class _Storage:
+    """將驗證過的 piece 寫入選取檔案的 .part，只在執行緒中呼叫。"""
+
+    def __init__(self, meta: TorrentMeta, selected: Sequence[int], target_dir: str):
+        self.meta = meta
+        self.files = [meta.files[i] for i in selected]
+        # 只保留檔名，OP/ED 直接放在目標資料夾
+        self.paths = {f.path: os.path.join(target_dir, os.path.basename(f.path)) for f in self.files}
+
+    def _part(self, f: TorrentFile) -> str:
+        return self.paths[f.path] + ".part"
+
+    def _overlaps(self, start: int, end: int) -> List[Tuple[TorrentFile, int, int]]:
+        return [(f, max(f.offset, start), min(f.end, end)) for f in self.files if f.offset < end and f.end > start]
+
+    def _piece_range(self, index: int) -> Tuple[int, int]:
+        start = index * self.meta.piece_length
+        return start, start + self.meta.piece_size(index)
+
+    def prepare(self) -> Set[int]:
+        """建立 .part 檔；回傳既有 .part 中可完整驗證且通過的 piece。"""
+        existing: Set[str] = set()
+        for f in self.files:
+            part = self._part(f)
+            os.makedirs(os.path.dirname(os.path.abspath(part)), exist_ok=True)
+            if os.path.exists(part) and os.path.getsize(part) == f.length:
+                existing.add(f.path)
+            else:
+                with open(part, "wb") as fh:
+                    fh.truncate(f.length)
+        verified: Set[int] = set()
+        if not existing:
+            return verified
+        for index in self.meta.pieces_for(self.files):
+            start, end = self._piece_range(index)
+            spans = self._overlaps(start, end)
+            # 與未選取檔案重疊的 piece 無法從本機資料驗證
+            if sum(e - s for _, s, e in spans) != end - start or any(f.path not in existing for f, _, _ in spans):
+                continue
+            data = bytearray()
+            for f, s, e in spans:
+                with open(self._part(f), "rb") as fh:
+                    fh.seek(s - f.offset)
+                    data += fh.read(e - s)
+            if hashlib.sha1(data).digest() == self.meta.piece_hashes[index]:
+                verified.add(index)
+        return verified
+
+    def write_piece(self, index: int, data: bytes) -> bool:
+        """驗證雜湊後寫入；不符時回傳 False。"""
+        if hashlib.sha1(data).digest() != self.meta.piece_hashes[index]:
+            return False
+        start, end = self._piece_range(index)
+        for f, s, e in self._overlaps(start, end):
+            with open(self._part(f), "r+b") as fh:
+                fh.seek(s - f.offset)
+                fh.write(data[s - start:e - start])
+        return True
+
+    def finalize(self) -> List[str]:
+        final_paths = []
+        for f in self.files:
+            os.replace(self._part(f), self.paths[f.path])
+            final_paths.append(self.paths[f.path])
+        return final_paths
+
+
+# ---- 下載排程 ----
+
+@dataclass
+class _PieceBuffer:
+    index: int
+    size: int
+    data: bytearray
+    next_offset: int = 0
+    outstanding: Set[int] = field(default_factory=set)
+    received: int = 0
+
+
+class _Swarm:
+    """單一 torrent 的多 peer 下載狀態。"""
+
+    def __init__(
+        self,
+        meta: TorrentMeta,
+        storage: _Storage,
+        wanted: Set[int],
+        have: Set[int],
+        peer_id: bytes,
+        max_peers: int,
+        pipeline: int,
+        peer_timeout: float,
+        on_progress: Optional[ProgressCallback],
+        throttle: Optional[Throttle] = None,
+    ):
+        self.meta = meta
+        self.storage = storage
+        self.peer_id = peer_id
+        self.max_peers = max_peers
+        self.pipeline = pipeline
+        self.peer_timeout = peer_timeout
+        self.on_progress = on_progress
+        self.throttle = throttle
+
+        self.remaining = wanted - have
+        self.total = sum(meta.piece_size(i) for i in wanted)
+        self.completed = self.total - sum(meta.piece_size(i) for i in self.remaining)
+        self.availability: Dict[int, int] = {}
+        self.claims: Dict[int, int] = {}
+        self.peers: Dict[Peer, None] = {}
+        self.tried: Set[Peer] = set()
+        self.banned: Set[Peer] = set()
+        self.bad_pieces: Dict[Peer, int] = {}
+        self.workers: Set[asyncio.Task] = set()
+        self.done = asyncio.Event()
+        if not self.remaining:
+            self.done.set()
+
+    async def run(self, discover: Callable[[], Awaitable[List[Peer]]], max_rounds: int, retry_delay: float) -> None:
+        """持續連線 peer 直到所有 piece 完成；peer 用盡時重新向 tracker 宣告。"""
+        rounds = 0
+        progress_at_last_round = -1
+        try:
+            while not self.done.is_set():
+                self._spawn_workers()
+                if self.workers:
+                    waiter = asyncio.ensure_future(self.done.wait())
+                    try:
+                        await asyncio.wait({waiter, *self.workers}, return_when=asyncio.FIRST_COMPLETED)
+                    finally:
+                        waiter.cancel()
+                    continue
+
+                if self.completed > progress_at_last_round:
+                    # 上一輪有進展就不算失敗
+                    rounds = 0
+                if rounds >= max_rounds:
+                    raise BitTorrentError(
+                        f"沒有可用的 peer（已完成 {self.completed}/{self.total} bytes）"
+                    )
+                if progress_at_last_round >= 0:
+                    await asyncio.sleep(retry_delay)
+                rounds += 1
+                progress_at_last_round = self.completed
+                # 先前斷線的 peer 也給予重試機會
+                self.tried.clear()
+                for peer in await discover():
+                    self.peers.setdefault(peer, None)
+        finally:
+            workers = list(self.workers)
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def _spawn_workers(self) -> None:
+        for peer in self.peers:
+            if len(self.workers) >= self.max_peers:
+                break
+            if peer in self.tried or peer in self.banned:
+                continue
+            self.tried.add(peer)
+            worker = asyncio.create_task(self._peer_worker(peer))
+            self.workers.add(worker)
+            worker.add_done_callback(self.workers.discard)
+
+    def _claim(self, bitfield: Set[int]) -> Optional[_PieceBuffer]:
+        candidates = [i for i in self.remaining if i in bitfield]
+        if not candidates:
+            return None
+        # 優先未被認領、最稀有的 piece；全部已認領時 (收尾階段) 與其他 peer 重複下載
+        index = min(candidates, key=lambda i: (self.claims.get(i, 0), self.availability.get(i, 0), i))
+        self.claims[index] = self.claims.get(index, 0) + 1
+        size = self.meta.piece_size(index)
+        return _PieceBuffer(index, size, bytearray(size))
+
+    def _release(self, piece: _PieceBuffer) -> None:
+        count = self.claims.get(piece.index, 0) - 1
+        if count > 0:
+            self.claims[piece.index] = count
+        else:
+            self.claims.pop(piece.index, None)
+
+    async def _fill_pipeline(self, conn: PeerConnection, piece: _PieceBuffer) -> None:
+        while len(piece.outstanding) < self.pipeline and piece.next_offset < piece.size:
+            length = min(BLOCK_SIZE, piece.size - piece.next_offset)
+            await conn.send(REQUEST, struct.pack(">III", piece.index, piece.next_offset, length))
+            piece.outstanding.add(piece.next_offset)
+            piece.next_offset += length
+
+    async def _complete(self, piece: _PieceBuffer) -> bool:
+        if piece.index not in self.remaining:
+            return True
+        with timed_write():
+            written = await asyncio.to_thread(self.storage.write_piece, piece.index, bytes(piece.data))
+        if not written:
+            return False
+        # 寫入期間可能已由其他 peer 完成
+        if piece.index in self.remaining:
+            self.remaining.discard(piece.index)
+            self.completed += piece.size
+            if self.on_progress:
+                self.on_progress(self.completed, self.total)
+            if not self.remaining:
+                self.done.set()
+        return True
+
+    async def _peer_worker(self, peer: Peer) -> None:
+        try:
+            conn = await PeerConnection.open(peer, self.meta.info_hash, self.peer_id, self.peer_timeout)
+        except _PEER_ERRORS as e:
+            logger.debug(f"[BT] 無法連線 {peer}: {e}")
+            return
+
+        bitfield: Set[int] = set()
+        choked = True
+        piece: Optional[_PieceBuffer] = None
+        try:
+            await conn.send(INTERESTED)
+            while not self.done.is_set():
+                if piece is not None and piece.index not in self.remaining:
+                    # 收尾階段其他 peer 已完成此 piece
+                    for begin in piece.outstanding:
+                        length = min(BLOCK_SIZE, piece.size - begin)
+                        await conn.send(CANCEL, struct.pack(">III", piece.index, begin, length))
+                    self._release(piece)
+                    piece = None
+                if piece is None and not choked:
+                    piece = self._claim(bitfield)
+                if piece is not None and not choked:
+                    await self._fill_pipeline(conn, piece)
+
+                msg_id, payload = await conn.receive(self.peer_timeout)
+                if msg_id == CHOKE:
+                    choked = True
+                    if piece is not None:
+                        self._release(piece)
+                        piece = None
+                elif msg_id == UNCHOKE:
+                    choked = False
+                elif msg_id == HAVE:
+                    (index,) = struct.unpack(">I", payload[:4])
+                    if index < len(self.meta.piece_hashes) and index not in bitfield:
+                        bitfield.add(index)
+                        self.availability[index] = self.availability.get(index, 0) + 1
+                elif msg_id == BITFIELD:
+                    for index in _parse_bitfield(payload, len(self.meta.piece_hashes)) - bitfield:
+                        bitfield.add(index)
+                        self.availability[index] = self.availability.get(index, 0) + 1
+                elif msg_id == PIECE and piece is not None:
+                    index, begin = struct.unpack(">II", payload[:8])
+                    block = payload[8:]
+                    if index != piece.index or begin not in piece.outstanding:
+                        continue
+                    if len(block) != min(BLOCK_SIZE, piece.size - begin):
+                        raise BitTorrentError("區塊長度不符")
+                    piece.outstanding.discard(begin)
+                    piece.data[begin:begin + len(block)] = block
+                    piece.received += len(block)
+                    if self.throttle:
+                        # 等待頻寬額度期間不讀取此 peer，由 TCP 流量控制放慢對方
+                        await self.throttle.consume(len(block))
+                    if piece.received == piece.size:
+                        finished, piece = piece, None
+                        self._release(finished)
+                        if not await self._complete(finished):
+                            self.bad_pieces[peer] = self.bad_pieces.get(peer, 0) + 1
+                            logger.warning(f"[BT] piece {finished.index} 驗證失敗 (peer {peer})")
+                            if self.bad_pieces[peer] >= MAX_BAD_PIECES:
+                                self.banned.add(peer)
+                                return
+        except _PEER_ERRORS as e:
+            logger.debug(f"[BT] peer {peer} 中斷: {e}")
+        finally:
+            if piece is not None:
+                self._release(piece)
+            for index in bitfield:
+                self.availability[index] -= 1
+            await conn.close()
+
+
+def _parse_bitfield(payload: bytes, num_pieces: int) -> Set[int]:
+    return {
+        i for i in range(min(num_pieces, len(payload) * 8))
+        if payload[i // 8] & (0x80 >> (i % 8))
+    }
+
+
+# ---- 對外介面 ----
+
+class BitTorrentClient:
+    def __init__(
+        self,
+        client: Optional[httpx.AsyncClient] = None,
+        max_peers: int = 30,
+        pipeline: int = 16,
+        peer_timeout: float = 30.0,
+        tracker_timeout: float = 10.0,
+        max_announce_rounds: int = 3,
+        retry_delay: float = 5.0,
+        metadata_concurrency: int = 8,
+    ):
+        # 用於 HTTP tracker；未注入時自行建立
+        self.client = client or httpx.AsyncClient(timeout=tracker_timeout, follow_redirects=True)
+        self.max_peers = max_peers
+        self.pipeline = pipeline
+        self.peer_timeout = peer_timeout
+        self.tracker_timeout = tracker_timeout
+        self.max_announce_rounds = max_announce_rounds
+        self.retry_delay = retry_delay
+        self.metadata_concurrency = metadata_concurrency
+        self.peer_id = _make_peer_id()
+
+    async def load(self, source: Union[str, bytes], trackers: Sequence[str] = ()) -> TorrentMeta:
+        """source 為 .torrent 內容 (bytes) 或磁力連結 (str)。"""
+        if isinstance(source, bytes):
+            return TorrentMeta.from_torrent(source, trackers)
+        magnet = parse_magnet(source)
+        all_trackers = _unique([*magnet.trackers, *trackers])
+        if not all_trackers:
+            raise BitTorrentError("磁力連結沒有 tracker，無法尋找 peer")
+        peers = await self._discover(magnet.info_hash, all_trackers, left=1)
+        if not peers:
+            raise BitTorrentError("tracker 沒有回傳任何 peer")
+        info = await self._fetch_metadata_any(magnet.info_hash, peers)
+        return TorrentMeta.from_info(info, all_trackers)
+
+    async def download(
+        self,
+        source: Union[str, bytes],
+        target_dir: str,
+        select_files: Optional[FileSelector] = None,
+        on_progress: Optional[ProgressCallback] = None,
+        trackers: Sequence[str] = (),
+        throttle: Optional[Throttle] = None,
+        on_partial: Optional[Callable[[List[str]], None]] = None,
+    ) -> List[str]:
+        """
+        下載選取的檔案至 target_dir，回傳完成的檔案路徑。有 throttle 時收到的區塊計入頻寬上限；
+        on_partial 在建立 .part 檔後收到其路徑，中斷時可用來清理。
+        """
+        meta = await self.load(source, trackers)
+        selected = list(select_files(meta.files)) if select_files else list(range(len(meta.files)))
+        if not selected:
+            raise BitTorrentError("沒有選取任何檔案")
+
+        storage = _Storage(meta, selected, target_dir)
+        have = await asyncio.to_thread(storage.prepare)
+        if on_partial:
+            on_partial([storage._part(f) for f in storage.files])
+        swarm = _Swarm(
+            meta, storage, meta.pieces_for(storage.files), have, self.peer_id,
+            max_peers=self.max_peers, pipeline=self.pipeline,
+            peer_timeout=self.peer_timeout, on_progress=on_progress, throttle=throttle,
+        )
+        if have:
+            logger.info(f"[BT] {meta.name}: 從既有檔案續傳 {len(have)} 個 piece")
+        if on_progress:
+            on_progress(swarm.completed, swarm.total)
+
+        async def _discover() -> List[Peer]:
+            return await self._discover(meta.info_hash, meta.trackers, left=swarm.total - swarm.completed)
+
+        await swarm.run(_discover, self.max_announce_rounds, self.retry_delay)
+        with timed_write():
+            return await asyncio.to_thread(storage.finalize)
+
+    async def _discover(self, info_hash: bytes, trackers: Sequence[str], left: int) -> List[Peer]:
+        """同時向所有 tracker 宣告，合併回傳的 peer。"""
+        results = await asyncio.gather(
+            *(announce(self.client, url, info_hash, self.peer_id, left, timeout=self.tracker_timeout)
+              for url in trackers),
+            return_exceptions=True,
+        )
+        peers: Dict[Peer, None] = {}
+        for url, result in zip(trackers, results):
+            if isinstance(result, BaseException):
+                logger.info(f"[BT] tracker {url} 失敗: {result}")
+                continue
+            for peer in result:
+                peers.setdefault(peer, None)
+        return list(peers)
+
+    async def _fetch_metadata_any(self, info_hash: bytes, peers: Sequence[Peer]) -> bytes:
+        """同時向多個 peer 要 metadata，採用第一個驗證通過的結果。"""
+        semaphore = asyncio.Semaphore(self.metadata_concurrency)
+
+        async def _try(peer: Peer) -> bytes:
+            async with semaphore:
+                return await fetch_metadata(peer, info_hash, self.peer_id, self.peer_timeout)
+
+        attempts = [asyncio.create_task(_try(p)) for p in peers]
+        try:
+            for attempt in asyncio.as_completed(attempts):
+                try:
+                    return await attempt
+                except (*_PEER_ERRORS, KeyError, TypeError, AttributeError) as e:
+                    logger.debug(f"[BT] 取得 metadata 失敗: {e}")
+        finally:
+            for a in attempts:
+                a.cancel()
+            await asyncio.gather(*attempts, return_exceptions=True)
+        raise BitTorrentError("無法從任何 peer 取得 metadata")
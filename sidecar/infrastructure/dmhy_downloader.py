@@ -1,15 +1,59 @@
 import os
+import re
+import time
 import httpx
+import asyncio
 import logging
-from bs4 import BeautifulSoup
-from typing import Optional, List, Dict, Any
-from sidecar.domain.models import Task, TaskStatus, Source, DownloadMode
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from typing import Optional, List, Dict, Any, Tuple
+from sidecar.domain.models import Task, TaskStatus, Source, DownloadMode, DMHYSearchMode, Metadata
+from sidecar.domain.stages import DETAIL, SEARCH, span
+from sidecar.infrastructure.bandwidth import BandwidthLimiter, Throttle
+from sidecar.infrastructure.bittorrent import BitTorrentClient, BitTorrentError, TorrentFile, parse_magnet
+from sidecar.infrastructure.metadata_cache import normalize_title
+from sidecar.infrastructure.partial_download import PartialDownload, write_atomic
+from sidecar.infrastructure.segmented_download import fetch_segmented
 
 logger = logging.getLogger(__name__)
 
+MEDIA_EXTENSIONS = (".mkv", ".mp4", ".avi", ".webm", ".m2ts", ".ts", ".flac", ".mp3", ".m4a", ".aac", ".wav", ".ogg")
+
+def _parse_html(text: str):
+    # bs4 只有 HTML 搜尋模式用得到，第一次使用時才載入
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(text, "html.parser")
+
+class _SearchCancelled(Exception):
+    """發起共用搜尋的任務被取消；等待同一搜尋的其他任務應重新搜尋。"""
+
+@dataclass(frozen=True)
+class DMHYSearchResult:
+    magnet_link: Optional[str] = None
+    torrent_url: Optional[str] = None
+    detail_url: Optional[str] = None
+
 class DMHYDownloader:
-    def __init__(self, base_url: str = "https://share.dmhy.org"):
+    def __init__(
+        self,
+        base_url: str = "https://share.dmhy.org",
+        client: Optional[httpx.AsyncClient] = None,
+        search_cache_ttl: float = 120.0,
+        bt_client: Optional[BitTorrentClient] = None,
+        bandwidth: Optional[BandwidthLimiter] = None,
+        max_connections: int = 4,
+    ):
         self.base_url = base_url
+        # 由 app lifespan 注入共用 client；未注入時自行建立
+        self.client = client or httpx.AsyncClient(timeout=20.0, follow_redirects=True)
+        # 影片模式使用的內建 BT 引擎
+        self.bt_client = bt_client or BitTorrentClient(client=self.client)
+        # 全域與任務的頻寬上限；HTTP 檔案支援 Range 時最多以 max_connections 條連線分段下載
+        self.bandwidth = bandwidth or BandwidthLimiter()
+        self.max_connections = max_connections
+        # 同一批次內相同關鍵字只搜尋一次：(模式, 關鍵字) -> (到期時間, 搜尋中的 Future)
+        self.search_cache_ttl = search_cache_ttl
+        self._search_cache: Dict[Tuple[DMHYSearchMode, str], Tuple[float, asyncio.Future]] = {}
 
     def get_source(self) -> Source:
         return Source.DMHY
@@ -20,93 +64,295 @@ class DMHYDownloader:
             task.update_status(TaskStatus.FAILED, error="缺少元數據，無法搜尋下載")
             return False
 
-        search_query = f"{task.metadata.anime_title} {task.metadata.song_title}"
-        if hasattr(task, 'custom_keywords') and task.custom_keywords:
-            search_query = task.custom_keywords
-
         task.update_status(TaskStatus.DOWNLOADING, progress=5.0)
 
+        throttle = self.bandwidth.throttle(task.id, task.bandwidth_limit)
         try:
-            async with httpx.AsyncClient(timeout=20.0, follow_redirects=True) as client:
-                # 1. 搜尋
-                search_url = f"{self.base_url}/topics/list"
-                params = {"keyword": search_query}
-                response = await client.get(search_url, params=params)
-                response.raise_for_status()
-
-                # 2. 解析 HTML 獲取第一個結果
-                soup = BeautifulSoup(response.text, "html.parser")
-                rows = soup.select("#topic_list tbody tr")
-                if not rows:
-                    task.update_status(TaskStatus.FAILED, error=f"在 DMHY 找不到符合的資源: {search_query}")
-                    return False
+            links = await self._resolve_links(task)
+            if links is None:
+                task.update_status(TaskStatus.FAILED, error=f"在 DMHY 找不到符合的資源: {_search_query(task)}")
+                return False
+            magnet_link, torrent_url = links
+
+            if task.dmhy_mode == DownloadMode.TORRENT:
+                # 模式 B：僅下載種子檔案
+                if not torrent_url:
+                     task.update_status(TaskStatus.FAILED, error="找不到可用於下載的種子檔案連結")
+                     return False
+                task.resolved_url = torrent_url
+
+                torrent_filename = os.path.basename(torrent_url.split('?')[0])
+                if not torrent_filename.endswith(".torrent"):
+                    torrent_filename += ".torrent"
+
+                save_path = os.path.join(task.target_dir, torrent_filename)
+
+                # 以串流寫入 .part 並在完成後原子改名；中斷後可用 Range 續傳
+                def _on_progress(downloaded: int, total: Optional[int]) -> None:
+                    progress = round(10.0 + 89.0 * downloaded / total, 1) if total else task.progress
+                    task.update_status(
+                        TaskStatus.DOWNLOADING, progress=progress, downloaded_bytes=downloaded, total_bytes=total
+                    )
+
+                partial = PartialDownload(save_path)
+                task.partial_files = [partial.part_path, partial.manifest_path]
+                await fetch_segmented(
+                    self.client, torrent_url, save_path, task_id=task.id, on_progress=_on_progress,
+                    throttle=throttle, max_connections=self.max_connections,
+                )
 
-                # 取得第一個有效的資源行
-                first_row = rows[0]
-                title_link = first_row.select_one(".title a")
-                if not title_link:
-                    task.update_status(TaskStatus.FAILED, error="解析資源標題連結失敗")
+                # 種子檔不需要後處理；complete_transfer 一併清除暫存檔紀錄 (含先前嘗試留下的)
+                task.postprocess = None
+                task.complete_transfer([save_path])
+                return True
+
+            else:
+                # 模式 A：以內建 BT 引擎下載影片，只取 OP/ED 檔案
+                if not (magnet_link or torrent_url):
+                    task.update_status(TaskStatus.FAILED, error="找不到可用於下載的磁力連結")
                     return False
+                task.resolved_url = magnet_link or torrent_url
 
-                # 進入細節頁獲取磁力和種子檔連結
-                detail_url = self.base_url + title_link['href']
-                detail_resp = await client.get(detail_url)
-                detail_resp.raise_for_status()
-                detail_soup = BeautifulSoup(detail_resp.text, "html.parser")
-
-                # 獲取磁力連結
-                magnet_link_node = detail_soup.select_one("#magnet")
-                magnet_link = magnet_link_node.get_text() if magnet_link_node else None
-                
-                # 獲取種子檔連結
-                torrent_link_node = detail_soup.select_one("#tabs-1 a[href$='.torrent']")
-                torrent_url = None
-                if torrent_link_node:
-                    rel_url = torrent_link_node['href']
-                    if rel_url.startswith("//"):
-                        torrent_url = "https:" + rel_url
-                    elif rel_url.startswith("/"):
-                        torrent_url = self.base_url + rel_url
-                    else:
-                        torrent_url = rel_url
-
-                if task.dmhy_mode == DownloadMode.TORRENT:
-                    # 模式 B：僅下載種子檔案
-                    if not torrent_url:
-                         task.update_status(TaskStatus.FAILED, error="找不到可用於下載的種子檔案連結")
-                         return False
-                    
-                    os.makedirs(task.target_dir, exist_ok=True)
-                    torrent_filename = os.path.basename(torrent_url.split('?')[0])
-                    if not torrent_filename.endswith(".torrent"):
-                        torrent_filename += ".torrent"
-                    
-                    save_path = os.path.join(task.target_dir, torrent_filename)
-
-                    t_resp = await client.get(torrent_url)
-                    t_resp.raise_for_status()
-                    with open(save_path, "wb") as f:
-                        f.write(t_resp.content)
-                    
-                    task.update_status(TaskStatus.COMPLETED, progress=100.0)
-                    return True
-
-                else:
-                    # 模式 A：進階下載影片
-                    if not magnet_link:
-                        task.update_status(TaskStatus.FAILED, error="找不到可用於下載的磁力連結")
-                        return False
-                    
-                    # 由於直接下載影片需要 BT 客戶端邏輯，暫時將磁力連結寫入檔案
-                    os.makedirs(task.target_dir, exist_ok=True)
-                    with open(os.path.join(task.target_dir, "magnet.txt"), "w") as f:
-                        f.write(magnet_link)
-
-                    # [NOTE] 未來這裡應整合 libtorrent 或外部下載程式
-                    task.update_status(TaskStatus.FAILED, error="模式 A (直接下載影片) 尚未整合 BT 引擎，磁力連結已儲存至 magnet.txt。建議切換至 TORRENT 模式。")
+                try:
+                    output_files = await self._download_video(task, magnet_link, torrent_url, throttle)
+                except BitTorrentError as e:
+                    # 保留磁力連結，仍可交給外部 BT 客戶端
+                    if magnet_link:
+                        await write_atomic(os.path.join(task.target_dir, "magnet.txt"), magnet_link.encode("utf-8"))
+                    task.update_status(TaskStatus.FAILED, error=f"BT 下載失敗: {e}")
                     return False
 
+                task.complete_transfer(output_files)
+                return True
+
         except Exception as e:
             logger.error(f"DMHY 下載錯誤: {e}")
             task.update_status(TaskStatus.FAILED, error=f"DMHY 錯誤: {str(e)}")
             return False
+        finally:
+            throttle.close()
+
+    async def resolve(self, task: Task) -> Optional[str]:
+        """只搜尋，回傳此模式下要使用的連結（種子模式為種子連結，影片模式優先磁力連結）。"""
+        if not task.metadata or not task.metadata.song_title:
+            return None
+        links = await self._resolve_links(task)
+        if links is None:
+            return None
+        magnet_link, torrent_url = links
+        if task.dmhy_mode == DownloadMode.TORRENT:
+            return torrent_url
+        return magnet_link or torrent_url
+
+    async def _resolve_links(self, task: Task) -> Optional[Tuple[Optional[str], Optional[str]]]:
+        """回傳 (磁力連結, 種子連結)；搜尋不到時回傳 None。"""
+        # 續傳或已預先解析時沿用既有連結，跳過搜尋
+        if task.dmhy_mode == DownloadMode.TORRENT:
+            torrent_url = task.resolved_url if _is_torrent_url(task.resolved_url) else None
+            magnet_link = None
+        else:
+            magnet_link = task.resolved_url if _is_magnet(task.resolved_url) else None
+            torrent_url = task.resolved_url if _is_torrent_url(task.resolved_url) else None
+        if torrent_url or magnet_link:
+            return magnet_link, torrent_url
+
+        with span(SEARCH, engine="dmhy", mode=task.dmhy_search.value):
+            found = await self._search(_search_query(task), task.dmhy_search)
+        if found is None:
+            return None
+        magnet_link, torrent_url = found.magnet_link, found.torrent_url
+        if task.dmhy_mode == DownloadMode.TORRENT and not torrent_url and found.detail_url:
+            # RSS 只提供磁力連結，種子檔連結仍需細節頁
+            magnet_link, torrent_url = await self._fetch_detail(found.detail_url)
+        return magnet_link, torrent_url
+
+    async def _download_video(
+        self, task: Task, magnet_link: Optional[str], torrent_url: Optional[str], throttle: Optional[Throttle] = None
+    ) -> List[str]:
+        def _on_progress(downloaded: int, total: int) -> None:
+            progress = round(10.0 + 89.0 * downloaded / total, 1) if total else task.progress
+            task.update_status(
+                TaskStatus.DOWNLOADING, progress=progress, downloaded_bytes=downloaded, total_bytes=total
+            )
+
+        # 有種子檔時直接使用，省去向 peer 取得 metadata
+        source = magnet_link
+        if torrent_url:
+            try:
+                resp = await self.client.get(torrent_url)
+                resp.raise_for_status()
+                source = resp.content
+            except httpx.HTTPError as e:
+                if not magnet_link:
+                    raise BitTorrentError(f"無法下載種子檔: {e}") from e
+                logger.warning(f"種子檔下載失敗，改用磁力連結: {e}")
+
+        return await self.bt_client.download(
+            source,
+            task.target_dir,
+            select_files=lambda files: _select_op_ed_files(files, task.metadata),
+            on_progress=_on_progress,
+            trackers=parse_magnet(magnet_link).trackers if magnet_link else (),
+            throttle=throttle,
+            on_partial=lambda paths: setattr(task, "partial_files", paths),
+        )
+
+    async def _search(self, search_query: str, mode: DMHYSearchMode) -> Optional[DMHYSearchResult]:
+        """
+        依模式搜尋並快取結果一段時間；並行的相同搜尋共用同一次請求。
+        RSS 模式失敗時改走 HTML 解析。
+        """
+        key = (mode, search_query)
+        now = time.monotonic()
+        cached = self._search_cache.get(key)
+        if cached is not None and cached[0] > now:
+            try:
+                return await asyncio.shield(cached[1])
+            except _SearchCancelled:
+                # 發起搜尋的任務已取消 (快取項目已移除)，改由這個任務重新搜尋
+                return await self._search(search_query, mode)
+
+        future = asyncio.get_running_loop().create_future()
+        self._search_cache[key] = (now + self.search_cache_ttl, future)
+        self._prune_search_cache(now)
+        try:
+            if mode == DMHYSearchMode.RSS:
+                try:
+                    result = await self._search_rss(search_query)
+                except Exception as e:
+                    logger.warning(f"DMHY RSS 搜尋失敗，改用 HTML: {e}")
+                    result = await self._search_html(search_query)
+            else:
+                result = await self._search_html(search_query)
+        except BaseException as e:
+            self._search_cache.pop(key, None)
+            # 取消只屬於發起搜尋的任務，不能讓等待同一搜尋的其他任務也收到 CancelledError
+            future.set_exception(_SearchCancelled() if isinstance(e, asyncio.CancelledError) else e)
+            # 沒有其他等待者時避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        future.set_result(result)
+        return result
+
+    def _prune_search_cache(self, now: float) -> None:
+        expired = [k for k, (expires, f) in self._search_cache.items() if expires <= now and f.done()]
+        for k in expired:
+            del self._search_cache[k]
+
+    async def _search_rss(self, search_query: str) -> Optional[DMHYSearchResult]:
+        """
+        以 RSS 搜尋，串流解析 XML，讀到第一個帶磁力 enclosure 的 item 即停止。
+        """
+        rss_url = f"{self.base_url}/topics/rss/rss.xml"
+        parser = ET.XMLPullParser(events=("end",))
+        async with self.client.stream("GET", rss_url, params={"keyword": search_query}) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                parser.feed(chunk)
+                for _, elem in parser.read_events():
+                    if elem.tag != "item":
+                        continue
+                    enclosure = elem.find("enclosure")
+                    magnet_link = enclosure.get("url") if enclosure is not None else None
+                    link = (elem.findtext("link") or "").strip() or None
+                    torrent_url = None
+                    if magnet_link and not _is_magnet(magnet_link):
+                        magnet_link, torrent_url = None, magnet_link
+                    if magnet_link or torrent_url:
+                        return DMHYSearchResult(
+                            magnet_link=magnet_link,
+                            torrent_url=self._absolute_url(torrent_url) if torrent_url else None,
+                            detail_url=self._absolute_url(link) if link else None,
+                        )
+                    elem.clear()
+        parser.close()
+        return None
+
+    async def _search_html(self, search_query: str) -> Optional[DMHYSearchResult]:
+        """搜尋列表頁並進入第一個結果的細節頁；找不到時回傳 None。"""
+        client = self.client
+        # 1. 搜尋
+        search_url = f"{self.base_url}/topics/list"
+        params = {"keyword": search_query}
+        response = await client.get(search_url, params=params)
+        response.raise_for_status()
+
+        # 2. 解析 HTML 獲取第一個結果
+        soup = _parse_html(response.text)
+        rows = soup.select("#topic_list tbody tr")
+        if not rows:
+            return None
+
+        # 取得第一個有效的資源行
+        first_row = rows[0]
+        title_link = first_row.select_one(".title a")
+        if not title_link:
+            raise ValueError("解析資源標題連結失敗")
+
+        # 進入細節頁獲取磁力和種子檔連結
+        detail_url = self.base_url + title_link['href']
+        magnet_link, torrent_url = await self._fetch_detail(detail_url)
+        return DMHYSearchResult(magnet_link=magnet_link, torrent_url=torrent_url, detail_url=detail_url)
+
+    async def _fetch_detail(self, detail_url: str) -> Tuple[Optional[str], Optional[str]]:
+        """解析細節頁，回傳 (磁力連結, 種子檔連結)。"""
+        with span(DETAIL):
+            detail_resp = await self.client.get(detail_url)
+            detail_resp.raise_for_status()
+            detail_soup = _parse_html(detail_resp.text)
+
+        # 獲取磁力連結
+        magnet_link_node = detail_soup.select_one("#magnet")
+        magnet_link = magnet_link_node.get_text() if magnet_link_node else None
+
+        # 獲取種子檔連結
+        torrent_link_node = detail_soup.select_one("#tabs-1 a[href$='.torrent']")
+        torrent_url = None
+        if torrent_link_node:
+            torrent_url = self._absolute_url(torrent_link_node['href'])
+        return magnet_link, torrent_url
+
+    def _absolute_url(self, rel_url: str) -> str:
+        if rel_url.startswith("//"):
+            return "https:" + rel_url
+        if rel_url.startswith("/"):
+            return self.base_url + rel_url
+        return rel_url
+
+
+def _search_query(task: Task) -> str:
+    if task.custom_keywords:
+        return task.custom_keywords
+    return f"{task.metadata.anime_title} {task.metadata.song_title}"
+
+
+def _is_magnet(url: Optional[str]) -> bool:
+    return bool(url) and url.startswith("magnet:")
+
+
+def _is_torrent_url(url: Optional[str]) -> bool:
+    return bool(url) and url.startswith(("http://", "https://"))
+
+
+def _select_op_ed_files(files: List[TorrentFile], metadata: Optional[Metadata]) -> List[int]:
+    """
+    從 torrent 的檔案中挑出一個最可能是該 OP/ED 的媒體檔：
+    檔名含歌名者優先，其次是含 NCOP / OP1 等標記者，最後取最大的媒體檔。
+    """
+    media = [i for i, f in enumerate(files) if f.path.lower().endswith(MEDIA_EXTENSIONS)]
+    if len(media) <= 1:
+        return media or [max(range(len(files)), key=lambda i: files[i].length)]
+
+    song = normalize_title(metadata.song_title).replace(" ", "") if metadata and metadata.song_title else ""
+    kind = re.escape(metadata.type) if metadata and metadata.type else None
+
+    def _score(i: int) -> Tuple[int, int]:
+        name = os.path.basename(files[i].path)
+        score = 0
+        if song and song in normalize_title(name).replace(" ", ""):
+            score += 4
+        if kind and re.search(rf"(?<![a-z])(nc)?{kind}\d*(?![a-z])", name, re.IGNORECASE):
+            score += 2
+        return score, files[i].length
+
+    return [max(media, key=_score)]
@@ -0,0 +1,168 @@
+"""
+HttpClientPool: 為每個上游主機維護一個長生命週期的 httpx.AsyncClient。
+
+此模組屬於 Infrastructure 層。Bangumi 與 DMHY 的請求共用連線池，
+避免每次搜尋或下載都重新進行 DNS、TCP 與 TLS 握手。
+"""
+
+import os
+import logging
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from sidecar.infrastructure.rate_limit import AdaptiveRateLimiter, RetryTransport
+
+logger = logging.getLogger(__name__)
+
+
+def _http2_available() -> bool:
+    """httpx 需要安裝 h2 才能啟用 HTTP/2。"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+@dataclass(frozen=True)
+class HttpClientConfig:
+    """連線池與逾時設定。"""
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    keepalive_expiry: float = 30.0
+    connect_timeout: float = 5.0
+    read_timeout: float = 20.0
+    write_timeout: float = 20.0
+    pool_timeout: float = 10.0
+    http2: bool = True
+
+    @classmethod
+    def from_env(cls) -> "HttpClientConfig":
+        """從 OPUSED_HTTP_* 環境變數讀取設定，未設定者使用預設值。"""
+        default = cls()
+
+        def _get(name: str, fallback, cast):
+            raw = os.environ.get(f"OPUSED_HTTP_{name}")
+            return cast(raw) if raw not in (None, "") else fallback
+
+        return cls(
+            max_connections=_get("MAX_CONNECTIONS", default.max_connections, int),
+            max_keepalive_connections=_get("MAX_KEEPALIVE", default.max_keepalive_connections, int),
+            keepalive_expiry=_get("KEEPALIVE_EXPIRY", default.keepalive_expiry, float),
+            connect_timeout=_get("CONNECT_TIMEOUT", default.connect_timeout, float),
+            read_timeout=_get("READ_TIMEOUT", default.read_timeout, float),
+            write_timeout=_get("WRITE_TIMEOUT", default.write_timeout, float),
+            pool_timeout=_get("POOL_TIMEOUT", default.pool_timeout, float),
+            http2=_get("HTTP2", default.http2, lambda v: v.lower() not in ("0", "false", "no")),
+        )
+
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def timeout(self, read: Optional[float] = None) -> httpx.Timeout:
+        return httpx.Timeout(
+            connect=self.connect_timeout,
+            read=read if read is not None else self.read_timeout,
+            write=self.write_timeout,
+            pool=self.pool_timeout,
+        )
+
+
+class HttpClientPool:
+    """
+    以主機為單位快取 httpx.AsyncClient。
+
+    由 FastAPI lifespan 持有，關閉時統一釋放所有連線。
+    """
+
+    def __init__(
+        self,
+        config: Optional[HttpClientConfig] = None,
+        event_hooks: Optional[Dict[str, List[Callable]]] = None,
+        rate_limiter: Optional[AdaptiveRateLimiter] = None,
+    ):
+        self.config = config or HttpClientConfig()
+        # 例如 SidecarMetrics.http_event_hooks()，套用到之後建立的每個 client
+        self.event_hooks = event_hooks
+        # 設定時所有 client 的請求都會依主機限流並重試；hooks 只看到最後一次回應
+        self.rate_limiter = rate_limiter
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        # 各主機由呼叫端明確指定的標頭 (名稱小寫) 與讀取逾時，之後的呼叫需與其一致
+        self._headers: Dict[str, Dict[str, str]] = {}
+        self._read_timeouts: Dict[str, Optional[float]] = {}
+
+    @staticmethod
+    def _host_key(base_url: str) -> str:
+        parts = urlsplit(base_url)
+        return f"{parts.scheme}://{parts.netloc}".lower()
+
+    def get_client(
+        self,
+        base_url: str,
+        headers: Optional[Dict[str, str]] = None,
+        read_timeout: Optional[float] = None,
+    ) -> httpx.AsyncClient:
+        """
+        取得（或建立）指定主機的共用 client。同一主機只會建立一次；
+        之後的呼叫指定的標頭與讀取逾時會合併到既有 client，與先前指定的值衝突時拋出 ValueError。
+        """
+        key = self._host_key(base_url)
+        client = self._clients.get(key)
+        if client is not None and not client.is_closed:
+            self._merge(key, client, headers, read_timeout)
+            return client
+        http2 = self.config.http2 and _http2_available()
+        transport = None
+        if self.rate_limiter is not None:
+            # 自訂 transport 時 client 的 limits / http2 參數不會生效，需設定在內層 transport
+            transport = RetryTransport(
+                httpx.AsyncHTTPTransport(limits=self.config.limits(), http2=http2), self.rate_limiter
+            )
+        client = httpx.AsyncClient(
+            headers=headers,
+            timeout=self.config.timeout(read_timeout),
+            limits=self.config.limits(),
+            http2=http2,
+            follow_redirects=True,
+            event_hooks=self.event_hooks,
+            transport=transport,
+        )
+        self._clients[key] = client
+        self._headers[key] = {k.lower(): v for k, v in (headers or {}).items()}
+        self._read_timeouts[key] = read_timeout
+        logger.info(f"[HttpClientPool] Created client for {key} (http2={http2})")
+        return client
+
+    def _merge(
+        self,
+        key: str,
+        client: httpx.AsyncClient,
+        headers: Optional[Dict[str, str]],
+        read_timeout: Optional[float],
+    ) -> None:
+        explicit = self._headers[key]
+        for name, value in (headers or {}).items():
+            if explicit.get(name.lower(), value) != value:
+                raise ValueError(f"{key} 的共用 client 已指定不同的 {name} 標頭")
+        current = self._read_timeouts[key]
+        if read_timeout is not None and current is not None and read_timeout != current:
+            raise ValueError(f"{key} 的共用 client 已指定不同的讀取逾時 ({current}s)")
+        for name, value in (headers or {}).items():
+            client.headers[name] = value
+            explicit[name.lower()] = value
+        if read_timeout is not None and current is None:
+            client.timeout = self.config.timeout(read_timeout)
+            self._read_timeouts[key] = read_timeout
+
+    async def aclose(self) -> None:
+        """關閉所有 client 並清空快取。"""
+        clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            await client.aclose()
@@ -0,0 +1,392 @@
+"""
+SQLiteLibraryIndex: 下載資料夾 (target_dir) 的檔案索引，用來在排程前辨識已經下載過的歌曲。
+
+- 每個檔案記錄路徑、大小、mtime、內容雜湊與標籤 (歌名 / 歌手 / 專輯 / 註解)
+- 重新整理時只處理 size 或 mtime 改變的檔案 (重算雜湊、重讀標籤)，消失的檔案從索引移除
+- 標籤以 ffprobe 讀取；沒有 ffprobe 時改用 Sidecar 下載完成時記錄的 Metadata 與檔名比對
+- 同一資料夾在 refresh_interval 內不重複掃描，並行的掃描共用同一次
+- 比對時最多等掃描 scan_wait 秒，逾時即以目前的索引回答，掃描在背景繼續
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sidecar.domain.models import Metadata, Task
+from sidecar.domain.repositories import ILibraryIndex
+from sidecar.infrastructure.metadata_cache import normalize_title
+
+MEDIA_EXTENSIONS = (
+    ".mkv", ".mp4", ".avi", ".webm", ".m2ts", ".ts",
+    ".flac", ".mp3", ".m4a", ".aac", ".wav", ".ogg", ".opus", ".weba",
+)
+HASH_SAMPLE = 1024 * 1024  # 雜湊取樣：檔案開頭與結尾各 1 MiB，大型影片也不必整個讀完
+FFPROBE_TIMEOUT = 10.0
+TAG_FIELDS = ("title", "artist", "album", "comment")
+
+TagReader = Callable[[str], Dict[str, str]]
+
+
+def match_key(text: Optional[str]) -> str:
+    """比對用的鍵：normalize_title 後去除空白。"""
+    return normalize_title(text).replace(" ", "") if text else ""
+
+
+def content_hash(path: str, size: int) -> str:
+    """以檔案大小與開頭、結尾的內容計算雜湊；內容改變但大小與取樣處都相同的情況視為未變。"""
+    h = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        h.update(f.read(HASH_SAMPLE))
+        if size > 2 * HASH_SAMPLE:
+            f.seek(size - HASH_SAMPLE)
+            h.update(f.read(HASH_SAMPLE))
+        elif size > HASH_SAMPLE:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def read_tags(path: str) -> Dict[str, str]:
+    """以 ffprobe 讀取容器層級的標籤；沒有 ffprobe 或讀取失敗時回傳空 dict。"""
+    ffprobe = shutil.which("ffprobe")
+    if ffprobe is None:
+        return {}
+    cmd = [ffprobe, "-v", "error", "-show_entries", "format_tags", "-of", "json", path]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=FFPROBE_TIMEOUT)
+        tags = json.loads(result.stdout or "{}").get("format", {}).get("tags", {})
+    except (subprocess.TimeoutExpired, OSError, ValueError):
+        return {}
+    tags = {k.lower(): v for k, v in tags.items()}
+    return {k: tags[k] for k in TAG_FIELDS if tags.get(k)}
+
+
+@dataclass
+class LibraryStats:
+    hits: int = 0
+    misses: int = 0
+    scans: int = 0
+    hashed: int = 0  # 新增或內容改變而重新處理的檔案數
+
+
+@dataclass
+class ScanResult:
+    root: str
+    files: int
+    updated: int
+    removed: int
+    seconds: float
+
+
+class SQLiteLibraryIndex(ILibraryIndex):
+    """所有 SQLite 與檔案系統操作都在執行緒中進行，不阻塞事件迴圈。"""
+
+    def __init__(
+        self,
+        db_path: str,
+        refresh_interval: float = 30.0,
+        tag_reader: TagReader = read_tags,
+        scan_wait: float = 2.0,
+    ):
+        self.db_path = db_path
+        self.refresh_interval = refresh_interval
+        self.scan_wait = scan_wait
+        self.tag_reader = tag_reader
+        self.stats = LibraryStats()
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                root TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                title TEXT,
+                artist TEXT,
+                album TEXT,
+                comment TEXT,
+                song_key TEXT NOT NULL,
+                name_key TEXT NOT NULL,
+                indexed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS files_root_song ON files (root, song_key);
+            CREATE TABLE IF NOT EXISTS roots (
+                root TEXT PRIMARY KEY,
+                scanned_at REAL NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+        self._scans: Dict[str, asyncio.Future] = {}
+        self._scanned: Dict[str, float] = {}
+
+    @staticmethod
+    def _root(target_dir: str) -> str:
+        return os.path.normcase(os.path.abspath(target_dir or "."))
+
+    async def refresh(self, target_dir: str, force: bool = False) -> Optional[ScanResult]:
+        """掃描 target_dir 的變更；refresh_interval 內已掃描過且未指定 force 時回傳 None。"""
+        root = self._root(target_dir)
+        last = self._scanned.get(root)
+        if not force and last is not None and time.monotonic() - last < self.refresh_interval:
+            return None
+        job = self._scans.get(root)
+        if job is None:
+            job = self._scans[root] = asyncio.ensure_future(asyncio.to_thread(self._scan, root))
+            job.add_done_callback(lambda _f: self._scans.pop(root, None))
+        result = await asyncio.shield(job)
+        self._scanned[root] = time.monotonic()
+        return result
+
+    async def find(self, target_dir: str, metadata: Metadata) -> List[str]:
+        """
+        回傳 target_dir 中符合此歌曲的檔案路徑；找不到時回傳空 list。
+        大型資料夾的掃描不會卡住下載請求：超過 scan_wait 秒就先以目前的索引比對。
+        """
+        refresh = asyncio.ensure_future(self.refresh(target_dir))
+        done, _ = await asyncio.wait([refresh], timeout=self.scan_wait)
+        if refresh in done:
+            refresh.result()
+        else:
+            # 掃描在背景完成；錯誤留待下次 refresh 再處理
+            refresh.add_done_callback(lambda f: f.cancelled() or f.exception())
+        paths = await asyncio.to_thread(self._find, self._root(target_dir), metadata)
+        if paths:
+            self.stats.hits += 1
+        else:
+            self.stats.misses += 1
+        return paths
+
+    async def record(self, task: Task) -> None:
+        """下載完成後登記輸出檔案，標籤取自任務的 Metadata，下次不必等掃描即可比對。"""
+        if task.output_files:
+            await asyncio.to_thread(self._record, self._root(task.target_dir), task.output_files, task.metadata)
+
+    async def list_files(
+        self, target_dir: Optional[str] = None, query: Optional[str] = None, limit: int = 200, offset: int = 0
+    ) -> List[Dict[str, Any]]:
+        root = self._root(target_dir) if target_dir else None
+        return await asyncio.to_thread(self._list_files, root, match_key(query), limit, offset)
+
+    async def list_roots(self) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self._list_roots)
+
+    def get_stats(self) -> Dict[str, int]:
+        return asdict(self.stats)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # ---- 以下在執行緒中執行 ----
+
+    def _scan(self, root: str) -> ScanResult:
+        started = time.perf_counter()
+        with self._lock:
+            known = {
+                path: (size, mtime_ns)
+                for path, size, mtime_ns in self._conn.execute(
+                    # 以路徑範圍比對：子資料夾先被當作另一個下載資料夾索引過的檔案也算在內
+                    "SELECT path, size, mtime_ns FROM files WHERE path >= ? AND path < ?", _path_range(root)
+                )
+            }
+        seen = set()
+        changed = []
+        for path, st in _walk_media(root):
+            seen.add(path)
+            if known.get(path) != (st.st_size, st.st_mtime_ns):
+                changed.append((path, st))
+
+        rows = []
+        for path, st in changed:
+            try:
+                digest = content_hash(path, st.st_size)
+            except OSError:
+                seen.discard(path)
+                continue
+            tags = self.tag_reader(path)
+            rows.append((path, st, digest, tags))
+        removed = [p for p in known if p not in seen]
+
+        with self._lock:
+            for path, st, digest, tags in rows:
+                self._upsert(root, path, st, digest, tags, keep_tags=not tags)
+            self._conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in removed])
+            self._conn.execute(
+                "INSERT OR REPLACE INTO roots (root, scanned_at) VALUES (?, ?)", (root, time.time())
+            )
+            self._conn.commit()
+        self.stats.scans += 1
+        self.stats.hashed += len(rows)
+        return ScanResult(
+            root=root, files=len(seen), updated=len(rows), removed=len(removed),
+            seconds=round(time.perf_counter() - started, 3),
+        )
+
+    def _upsert(
+        self, root: str, path: str, st: os.stat_result, digest: str, tags: Dict[str, str], keep_tags: bool
+    ) -> None:
+        """
+        呼叫端需持有 _lock。keep_tags 時沿用既有的標籤 (例如讀不到標籤、但先前由 record 登記過)。
+        已索引的檔案保留原本的 root。
+        """
+        if keep_tags:
+            row = self._conn.execute(
+                "SELECT title, artist, album, comment FROM files WHERE path = ?", (path,)
+            ).fetchone()
+            if row is not None:
+                tags = {k: v for k, v in zip(TAG_FIELDS, row) if v}
+        name = os.path.splitext(os.path.basename(path))[0]
+        self._conn.execute(
+            """
+            INSERT INTO files
+                (path, root, size, mtime_ns, hash, title, artist, album, comment, song_key, name_key, indexed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (path) DO UPDATE SET
+                size = excluded.size, mtime_ns = excluded.mtime_ns, hash = excluded.hash,
+                title = excluded.title, artist = excluded.artist, album = excluded.album, comment = excluded.comment,
+                song_key = excluded.song_key, name_key = excluded.name_key, indexed_at = excluded.indexed_at
+            """,
+            (
+                path, root, st.st_size, st.st_mtime_ns, digest,
+                tags.get("title"), tags.get("artist"), tags.get("album"), tags.get("comment"),
+                match_key(tags.get("title")), match_key(name), time.time(),
+            ),
+        )
+
+    def _record(self, root: str, paths: List[str], metadata: Optional[Metadata]) -> None:
+        tags = {}
+        if metadata:
+            tags = {
+                "title": metadata.song_title, "artist": metadata.artist,
+                "album": metadata.anime_title, "comment": metadata.type,
+            }
+        entries = []
+        for path in paths:
+            path = os.path.normcase(os.path.abspath(path))
+            if not path.lower().endswith(MEDIA_EXTENSIONS):
+                continue
+            try:
+                st = os.stat(path)
+                entries.append((path, st, content_hash(path, st.st_size)))
+            except OSError:
+                continue
+        with self._lock:
+            for path, st, digest in entries:
+                self._upsert(root, path, st, digest, {k: v for k, v in tags.items() if v}, keep_tags=not tags)
+            self._conn.commit()
+
+    def _find(self, root: str, metadata: Metadata) -> List[str]:
+        song = match_key(metadata.song_title)
+        if not song:
+            return []
+        anime = match_key(metadata.anime_title)
+        artist = match_key(metadata.artist)
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT path, size, mtime_ns, song_key, name_key, artist, album FROM files
+                WHERE path >= ? AND path < ? AND (song_key = ? OR instr(name_key, ?) > 0)
+                ORDER BY path
+                """,
+                (*_path_range(root), song, song),
+            ).fetchall()
+        paths = []
+        for path, size, mtime_ns, song_key, name_key, tag_artist, album in rows:
+            if song_key == song:
+                # 歌名相同時以作品或歌手排除同名的其他歌曲
+                album_key, artist_key = match_key(album), match_key(tag_artist)
+                if album_key or artist_key:
+                    ok = bool(
+                        (anime and album_key and (anime in album_key or album_key in anime))
+                        or (artist and artist_key and (artist in artist_key or artist_key in artist))
+                    )
+                else:
+                    # 沒有作品與歌手標籤時，檔名需含作品名或歌手
+                    ok = bool((anime and anime in name_key) or (artist and artist in name_key))
+            else:
+                # 只有檔名可比對時，檔名需同時含作品名
+                ok = bool(anime) and anime in name_key
+            if not ok:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if (st.st_size, st.st_mtime_ns) == (size, mtime_ns):
+                paths.append(path)
+        return paths
+
+    def _list_files(self, root: Optional[str], query: str, limit: int, offset: int) -> List[Dict[str, Any]]:
+        sql = "SELECT path, root, size, mtime_ns, hash, title, artist, album, comment, indexed_at FROM files"
+        clauses, params = [], []
+        if root:
+            clauses.append("path >= ? AND path < ?")
+            params += _path_range(root)
+        if query:
+            clauses.append("(instr(song_key, ?) > 0 OR instr(name_key, ?) > 0)")
+            params += [query, query]
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY root, path LIMIT ? OFFSET ?"
+        params += [limit, offset]
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [
+            {
+                "path": path, "root": r, "size": size, "mtime": mtime_ns / 1e9, "hash": digest,
+                "title": title, "artist": artist, "album": album, "comment": comment, "indexed_at": indexed_at,
+            }
+            for path, r, size, mtime_ns, digest, title, artist, album, comment, indexed_at in rows
+        ]
+
+    def _list_roots(self) -> List[Dict[str, Any]]:
+        result = []
+        with self._lock:
+            roots = self._conn.execute("SELECT root, scanned_at FROM roots ORDER BY root").fetchall()
+            for root, at in roots:
+                # 巢狀的下載資料夾各自計入其下所有檔案
+                n, size = self._conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files WHERE path >= ? AND path < ?",
+                    _path_range(root),
+                ).fetchone()
+                result.append({"root": root, "scanned_at": at, "files": n, "bytes": size})
+        return result
+
+
+def _path_range(root: str) -> Tuple[str, str]:
+    """root 之下所有路徑的字串範圍 [lo, hi)，可直接使用 path 主鍵的索引。"""
+    prefix = root if root.endswith(os.sep) else root + os.sep
+    return prefix, prefix[:-1] + chr(ord(os.sep) + 1)
+
+
+def _walk_media(root: str):
+    """遞迴列出 root 下的媒體檔 (略過隱藏檔與下載中的 .part)，產生 (正規化路徑, stat)。"""
+    stack = [root]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.lower().endswith(MEDIA_EXTENSIONS):
+                    yield os.path.normcase(os.path.abspath(entry.path)), entry.stat()
+            except OSError:
+                continue
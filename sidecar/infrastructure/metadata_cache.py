@@ -0,0 +1,354 @@
+"""
+CachedMetadataProvider: 位於 IMetadataProvider 前方的兩層快取。
+
+- 第一層：有上限的記憶體 LRU。
+- 第二層：SQLite 檔案，Sidecar 重啟後仍然有效。
+
+過期 (stale) 的項目會先回傳給呼叫端，同時在背景以條件式請求
+(ETag / If-Modified-Since) 重新驗證。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Set
+
+from sidecar.domain.models import Metadata
+from sidecar.domain.repositories import IMetadataProvider
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_title(title: str) -> str:
+    """統一全形/半形、大小寫與空白，讓同一部作品的不同寫法共用快取。"""
+    normalized = unicodedata.normalize("NFKC", title).casefold()
+    return " ".join(normalized.split())
+
+
+def title_key(title: str) -> str:
+    return f"title:{normalize_title(title)}"
+
+
+def subject_key(subject_id: str) -> str:
+    return f"subject:{subject_id}"
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    results: List[Metadata]
+    fetched_at: float
+    subject_id: Optional[str] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    def age(self, now: float) -> float:
+        return now - self.fetched_at
+
+
+@dataclass
+class CacheStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    stale_served: int = 0
+    revalidations: int = 0
+    not_modified: int = 0
+    errors: int = 0
+
+    def to_dict(self) -> Dict[str, float]:
+        data = asdict(self)
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        data["hit_ratio"] = round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0
+        return data
+
+
+class LRUCache:
+    """以 OrderedDict 實作的有上限 LRU。"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data: "OrderedDict[str, CacheEntry]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        entry = self._data.get(key)
+        if entry is not None:
+            self._data.move_to_end(key)
+        return entry
+
+    def put(self, entry: CacheEntry) -> None:
+        self._data[entry.key] = entry
+        self._data.move_to_end(entry.key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteMetadataStore:
+    """
+    SQLite 持久層。所有方法皆為同步呼叫，需透過 asyncio.to_thread 執行，
+    避免在事件迴圈上阻塞。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS metadata_cache (
+                key TEXT PRIMARY KEY,
+                subject_id TEXT,
+                payload TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                etag TEXT,
+                last_modified TEXT
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key, subject_id, payload, fetched_at, etag, last_modified "
+                "FROM metadata_cache WHERE key = ?",
+                (key,),
+            ).fetchone()
+        if row is None:
+            return None
+        return CacheEntry(
+            key=row[0],
+            subject_id=row[1],
+            results=[Metadata(**item) for item in json.loads(row[2])],
+            fetched_at=row[3],
+            etag=row[4],
+            last_modified=row[5],
+        )
+
+    def put_many(self, entries: List[CacheEntry]) -> None:
+        rows = [
+            (
+                e.key,
+                e.subject_id,
+                json.dumps([asdict(m) for m in e.results], ensure_ascii=False),
+                e.fetched_at,
+                e.etag,
+                e.last_modified,
+            )
+            for e in entries
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO metadata_cache "
+                "(key, subject_id, payload, fetched_at, etag, last_modified) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class CachedMetadataProvider(IMetadataProvider):
+    """
+    以正規化標題與 subject id 為鍵的快取裝飾器。
+
+    若內層 provider 提供 fetch_conditional（如 BangumiMetadataProvider），
+    背景重新驗證會帶上 ETag / Last-Modified；否則直接重新查詢。
+    """
+
+    def __init__(
+        self,
+        provider: IMetadataProvider,
+        store: Optional[SQLiteMetadataStore] = None,
+        max_memory_entries: int = 512,
+        ttl: float = 24 * 3600,
+        max_stale: float = 30 * 24 * 3600,
+        negative_ttl: float = 600,
+    ):
+        self.provider = provider
+        self.store = store
+        self.memory = LRUCache(max_memory_entries)
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.negative_ttl = negative_ttl
+        self.stats = CacheStats()
+        self._revalidating: Set[str] = set()
+        self._background: Set[asyncio.Task] = set()
+
+    async def get_metadata(self, anime_title: str, token: Optional[str] = None) -> List[Metadata]:
+        key = title_key(anime_title)
+        entry = await self._lookup(key)
+        now = time.time()
+
+        if entry is not None:
+            age = entry.age(now)
+            if age <= self._fresh_ttl(entry):
+                return list(entry.results)
+            if age <= self.max_stale:
+                self.stats.stale_served += 1
+                self._schedule_revalidate(entry, anime_title, token)
+                return list(entry.results)
+
+        # 過期太久的項目不再回傳，但其 subject id 仍可讓搜尋與集數查詢並行
+        hint = entry.subject_id if entry is not None else None
+        return await self._refresh(key, anime_title, token, previous=None, subject_id_hint=hint)
+
+    def get_subject_id(self, anime_title: str) -> Optional[str]:
+        """從記憶體層查詢已知的 title → subject id 對應。"""
+        entry = self.memory.get(title_key(anime_title))
+        return entry.subject_id if entry else None
+
+    async def get_by_subject_id(self, subject_id: str) -> Optional[List[Metadata]]:
+        entry = await self._lookup(subject_key(subject_id), count=False)
+        return list(entry.results) if entry else None
+
+    def get_stats(self) -> Dict[str, float]:
+        data = self.stats.to_dict()
+        data["memory_entries"] = len(self.memory)
+        return data
+
+    async def aclose(self) -> None:
+        for task in list(self._background):
+            task.cancel()
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+        if self.store:
+            await asyncio.to_thread(self.store.close)
+        inner_close = getattr(self.provider, "aclose", None)
+        if inner_close is not None:
+            await inner_close()
+
+    def _fresh_ttl(self, entry: CacheEntry) -> float:
+        return self.ttl if entry.results else self.negative_ttl
+
+    async def _lookup(self, key: str, count: bool = True) -> Optional[CacheEntry]:
+        entry = self.memory.get(key)
+        if entry is not None:
+            if count:
+                self.stats.memory_hits += 1
+            return entry
+
+        if self.store is not None:
+            entry = await asyncio.to_thread(self.store.get, key)
+            if entry is not None:
+                self.memory.put(entry)
+                if count:
+                    self.stats.disk_hits += 1
+                return entry
+
+        if count:
+            self.stats.misses += 1
+        return None
+
+    async def _refresh(
+        self,
+        key: str,
+        anime_title: str,
+        token: Optional[str],
+        previous: Optional[CacheEntry],
+        subject_id_hint: Optional[str] = None,
+    ) -> List[Metadata]:
+        fetch_conditional = getattr(self.provider, "fetch_conditional", None)
+        if fetch_conditional is None:
+            results = await self.provider.get_metadata(anime_title, token=token)
+            subject_id = results[0].bangumi_id if results else None
+            await self._store(CacheEntry(key, results, time.time(), subject_id=subject_id))
+            return results
+
+        etag = previous.etag if previous else None
+        last_modified = previous.last_modified if previous else None
+        if previous is not None and not (etag or last_modified):
+            # 無驗證標頭時必定要重新查詢集數，不如與搜尋同時進行
+            subject_id_hint = previous.subject_id
+        try:
+            fetched = await fetch_conditional(
+                anime_title,
+                token=token,
+                etag=etag,
+                last_modified=last_modified,
+                subject_id_hint=subject_id_hint,
+            )
+        except Exception as e:
+            # 失敗不寫入快取，以免把暫時性錯誤固定下來
+            self.stats.errors += 1
+            logger.error(f"Bangumi 獲取元數據失敗: {e}")
+            return list(previous.results) if previous else []
+
+        if fetched.not_modified and previous is not None:
+            self.stats.not_modified += 1
+            # 304 只代表搜尋結果未變，條目之後新增的 OP/ED 需另外查詢集數
+            results = previous.results
+            fetch_episodes = getattr(self.provider, "fetch_episodes", None)
+            if fetch_episodes is not None and previous.subject_id and previous.results:
+                try:
+                    results = await fetch_episodes(previous.subject_id, previous.results[0].anime_title, token=token)
+                except Exception as e:
+                    # 不更新時間戳記，下次查詢時再重新驗證
+                    self.stats.errors += 1
+                    logger.error(f"Bangumi 獲取集數失敗: {e}")
+                    return list(previous.results)
+            await self._store(CacheEntry(
+                key,
+                results,
+                time.time(),
+                subject_id=previous.subject_id,
+                etag=fetched.etag or previous.etag,
+                last_modified=fetched.last_modified or previous.last_modified,
+            ))
+            return list(results)
+
+        await self._store(CacheEntry(
+            key,
+            fetched.results,
+            time.time(),
+            subject_id=fetched.subject_id,
+            etag=fetched.etag,
+            last_modified=fetched.last_modified,
+        ))
+        return list(fetched.results)
+
+    async def _store(self, entry: CacheEntry) -> None:
+        entries = [entry]
+        if entry.subject_id:
+            entries.append(CacheEntry(
+                subject_key(entry.subject_id),
+                entry.results,
+                entry.fetched_at,
+                subject_id=entry.subject_id,
+            ))
+        for e in entries:
+            self.memory.put(e)
+        if self.store is not None:
+            await asyncio.to_thread(self.store.put_many, entries)
+
+    def _schedule_revalidate(self, entry: CacheEntry, anime_title: str, token: Optional[str]) -> None:
+        if entry.key in self._revalidating:
+            return
+        self._revalidating.add(entry.key)
+        self.stats.revalidations += 1
+
+        async def _run():
+            try:
+                await self._refresh(entry.key, anime_title, token, previous=entry)
+            finally:
+                self._revalidating.discard(entry.key)
+
+        task = asyncio.create_task(_run())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
@@ -1,91 +1,247 @@
 import httpx
+import asyncio
 import logging
 import urllib.parse
-from typing import List, Optional, Dict, Any
+from dataclasses import dataclass, field
+from typing import List, Optional, Dict, Any, Tuple
 from sidecar.domain.models import Metadata
 from sidecar.domain.repositories import IMetadataProvider
+from sidecar.infrastructure.bangumi_index import BangumiIndex
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_HEADERS = {
+    "User-Agent": "twkevinzhang/OpusED (https://github.com/twkevinzhang/OpusED)",
+    "Accept": "application/json"
+}
+
+# Bangumi episode 類型：2 為 OP，3 為 ED
+EPISODE_TYPES = {2: "OP", 3: "ED"}
+EPISODE_PAGE_SIZE = 100
+# online: 只查 API；hybrid: 先查本機索引，找不到才查 API；offline: 只查本機索引
+METADATA_MODES = ("online", "hybrid", "offline")
+
+@dataclass
+class MetadataFetchResult:
+    """一次 (可能為條件式) 查詢的結果與 HTTP 驗證標頭。"""
+    results: List[Metadata] = field(default_factory=list)
+    subject_id: Optional[str] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    not_modified: bool = False
+
 class BangumiMetadataProvider(IMetadataProvider):
-    def __init__(self, base_url: str = "https://api.bgm.tv"):
+    def __init__(
+        self,
+        base_url: str = "https://api.bgm.tv",
+        client: Optional[httpx.AsyncClient] = None,
+        index: Optional[BangumiIndex] = None,
+        mode: str = "online",
+    ):
+        if mode not in METADATA_MODES:
+            raise ValueError(f"未知的元數據模式: {mode}")
+        if mode != "online" and index is None:
+            raise ValueError(f"{mode} 模式需要本機索引")
         self.base_url = base_url
+        # 由 app lifespan 注入共用 client；未注入時（如單元測試）自行建立
+        self.client = client or httpx.AsyncClient(headers=DEFAULT_HEADERS, timeout=12.0, follow_redirects=True)
+        self.index = index
+        self.mode = mode
+
+    async def aclose(self) -> None:
+        """關閉本機索引；共用 client 由 app lifespan 負責關閉。"""
+        if self.index is not None:
+            await asyncio.to_thread(self.index.close)
 
     async def get_metadata(self, anime_title: str, token: Optional[str] = None) -> List[Metadata]:
         """
         搜尋動畫並獲取其角色、曲目資訊 (使用 /v0/episodes API)。
         """
-        headers = {
-            "User-Agent": "twkevinzhang/OpusED (https://github.com/twkevinzhang/OpusED)",
-            "Accept": "application/json"
-        }
-        if token:
-            headers["Authorization"] = f"Bearer {token}"
-
-        async with httpx.AsyncClient(headers=headers, timeout=12.0, follow_redirects=True) as client:
-            try:
-                # 1. 搜尋條目 (使用 URL 編碼)
-                encoded_title = urllib.parse.quote(anime_title)
-                search_url = f"{self.base_url}/search/subject/{encoded_title}"
-                params = {"type": 2}  # 2 為動畫
-                response = await client.get(search_url, params=params)
-                response.raise_for_status()
-                
-                data = response.json()
-                if not data.get("list"):
-                    logger.warning(f"Bangumi 找不到動畫: {anime_title}")
-                    return []
-                
-                # 取第一個結果的 ID
-                subject_id = data["list"][0]["id"]
-                anime_name_cn = data["list"][0].get("name_cn") or data["list"][0].get("name")
-                logger.info(f"Found Subject: {anime_name_cn} ({subject_id})")
-
-                results = []
-
-                # 2. 獲取 OP (type=2) 和 ED (type=3)
-                # API: /v0/episodes?subject_id={id}&type={type}
-                ep_types = {2: "OP", 3: "ED"}
-                
-                for ep_type_id, type_label in ep_types.items():
-                    ep_url = f"{self.base_url}/v0/episodes"
-                    ep_params = {"subject_id": subject_id, "type": ep_type_id}
-                    
-                    ep_resp = await client.get(ep_url, params=ep_params)
-                    ep_resp.raise_for_status()
-                    ep_data = ep_resp.json()
-                    
-                    ep_list = ep_data.get("data", [])
-                    for ep in ep_list:
-                        song_title = ep.get("name")
-                        desc = ep.get("desc", "")
-                        artist = self._parse_artist_from_desc(song_title, desc)
-                        
-                        if song_title:
-                            results.append(Metadata(
-                                anime_title=anime_name_cn,
-                                song_title=song_title,
-                                artist=artist,
-                                type=type_label,
-                                bangumi_id=str(subject_id)
-                            ))
-
-                if not results:
-                     logger.warning(f"No OP/ED found for {anime_name_cn}")
-                     # Fallback empty result
-                     results.append(Metadata(
-                        anime_title=anime_name_cn,
-                        song_title="[請輸入歌曲]",
-                        artist="[請輸入歌手]",
-                        type="OP/ED",
-                        bangumi_id=str(subject_id)
-                    ))
-
-                return results
-
-            except Exception as e:
-                logger.error(f"Bangumi 獲取元數據失敗: {e}")
-                return []
+        try:
+            fetched = await self.fetch_conditional(anime_title, token=token)
+            return fetched.results
+        except Exception as e:
+            logger.error(f"Bangumi 獲取元數據失敗: {e}")
+            return []
+
+    async def fetch_conditional(
+        self,
+        anime_title: str,
+        token: Optional[str] = None,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        subject_id_hint: Optional[str] = None,
+    ) -> MetadataFetchResult:
+        """
+        與 get_metadata 相同，但會在搜尋請求附帶 If-None-Match / If-Modified-Since，
+        並回傳驗證標頭供快取重新驗證使用。錯誤不會被吞掉。
+
+        若已知 subject id (subject_id_hint)，集數查詢會與搜尋同時進行；
+        搜尋結果與提示不符時才改用新的 id 重新查詢。
+
+        hybrid / offline 模式先查本機索引，命中時不發出任何請求 (結果不帶驗證標頭)。
+        """
+        if self.mode != "online":
+            local = await self._fetch_local(anime_title)
+            if local is not None or self.mode == "offline":
+                return local or MetadataFetchResult()
+
+        # Token 屬於單次請求，不可寫入共用 client 的 headers
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        hinted_episodes: Optional[asyncio.Task] = None
+        if subject_id_hint:
+            hinted_episodes = asyncio.create_task(self._fetch_all_episodes(subject_id_hint, headers))
+
+        try:
+            # 1. 搜尋條目 (使用 URL 編碼)
+            encoded_title = urllib.parse.quote(anime_title)
+            search_url = f"{self.base_url}/search/subject/{encoded_title}"
+            params = {"type": 2}  # 2 為動畫
+            search_headers = dict(headers)
+            if etag:
+                search_headers["If-None-Match"] = etag
+            if last_modified:
+                search_headers["If-Modified-Since"] = last_modified
+            response = await self.client.get(search_url, params=params, headers=search_headers)
+            if response.status_code == 304:
+                return MetadataFetchResult(
+                    results=[], etag=etag, last_modified=last_modified, not_modified=True
+                )
+            response.raise_for_status()
+            validators = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+
+            data = response.json()
+            if not data.get("list"):
+                logger.warning(f"Bangumi 找不到動畫: {anime_title}")
+                return MetadataFetchResult(results=[], **validators)
+
+            # 取第一個結果的 ID
+            subject = data["list"][0]
+            subject_id = str(subject["id"])
+
+            # 2. 獲取 OP (type=2) 和 ED (type=3)；搜尋結果缺少中文名時同時查詢條目詳情
+            if hinted_episodes is not None and subject_id == str(subject_id_hint):
+                episodes_job, hinted_episodes = hinted_episodes, None
+            else:
+                episodes_job = self._fetch_all_episodes(subject_id, headers)
+
+            anime_name_cn = subject.get("name_cn")
+            if anime_name_cn:
+                episodes = await episodes_job
+            else:
+                episodes, anime_name_cn = await asyncio.gather(
+                    episodes_job, self._fetch_subject_name(subject_id, headers)
+                )
+                anime_name_cn = anime_name_cn or subject.get("name")
+            logger.info(f"Found Subject: {anime_name_cn} ({subject_id})")
+        finally:
+            if hinted_episodes is not None:
+                hinted_episodes.cancel()
+
+        return MetadataFetchResult(
+            results=self._build_results(anime_name_cn, subject_id, episodes), subject_id=subject_id, **validators
+        )
+
+    async def fetch_episodes(self, subject_id: str, anime_title: str, token: Optional[str] = None) -> List[Metadata]:
+        """
+        只重新查詢已知條目的 OP/ED，anime_title 沿用先前的名稱。
+        搜尋回應 304 時使用：集數列表沒有驗證標頭，需另外查詢才能取得新增的曲目。錯誤不會被吞掉。
+        """
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        episodes = await self._fetch_all_episodes(subject_id, headers)
+        return self._build_results(anime_title, subject_id, episodes)
+
+    async def _fetch_local(self, anime_title: str) -> Optional[MetadataFetchResult]:
+        """從本機索引查詢；找不到符合的條目時回傳 None。"""
+        subject = await asyncio.to_thread(self.index.find_subject, anime_title)
+        if subject is None:
+            logger.info(f"本機索引找不到動畫: {anime_title}")
+            return None
+        anime_name_cn = subject.name_cn or subject.name
+        episodes = [(ep.type, {"name": ep.name, "desc": ep.desc}) for ep in subject.episodes]
+        logger.info(f"Found Subject (local): {anime_name_cn} ({subject.subject_id})")
+        return MetadataFetchResult(
+            results=self._build_results(anime_name_cn, subject.subject_id, episodes), subject_id=subject.subject_id
+        )
+
+    def _build_results(
+        self, anime_name_cn: str, subject_id: str, episodes: List[Tuple[str, Dict[str, Any]]]
+    ) -> List[Metadata]:
+        results = []
+        for type_label, ep in episodes:
+            song_title = ep.get("name")
+            desc = ep.get("desc", "")
+            artist = self._parse_artist_from_desc(song_title, desc)
+
+            if song_title:
+                results.append(Metadata(
+                    anime_title=anime_name_cn,
+                    song_title=song_title,
+                    artist=artist,
+                    type=type_label,
+                    bangumi_id=subject_id
+                ))
+
+        if not results:
+             logger.warning(f"No OP/ED found for {anime_name_cn}")
+             # Fallback empty result
+             results.append(Metadata(
+                anime_title=anime_name_cn,
+                song_title="[請輸入歌曲]",
+                artist="[請輸入歌手]",
+                type="OP/ED",
+                bangumi_id=subject_id
+            ))
+        return results
+
+    async def _fetch_all_episodes(self, subject_id: str, headers: Dict[str, str]) -> List[Tuple[str, Dict[str, Any]]]:
+        """同時查詢 OP 與 ED 的所有分頁，回傳 (類型標籤, episode) 列表，OP 在前。"""
+        per_type = await asyncio.gather(*(
+            self._fetch_episode_type(subject_id, ep_type_id, headers) for ep_type_id in EPISODE_TYPES
+        ))
+        return [
+            (EPISODE_TYPES[ep_type_id], ep)
+            for ep_type_id, eps in zip(EPISODE_TYPES, per_type)
+            for ep in eps
+        ]
+
+    async def _fetch_episode_type(self, subject_id: str, ep_type_id: int, headers: Dict[str, str]) -> List[Dict[str, Any]]:
+        """
+        API: /v0/episodes?subject_id={id}&type={type}&limit=&offset=
+        先取第一頁得知 total，其餘分頁並行取得。
+        """
+        first = await self._fetch_episode_page(subject_id, ep_type_id, 0, headers)
+        episodes = list(first.get("data", []))
+        total = first.get("total") or len(episodes)
+        page_size = first.get("limit") or EPISODE_PAGE_SIZE
+
+        offsets = range(len(episodes), total, page_size) if episodes else range(0)
+        pages = await asyncio.gather(*(
+            self._fetch_episode_page(subject_id, ep_type_id, offset, headers) for offset in offsets
+        ))
+        for page in pages:
+            episodes.extend(page.get("data", []))
+        return episodes
+
+    async def _fetch_episode_page(self, subject_id: str, ep_type_id: int, offset: int, headers: Dict[str, str]) -> Dict[str, Any]:
+        ep_url = f"{self.base_url}/v0/episodes"
+        ep_params = {"subject_id": subject_id, "type": ep_type_id, "limit": EPISODE_PAGE_SIZE, "offset": offset}
+        ep_resp = await self.client.get(ep_url, params=ep_params, headers=headers)
+        ep_resp.raise_for_status()
+        return ep_resp.json()
+
+    async def _fetch_subject_name(self, subject_id: str, headers: Dict[str, str]) -> Optional[str]:
+        """從 /v0/subjects/{id} 取得中文名，失敗時回傳 None 讓呼叫端使用原名。"""
+        try:
+            resp = await self.client.get(f"{self.base_url}/v0/subjects/{subject_id}", headers=headers)
+            resp.raise_for_status()
+            return resp.json().get("name_cn") or None
+        except Exception as e:
+            logger.warning(f"Bangumi 獲取條目名稱失敗 ({subject_id}): {e}")
+            return None
 
     def _parse_artist_from_desc(self, song_title: str, desc: str) -> str:
         """
@@ -0,0 +1,383 @@
+"""
+Prometheus 文字格式的指標，不依賴 prometheus_client。
+
+每次記錄只做字典查詢與 bisect，並在鎖內更新 (yt-dlp 的進度回呼來自工作執行緒)；
+佇列深度、快取命中率等由 collector 在 /metrics 被讀取時才計算，平時沒有成本。
+"""
+
+import asyncio
+import re
+import threading
+import time
+from bisect import bisect_left
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sidecar.domain.models import Task
+from sidecar.domain.repositories import ITaskMetrics
+from sidecar.domain.stages import HTTP, record_span
+
+if TYPE_CHECKING:
+    import httpx
+
+LabelValues = Tuple[str, ...]
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 900.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# 路徑中只保留前兩段「像名稱」的片段，搜尋字串、id 與檔名不會讓標籤數量無限成長
+_ENDPOINT_SEGMENT = re.compile(r"^[A-Za-z][A-Za-z0-9_\-]*$")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    """值由 function 在讀取時計算；function 回傳 {標籤值 tuple: 數值}。"""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        function: Optional[Callable[[], Dict[LabelValues, float]]] = None,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._function = function
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, function: Callable[[], Dict[LabelValues, float]]) -> None:
+        self._function = function
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            values = dict(self._values)
+        if self._function is not None:
+            values.update(self._function())
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 標籤值 -> [各 bucket 的非累計次數..., +Inf 次數, 總和]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            row[index] += 1
+            row[-1] += value
+
+    def count(self, **labels: str) -> int:
+        row = self._values.get(self._key(labels))
+        return int(sum(row[:-1])) if row else 0
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for key, row in items:
+            cumulative = 0.0
+            for bound, hits in zip(self.buckets + (float("inf"),), row[:-1]):
+                cumulative += hits
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(cumulative)}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(row[-1])}"
+            yield f"{self.name}_count{labels} {_format_value(cumulative)}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> Any:
+        if metric.name in self._metrics:
+            raise ValueError(f"指標 {metric.name} 已註冊")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class _RateWindow:
+    """以每秒一格的環狀陣列計算最近 window 秒的平均速率。"""
+
+    def __init__(self, window: int = 10):
+        self.window = window
+        self._slots = [0.0] * window
+        self._seconds = [0] * window
+
+    def add(self, amount: float, now: float) -> None:
+        second = int(now)
+        index = second % self.window
+        if self._seconds[index] != second:
+            self._seconds[index] = second
+            self._slots[index] = 0.0
+        self._slots[index] += amount
+
+    def rate(self, now: float) -> float:
+        second = int(now)
+        total = sum(v for s, v in zip(self._seconds, self._slots) if second - self.window < s <= second)
+        return total / self.window
+
+
+def endpoint_label(path: str) -> str:
+    segments = []
+    for segment in path.split("/"):
+        if not segment:
+            continue
+        if len(segments) == 2 or not _ENDPOINT_SEGMENT.match(segment):
+            break
+        segments.append(segment)
+    return "/" + "/".join(segments)
+
+
+class LoopLagMonitor:
+    """定期睡眠 interval 秒，實際醒來時間超出的部分即為事件迴圈被佔用的時間。"""
+
+    def __init__(self, on_sample: Callable[[float], None], interval: float = 0.5):
+        self.on_sample = on_sample
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.on_sample(max(0.0, time.perf_counter() - started - self.interval))
+
+
+class SidecarMetrics(ITaskMetrics):
+    """Sidecar 的所有指標；由 main 建立並注入排程器、用例與 HTTP client。"""
+
+    def __init__(self, registry: Optional[MetricsRegistry] = None, rate_window: int = 10):
+        self.registry = registry or MetricsRegistry()
+        r = self.registry
+        self.http_duration = r.register(Histogram(
+            "opused_http_request_duration_seconds",
+            "Time until response headers from upstream hosts",
+            ("host", "endpoint", "method"),
+        ))
+        self.http_requests = r.register(Counter(
+            "opused_http_requests_total", "Upstream HTTP requests by status code", ("host", "endpoint", "status")
+        ))
+        self.task_stage = r.register(Histogram(
+            "opused_task_stage_seconds",
+            "Download task stage durations (transfer includes write)",
+            ("source", "stage"),
+            buckets=STAGE_BUCKETS,
+        ))
+        self.transfer_bytes = r.register(Counter(
+            "opused_transfer_bytes_total", "Bytes downloaded per source", ("source",)
+        ))
+        self.transfer_rate = r.register(Gauge(
+            "opused_transfer_bytes_per_second",
+            f"Average download rate over the last {rate_window}s",
+            ("source",),
+            function=self._rates,
+        ))
+        self.tasks = r.register(Gauge("opused_tasks", "Download tasks by state", ("source", "state")))
+        self.cache_lookups = r.register(Gauge(
+            "opused_cache_lookups", "Cache lookups since start", ("cache", "result")
+        ))
+        self.cache_hit_ratio = r.register(Gauge("opused_cache_hit_ratio", "Cache hit ratio since start", ("cache",)))
+        self.rate_limit = r.register(Gauge(
+            "opused_http_rate_limit", "Current adaptive request rate per upstream host (req/s)", ("host",)
+        ))
+        self.rate_limit_events = r.register(Gauge(
+            "opused_http_rate_limit_events", "Throttled responses and retries per upstream host since start",
+            ("host", "event"),
+        ))
+        self.postprocess_jobs = r.register(Gauge(
+            "opused_postprocess_jobs", "Post-processing files waiting for or holding a worker", ("state",)
+        ))
+        self.postprocess_files = r.register(Gauge(
+            "opused_postprocess_files", "Post-processed files since start", ("result",)
+        ))
+        self.postprocess_rate = r.register(Gauge(
+            "opused_postprocess_files_per_minute", "Files post-processed during the last minute"
+        ))
+        self.bandwidth_limit = r.register(Gauge(
+            "opused_bandwidth_limit_bytes_per_second", "Global download bandwidth cap (0 when unlimited)"
+        ))
+        self.bandwidth_wait = r.register(Gauge(
+            "opused_bandwidth_wait_seconds", "Time transfers spent waiting for bandwidth since start"
+        ))
+        self.loop_lag = r.register(Histogram(
+            "opused_event_loop_lag_seconds", "Event loop scheduling delay", buckets=LAG_BUCKETS
+        ))
+        self._rate_windows: Dict[str, _RateWindow] = {}
+        self._rate_window = rate_window
+        self._lock = threading.Lock()
+        self._collectors: List[Callable[[], None]] = []
+
+    # ---- 任務 ----
+
+    def observe_stage(self, task: Task, stage: str, seconds: float) -> None:
+        self.task_stage.observe(seconds, source=task.source.value, stage=stage)
+
+    def observe_bytes(self, task: Task, count: int) -> None:
+        source = task.source.value
+        self.transfer_bytes.inc(count, source=source)
+        with self._lock:
+            window = self._rate_windows.get(source)
+            if window is None:
+                window = self._rate_windows[source] = _RateWindow(self._rate_window)
+            window.add(count, time.monotonic())
+
+    def _rates(self) -> Dict[LabelValues, float]:
+        now = time.monotonic()
+        with self._lock:
+            return {(source,): round(w.rate(now), 1) for source, w in self._rate_windows.items()}
+
+    # ---- HTTP ----
+
+    def http_event_hooks(self) -> Dict[str, List[Callable]]:
+        """
+        httpx 的 event hooks：記錄到收到回應標頭為止的延遲 (串流下載不含本文時間)。
+        請求屬於某個任務時，同時在任務時間軸留下一段 http span。
+        """
+
+        async def _on_request(request: "httpx.Request") -> None:
+            request.extensions["opused_started"] = time.perf_counter()
+
+        async def _on_response(response: "httpx.Response") -> None:
+            request = response.request
+            started = request.extensions.get("opused_started")
+            host, endpoint = request.url.host, endpoint_label(request.url.path)
+            if started is not None:
+                now = time.perf_counter()
+                self.http_duration.observe(now - started, host=host, endpoint=endpoint, method=request.method)
+                record_span(
+                    HTTP, started, now,
+                    method=request.method, host=host, endpoint=endpoint, status=response.status_code,
+                )
+            self.http_requests.inc(host=host, endpoint=endpoint, status=str(response.status_code))
+
+        return {"request": [_on_request], "response": [_on_response]}
+
+    # ---- 讀取時才計算的指標 ----
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        """collector 在每次 render 前執行，用來更新佇列深度、快取統計等 Gauge。"""
+        self._collectors.append(collector)
+
+    def record_scheduler(self, stats: Dict[str, Any]) -> None:
+        for source, counts in stats["sources"].items():
+            self.tasks.set(counts["queued"], source=source, state="queued")
+            self.tasks.set(counts["running"], source=source, state="running")
+
+    def record_cache(self, cache: str, hits: float, misses: float) -> None:
+        self.cache_lookups.set(hits, cache=cache, result="hit")
+        self.cache_lookups.set(misses, cache=cache, result="miss")
+        lookups = hits + misses
+        self.cache_hit_ratio.set(round(hits / lookups, 4) if lookups else 0.0, cache=cache)
+
+    def record_rate_limits(self, stats: Dict[str, Dict[str, Any]]) -> None:
+        for host, values in stats.items():
+            self.rate_limit.set(values["rate"], host=host)
+            self.rate_limit_events.set(values["throttled"], host=host, event="throttled")
+            self.rate_limit_events.set(values["retries"], host=host, event="retried")
+
+    def record_postprocess(self, stats: Dict[str, Any]) -> None:
+        self.postprocess_jobs.set(stats["queued"], state="queued")
+        self.postprocess_jobs.set(stats["running"], state="running")
+        self.postprocess_files.set(stats["completed"], result="completed")
+        self.postprocess_files.set(stats["failed"], result="failed")
+        self.postprocess_rate.set(stats["files_per_minute"])
+
+    def record_bandwidth(self, stats: Dict[str, Any]) -> None:
+        self.bandwidth_limit.set(stats["rate"] or 0)
+        self.bandwidth_wait.set(stats["wait_seconds"])
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+        return self.registry.render()
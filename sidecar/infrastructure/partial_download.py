@@ -0,0 +1,174 @@
+"""
+可續傳的 HTTP 下載。
+
+下載內容先寫入 `<檔名>.part`，旁邊的 `<檔名>.part.json` 記錄來源 URL 與
+ETag / Last-Modified。重試或 Sidecar 重啟後以 Range + If-Range 從已下載的
+位元組續傳，完成後才以 os.replace 原子地移到最終路徑。
+
+所有檔案系統操作皆透過 aiofiles 在執行緒池中進行，不阻塞事件迴圈。
+"""
+
+import json
+import logging
+import os
+import uuid
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple
+
+import aiofiles
+import aiofiles.os
+import httpx
+
+from sidecar.domain.stages import timed_write
+
+if TYPE_CHECKING:
+    from sidecar.infrastructure.bandwidth import Throttle
+
+logger = logging.getLogger(__name__)
+
+PART_SUFFIX = ".part"
+MANIFEST_SUFFIX = ".part.json"
+
+ProgressCallback = Callable[[int, Optional[int]], None]
+
+
+class PartialDownload:
+    """管理單一目標檔案的 .part 檔與 manifest。"""
+
+    def __init__(self, final_path: str):
+        self.final_path = final_path
+        self.part_path = final_path + PART_SUFFIX
+        self.manifest_path = final_path + MANIFEST_SUFFIX
+
+    async def load_manifest(self) -> Optional[Dict[str, Any]]:
+        try:
+            async with aiofiles.open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.loads(await f.read())
+        except (OSError, ValueError):
+            return None
+
+    async def save_manifest(self, manifest: Dict[str, Any]) -> None:
+        tmp_path = self.manifest_path + ".tmp"
+        async with aiofiles.open(tmp_path, "w", encoding="utf-8") as f:
+            await f.write(json.dumps(manifest, ensure_ascii=False))
+        await aiofiles.os.replace(tmp_path, self.manifest_path)
+
+    async def resume_state(self, url: str) -> Tuple[int, Optional[str]]:
+        """回傳 (可續傳的位移, If-Range 驗證值)。來源不同或缺檔時從 0 開始。"""
+        manifest = await self.load_manifest()
+        if not manifest or manifest.get("url") != url or manifest.get("segment_size"):
+            # 分段下載的 .part 是預先配置的稀疏檔，不能從檔尾續傳
+            return 0, None
+        validator = manifest.get("etag") or manifest.get("last_modified")
+        if not validator:
+            # 無法確認伺服器端內容未變，不冒險拼接
+            return 0, None
+        try:
+            return await aiofiles.os.path.getsize(self.part_path), validator
+        except OSError:
+            return 0, None
+
+    async def finalize(self) -> None:
+        with timed_write():
+            await aiofiles.os.replace(self.part_path, self.final_path)
+        await self._remove(self.manifest_path)
+
+    async def discard(self) -> None:
+        await self._remove(self.part_path)
+        await self._remove(self.manifest_path)
+
+    @staticmethod
+    async def _remove(path: str) -> None:
+        try:
+            await aiofiles.os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+async def write_atomic(path: str, data: bytes) -> None:
+    """寫入暫存檔後改名，讀者不會看到寫到一半的檔案。"""
+    await aiofiles.os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # 暫存檔名唯一，並行寫入同一路徑時不會互相覆蓋
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with timed_write():
+        async with aiofiles.open(tmp_path, "wb") as f:
+            await f.write(data)
+        await aiofiles.os.replace(tmp_path, path)
+
+
+def _content_range_total(value: Optional[str]) -> Optional[int]:
+    """解析 `bytes 100-199/1000` 或 `bytes */1000` 的總長度。"""
+    if not value or "/" not in value:
+        return None
+    total = value.rsplit("/", 1)[1].strip()
+    return int(total) if total.isdigit() else None
+
+
+async def fetch_resumable(
+    client: httpx.AsyncClient,
+    url: str,
+    final_path: str,
+    task_id: Optional[str] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    chunk_size: int = 64 * 1024,
+    throttle: Optional["Throttle"] = None,
+) -> str:
+    """
+    下載 url 至 final_path，必要時從既有 .part 續傳。
+    失敗時保留 .part 與 manifest，供下次續傳；成功時回傳 final_path。
+    有 throttle 時每個區塊寫入前先取得頻寬額度。
+    """
+    partial = PartialDownload(final_path)
+    await aiofiles.os.makedirs(os.path.dirname(os.path.abspath(final_path)), exist_ok=True)
+    offset, validator = await partial.resume_state(url)
+    # 位元組位移必須對應原始內容，不接受壓縮傳輸
+    headers = {"Accept-Encoding": "identity"}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = validator
+
+    async with client.stream("GET", url, headers=headers) as resp:
+        if resp.status_code == 416 and offset:
+            # 要求的範圍超出檔案長度：.part 已是完整內容
+            total = _content_range_total(resp.headers.get("Content-Range"))
+            if total == offset:
+                await partial.finalize()
+                if on_progress:
+                    on_progress(offset, total)
+                return final_path
+            await partial.discard()
+            raise httpx.HTTPStatusError("Range not satisfiable", request=resp.request, response=resp)
+        resp.raise_for_status()
+
+        if resp.status_code == 206:
+            total = _content_range_total(resp.headers.get("Content-Range"))
+            mode = "ab"
+            logger.info(f"續傳 {os.path.basename(final_path)}，從 {offset} bytes 開始")
+        else:
+            offset = 0
+            length = resp.headers.get("Content-Length")
+            total = int(length) if length and length.isdigit() else None
+            mode = "wb"
+
+        await partial.save_manifest({
+            "url": url,
+            "task_id": task_id,
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "total_bytes": total,
+        })
+
+        downloaded = offset
+        async with aiofiles.open(partial.part_path, mode) as f:
+            async for chunk in resp.aiter_bytes(chunk_size):
+                if throttle:
+                    await throttle.consume(len(chunk))
+                with timed_write():
+                    await f.write(chunk)
+                downloaded += len(chunk)
+                if on_progress:
+                    on_progress(downloaded, total)
+
+    if total is not None and downloaded != total:
+        raise IOError(f"下載不完整: {downloaded}/{total} bytes")
+    await partial.finalize()
+    return final_path
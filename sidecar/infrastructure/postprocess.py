@@ -0,0 +1,313 @@
+"""
+PostProcessPool: 下載完成後的轉檔、寫入標籤 / 封面與改名。
+
+ffmpeg 的轉檔是 CPU 密集工作，在有上限的行程池中執行；下載用例在傳輸結束後即讓出下載名額，
+所以同一批次中已完成任務的轉檔會與其餘任務的網路傳輸同時進行。
+封面由主行程透過共用 (已限流) 的 HTTP client 取得並快取，工作行程只處理本機檔案。
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import asdict
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import httpx
+
+from sidecar.domain.models import Metadata, PostProcessOptions, Task
+from sidecar.domain.repositories import IPostProcessor
+from sidecar.domain.stages import record_span
+
+logger = logging.getLogger(__name__)
+
+# 音訊格式 -> (ffmpeg 編碼器, 副檔名)
+ENCODERS = {
+    "mp3": ("libmp3lame", "mp3"),
+    "m4a": ("aac", "m4a"),
+    "opus": ("libopus", "opus"),
+    "flac": ("flac", "flac"),
+    "wav": ("pcm_s16le", "wav"),
+}
+AUDIO_EXTENSIONS = {"mp3", "m4a", "aac", "opus", "ogg", "oga", "flac", "wav", "webm", "weba"}
+# ffmpeg 能以 attached_pic 寫入封面的格式
+COVER_EXTENSIONS = {"mp3", "m4a", "flac"}
+THROUGHPUT_WINDOW = 60.0  # 計算每分鐘處理檔案數的時間窗 (秒)
+FFMPEG_TIMEOUT = 600.0
+
+_UNSAFE_CHARS = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+
+
+class PostProcessError(Exception):
+    """ffmpeg 不存在或轉檔失敗。"""
+
+
+def metadata_tags(metadata: Metadata) -> Dict[str, str]:
+    """寫入檔案的標籤：歌名、歌手，作品名作為專輯，OP/ED 寫在註解。"""
+    return {
+        "title": metadata.song_title,
+        "artist": metadata.artist,
+        "album": metadata.anime_title,
+        "genre": "Anime",
+        "comment": metadata.type,
+    }
+
+
+def render_filename(template: str, metadata: Metadata) -> str:
+    """以範本產生不含副檔名的檔名，去除路徑分隔字元等檔案系統不允許的字元。"""
+    values = {k: _UNSAFE_CHARS.sub("_", str(v)).strip() for k, v in asdict(metadata).items() if v is not None}
+    name = _UNSAFE_CHARS.sub("_", template.format_map(values)).strip(" .")
+    return name[:200] or "untitled"
+
+
+def build_ffmpeg_command(
+    ffmpeg: str,
+    src: str,
+    dst: str,
+    codec: Optional[str],
+    bitrate: Optional[str],
+    tags: Dict[str, str],
+    cover: Optional[str],
+) -> List[str]:
+    ext = os.path.splitext(dst)[1].lstrip(".").lower()
+    # 指定音訊格式或本來就是音訊檔時只保留第一條音軌；影片則保留所有串流
+    audio_only = codec is not None or ext in AUDIO_EXTENSIONS
+    cover = cover if audio_only and ext in COVER_EXTENSIONS else None
+    cmd = [ffmpeg, "-hide_banner", "-loglevel", "error", "-nostdin", "-y", "-i", src]
+    if cover:
+        cmd += ["-i", cover]
+    cmd += ["-map", "0:a:0"] if audio_only else ["-map", "0"]
+    if cover:
+        cmd += ["-map", "1:v:0", "-c:v", "copy", "-disposition:v:0", "attached_pic"]
+    if codec:
+        cmd += ["-c:a", ENCODERS[codec][0]]
+        if bitrate:
+            cmd += ["-b:a", bitrate]
+    else:
+        cmd += ["-c:a", "copy"] if audio_only else ["-c", "copy"]
+    for key, value in tags.items():
+        cmd += ["-metadata", f"{key}={value}"]
+    if ext == "mp3":
+        cmd += ["-id3v2_version", "3"]
+    cmd.append(dst)
+    return cmd
+
+
+def _unique_path(path: str, src: str) -> str:
+    """目的地已有其他檔案時加上 (2)、(3)…；與來源相同則直接覆寫。"""
+    stem, ext = os.path.splitext(path)
+    candidate, n = path, 2
+    while os.path.exists(candidate) and os.path.abspath(candidate) != os.path.abspath(src):
+        candidate, n = f"{stem} ({n}){ext}", n + 1
+    return candidate
+
+
+def process_file(
+    src: str,
+    options: Dict[str, Any],
+    tags: Dict[str, str],
+    cover: Optional[str],
+    filename: Optional[str],
+) -> Dict[str, Any]:
+    """
+    在工作行程中執行：轉檔並寫入標籤到暫存檔，完成後原子改名並刪除原檔。
+    不需轉檔、寫標籤或封面時只改名。失敗時原檔保留。
+    """
+    started = time.perf_counter()
+    codec = options.get("audio_codec")
+    src_ext = os.path.splitext(src)[1].lstrip(".")
+    ext = ENCODERS[codec][1] if codec else src_ext
+    stem = filename or os.path.splitext(os.path.basename(src))[0]
+    dst = _unique_path(os.path.join(os.path.dirname(src), f"{stem}.{ext}"), src)
+    input_bytes = os.path.getsize(src)
+
+    if codec or tags or cover:
+        ffmpeg = shutil.which("ffmpeg")
+        if ffmpeg is None:
+            raise PostProcessError("找不到 ffmpeg")
+        # 暫存檔保留副檔名，ffmpeg 依此選擇封裝格式
+        tmp = os.path.join(os.path.dirname(dst), f".{os.path.basename(stem)}.pp-tmp.{ext}")
+        cmd = build_ffmpeg_command(ffmpeg, src, tmp, codec, options.get("audio_bitrate"), tags, cover)
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=FFMPEG_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            _remove_quietly(tmp)
+            raise PostProcessError(f"ffmpeg 逾時 ({FFMPEG_TIMEOUT:.0f}s)")
+        if result.returncode != 0:
+            _remove_quietly(tmp)
+            lines = result.stderr.strip().splitlines()
+            raise PostProcessError(f"ffmpeg 失敗: {lines[-1] if lines else result.returncode}")
+        os.replace(tmp, dst)
+        if os.path.abspath(dst) != os.path.abspath(src):
+            os.remove(src)
+    elif dst != src:
+        os.replace(src, dst)
+
+    return {
+        "path": dst,
+        "input_bytes": input_bytes,
+        "output_bytes": os.path.getsize(dst),
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class PostProcessPool(IPostProcessor):
+    """
+    以 workers 個工作行程處理檔案；超出的工作在主行程排隊，佇列深度可由 stats() 查詢。
+    行程池在第一次使用時才建立。
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        client: Optional[httpx.AsyncClient] = None,
+        cover_base_url: str = "https://api.bgm.tv",
+        cover_dir: Optional[str] = None,
+        executor: Optional[Executor] = None,
+        worker: Callable[..., Dict[str, Any]] = process_file,
+        start_method: str = "spawn",
+    ):
+        self.workers = max(1, workers)
+        self.client = client
+        self.cover_base_url = cover_base_url
+        self.cover_dir = cover_dir
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._worker = worker
+        # 與 YtdlpProcessPool 相同使用 spawn：fork 會複製主行程的事件迴圈、執行緒與 httpx 連線
+        self._ctx = multiprocessing.get_context(start_method)
+        self._slots = asyncio.Semaphore(self.workers)
+        self._covers: Dict[str, asyncio.Task] = {}
+        self._finished: Deque[float] = deque()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.input_bytes = 0
+        self.output_bytes = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=self._ctx)
+        return self._executor
+
+    async def process(self, task: Task) -> List[str]:
+        options = task.postprocess or PostProcessOptions()
+        metadata = task.metadata
+        tags = metadata_tags(metadata) if metadata and options.embed_tags else {}
+        cover = await self._cover(metadata.bangumi_id) if metadata and options.embed_cover else None
+        outputs = []
+        for index, src in enumerate(task.output_files):
+            filename = None
+            if options.filename_template and metadata:
+                filename = render_filename(options.filename_template, metadata)
+                if len(task.output_files) > 1:
+                    filename = f"{filename} {index + 1}"
+            outputs.append(await self._run(src, asdict(options), tags, cover, filename))
+        return outputs
+
+    async def _run(
+        self, src: str, options: Dict[str, Any], tags: Dict[str, str], cover: Optional[str], filename: Optional[str]
+    ) -> str:
+        queued_at = time.perf_counter()
+        self.queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        started = time.perf_counter()
+        if started - queued_at > 0.001:
+            record_span("postprocess:wait", queued_at, started)
+        self.running += 1
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(
+                self._get_executor(), self._worker, src, options, tags, cover, filename
+            )
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.running -= 1
+            self._slots.release()
+            self.busy_seconds += time.perf_counter() - started
+        self.completed += 1
+        self.input_bytes += result["input_bytes"]
+        self.output_bytes += result["output_bytes"]
+        self._finished.append(time.monotonic())
+        record_span("postprocess:ffmpeg", started, path=os.path.basename(result["path"]))
+        return result["path"]
+
+    async def _cover(self, bangumi_id: Optional[str]) -> Optional[str]:
+        """取得條目封面並快取於 cover_dir；同一條目並行的請求共用一次下載，失敗時不寫入封面。"""
+        if not bangumi_id or self.client is None or self.cover_dir is None:
+            return None
+        job = self._covers.get(bangumi_id)
+        # 上次失敗 (回傳 None 或拋出例外) 時重新下載，不讓失敗結果一直留在快取
+        if job is None or (job.done() and (job.cancelled() or job.exception() is not None or job.result() is None)):
+            job = self._covers[bangumi_id] = asyncio.ensure_future(self._fetch_cover(bangumi_id))
+        return await asyncio.shield(job)
+
+    async def _fetch_cover(self, bangumi_id: str) -> Optional[str]:
+        path = os.path.join(self.cover_dir, f"{os.path.basename(bangumi_id)}.jpg")
+        if await asyncio.to_thread(os.path.exists, path):
+            return path
+        try:
+            resp = await self.client.get(
+                f"{self.cover_base_url}/v0/subjects/{bangumi_id}/image", params={"type": "large"}
+            )
+            resp.raise_for_status()
+        except httpx.HTTPError as e:
+            logger.warning(f"封面下載失敗 ({bangumi_id}): {e}")
+            return None
+
+        def _write() -> None:
+            os.makedirs(self.cover_dir, exist_ok=True)
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(resp.content)
+            os.replace(tmp, path)
+
+        try:
+            await asyncio.to_thread(_write)
+        except OSError as e:
+            logger.warning(f"封面寫入失敗 ({bangumi_id}): {e}")
+            return None
+        return path
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        while self._finished and now - self._finished[0] > THROUGHPUT_WINDOW:
+            self._finished.popleft()
+        return {
+            "workers": self.workers,
+            "queued": self.queued,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "files_per_minute": round(len(self._finished) * 60.0 / THROUGHPUT_WINDOW, 2),
+            "average_seconds": round(self.busy_seconds / (self.completed + self.failed), 3)
+            if self.completed + self.failed else None,
+            "input_bytes": self.input_bytes,
+            "output_bytes": self.output_bytes,
+        }
+
+    def shutdown(self) -> None:
+        """結束工作行程；執行中的 ffmpeg 會完成後才結束。"""
+        if self._owns_executor and self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,145 @@
+"""
+SamplingProfiler: 選用的取樣式分析器，找出事件迴圈與工作執行緒上的熱點。
+
+背景執行緒每隔 interval 秒讀取一次 sys._current_frames()，把每個執行緒的呼叫堆疊
+(以 模組:函式 表示，不含行號以便合併) 計數。只在開啟時有成本，預設關閉。
+yt-dlp 的工作行程是獨立行程，不在取樣範圍內；其各階段耗時見任務時間軸。
+"""
+
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from types import FrameType
+from typing import Any, Dict, List, Optional, Tuple
+
+# 等待中的堆疊頂端；預設不計入，結果只剩真正在執行的程式碼
+_IDLE_FRAMES = {
+    ("selectors", "select"),
+    ("threading", "wait"),
+    ("threading", "_wait_for_tstate_lock"),
+    ("queue", "get"),
+    ("concurrent.futures.thread", "_worker"),
+    ("multiprocessing.connection", "_recv"),
+    ("multiprocessing.connection", "wait"),
+}
+# 執行緒池的成員名稱只差編號 (asyncio_0, ytdlp_1 ...)，合併成同一列
+_THREAD_SUFFIX = re.compile(r"[_-]\d+$")
+
+
+def _frame_label(frame: FrameType) -> Tuple[str, str]:
+    return frame.f_globals.get("__name__", "?"), frame.f_code.co_name
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.005, max_depth: int = 64, include_idle: bool = False):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.include_idle = include_idle
+        self._counts: Counter = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._loop_thread: Optional[int] = None
+        self.samples = 0
+        self.idle = 0
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: Optional[float] = None, duration: Optional[float] = None) -> None:
+        """
+        開始取樣並清除上次的結果；在事件迴圈中呼叫時，該執行緒會標示為 event-loop。
+        duration 秒後自動停止，避免忘記關閉。
+        """
+        if self.running:
+            return
+        self.interval = interval or self.interval
+        self._loop_thread = threading.get_ident()
+        self.reset()
+        self._stop.clear()
+        self.started_at, self.stopped_at = time.time(), None
+        self._thread = threading.Thread(target=self._run, args=(duration,), name="opused-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counts.clear()
+            self.samples = 0
+            self.idle = 0
+
+    def _run(self, duration: Optional[float]) -> None:
+        deadline = time.monotonic() + duration if duration else None
+        while not self._stop.wait(self.interval):
+            self._sample()
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+        self.stopped_at = time.time()
+
+    def _thread_label(self, ident: int, names: Dict[int, str]) -> str:
+        if ident == self._loop_thread:
+            return "event-loop"
+        return _THREAD_SUFFIX.sub("", names.get(ident, f"thread-{ident}"))
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        stacks: List[Tuple[str, ...]] = []
+        idle = 0
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            if not self.include_idle and _frame_label(frame) in _IDLE_FRAMES:
+                idle += 1
+                continue
+            labels: List[str] = []
+            current: Optional[FrameType] = frame
+            while current is not None and len(labels) < self.max_depth:
+                module, func = _frame_label(current)
+                labels.append(f"{module}:{func}")
+                current = current.f_back
+            labels.append(self._thread_label(ident, names))
+            stacks.append(tuple(reversed(labels)))
+        with self._lock:
+            self.samples += 1
+            self.idle += idle
+            self._counts.update(stacks)
+
+    def stats(self, limit: int = 20) -> Dict[str, Any]:
+        """最常出現的堆疊 (由外而內) 與各執行緒的取樣數。"""
+        with self._lock:
+            counts = self._counts.copy()
+            samples, idle = self.samples, self.idle
+        threads: Counter = Counter()
+        for stack, count in counts.items():
+            threads[stack[0]] += count
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "started_at": self.started_at,
+            "stopped_at": self.stopped_at,
+            "samples": samples,
+            "idle": idle,
+            "threads": dict(threads.most_common()),
+            "top": [
+                {"thread": stack[0], "stack": list(stack[1:]), "count": count,
+                 "ratio": round(count / samples, 4) if samples else 0.0}
+                for stack, count in counts.most_common(limit)
+            ],
+        }
+
+    def folded(self) -> str:
+        """collapsed stack 格式 (每行 `堆疊;以;分號;分隔 次數`)，可直接給 flamegraph.pl 或 speedscope。"""
+        with self._lock:
+            counts = self._counts.copy()
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in sorted(counts.items()))
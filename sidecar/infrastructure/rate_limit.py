@@ -0,0 +1,247 @@
+"""
+每個上游主機的自適應限流與重試。
+
+- 以 token bucket 控制每個主機的請求速率
+- AIMD：回應正常時速率增加 (第一次過載前每個成功請求加一，之後線性增加)，
+  遇到 429 / 502-504、逾時或延遲過高時乘法減少
+- 遵守 Retry-After：期間同一主機的所有請求都會暫停
+- 冪等請求 (GET 等) 遇到上述錯誤時以 full jitter 指數退避重試
+
+RetryTransport 包在 httpx 的 transport 外層，由 HttpClientPool 套用到每個共用 client，
+Bangumi 與 DMHY 的請求都會經過，呼叫端不需修改。
+"""
+
+import asyncio
+import email.utils
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import httpx
+
+from sidecar.domain.stages import RATE_LIMIT, RETRY, record_span
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# 可重試的狀態碼；其中代表上游過載的會降低速率
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+OVERLOAD_STATUSES = {429, 502, 503, 504}
+RETRY_EXCEPTIONS = (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)
+
+
+@dataclass(frozen=True)
+class RateLimitConfig:
+    """每個主機的限流與重試設定。"""
+    initial_rate: float = 5.0  # 每秒請求數
+    min_rate: float = 0.5
+    max_rate: float = 50.0
+    burst: int = 5  # bucket 至少可累積的請求數；速率較高時可累積一秒的量
+    increase: float = 1.0  # 滿載時約每秒增加的請求數
+    decrease: float = 0.5  # 過載時速率乘上的倍數
+    latency_target: float = 3.0  # 超過此延遲視為上游吃緊，速率小幅降低
+    latency_decrease: float = 0.8
+    decrease_cooldown: float = 1.0  # 同一波並行請求的多個錯誤只降速一次
+    max_retries: int = 3
+    backoff_base: float = 0.5
+    backoff_max: float = 30.0
+    max_retry_after: float = 120.0  # Retry-After 更長時不重試，直接回傳錯誤
+
+    @classmethod
+    def from_env(cls) -> "RateLimitConfig":
+        """從 OPUSED_RATE_* 環境變數讀取設定，未設定者使用預設值。"""
+        default = cls()
+
+        def _get(name: str, fallback, cast):
+            raw = os.environ.get(f"OPUSED_RATE_{name}")
+            return cast(raw) if raw not in (None, "") else fallback
+
+        return cls(
+            initial_rate=_get("INITIAL", default.initial_rate, float),
+            min_rate=_get("MIN", default.min_rate, float),
+            max_rate=_get("MAX", default.max_rate, float),
+            burst=_get("BURST", default.burst, int),
+            latency_target=_get("LATENCY_TARGET", default.latency_target, float),
+            max_retries=_get("MAX_RETRIES", default.max_retries, int),
+            backoff_base=_get("BACKOFF_BASE", default.backoff_base, float),
+            backoff_max=_get("BACKOFF_MAX", default.backoff_max, float),
+            max_retry_after=_get("MAX_RETRY_AFTER", default.max_retry_after, float),
+        )
+
+
+def parse_retry_after(value: Optional[str], now: Optional[float] = None) -> Optional[float]:
+    """Retry-After 可以是秒數或 HTTP 日期；無法解析時回傳 None。"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - (time.time() if now is None else now))
+
+
+class HostBucket:
+    """單一主機的 token bucket；rate 由回應結果以 AIMD 調整。"""
+
+    def __init__(self, config: RateLimitConfig):
+        self.config = config
+        self.rate = config.initial_rate
+        self.tokens = float(config.burst)
+        # 類似 TCP slow start：尚未遇到過載前快速爬升，找出上游能承受的速率
+        self.slow_start = True
+        self.updated = time.perf_counter()
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.requests = 0
+        self.throttled = 0  # 收到過載回應或逾時的次數
+        self.retries = 0
+        self.wait_seconds = 0.0
+        # FIFO 取得 token，避免大量等待者同時醒來搶同一個 token
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        capacity = max(float(self.config.burst), self.rate)
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> float:
+        """等待直到可以送出請求，回傳等待的秒數。"""
+        started = time.perf_counter()
+        async with self._lock:
+            while True:
+                now = time.perf_counter()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    break
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+        self.requests += 1
+        waited = time.perf_counter() - started
+        self.wait_seconds += waited
+        return waited
+
+    def on_success(self, latency: float) -> None:
+        if latency > self.config.latency_target:
+            self._decrease(self.config.latency_decrease)
+        elif self.slow_start:
+            # 滿載時約每秒加倍
+            self.rate = min(self.config.max_rate, self.rate + self.config.increase)
+        else:
+            # 每 rate 個成功請求約增加 increase，即滿載時每秒線性增加
+            self.rate = min(self.config.max_rate, self.rate + self.config.increase / self.rate)
+
+    def on_overload(self, retry_after: Optional[float] = None) -> None:
+        self.throttled += 1
+        self._decrease(self.config.decrease)
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, time.perf_counter() + retry_after)
+            self.tokens = 0.0
+
+    def _decrease(self, factor: float) -> None:
+        now = time.perf_counter()
+        if now - self.last_decrease < self.config.decrease_cooldown:
+            return
+        self.last_decrease = now
+        self.slow_start = False
+        self.rate = max(self.config.min_rate, self.rate * factor)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rate": round(self.rate, 3),
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "retries": self.retries,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "blocked_for": round(max(0.0, self.blocked_until - time.perf_counter()), 3),
+        }
+
+
+class AdaptiveRateLimiter:
+    """依主機名稱分開的 HostBucket 集合。"""
+
+    def __init__(self, config: Optional[RateLimitConfig] = None):
+        self.config = config or RateLimitConfig()
+        self._buckets: Dict[str, HostBucket] = {}
+
+    def bucket(self, host: str) -> HostBucket:
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._buckets[host] = HostBucket(self.config)
+        return bucket
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {host: bucket.stats() for host, bucket in self._buckets.items()}
+
+
+class RetryTransport(httpx.AsyncBaseTransport):
+    """在 transport 外層限流，並重試冪等請求；回應與例外對呼叫端而言與未包裝時相同。"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, limiter: AdaptiveRateLimiter):
+        self.transport = transport
+        self.limiter = limiter
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        config = self.limiter.config
+        host = request.url.host
+        bucket = self.limiter.bucket(host)
+        retryable = request.method in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            waited = await bucket.acquire()
+            if waited > 0.001:
+                record_span(RATE_LIMIT, time.perf_counter() - waited, host=host, rate=round(bucket.rate, 3))
+            started = time.perf_counter()
+            try:
+                response = await self.transport.handle_async_request(request)
+            except RETRY_EXCEPTIONS as e:
+                bucket.on_overload()
+                if not retryable or attempt >= config.max_retries:
+                    raise
+                reason, delay = type(e).__name__, self._backoff(attempt)
+            else:
+                status = response.status_code
+                if status not in RETRY_STATUSES:
+                    bucket.on_success(time.perf_counter() - started)
+                    return response
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                if status in OVERLOAD_STATUSES:
+                    bucket.on_overload(retry_after)
+                if (
+                    not retryable
+                    or attempt >= config.max_retries
+                    or (retry_after is not None and retry_after > config.max_retry_after)
+                ):
+                    return response
+                await response.aclose()
+                reason = str(status)
+                if retry_after is not None:
+                    delay = retry_after + random.uniform(0, config.backoff_base)
+                else:
+                    delay = self._backoff(attempt)
+            attempt += 1
+            bucket.retries += 1
+            logger.warning(
+                f"[RateLimit] {request.method} {host}{request.url.path} {reason}, "
+                f"retry {attempt}/{config.max_retries} in {delay:.2f}s (rate={bucket.rate:.2f}/s)"
+            )
+            retry_started = time.perf_counter()
+            await asyncio.sleep(delay)
+            record_span(RETRY, retry_started, host=host, reason=reason, attempt=attempt)
+
+    def _backoff(self, attempt: int) -> float:
+        config = self.limiter.config
+        return random.uniform(0, min(config.backoff_max, config.backoff_base * 2 ** attempt))
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
@@ -0,0 +1,112 @@
+"""
+SQLiteResolutionCache: 持久化「搜尋條件 → 下載來源」的對應。
+
+同一首歌在不同批次或重試時不必再跑 ytsearch 或爬 DMHY 搜尋頁；
+下載失敗時由呼叫端使對應項目失效，下次重新搜尋。
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, Optional
+
+from sidecar.domain.models import Source, Task
+from sidecar.domain.repositories import IResolutionCache
+from sidecar.infrastructure.metadata_cache import normalize_title
+
+
+def resolution_key(task: Task) -> str:
+    """由搜尋條件組成的鍵；DMHY 的影片與種子模式解析結果不同，分開保存。"""
+    if task.custom_keywords:
+        query = task.custom_keywords
+    elif task.metadata:
+        query = f"{task.metadata.anime_title} {task.metadata.song_title} {task.metadata.type}"
+    else:
+        query = task.anime_title
+    prefix = task.source.value
+    if task.source == Source.DMHY:
+        prefix += f":{task.dmhy_mode.value}"
+    return f"{prefix}:{normalize_title(query)}"
+
+
+@dataclass
+class ResolutionStats:
+    hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    invalidations: int = 0
+
+
+class SQLiteResolutionCache(IResolutionCache):
+    """所有 SQLite 操作都在執行緒中進行，不阻塞事件迴圈。"""
+
+    def __init__(self, db_path: str, ttl: Optional[float] = 30 * 24 * 3600):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.stats = ResolutionStats()
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS resolutions (
+                key TEXT PRIMARY KEY,
+                resolved_url TEXT NOT NULL,
+                resolved_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    async def get(self, task: Task) -> Optional[str]:
+        url = await asyncio.to_thread(self._get, resolution_key(task))
+        if url is None:
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+        return url
+
+    async def put(self, task: Task, resolved_url: str) -> None:
+        await asyncio.to_thread(self._put, resolution_key(task), resolved_url)
+        self.stats.stores += 1
+
+    async def invalidate(self, task: Task) -> None:
+        await asyncio.to_thread(self._delete, resolution_key(task))
+        self.stats.invalidations += 1
+
+    def get_stats(self) -> Dict[str, int]:
+        return asdict(self.stats)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT resolved_url, resolved_at FROM resolutions WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        if self.ttl is not None and time.time() - row[1] > self.ttl:
+            self._delete(key)
+            return None
+        return row[0]
+
+    def _put(self, key: str, resolved_url: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO resolutions (key, resolved_url, resolved_at) VALUES (?, ?, ?)",
+                (key, resolved_url, time.time()),
+            )
+            self._conn.commit()
+
+    def _delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM resolutions WHERE key = ?", (key,))
+            self._conn.commit()
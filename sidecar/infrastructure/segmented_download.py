@@ -0,0 +1,325 @@
+"""
+多連線分段 HTTP 下載。
+
+第一個請求只要求第一段 (Range: bytes=0-<段長-1>)：
+伺服器不支援 Range 時直接以這個回應單線下載；支援時由回應得知總長度，
+預先配置 .part 檔後以多個連線各自下載不同的段，寫入對應位移。
+
+連線數從 1 開始，每隔 PROBE_INTERVAL 比較總速率，增加連線能讓速率明顯提升時再加一條，
+不再提升 (例如已達頻寬上限或上游單 IP 限速) 就維持目前數量，最多 max_connections 條。
+已完成的段記錄在 .part.json，中斷後只重新下載未完成的段；伺服器端內容改變 (ETag / 長度不同) 時從頭開始。
+"""
+
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Set, Tuple
+
+import aiofiles
+import aiofiles.os
+import httpx
+
+from sidecar.domain.stages import record_span, timed_write
+from sidecar.infrastructure.bandwidth import Throttle
+from sidecar.infrastructure.partial_download import (
+    PartialDownload,
+    ProgressCallback,
+    _content_range_total,
+    fetch_resumable,
+)
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SIZE = 2 * 1024 * 1024
+PROBE_INTERVAL = 1.0
+SPEEDUP_THRESHOLD = 1.15  # 加一條連線後總速率至少要提升的倍數
+SEGMENT_RETRIES = 2
+MANIFEST_INTERVAL = 1.0  # 已完成段的紀錄最短寫入間隔 (秒)
+
+
+class _SegmentError(IOError):
+    """分段請求沒有得到預期的 206 回應或長度不符。"""
+
+
+class _Transfer:
+    """單一檔案的分段下載狀態。"""
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        partial: PartialDownload,
+        manifest: Dict[str, Any],
+        done: Set[int],
+        on_progress: Optional[ProgressCallback],
+        throttle: Optional[Throttle],
+        chunk_size: int,
+    ):
+        self.client = client
+        self.url = url
+        self.partial = partial
+        self.manifest = manifest
+        self.total: int = manifest["total_bytes"]
+        self.segment_size: int = manifest["segment_size"]
+        self.validator = manifest.get("etag") or manifest.get("last_modified")
+        self.done = done
+        self.on_progress = on_progress
+        self.throttle = throttle
+        self.chunk_size = chunk_size
+        self.count = math.ceil(self.total / self.segment_size)
+        self.pending: Deque[int] = deque(i for i in range(self.count) if i not in done)
+        self.downloaded = sum(self._range(i)[1] - self._range(i)[0] + 1 for i in done)
+        self.connections = 0
+        self.peak_connections = 0
+        self._manifest_lock = asyncio.Lock()
+        self._manifest_saved = 0.0
+
+    def _range(self, index: int) -> Tuple[int, int]:
+        start = index * self.segment_size
+        return start, min(self.total, start + self.segment_size) - 1
+
+    def _report(self) -> None:
+        if self.on_progress:
+            self.on_progress(self.downloaded, self.total)
+
+    async def _save_manifest(self, force: bool = False) -> None:
+        async with self._manifest_lock:
+            now = time.monotonic()
+            if not force and now - self._manifest_saved < MANIFEST_INTERVAL:
+                return
+            self._manifest_saved = now
+            await self.partial.save_manifest({**self.manifest, "done": sorted(self.done)})
+
+    async def _write(self, f, index: int, resp: httpx.Response) -> None:
+        """把一段的回應寫入 .part 的對應位移；長度不符時拋出 _SegmentError。"""
+        start, end = self._range(index)
+        position, written = start, 0
+        try:
+            async for chunk in resp.aiter_bytes(self.chunk_size):
+                if written + len(chunk) > end - start + 1:
+                    raise _SegmentError(f"第 {index} 段超出預期長度")
+                if self.throttle:
+                    await self.throttle.consume(len(chunk))
+                with timed_write():
+                    await f.seek(position)
+                    await f.write(chunk)
+                position += len(chunk)
+                written += len(chunk)
+                self.downloaded += len(chunk)
+                self._report()
+            if written != end - start + 1:
+                raise _SegmentError(f"第 {index} 段不完整: {written}/{end - start + 1} bytes")
+        except BaseException:
+            # 未完成的段之後整段重抓，進度扣回
+            self.downloaded -= written
+            raise
+        self.done.add(index)
+        await self._save_manifest()
+
+    async def _fetch(self, f, index: int) -> None:
+        start, end = self._range(index)
+        headers = {"Range": f"bytes={start}-{end}", "Accept-Encoding": "identity"}
+        if self.validator:
+            headers["If-Range"] = self.validator
+        async with self.client.stream("GET", self.url, headers=headers) as resp:
+            resp.raise_for_status()
+            if resp.status_code != 206 or _content_range_total(resp.headers.get("Content-Range")) != self.total:
+                # 伺服器端內容已改變，或中途不再支援 Range
+                raise _SegmentError(f"第 {index} 段未得到分段回應 (HTTP {resp.status_code})")
+            await self._write(f, index, resp)
+
+    async def _worker(self, first: Optional[httpx.Response] = None) -> None:
+        self.connections += 1
+        self.peak_connections = max(self.peak_connections, self.connections)
+        try:
+            async with aiofiles.open(self.partial.part_path, "r+b") as f:
+                if first is not None:
+                    try:
+                        await self._write(f, 0, first)
+                    except (httpx.TransportError, _SegmentError) as e:
+                        logger.warning(f"分段下載第 0 段失敗，稍後重試: {e}")
+                        self.pending.appendleft(0)
+                while self.pending:
+                    index = self.pending.popleft()
+                    for attempt in range(SEGMENT_RETRIES + 1):
+                        try:
+                            await self._fetch(f, index)
+                            break
+                        except (httpx.TransportError, _SegmentError) as e:
+                            if attempt == SEGMENT_RETRIES:
+                                self.pending.appendleft(index)
+                                raise
+                            logger.warning(f"分段下載第 {index} 段失敗，重試 ({attempt + 1}/{SEGMENT_RETRIES}): {e}")
+        finally:
+            self.connections -= 1
+
+    async def run(self, max_connections: int, first: Optional[httpx.Response] = None) -> None:
+        started = time.perf_counter()
+        workers: Set[asyncio.Task] = {asyncio.create_task(self._worker(first))}
+        growing = max_connections > 1
+        best_rate = 0.0
+        last_bytes, last_time = self.downloaded, time.perf_counter()
+        try:
+            while workers:
+                finished, workers = await asyncio.wait(
+                    workers, timeout=PROBE_INTERVAL, return_when=asyncio.FIRST_EXCEPTION
+                )
+                for w in finished:
+                    w.result()  # 有 worker 失敗時拋出，其餘 worker 在 finally 中取消
+                if not growing or not self.pending:
+                    continue
+                now = time.perf_counter()
+                rate = (self.downloaded - last_bytes) / max(now - last_time, 1e-6)
+                last_bytes, last_time = self.downloaded, now
+                if len(workers) >= max_connections:
+                    growing = False
+                elif rate >= best_rate * SPEEDUP_THRESHOLD:
+                    best_rate = rate
+                    workers.add(asyncio.create_task(self._worker()))
+                else:
+                    # 多一條連線沒有帶來更高的速率，維持目前的連線數
+                    growing = False
+        finally:
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if len(self.done) < self.count:
+                await self._save_manifest(force=True)
+        record_span(
+            "transfer:segmented", started, bytes=self.total, segments=self.count, connections=self.peak_connections
+        )
+
+
+async def _probe(client: httpx.AsyncClient, url: str) -> Optional[Dict[str, Any]]:
+    """以 1 byte 的 Range 請求取得總長度與驗證值；不支援 Range 時回傳 None。"""
+    headers = {"Range": "bytes=0-0", "Accept-Encoding": "identity"}
+    async with client.stream("GET", url, headers=headers) as resp:
+        resp.raise_for_status()
+        total = _content_range_total(resp.headers.get("Content-Range"))
+        if resp.status_code != 206 or total is None:
+            return None
+        return {"total_bytes": total, "etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")}
+
+
+def _preallocate(path: str, size: int) -> None:
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+
+async def fetch_segmented(
+    client: httpx.AsyncClient,
+    url: str,
+    final_path: str,
+    task_id: Optional[str] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    throttle: Optional[Throttle] = None,
+    max_connections: int = 4,
+    segment_size: int = SEGMENT_SIZE,
+    chunk_size: int = 64 * 1024,
+) -> str:
+    """
+    下載 url 至 final_path，伺服器支援 Range 且檔案大於一段時以多條連線分段下載，
+    否則與 fetch_resumable 相同。失敗時保留 .part 與 manifest 供下次續傳；成功時回傳 final_path。
+    """
+    partial = PartialDownload(final_path)
+    await aiofiles.os.makedirs(os.path.dirname(os.path.abspath(final_path)), exist_ok=True)
+    manifest = await partial.load_manifest()
+    if manifest and manifest.get("url") == url and not manifest.get("segment_size"):
+        # 上次是單線下載，沿用其續傳方式
+        return await fetch_resumable(client, url, final_path, task_id, on_progress, chunk_size, throttle)
+
+    if manifest and manifest.get("url") == url and manifest.get("segment_size"):
+        probe = await _probe(client, url)
+        validator = manifest.get("etag") or manifest.get("last_modified")
+        unchanged = (
+            probe is not None
+            and validator
+            and validator == (probe["etag"] or probe["last_modified"])
+            and probe["total_bytes"] == manifest.get("total_bytes")
+        )
+        try:
+            part_size = await aiofiles.os.path.getsize(partial.part_path)
+        except OSError:
+            part_size = None
+        if unchanged and part_size == manifest["total_bytes"]:
+            done = set(manifest.get("done") or ())
+            logger.info(f"分段續傳 {os.path.basename(final_path)}，已完成 {len(done)} 段")
+            transfer = _Transfer(client, url, partial, manifest, done, on_progress, throttle, chunk_size)
+            transfer._report()
+            await transfer.run(max_connections)
+            await partial.finalize()
+            return final_path
+        await partial.discard()
+    elif manifest:
+        await partial.discard()
+
+    headers = {"Range": f"bytes=0-{segment_size - 1}", "Accept-Encoding": "identity"}
+    async with client.stream("GET", url, headers=headers) as resp:
+        resp.raise_for_status()
+        total = _content_range_total(resp.headers.get("Content-Range"))
+        if resp.status_code != 206 or (total is not None and total <= segment_size):
+            return await _single(resp, url, partial, task_id, total, on_progress, throttle, chunk_size)
+
+        if total is not None:
+            manifest = {
+                "url": url,
+                "task_id": task_id,
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+                "total_bytes": total,
+                "segment_size": segment_size,
+            }
+            await asyncio.to_thread(_preallocate, partial.part_path, total)
+            await partial.save_manifest({**manifest, "done": []})
+            transfer = _Transfer(client, url, partial, manifest, set(), on_progress, throttle, chunk_size)
+            transfer.pending.popleft()  # 第一段由目前的回應寫入
+            await transfer.run(max_connections, first=resp)
+    if total is None:
+        # 206 卻未告知總長度 (bytes 0-N/*)，無法確認這一段是否就是整個檔案：改以不帶 Range 的請求讀到 EOF
+        return await fetch_resumable(client, url, final_path, task_id, on_progress, chunk_size, throttle)
+    await partial.finalize()
+    return final_path
+
+
+async def _single(
+    resp: httpx.Response,
+    url: str,
+    partial: PartialDownload,
+    task_id: Optional[str],
+    total: Optional[int],
+    on_progress: Optional[ProgressCallback],
+    throttle: Optional[Throttle],
+    chunk_size: int,
+) -> str:
+    """以第一個請求的回應單線下載整個檔案 (伺服器不支援 Range 或檔案只有一段)。"""
+    if resp.status_code == 206 and total is None:
+        # 不知道總長度就無法確認這一段涵蓋整個檔案，不可當作已完成
+        raise IOError("Range 回應缺少檔案總長度")
+    if resp.status_code != 206:
+        length = resp.headers.get("Content-Length")
+        total = int(length) if length and length.isdigit() else None
+    await partial.save_manifest({
+        "url": url,
+        "task_id": task_id,
+        "etag": resp.headers.get("ETag"),
+        "last_modified": resp.headers.get("Last-Modified"),
+        "total_bytes": total,
+    })
+    downloaded = 0
+    async with aiofiles.open(partial.part_path, "wb") as f:
+        async for chunk in resp.aiter_bytes(chunk_size):
+            if throttle:
+                await throttle.consume(len(chunk))
+            with timed_write():
+                await f.write(chunk)
+            downloaded += len(chunk)
+            if on_progress:
+                on_progress(downloaded, total)
+    if total is not None and downloaded != total:
+        raise IOError(f"下載不完整: {downloaded}/{total} bytes")
+    await partial.finalize()
+    return partial.final_path
+
@@ -0,0 +1,233 @@
+"""
+TaskEventBus: 將 TaskManager 的任務變更轉為帶版本號的事件串流。
+
+- 新連線先收到一份快照，之後只收到差異 (added / updated / removed)
+- 進度更新按任務節流：每個任務每秒最多 N 次，期間的更新合併為最後狀態
+- 狀態或錯誤訊息改變時立即送出
+- 每個客戶端的積壓有上限，超過時丟棄積壓並改送新快照
+- 保留最近的事件，重新連線的客戶端可從指定版本續傳
+- 事件 id 為「啟動批次-版本號」；Sidecar 重啟後版本號歸零，舊 id 的批次不同，改送快照
+"""
+
+import asyncio
+import time
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Set, Tuple
+
+from sidecar.domain.models import Task, TaskStatus
+from sidecar.infrastructure.task_manager import TaskManager
+
+
+def task_to_dict(task: Task) -> Dict[str, Any]:
+    """任務的完整表示，與 GET /tasks 的單筆格式一致。"""
+    return {
+        "task_id": task.id,
+        "anime_title": task.anime_title,
+        "status": task.status.value,
+        "progress": task.progress,
+        "downloaded_bytes": task.downloaded_bytes,
+        "total_bytes": task.total_bytes,
+        "error_message": task.error_message,
+        "source": task.source.value,
+        "target_dir": task.target_dir,
+        "output_files": list(task.output_files),
+        "metadata": {
+            "anime_title": task.metadata.anime_title,
+            "song_title": task.metadata.song_title,
+            "artist": task.metadata.artist,
+            "type": task.metadata.type,
+        } if task.metadata else None
+    }
+
+
+def task_progress_dict(task: Task) -> Dict[str, Any]:
+    """進度事件只攜帶會變動的欄位。"""
+    return {
+        "task_id": task.id,
+        "status": task.status.value,
+        "progress": task.progress,
+        "downloaded_bytes": task.downloaded_bytes,
+        "total_bytes": task.total_bytes,
+        "error_message": task.error_message,
+    }
+
+
+@dataclass
+class TaskEvent:
+    version: int
+    kind: str  # "snapshot" / "added" / "updated" / "removed"
+    task_id: Optional[str]
+    data: Dict[str, Any]
+
+
+class _Subscriber:
+    """單一客戶端的積壓事件，同一任務只保留最新一筆。"""
+
+    def __init__(self, max_backlog: int):
+        self.max_backlog = max_backlog
+        self.backlog: "OrderedDict[str, TaskEvent]" = OrderedDict()
+        self.needs_snapshot = False
+        self.wakeup = asyncio.Event()
+
+    def push(self, event: TaskEvent) -> None:
+        if self.needs_snapshot:
+            return
+        previous = self.backlog.pop(event.task_id, None)
+        if previous is not None and previous.kind == "added" and event.kind == "updated":
+            # 客戶端尚未收到 added，合併為一筆完整的 added
+            event = TaskEvent(event.version, "added", event.task_id, {**previous.data, **event.data})
+        if len(self.backlog) >= self.max_backlog:
+            self.backlog.clear()
+            self.needs_snapshot = True
+        else:
+            self.backlog[event.task_id] = event
+        self.wakeup.set()
+
+
+class TaskEventBus:
+    def __init__(
+        self,
+        task_manager: TaskManager,
+        max_events_per_second: float = 4.0,
+        history_size: int = 1000,
+        max_client_backlog: int = 500,
+    ):
+        self.task_manager = task_manager
+        self.min_interval = 1.0 / max_events_per_second if max_events_per_second > 0 else 0.0
+        self.max_client_backlog = max_client_backlog
+        self.version = 0
+        self.epoch = uuid.uuid4().hex[:8]
+        self._history: Deque[TaskEvent] = deque(maxlen=history_size)
+        self._subscribers: Set[_Subscriber] = set()
+        # task_id -> (上次送出時間, 上次送出的 (status, error))
+        self._last_emitted: Dict[str, Tuple[float, Tuple[TaskStatus, Optional[str]]]] = {}
+        self._pending: Dict[str, asyncio.TimerHandle] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        task_manager.add_listener(self._on_task_event)
+
+    # ---- 事件來源 ----
+
+    def _on_task_event(self, kind: str, task: Task) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # 來自工作執行緒（如 yt-dlp progress hook），轉交事件迴圈處理
+            if self._loop is not None and not self._loop.is_closed():
+                self._loop.call_soon_threadsafe(self._on_task_event, kind, task)
+            return
+        self._loop = loop
+
+        if kind == "updated":
+            self._throttle(task)
+            return
+
+        self._cancel_pending(task.id)
+        if kind == "removed":
+            self._last_emitted.pop(task.id, None)
+            self._emit("removed", task.id, {"task_id": task.id})
+        else:
+            self._emit(kind, task.id, task_to_dict(task))
+            self._last_emitted[task.id] = (time.monotonic(), (task.status, task.error_message))
+
+    def _throttle(self, task: Task) -> None:
+        now = time.monotonic()
+        last_time, last_state = self._last_emitted.get(task.id, (0.0, None))
+        state = (task.status, task.error_message)
+
+        if state != last_state or now - last_time >= self.min_interval:
+            self._cancel_pending(task.id)
+            self._emit_update(task)
+        elif task.id not in self._pending:
+            delay = last_time + self.min_interval - now
+            self._pending[task.id] = self._loop.call_later(delay, self._flush, task)
+
+    def _flush(self, task: Task) -> None:
+        self._pending.pop(task.id, None)
+        if self.task_manager.get_task(task.id) is task:
+            self._emit_update(task)
+
+    def _cancel_pending(self, task_id: str) -> None:
+        handle = self._pending.pop(task_id, None)
+        if handle is not None:
+            handle.cancel()
+
+    def _emit_update(self, task: Task) -> None:
+        self._last_emitted[task.id] = (time.monotonic(), (task.status, task.error_message))
+        self._emit("updated", task.id, task_progress_dict(task))
+
+    def _emit(self, kind: str, task_id: str, data: Dict[str, Any]) -> None:
+        self.version += 1
+        event = TaskEvent(self.version, kind, task_id, data)
+        self._history.append(event)
+        for subscriber in self._subscribers:
+            subscriber.push(event)
+
+    # ---- 訂閱端 ----
+
+    def snapshot(self) -> TaskEvent:
+        tasks = [task_to_dict(t) for t in self.task_manager.get_all_tasks()]
+        return TaskEvent(
+            self.version, "snapshot", None, {"version": self.version, "epoch": self.epoch, "tasks": tasks}
+        )
+
+    def event_id(self, event: TaskEvent) -> str:
+        """SSE 的事件 id。"""
+        return f"{self.epoch}-{event.version}"
+
+    def parse_event_id(self, event_id: Optional[str]) -> Optional[int]:
+        """
+        取出 Last-Event-ID 的版本號；格式不符或來自另一次啟動 (包括沒有批次的舊格式) 時回傳 None，
+        此時應改送快照。
+        """
+        epoch, _, version = (event_id or "").rpartition("-")
+        if epoch != self.epoch or not version.isdigit():
+            return None
+        return int(version)
+
+    def events_since(self, version: int) -> Optional[List[TaskEvent]]:
+        """回傳版本號大於 version 的事件；歷史不足以續傳時回傳 None。"""
+        if version > self.version:
+            return None
+        if version == self.version:
+            return []
+        if not self._history or self._history[0].version > version + 1:
+            return None
+        return [e for e in self._history if e.version > version]
+
+    async def subscribe(
+        self, since: Optional[int] = None, keepalive: float = 15.0
+    ) -> AsyncIterator[Optional[TaskEvent]]:
+        """
+        產出事件直到客戶端斷線。since 可續傳時先補送遺漏事件，否則先送快照。
+        閒置超過 keepalive 秒時產出 None，供呼叫端送出心跳。
+        """
+        subscriber = _Subscriber(self.max_client_backlog)
+        self._subscribers.add(subscriber)
+        try:
+            replay = self.events_since(since) if since is not None else None
+            if replay is None:
+                yield self.snapshot()
+            else:
+                for event in replay:
+                    yield event
+
+            while True:
+                if subscriber.needs_snapshot:
+                    subscriber.needs_snapshot = False
+                    yield self.snapshot()
+                elif subscriber.backlog:
+                    _, event = subscriber.backlog.popitem(last=False)
+                    yield event
+                else:
+                    subscriber.wakeup.clear()
+                    try:
+                        await asyncio.wait_for(subscriber.wakeup.wait(), timeout=keepalive)
+                    except asyncio.TimeoutError:
+                        yield None
+        finally:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
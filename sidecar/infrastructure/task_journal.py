@@ -0,0 +1,111 @@
+"""
+JsonTaskJournal: 以 JSON 檔案保存未完成的任務 (每個任務一個檔案)。
+
+寫入先落到暫存檔再 os.replace，避免 Sidecar 中途結束時留下半個檔案。
+"""
+
+import asyncio
+import json
+import logging
+import os
+from dataclasses import asdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sidecar.domain.models import DMHYSearchMode, DownloadMode, Metadata, PostProcessOptions, Source, Task
+from sidecar.domain.repositories import ITaskJournal
+
+logger = logging.getLogger(__name__)
+
+
+def task_to_record(task: Task) -> Dict[str, Any]:
+    return {
+        "id": task.id,
+        "anime_title": task.anime_title,
+        "target_dir": task.target_dir,
+        "source": task.source.value,
+        "dmhy_mode": task.dmhy_mode.value,
+        "dmhy_search": task.dmhy_search.value,
+        "metadata": asdict(task.metadata) if task.metadata else None,
+        "custom_keywords": task.custom_keywords,
+        "priority": task.priority,
+        "batch_id": task.batch_id,
+        "resolved_url": task.resolved_url,
+        "postprocess": asdict(task.postprocess) if task.postprocess else None,
+        "bandwidth_limit": task.bandwidth_limit,
+        "partial_files": task.partial_files,
+        "created_at": task.created_at.isoformat(),
+    }
+
+
+def task_from_record(record: Dict[str, Any]) -> Task:
+    return Task(
+        id=record["id"],
+        anime_title=record.get("anime_title", ""),
+        target_dir=record.get("target_dir", ""),
+        source=Source(record.get("source", Source.YOUTUBE.value)),
+        dmhy_mode=DownloadMode(record.get("dmhy_mode", DownloadMode.VIDEO.value)),
+        dmhy_search=DMHYSearchMode(record.get("dmhy_search", DMHYSearchMode.RSS.value)),
+        metadata=Metadata(**record["metadata"]) if record.get("metadata") else None,
+        custom_keywords=record.get("custom_keywords"),
+        priority=record.get("priority", 0),
+        batch_id=record.get("batch_id"),
+        resolved_url=record.get("resolved_url"),
+        postprocess=PostProcessOptions(**record["postprocess"]) if record.get("postprocess") else None,
+        bandwidth_limit=record.get("bandwidth_limit"),
+        partial_files=record.get("partial_files") or [],
+        created_at=datetime.fromisoformat(record["created_at"]) if record.get("created_at") else datetime.now(),
+    )
+
+
+class JsonTaskJournal(ITaskJournal):
+    def __init__(self, journal_dir: str):
+        self.journal_dir = journal_dir
+
+    def _path(self, task_id: str) -> str:
+        # task_id 由客戶端提供，只取檔名部分以免跳出目錄
+        return os.path.join(self.journal_dir, os.path.basename(task_id) + ".json")
+
+    def _write(self, task_id: str, record: Dict[str, Any]) -> None:
+        os.makedirs(self.journal_dir, exist_ok=True)
+        path = self._path(task_id)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _read(self, task_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(task_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            logger.warning(f"任務紀錄損毀 ({task_id}): {e}")
+            return None
+
+    def _remove(self, task_id: str) -> None:
+        try:
+            os.remove(self._path(task_id))
+        except FileNotFoundError:
+            pass
+
+    def _list(self) -> List[str]:
+        try:
+            names = os.listdir(self.journal_dir)
+        except FileNotFoundError:
+            return []
+        return sorted(n[:-len(".json")] for n in names if n.endswith(".json"))
+
+    async def save(self, task: Task) -> None:
+        await asyncio.to_thread(self._write, task.id, task_to_record(task))
+
+    async def load(self, task_id: str) -> Optional[Task]:
+        record = await asyncio.to_thread(self._read, task_id)
+        return task_from_record(record) if record else None
+
+    async def delete(self, task_id: str) -> None:
+        await asyncio.to_thread(self._remove, task_id)
+
+    async def list_ids(self) -> List[str]:
+        return await asyncio.to_thread(self._list)
@@ -4,8 +4,26 @@ TaskManager: 在内存中管理所有活跃任务状态的单例类。
 此模块属于 Infrastructure 层，负责任务状态的运行时管理。
 """
 
-from typing import Optional
-from sidecar.domain.models import Task
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Iterable, Optional
+from sidecar.domain.models import Source, Task, TaskStatus
+
+# 监听器签名：(事件类型, 任务)，事件类型为 "added" / "updated" / "removed"
+TaskListener = Callable[[str, Task], None]
+
+TERMINAL_STATUSES = (TaskStatus.COMPLETED, TaskStatus.FAILED)
+
+
+@dataclass
+class TaskPage:
+    """分页查询结果。next_cursor 为 None 表示没有下一页。"""
+    tasks: list[Task]
+    next_cursor: Optional[str]
 
 
 class TaskManager:
@@ -14,16 +32,38 @@ class TaskManager:
 
     Sidecar 是无状态服务，但下载任务需要在执行期间追踪进度。
     TaskManager 提供任务的临时存储，供 API 端点查询进度。
+
+    除主表外另维护按状态、来源的二级索引；已完成/失败的任务
+    超过保留时间或数量上限时自动淘汰，避免长时间运行时无限增长。
     """
     _instance: Optional["TaskManager"] = None
     _tasks: dict[str, Task]
+    _listeners: list[TaskListener]
 
     def __new__(cls) -> "TaskManager":
         if cls._instance is None:
             cls._instance = super().__new__(cls)
-            cls._instance._tasks = {}
+            cls._instance._init_state()
         return cls._instance
 
+    def _init_state(self) -> None:
+        self._tasks = {}
+        self._listeners = []
+        self._lock = threading.RLock()
+        self._seq: dict[str, int] = {}
+        self._next_seq = 0
+        self._by_status: dict[TaskStatus, dict[str, None]] = {s: {} for s in TaskStatus}
+        self._by_source: dict[Source, dict[str, None]] = {s: {} for s in Source}
+        self._by_batch: dict[str, dict[str, None]] = {}
+        self._indexed_status: dict[str, TaskStatus] = {}
+        # 终态任务按进入终态的先后排列：task_id -> 进入终态的 monotonic 时间
+        self._terminal: "OrderedDict[str, float]" = OrderedDict()
+        self.terminal_ttl: Optional[float] = 3600.0
+        self.max_terminal: Optional[int] = 1000
+        self.version = 0
+        # 每次启动不同；与 version 组合成 ETag 等对外的版本标识，避免重启后版本号归零而误判为未变
+        self.epoch = uuid.uuid4().hex[:8]
+
     @classmethod
     def get_instance(cls) -> "TaskManager":
         """获取 TaskManager 单例实例。"""
@@ -36,9 +76,90 @@ class TaskManager:
         """重置单例实例（仅用于测试）。"""
         cls._instance = None
 
+    def configure(self, terminal_ttl: Optional[float] = 3600.0, max_terminal: Optional[int] = 1000) -> None:
+        """设置终态任务的保留时间（秒）与数量上限，None 表示不限制。"""
+        self.terminal_ttl = terminal_ttl
+        self.max_terminal = max_terminal
+        self.evict_expired()
+
+    def add_listener(self, listener: TaskListener) -> None:
+        """注册任务新增、更新、移除的监听器。"""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: TaskListener) -> None:
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _notify(self, kind: str, task: Task) -> None:
+        for listener in list(self._listeners):
+            listener(kind, task)
+
+    # ---- 索引维护（调用方需持有锁） ----
+
+    def _index(self, task: Task) -> None:
+        self._by_status[task.status][task.id] = None
+        self._by_source[task.source][task.id] = None
+        if task.batch_id is not None:
+            self._by_batch.setdefault(task.batch_id, {})[task.id] = None
+        self._indexed_status[task.id] = task.status
+        if task.status in TERMINAL_STATUSES:
+            self._terminal[task.id] = time.monotonic()
+
+    def _unindex(self, task: Task) -> None:
+        status = self._indexed_status.pop(task.id, task.status)
+        self._by_status[status].pop(task.id, None)
+        self._by_source[task.source].pop(task.id, None)
+        batch = self._by_batch.get(task.batch_id) if task.batch_id is not None else None
+        if batch is not None:
+            batch.pop(task.id, None)
+            if not batch:
+                del self._by_batch[task.batch_id]
+        self._terminal.pop(task.id, None)
+        self._seq.pop(task.id, None)
+
+    def _on_task_updated(self, task: Task) -> None:
+        # 可能由工作线程触发（如 yt-dlp progress hook）
+        with self._lock:
+            if self._tasks.get(task.id) is not task:
+                return
+            self.version += 1
+            previous = self._indexed_status.get(task.id)
+            if previous != task.status:
+                self._by_status[previous].pop(task.id, None)
+                self._by_status[task.status][task.id] = None
+                self._indexed_status[task.id] = task.status
+                if task.status in TERMINAL_STATUSES:
+                    self._terminal[task.id] = time.monotonic()
+                else:
+                    self._terminal.pop(task.id, None)
+        self._notify("updated", task)
+        if task.status in TERMINAL_STATUSES:
+            self.evict_expired()
+
+    # ---- 公开接口 ----
+
     def add_task(self, task: Task) -> None:
-        """添加任务到管理器。"""
-        self._tasks[task.id] = task
+        """添加任务到管理器。同 ID 的旧任务会被取代。"""
+        self.add_tasks([task])
+
+    def add_tasks(self, tasks: list[Task]) -> None:
+        """一次添加多个任务：在同一次加锁内登记，查询不会看到只加入一部分的批次。"""
+        with self._lock:
+            for task in tasks:
+                previous = self._tasks.get(task.id)
+                if previous is not None:
+                    previous.unsubscribe(self._on_task_updated)
+                    self._unindex(previous)
+                    del self._tasks[task.id]
+                self._tasks[task.id] = task
+                self._seq[task.id] = self._next_seq
+                self._next_seq += 1
+                self._index(task)
+            self.version += 1
+        for task in tasks:
+            task.subscribe(self._on_task_updated)
+            self._notify("added", task)
+        self.evict_expired()
 
     def get_task(self, task_id: str) -> Optional[Task]:
         """根据 ID 获取任务。"""
@@ -46,15 +167,102 @@ class TaskManager:
 
     def get_all_tasks(self) -> list[Task]:
         """获取所有活跃任务。"""
-        return list(self._tasks.values())
+        self.evict_expired()
+        with self._lock:
+            return list(self._tasks.values())
+
+    def count(self, status: Optional[TaskStatus] = None) -> int:
+        with self._lock:
+            return len(self._tasks) if status is None else len(self._by_status[status])
+
+    def query(
+        self,
+        statuses: Optional[Iterable[TaskStatus]] = None,
+        sources: Optional[Iterable[Source]] = None,
+        updated_since: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+        limit: Optional[int] = None,
+        batch_id: Optional[str] = None,
+    ) -> TaskPage:
+        """
+        按状态、来源、批次、更新时间过滤，并以游标分页（按加入顺序）。
+        cursor 为上一页返回的 next_cursor。
+        """
+        self.evict_expired()
+        after = int(cursor) if cursor else -1
+        with self._lock:
+            candidates: Optional[set[str]] = None
+            if statuses is not None:
+                candidates = {tid for s in statuses for tid in self._by_status[s]}
+            if sources is not None:
+                by_source = {tid for s in sources for tid in self._by_source[s]}
+                candidates = by_source if candidates is None else candidates & by_source
+            if batch_id is not None:
+                by_batch = set(self._by_batch.get(batch_id, ()))
+                candidates = by_batch if candidates is None else candidates & by_batch
+
+            if candidates is None:
+                ordered = [tid for tid, seq in self._seq.items() if seq > after]
+            else:
+                ordered = sorted(
+                    (tid for tid in candidates if self._seq[tid] > after), key=self._seq.__getitem__
+                )
+
+            page: list[Task] = []
+            next_cursor = None
+            for tid in ordered:
+                task = self._tasks[tid]
+                if updated_since is not None and task.updated_at < updated_since:
+                    continue
+                if limit is not None and len(page) >= limit:
+                    next_cursor = str(self._seq[page[-1].id])
+                    break
+                page.append(task)
+            return TaskPage(tasks=page, next_cursor=next_cursor)
+
+    def get_batch(self, batch_id: str) -> list[Task]:
+        """按加入顺序返回同一批次的任务。"""
+        with self._lock:
+            ids = sorted(self._by_batch.get(batch_id, ()), key=self._seq.__getitem__)
+            return [self._tasks[tid] for tid in ids]
 
     def remove_task(self, task_id: str) -> bool:
         """移除任务。返回是否成功移除。"""
-        if task_id in self._tasks:
-            del self._tasks[task_id]
-            return True
-        return False
+        with self._lock:
+            task = self._tasks.pop(task_id, None)
+            if task is None:
+                return False
+            self._unindex(task)
+            self.version += 1
+        task.unsubscribe(self._on_task_updated)
+        self._notify("removed", task)
+        return True
+
+    def evict_expired(self) -> int:
+        """淘汰过期或超出数量上限的终态任务，返回淘汰数量。"""
+        expired: list[str] = []
+        with self._lock:
+            now = time.monotonic()
+            for task_id, finished_at in self._terminal.items():
+                over_count = self.max_terminal is not None and len(self._terminal) - len(expired) > self.max_terminal
+                too_old = self.terminal_ttl is not None and now - finished_at > self.terminal_ttl
+                if not (over_count or too_old):
+                    break
+                expired.append(task_id)
+        for task_id in expired:
+            self.remove_task(task_id)
+        return len(expired)
 
     def clear_all(self) -> None:
         """清空所有任务（仅用于测试）。"""
-        self._tasks.clear()
+        with self._lock:
+            for task in self._tasks.values():
+                task.unsubscribe(self._on_task_updated)
+            self._tasks.clear()
+            self._seq.clear()
+            self._indexed_status.clear()
+            self._terminal.clear()
+            for index in (*self._by_status.values(), *self._by_source.values()):
+                index.clear()
+            self._by_batch.clear()
+            self.version += 1
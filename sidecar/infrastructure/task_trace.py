@@ -0,0 +1,43 @@
+"""
+把任務時間軸匯出成 Chrome trace-event 格式，可直接載入 chrome://tracing、Perfetto 或 speedscope。
+
+每個任務佔一列 (tid)，時間以牆上時鐘的微秒表示，不同任務的 span 可以互相對照。
+"""
+
+from typing import Any, Dict, Iterable, List
+
+from sidecar.domain.models import Task
+
+PID = 1
+
+
+def _timestamp(task: Task, perf: float) -> float:
+    timeline = task.timeline
+    return round((timeline.wall_origin + perf - timeline.origin) * 1_000_000, 1)
+
+
+def chrome_trace(tasks: Iterable[Task]) -> Dict[str, Any]:
+    events: List[Dict[str, Any]] = [
+        {"ph": "M", "pid": PID, "name": "process_name", "args": {"name": "OpusED Sidecar"}},
+    ]
+    for tid, task in enumerate(sorted(tasks, key=lambda t: t.timeline.origin), start=1):
+        timeline = task.timeline
+        label = f"{task.anime_title or task.id} [{task.source.value}]"
+        events.append({"ph": "M", "pid": PID, "tid": tid, "name": "thread_name", "args": {"name": label}})
+        events.append({"ph": "M", "pid": PID, "tid": tid, "name": "thread_sort_index", "args": {"sort_index": tid}})
+        end = max((s.end for s in timeline.spans), default=timeline.origin)
+        # 整個任務的外框，子 span 依時間巢狀顯示在其下
+        events.append({
+            "ph": "X", "pid": PID, "tid": tid, "name": "task", "cat": "task",
+            "ts": _timestamp(task, timeline.origin),
+            "dur": round((end - timeline.origin) * 1_000_000, 1),
+            "args": {"task_id": task.id, "batch_id": task.batch_id, "status": task.status.value},
+        })
+        for s in sorted(timeline.spans, key=lambda s: (s.start, -s.end)):
+            events.append({
+                "ph": "X", "pid": PID, "tid": tid, "name": s.name, "cat": s.name.split(":", 1)[0],
+                "ts": _timestamp(task, s.start),
+                "dur": round((s.end - s.start) * 1_000_000, 1),
+                "args": {"thread": s.thread, **s.attrs},
+            })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
@@ -1,13 +1,53 @@
 import os
+import time
 import asyncio
 import logging
-from typing import Optional, Dict, Any
-import yt_dlp
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Optional, Dict, Any, List
 from sidecar.domain.models import Task, TaskStatus, Source
+from sidecar.domain.stages import POSTPROCESS, SEARCH, TaskTimeline, current_timeline, span
+from sidecar.infrastructure.bandwidth import BandwidthLimiter
+from sidecar.infrastructure.ytdlp_pool import YtdlpProcessPool, first_webpage_url, postprocessor_event
 
 logger = logging.getLogger(__name__)
 
+# 所有任務共用的 yt-dlp 選項；輸出資料夾由 paths 個別指定，行程池可沿用同一個 YoutubeDL
+YTDLP_OPTIONS: Dict[str, Any] = {
+    'format': 'bestaudio/best',
+    'outtmpl': '%(title)s.%(ext)s',
+    'noplaylist': True,
+    # 以 .part 暫存並在中斷後續傳，完成後由 yt-dlp 原子改名
+    'continuedl': True,
+    'nopart': False,
+    'quiet': True,
+    'noprogress': True,
+    'no_warnings': True,
+    # DASH / HLS 串流同時下載多個片段，高延遲連線時明顯加快
+    'concurrent_fragment_downloads': 4,
+}
+# 預先解析只需要搜尋結果的網址，不展開每部影片的格式
+RESOLVE_OPTIONS: Dict[str, Any] = {**YTDLP_OPTIONS, 'extract_flat': 'in_playlist'}
+
+def ytdlp_options(fragments: int) -> Dict[str, Any]:
+    """指定同時下載片段數的下載選項；行程池預熱時應使用同一組選項，才能沿用預先建立的實例。"""
+    return {**YTDLP_OPTIONS, 'concurrent_fragment_downloads': max(1, fragments)}
+
 class YouTubeDownloader:
+    def __init__(
+        self,
+        executor: Optional[Executor] = None,
+        pool: Optional[YtdlpProcessPool] = None,
+        options: Optional[Dict[str, Any]] = None,
+        bandwidth: Optional[BandwidthLimiter] = None,
+    ):
+        # 有行程池時在常駐子行程中執行 yt-dlp，否則使用專屬的執行緒池
+        self.pool = pool
+        self.executor = executor or (None if pool else ThreadPoolExecutor(max_workers=2, thread_name_prefix="ytdlp"))
+        self.options = options or YTDLP_OPTIONS
+        # yt-dlp 無法共用 token bucket，開始下載時取得固定的 ratelimit
+        self.bandwidth = bandwidth or BandwidthLimiter()
+
     def get_source(self) -> Source:
         return Source.YOUTUBE
 
@@ -17,41 +57,94 @@ class YouTubeDownloader:
             task.update_status(TaskStatus.FAILED, error="缺少元數據，無法搜尋下載")
             return False
 
-        search_query = f"{task.metadata.anime_title} {task.metadata.song_title} {task.metadata.type}"
-        # 如果有手動指定的關鍵字，優先使用
-        if hasattr(task, 'custom_keywords') and task.custom_keywords:
-            search_query = task.custom_keywords
+        search_query = _search_query(task)
 
         os.makedirs(task.target_dir, exist_ok=True)
 
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'outtmpl': os.path.join(task.target_dir, '%(title)s.%(ext)s'),
-            'logger': MyYtdlpLogger(task),
-            'progress_hooks': [lambda d: self._progress_hook(d, task)],
-            'noplaylist': True,
-            'quiet': True,
-            'no_warnings': True,
-        }
-
         task.update_status(TaskStatus.DOWNLOADING, progress=1.0)
-        
+        # 進度回呼在事件迴圈的 call_soon 或 yt-dlp 執行緒中執行，時間軸需明確傳入
+        stages = _StageTracker(current_timeline() or task.timeline)
+        output_files: List[str] = []
+
+        def _on_progress(d: Dict[str, Any]) -> None:
+            stages.on_progress(d)
+            if d.get('status') == 'finished' and d.get('filename') and d['filename'] not in output_files:
+                output_files.append(d['filename'])
+            tmp = d.get('tmpfilename')
+            if d.get('status') == 'downloading' and tmp and tmp not in task.partial_files:
+                # .part 與片段下載的續傳紀錄 (.ytdl)，取消時用來清理
+                task.partial_files = task.partial_files + [tmp, d.get('filename', tmp) + '.ytdl']
+            self._progress_hook(d, task)
+
+        # 執行緒無法從外部中斷：任務取消時設定旗標，由下一次進度回呼拋出例外結束 yt-dlp
+        aborted = threading.Event()
+
+        def _on_thread_progress(d: Dict[str, Any]) -> None:
+            if aborted.is_set():
+                from yt_dlp.utils import DownloadCancelled
+                raise DownloadCancelled("任務已取消")
+            _on_progress(d)
+
+        throttle = self.bandwidth.throttle(task.id, task.bandwidth_limit)
         try:
-            loop = asyncio.get_event_loop()
-            # 在執行緒池中執行，避免阻塞事件迴圈
-            await loop.run_in_executor(None, self._run_ytdl, f"ytsearch1:{search_query}", ydl_opts)
+            # 續傳時直接使用上次解析出的影片網址，確保接續同一個 .part 檔
+            url = task.resolved_url or f"ytsearch1:{search_query}"
+            if self.pool:
+                await self.pool.run(
+                    url, task.target_dir, self.options, on_progress=_on_progress, ratelimit=throttle.share()
+                )
+            else:
+                ydl_opts = {
+                    **self.options,
+                    'paths': {'home': task.target_dir},
+                    'ratelimit': throttle.share(),
+                    'logger': MyYtdlpLogger(task),
+                    'progress_hooks': [_on_thread_progress],
+                    'postprocessor_hooks': [lambda d: _on_thread_progress(postprocessor_event(d))],
+                }
+                # 在執行緒池中執行，避免阻塞事件迴圈
+                future = asyncio.get_running_loop().run_in_executor(self.executor, self._run_ytdl, url, ydl_opts)
+                try:
+                    await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    # 等 yt-dlp 停止寫入 .part，之後才能安全地刪除或續傳
+                    aborted.set()
+                    await asyncio.gather(future, return_exceptions=True)
+                    raise
             
             # 檢查檔案是否真的存在（yt-dlp 有時會安靜地失敗）
             if task.status != TaskStatus.FAILED:
-                task.update_status(TaskStatus.COMPLETED, progress=100.0)
+                task.complete_transfer(output_files)
                 return True
             return False
         except Exception as e:
             logger.error(f"YouTube 下載失敗: {e}")
             task.update_status(TaskStatus.FAILED, error=f"下載失敗: {str(e)}")
             return False
+        finally:
+            throttle.close()
+            stages.close()
+
+    async def resolve(self, task: Task) -> Optional[str]:
+        """只執行 ytsearch，回傳第一筆結果的影片網址。"""
+        if task.resolved_url:
+            return task.resolved_url
+        if not task.metadata or not task.metadata.song_title:
+            return None
+        url = f"ytsearch1:{_search_query(task)}"
+        with span(SEARCH, engine="ytsearch"):
+            if self.pool:
+                return await self.pool.extract(url, RESOLVE_OPTIONS)
+            opts = {**RESOLVE_OPTIONS, 'logger': MyYtdlpLogger(task)}
+            return await asyncio.get_running_loop().run_in_executor(self.executor, self._extract, url, opts)
+
+    def _extract(self, url: str, opts: Dict[str, Any]) -> Optional[str]:
+        import yt_dlp  # 載入數百個 extractor 模組，延後到第一次使用
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            return first_webpage_url(ydl.sanitize_info(ydl.extract_info(url, download=False)))
 
     def _run_ytdl(self, url: str, opts: Dict[str, Any]):
+        import yt_dlp  # 載入數百個 extractor 模組，延後到第一次使用
         try:
             with yt_dlp.YoutubeDL(opts) as ydl:
                 ydl.download([url])
@@ -59,12 +152,56 @@ class YouTubeDownloader:
             raise e
 
     def _progress_hook(self, d: Dict[str, Any], task: Task):
+        info = d.get('info_dict') or {}
+        if not task.resolved_url and info.get('webpage_url'):
+            task.resolved_url = info['webpage_url']
         if d['status'] == 'downloading':
             total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate')
             downloaded_bytes = d.get('downloaded_bytes', 0)
             if total_bytes:
                 progress = (downloaded_bytes / total_bytes) * 100
-                task.update_status(TaskStatus.DOWNLOADING, progress=round(progress, 1))
+                task.update_status(
+                    TaskStatus.DOWNLOADING, progress=round(progress, 1),
+                    downloaded_bytes=downloaded_bytes, total_bytes=total_bytes,
+                )
+
+class _StageTracker:
+    """由 yt-dlp 的進度與後處理事件推算各段時間：ytdlp:extract (搜尋與格式選擇)、ytdlp:download、postprocess。"""
+
+    def __init__(self, timeline: TaskTimeline):
+        self.timeline = timeline
+        self.started = time.perf_counter()
+        self.stage: Optional[str] = "ytdlp:extract"
+        self.attrs: Dict[str, Any] = {}
+
+    def _switch(self, stage: Optional[str], **attrs) -> None:
+        now = time.perf_counter()
+        if self.stage is not None:
+            self.timeline.add(self.stage, self.started, now, **self.attrs)
+        self.stage, self.started, self.attrs = stage, now, attrs
+
+    def on_progress(self, d: Dict[str, Any]) -> None:
+        status = d.get('status')
+        if status == 'downloading' and self.stage != "ytdlp:download":
+            self._switch("ytdlp:download")
+        elif status == 'finished' and self.stage != POSTPROCESS:
+            self._switch(None)
+        elif status == 'postprocessor_started':
+            self._switch(POSTPROCESS, postprocessor=d.get('postprocessor'))
+        elif status == 'postprocessor_finished' and self.stage == POSTPROCESS:
+            self._switch(None)
+
+    def close(self) -> None:
+        """下載結束 (或失敗) 時結束仍在進行的階段。"""
+        if self.stage is not None:
+            self.attrs["incomplete"] = True
+            self._switch(None)
+
+def _search_query(task: Task) -> str:
+    # 如果有手動指定的關鍵字，優先使用
+    if task.custom_keywords:
+        return task.custom_keywords
+    return f"{task.metadata.anime_title} {task.metadata.song_title} {task.metadata.type}"
 
 class MyYtdlpLogger:
     def __init__(self, task: Task):
@@ -0,0 +1,344 @@
+"""
+YtdlpProcessPool: 以常駐的子行程執行 yt-dlp。
+
+yt-dlp 的搜尋、格式選擇與後處理都是 CPU 密集的 Python 程式，放在執行緒中會與
+FastAPI 事件迴圈搶 GIL。每個工作行程啟動時即載入 yt-dlp 並建立 YoutubeDL 實例，
+之後的任務沿用同一個實例；進度與日誌透過 Pipe 回傳主行程。
+工作行程執行指定次數後即替換，避免記憶體持續成長。
+"""
+
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import threading
+import time
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Dict, List, Optional
+
+from sidecar.domain.stages import span
+
+logger = logging.getLogger(__name__)
+
+# 收到進度時的回呼，參數格式與 yt-dlp progress hook 相同（僅含常用欄位）
+ProgressCallback = Callable[[Dict[str, Any]], None]
+
+PROGRESS_INTERVAL = 0.2  # 子行程回報下載進度的最短間隔（秒）
+STOP_TIMEOUT = 5.0
+
+
+class YtdlpWorkerError(Exception):
+    """yt-dlp 執行失敗或工作行程異常結束。"""
+
+
+# ---- 子行程 ----
+
+class _WorkerLogger:
+    """只將 warning / error 送回主行程，debug 訊息留在子行程。"""
+
+    def __init__(self, conn: Connection, state: Dict[str, Any]):
+        self.conn = conn
+        self.state = state
+
+    def debug(self, msg: str) -> None:
+        pass
+
+    def warning(self, msg: str) -> None:
+        self.conn.send(("log", self.state["job_id"], logging.WARNING, msg))
+
+    def error(self, msg: str) -> None:
+        self.conn.send(("log", self.state["job_id"], logging.ERROR, msg))
+
+
+def postprocessor_event(d: Dict[str, Any]) -> Dict[str, Any]:
+    """把 yt-dlp 的 postprocessor hook 轉成進度訊息，status 為 postprocessor_started / postprocessor_finished。"""
+    return {"status": f"postprocessor_{d.get('status')}", "postprocessor": d.get("postprocessor")}
+
+
+def _options_key(opts: Dict[str, Any]) -> str:
+    return repr(sorted(opts.items()))
+
+
+def first_webpage_url(info: Optional[Dict[str, Any]]) -> Optional[str]:
+    """extract_info 的結果為搜尋 (playlist) 時取第一筆的網址。"""
+    if not info:
+        return None
+    entries = info.get("entries")
+    if entries is not None:
+        for entry in entries:
+            if entry:
+                return entry.get("webpage_url") or entry.get("url")
+        return None
+    return info.get("webpage_url")
+
+
+def _worker_main(conn: Connection, warm_opts: Optional[Dict[str, Any]]) -> None:
+    import yt_dlp  # 只在子行程載入，初始化成本每個行程只付一次
+
+    state: Dict[str, Any] = {"job_id": None, "last_progress": 0.0}
+    instances: Dict[str, Any] = {}
+
+    def _hook(d: Dict[str, Any]) -> None:
+        now = time.monotonic()
+        if d.get("status") == "downloading" and now - state["last_progress"] < PROGRESS_INTERVAL:
+            return
+        state["last_progress"] = now
+        info = d.get("info_dict") or {}
+        conn.send(("progress", state["job_id"], {
+            "status": d.get("status"),
+            "downloaded_bytes": d.get("downloaded_bytes"),
+            "total_bytes": d.get("total_bytes"),
+            "total_bytes_estimate": d.get("total_bytes_estimate"),
+            "filename": d.get("filename"),
+            "tmpfilename": d.get("tmpfilename"),
+            "info_dict": {"webpage_url": info.get("webpage_url")},
+        }))
+
+    def _pp_hook(d: Dict[str, Any]) -> None:
+        if d.get("status") in ("started", "finished"):
+            conn.send(("progress", state["job_id"], postprocessor_event(d)))
+
+    def _instance(opts: Dict[str, Any]):
+        key = _options_key(opts)
+        ydl = instances.get(key)
+        if ydl is None:
+            ydl = yt_dlp.YoutubeDL({
+                **opts,
+                "progress_hooks": [_hook],
+                "postprocessor_hooks": [_pp_hook],
+                "logger": _WorkerLogger(conn, state),
+            })
+            instances[key] = ydl
+        return ydl
+
+    if warm_opts:
+        _instance(warm_opts)
+    conn.send(("ready", None))
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        if message[0] == "stop":
+            return
+        kind, job_id, url, opts = message[:4]
+        state["job_id"] = job_id
+        state["last_progress"] = 0.0
+        try:
+            ydl = _instance(opts)
+            if kind == "extract":
+                info = ydl.extract_info(url, download=False)
+                conn.send(("done", job_id, first_webpage_url(ydl.sanitize_info(info))))
+                continue
+            # 輸出資料夾與頻寬上限每個任務不同，直接改 params 即可沿用同一個實例
+            ydl.params["paths"] = {"home": message[4]}
+            ydl.params["ratelimit"] = message[5]
+            ydl.download([url])
+            conn.send(("done", job_id, None))
+        except Exception as e:
+            # 失敗後的實例狀態不可靠，下次重建
+            instances.pop(_options_key(opts), None)
+            conn.send(("error", job_id, str(e)))
+
+
+# ---- 主行程 ----
+
+class _Worker:
+    def __init__(self, ctx, warm_opts: Optional[Dict[str, Any]], loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main, args=(child_conn, warm_opts), name="ytdlp-worker", daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+        self.killed = False
+        self.job_id: Optional[int] = None
+        self.future: Optional[asyncio.Future] = None
+        self.on_progress: Optional[ProgressCallback] = None
+        # 子行程載入 yt-dlp 並建立預熱實例後完成
+        self.warm: asyncio.Future = loop.create_future()
+        # Pipe 的讀取會阻塞，交給背景執行緒後轉回事件迴圈（Windows 的 Proactor 不支援 add_reader）
+        threading.Thread(target=self._read_loop, name="ytdlp-pipe", daemon=True).start()
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def _read_loop(self) -> None:
+        while True:
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            self._call_soon(self._dispatch, message)
+        self._call_soon(self._on_exit)
+
+    def _call_soon(self, callback, *args) -> None:
+        if not self.loop.is_closed():
+            try:
+                self.loop.call_soon_threadsafe(callback, *args)
+            except RuntimeError:
+                pass
+
+    def _dispatch(self, message) -> None:
+        kind, job_id = message[0], message[1]
+        if kind == "ready":
+            if not self.warm.done():
+                self.warm.set_result(None)
+            return
+        if kind == "log":
+            logger.log(message[2], f"[yt-dlp] {message[3]}")
+            return
+        if job_id != self.job_id or self.future is None or self.future.done():
+            return
+        if kind == "progress":
+            if self.on_progress:
+                self.on_progress(message[2])
+        elif kind == "done":
+            self.future.set_result(message[2])
+        elif kind == "error":
+            self.future.set_exception(YtdlpWorkerError(message[2]))
+
+    def _on_exit(self) -> None:
+        if not self.warm.done():
+            self.warm.cancel()
+        if self.future is not None and not self.future.done():
+            self.future.set_exception(YtdlpWorkerError("yt-dlp 工作行程異常結束"))
+
+    def submit(self, message: tuple, on_progress: Optional[ProgressCallback]) -> asyncio.Future:
+        self.job_id = message[1]
+        self.on_progress = on_progress
+        self.future = self.loop.create_future()
+        self.conn.send(message)
+        return self.future
+
+    def retire(self) -> None:
+        """請行程結束；在背景等待，逾時則強制終止。"""
+        try:
+            self.conn.send(("stop",))
+        except (OSError, ValueError):
+            pass
+
+        def _join() -> None:
+            self.process.join(STOP_TIMEOUT)
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join()
+            self.conn.close()
+
+        threading.Thread(target=_join, name="ytdlp-retire", daemon=True).start()
+
+    def kill(self) -> None:
+        self.killed = True
+        self.process.kill()
+
+
+class YtdlpProcessPool:
+    def __init__(
+        self,
+        workers: int = 2,
+        max_jobs_per_worker: int = 20,
+        warm_opts: Optional[Dict[str, Any]] = None,
+        start_method: str = "spawn",
+    ):
+        self.size = max(1, workers)
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.warm_opts = warm_opts
+        # spawn 在各平台行為一致，也不會複製主行程的事件迴圈與執行緒
+        self._ctx = multiprocessing.get_context(start_method)
+        self._slots: asyncio.Queue = asyncio.Queue()
+        for _ in range(self.size):
+            self._slots.put_nowait(None)
+        self._workers: List[_Worker] = []
+        self._job_ids = itertools.count(1)
+        self._closed = False
+
+    def start(self) -> None:
+        """預先啟動所有工作行程，讓第一個任務不必等待 yt-dlp 載入。"""
+        loop = asyncio.get_running_loop()
+        slots = [self._slots.get_nowait() for _ in range(self._slots.qsize())]
+        for worker in slots:
+            self._slots.put_nowait(worker if worker is not None else self._spawn(loop))
+
+    async def wait_warm(self, timeout: Optional[float] = None) -> int:
+        """等待已啟動的工作行程完成預熱，回傳已預熱的行程數。"""
+        pending = [w.warm for w in self._workers if not w.warm.done()]
+        if pending:
+            await asyncio.wait(pending, timeout=timeout)
+        return sum(1 for w in self._workers if w.warm.done() and not w.warm.cancelled())
+
+    async def run(
+        self,
+        url: str,
+        target_dir: str,
+        opts: Dict[str, Any],
+        on_progress: Optional[ProgressCallback] = None,
+        ratelimit: Optional[int] = None,
+    ) -> None:
+        """在工作行程中下載 url 至 target_dir，ratelimit 為 bytes/s (None 不限)；失敗時拋出 YtdlpWorkerError。"""
+        await self._execute(("download", next(self._job_ids), url, opts, target_dir, ratelimit), on_progress)
+
+    async def extract(self, url: str, opts: Dict[str, Any]) -> Optional[str]:
+        """只解析不下載，回傳影片網址（搜尋時為第一筆結果）。"""
+        return await self._execute(("extract", next(self._job_ids), url, opts), None)
+
+    async def _execute(self, message: tuple, on_progress: Optional[ProgressCallback]) -> Any:
+        if self._closed:
+            raise YtdlpWorkerError("yt-dlp 行程池已關閉")
+        loop = asyncio.get_running_loop()
+        with span("worker_wait", pool="ytdlp"):
+            worker = await self._slots.get()
+        if worker is None or not worker.is_alive():
+            worker = self._spawn(loop)
+        try:
+            return await worker.submit(message, on_progress)
+        except asyncio.CancelledError:
+            # yt-dlp 無法從外部中斷，直接結束行程
+            worker.kill()
+            raise
+        finally:
+            worker.jobs += 1
+            self._release(worker)
+
+    def _spawn(self, loop: asyncio.AbstractEventLoop) -> _Worker:
+        worker = _Worker(self._ctx, self.warm_opts, loop)
+        self._workers.append(worker)
+        logger.info(f"[YtdlpPool] Started worker pid={worker.pid}")
+        return worker
+
+    def _release(self, worker: _Worker) -> None:
+        if self._closed:
+            return
+        if not worker.killed and worker.is_alive() and worker.jobs < self.max_jobs_per_worker:
+            self._slots.put_nowait(worker)
+            return
+        # 達到任務上限或已結束：替換為新行程，維持預熱狀態
+        self._workers.remove(worker)
+        worker.retire()
+        self._slots.put_nowait(self._spawn(worker.loop))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": [
+                {"pid": w.pid, "jobs": w.jobs, "alive": w.is_alive(), "warm": w.warm.done() and not w.warm.cancelled()}
+                for w in self._workers
+            ],
+            "idle": self._slots.qsize(),
+            "max_jobs_per_worker": self.max_jobs_per_worker,
+        }
+
+    def shutdown(self) -> None:
+        """結束所有工作行程。"""
+        self._closed = True
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            if worker.future is not None and not worker.future.done():
+                worker.kill()
+            else:
+                worker.retire()
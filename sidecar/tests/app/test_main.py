@@ -0,0 +1,13 @@
+from sidecar.app import main
+from sidecar.domain.models import Source, TaskStatus
+
+def test_tasks_etag_depends_on_query_and_boot(monkeypatch):
+    etag = main._tasks_etag([TaskStatus.FAILED, TaskStatus.COMPLETED], None, None, None, 50, None)
+    assert etag == main._tasks_etag([TaskStatus.COMPLETED, TaskStatus.FAILED], None, None, None, 50, None)
+    assert etag != main._tasks_etag([TaskStatus.FAILED], None, None, None, 50, None)
+    assert etag != main._tasks_etag([TaskStatus.FAILED, TaskStatus.COMPLETED], [Source.YOUTUBE], None, None, 50, None)
+    assert etag != main._tasks_etag([TaskStatus.FAILED, TaskStatus.COMPLETED], None, None, "50", 50, None)
+
+    # 重啟後版本號歸零，ETag 也不能與重啟前相同
+    monkeypatch.setattr(main.task_manager, "epoch", "rebooted")
+    assert etag != main._tasks_etag([TaskStatus.FAILED, TaskStatus.COMPLETED], None, None, None, 50, None)
@@ -0,0 +1,42 @@
+import pytest
+from sidecar.app.startup import StartupReport, Subsystem, import_module, prewarm
+
+@pytest.mark.asyncio
+async def test_subsystem_builds_once_on_first_use_and_retries_failures():
+    report = StartupReport()
+    calls = []
+
+    async def factory():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("not yet")
+        return object()
+
+    subsystem = Subsystem("demo", factory, report)
+    assert not subsystem.ready and subsystem.peek() is None
+
+    with pytest.raises(RuntimeError):
+        await subsystem.get()
+    assert subsystem.status()["error"] == "not yet"
+
+    value = await subsystem.get()
+    assert await subsystem.get() is value
+    assert len(calls) == 2 and subsystem.ready and subsystem.error is None
+    assert [p.name for p in report.phases] == ["init:demo", "init:demo"]
+
+@pytest.mark.asyncio
+async def test_prewarm_records_imports_and_continues_after_failure():
+    report = StartupReport()
+
+    async def load_json():
+        return await import_module("json", report)
+
+    async def broken():
+        raise RuntimeError("boom")
+
+    subsystems = [Subsystem("broken", broken, report), Subsystem("json", load_json, report)]
+    await prewarm(subsystems, report)
+
+    assert [s.ready for s in subsystems] == [False, True]
+    names = [p["name"] for p in report.to_dict()["phases"]]
+    assert names == ["init:broken", "import:json", "init:json", "prewarm"]
@@ -0,0 +1,151 @@
+import asyncio
+import pytest
+from sidecar.domain.models import Task, Source
+from sidecar.application.download_scheduler import DownloadScheduler, SchedulerFullError
+
+class Recorder:
+    def __init__(self):
+        self.order = []
+        self.running = {Source.YOUTUBE: 0, Source.DMHY: 0}
+        self.peak = {Source.YOUTUBE: 0, Source.DMHY: 0}
+        self.release = asyncio.Event()
+
+    async def job(self, task: Task):
+        self.order.append(task.id)
+        self.running[task.source] += 1
+        self.peak[task.source] = max(self.peak[task.source], self.running[task.source])
+        await self.release.wait()
+        self.running[task.source] -= 1
+
+async def _drain(scheduler: DownloadScheduler):
+    while scheduler.stats()["queued"] or scheduler.stats()["running"]:
+        await asyncio.sleep(0.01)
+
+@pytest.mark.asyncio
+async def test_per_source_limits_and_queue_bound():
+    rec = Recorder()
+    scheduler = DownloadScheduler(
+        max_concurrency=3, per_source_limits={Source.YOUTUBE: 1}, max_queue_size=4
+    )
+    for i in range(2):
+        scheduler.submit(Task(id=f"yt{i}", source=Source.YOUTUBE), rec.job)
+        scheduler.submit(Task(id=f"dm{i}", source=Source.DMHY), rec.job)
+    with pytest.raises(SchedulerFullError):
+        scheduler.submit(Task(id="overflow"), rec.job)
+
+    await asyncio.sleep(0.05)
+    stats = scheduler.stats()
+    assert stats["running"] == 3
+    assert stats["sources"]["youtube"] == {"queued": 1, "running": 1, "limit": 1}
+
+    rec.release.set()
+    await _drain(scheduler)
+    assert rec.peak[Source.YOUTUBE] == 1
+    await scheduler.stop()
+
+@pytest.mark.asyncio
+async def test_priority_and_batch_fairness():
+    rec = Recorder()
+    rec.release.set()
+    scheduler = DownloadScheduler(max_concurrency=1)
+    blocker = asyncio.Event()
+
+    async def block(task):
+        await blocker.wait()
+
+    scheduler.submit(Task(id="blocker"), block)
+    await asyncio.sleep(0.01)
+
+    for i in range(3):
+        scheduler.submit(Task(id=f"a{i}", batch_id="A"), rec.job)
+    for i in range(2):
+        scheduler.submit(Task(id=f"b{i}", batch_id="B"), rec.job)
+    scheduler.submit(Task(id="late"), rec.job)
+    assert scheduler.set_priority("late", 10)
+
+    blocker.set()
+    await _drain(scheduler)
+    assert rec.order == ["late", "a0", "b0", "a1", "b1", "a2"]
+    await scheduler.stop()
+
+@pytest.mark.asyncio
+async def test_submit_many_is_all_or_nothing():
+    rec = Recorder()
+    rec.release.set()
+    scheduler = DownloadScheduler(max_concurrency=1, max_queue_size=3)
+    scheduler.submit(Task(id="a"), rec.job)
+
+    with pytest.raises(SchedulerFullError):
+        scheduler.submit_many([Task(id=f"b{i}") for i in range(3)], rec.job)
+    with pytest.raises(ValueError):
+        scheduler.submit_many([Task(id="c"), Task(id="a")], rec.job)
+    assert not scheduler.is_queued("c")
+
+    scheduler.submit_many([Task(id="b0"), Task(id="b1")], rec.job)
+    await _drain(scheduler)
+    assert rec.order == ["a", "b0", "b1"]
+    await scheduler.stop()
+
+@pytest.mark.asyncio
+async def test_cancel_releases_slot_before_cleanup_finishes():
+    scheduler = DownloadScheduler(max_concurrency=1)
+    order = []
+
+    async def slow_cleanup(task):
+        try:
+            await asyncio.Event().wait()
+        finally:
+            # 例如保存續傳紀錄；此時下一個任務應已開始
+            await asyncio.sleep(0.05)
+            order.append("cleaned")
+
+    async def job(task):
+        order.append(task.id)
+
+    scheduler.submit(Task(id="a"), slow_cleanup)
+    scheduler.submit(Task(id="b"), job)
+    await asyncio.sleep(0.01)
+
+    assert await scheduler.cancel("a")
+    assert order == ["b", "cleaned"]
+    assert not scheduler.is_active("a")
+    assert not await scheduler.cancel("a")
+    await scheduler.stop()
+
+@pytest.mark.asyncio
+async def test_batch_rounds_are_dropped_when_batch_finishes():
+    rec = Recorder()
+    rec.release.set()
+    scheduler = DownloadScheduler(max_concurrency=1)
+    scheduler.submit_many([Task(id=f"a{i}", batch_id="A") for i in range(3)], rec.job)
+    scheduler.submit(Task(id="solo"), rec.job)
+    scheduler.submit(Task(id="b0", batch_id="B"), rec.job)
+    assert scheduler.discard("b0")
+    assert "B" not in scheduler._batch_next_round
+
+    await _drain(scheduler)
+    assert scheduler._batch_next_round == {} and scheduler._batch_live == {}
+    await scheduler.stop()
+
+@pytest.mark.asyncio
+async def test_cancel_right_after_dispatch_releases_everything():
+    scheduler = DownloadScheduler(max_concurrency=1)
+    ran = []
+
+    async def job(task):
+        ran.append(task.id)
+
+    scheduler.submit(Task(id="a", batch_id="A"), job)
+    while "a" not in scheduler._running:
+        await asyncio.sleep(0)
+    # 協程尚未執行任何一步就被取消
+    assert await scheduler.cancel("a")
+
+    assert ran == [] and not scheduler.is_active("a")
+    stats = scheduler.stats()
+    assert (stats["running"], stats["detached"], stats["sources"]["youtube"]["running"]) == (0, 0, 0)
+    assert scheduler._batch_live == {} and scheduler._batch_next_round == {}
+    scheduler.submit(Task(id="a"), job)
+    await _drain(scheduler)
+    assert ran == ["a"]
+    await scheduler.stop()
@@ -0,0 +1,47 @@
+import asyncio
+import pytest
+from sidecar.application.single_flight import SingleFlight
+
+@pytest.mark.asyncio
+async def test_cancelling_one_waiter_keeps_shared_call_running():
+    flight = SingleFlight()
+    started = 0
+
+    async def work():
+        nonlocal started
+        started += 1
+        await asyncio.sleep(0.05)
+        return "done"
+
+    first = asyncio.create_task(flight.do("k", work))
+    second = asyncio.create_task(flight.do("k", work))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second == "done"
+    assert first.cancelled() and started == 1 and flight.shared == 1
+    assert "k" not in flight
+
+@pytest.mark.asyncio
+async def test_errors_are_shared_and_last_waiter_cancels_call():
+    flight = SingleFlight()
+    cancelled = asyncio.Event()
+
+    async def boom():
+        raise RuntimeError("upstream")
+
+    async def hang():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    results = await asyncio.gather(flight.do("e", boom), flight.do("e", boom), return_exceptions=True)
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+    waiter = asyncio.create_task(flight.do("h", hang))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    await asyncio.wait_for(cancelled.wait(), 1)
+    assert len(flight) == 0
@@ -0,0 +1,335 @@
+import asyncio
+import os
+import pytest
+from sidecar.domain.models import Metadata, PostProcessOptions, Source, Task, TaskStatus
+from sidecar.domain.repositories import IDownloader, IMetadataProvider, IPostProcessor, IResolutionCache, ITaskMetrics
+from sidecar.domain.stages import POSTPROCESS
+from sidecar.application.download_scheduler import DownloadScheduler
+from sidecar.application.use_cases import DownloadTaskUseCase, SearchMetadataUseCase
+
+class SlowProvider(IMetadataProvider):
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+
+    async def get_metadata(self, anime_title, token=None):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            if anime_title == "boom":
+                raise RuntimeError("upstream error")
+            await asyncio.sleep(0.05 if anime_title == "slow" else 0)
+            return [Metadata(anime_title=anime_title, song_title="s", artist="a", type="OP")]
+        finally:
+            self.running -= 1
+
+@pytest.mark.asyncio
+async def test_execute_batch_streams_in_completion_order():
+    provider = SlowProvider()
+    use_case = SearchMetadataUseCase(provider)
+    titles = ["slow", "boom"] + [f"t{i}" for i in range(10)]
+
+    items = [item async for item in use_case.execute_batch(titles, concurrency=3)]
+
+    assert len(items) == len(titles)
+    assert items[-1].title == "slow"
+    assert provider.peak <= 3
+    failed = [i for i in items if i.error]
+    assert [i.title for i in failed] == ["boom"] and failed[0].results == []
+
+class MemoryResolutionCache(IResolutionCache):
+    def __init__(self):
+        self.entries = {}
+
+    async def get(self, task):
+        return self.entries.get(task.custom_keywords)
+
+    async def put(self, task, resolved_url):
+        self.entries[task.custom_keywords] = resolved_url
+
+    async def invalidate(self, task):
+        self.entries.pop(task.custom_keywords, None)
+
+class ResolvingDownloader(IDownloader):
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.searches = 0
+        self.seen_urls = []
+
+    def get_source(self):
+        return Source.YOUTUBE
+
+    async def resolve(self, task):
+        self.searches += 1
+        return None if task.custom_keywords == "missing" else f"https://v/{task.custom_keywords}"
+
+    async def download(self, task):
+        self.seen_urls.append(task.resolved_url)
+        if not task.resolved_url:
+            task.resolved_url = await self.resolve(task)
+        if self.fail:
+            task.update_status(TaskStatus.FAILED, error="boom")
+            return False
+        task.update_status(TaskStatus.COMPLETED, progress=100.0)
+        return True
+
+@pytest.mark.asyncio
+async def test_pre_resolved_source_is_used_by_download():
+    downloader = ResolvingDownloader()
+    cache = MemoryResolutionCache()
+    use_case = DownloadTaskUseCase([downloader], resolution_cache=cache)
+    tasks = [Task(custom_keywords=k) for k in ("a", "b", "missing")]
+
+    first = sorted([r async for r in use_case.resolve_batch(tasks)], key=lambda r: r.index)
+    again = [r async for r in use_case.resolve_batch(tasks[:1])]
+
+    assert [(r.resolved_url, r.cached) for r in first[:2]] == [("https://v/a", False), ("https://v/b", False)]
+    assert first[2].error and first[2].resolved_url is None
+    assert again[0].cached and downloader.searches == 3
+
+    assert await use_case.execute(Task(custom_keywords="a"))
+    assert downloader.seen_urls == ["https://v/a"]
+    assert downloader.searches == 3
+
+@pytest.mark.asyncio
+async def test_failed_download_invalidates_resolution():
+    downloader = ResolvingDownloader(fail=True)
+    cache = MemoryResolutionCache()
+    cache.entries["a"] = "https://v/stale"
+    use_case = DownloadTaskUseCase([downloader], resolution_cache=cache)
+
+    assert not await use_case.execute(Task(custom_keywords="a"))
+    assert downloader.seen_urls == ["https://v/stale"]
+    assert "a" not in cache.entries
+
+@pytest.mark.asyncio
+async def test_identical_searches_share_one_upstream_call():
+    provider = SlowProvider()
+    calls = []
+    original = provider.get_metadata
+
+    async def counting(anime_title, token=None):
+        calls.append(anime_title)
+        return await original("slow", token=token)
+
+    provider.get_metadata = counting
+    use_case = SearchMetadataUseCase(provider)
+
+    results = await asyncio.gather(*(use_case.execute(t) for t in ("Title", "title ", "Title", "Other")))
+
+    assert sorted(calls) == ["Other", "Title"]
+    assert results[0] == results[1] == results[2] and results[0] is not results[1]
+    # 完成後不再共用，重新呼叫上游
+    await use_case.execute("Title")
+    assert len(calls) == 3
+
+class GatedDownloader(ResolvingDownloader):
+    def __init__(self):
+        super().__init__()
+        self.release = asyncio.Event()
+
+    async def download(self, task):
+        self.seen_urls.append(task.resolved_url)
+        task.update_status(TaskStatus.DOWNLOADING, progress=40.0, downloaded_bytes=400, total_bytes=1000)
+        await self.release.wait()
+        task.output_files = [os.path.join(task.target_dir, "song.m4a")]
+        task.update_status(TaskStatus.COMPLETED, progress=100.0, downloaded_bytes=1000)
+        return True
+
+@pytest.mark.asyncio
+async def test_identical_downloads_attach_to_one_transfer(tmp_path):
+    downloader = GatedDownloader()
+    use_case = DownloadTaskUseCase([downloader])
+    leader, follower = (Task(custom_keywords="a", target_dir=str(tmp_path)) for _ in range(2))
+    elsewhere = Task(custom_keywords="a", target_dir=str(tmp_path / "other"))
+
+    runs = [asyncio.create_task(use_case.execute(t)) for t in (leader, follower, elsewhere)]
+    for _ in range(5):
+        await asyncio.sleep(0)
+    assert (follower.status, follower.progress, follower.downloaded_bytes) == (TaskStatus.DOWNLOADING, 40.0, 400)
+
+    downloader.release.set()
+    assert await asyncio.gather(*runs) == [True, True, True]
+    assert downloader.searches == 1
+    assert downloader.seen_urls == ["https://v/a", "https://v/a"]
+    assert use_case.attached == 1
+    assert follower.status == TaskStatus.COMPLETED and follower.resolved_url == "https://v/a"
+    assert follower.downloaded_bytes == 1000
+    assert follower.output_files == leader.output_files == [os.path.join(str(tmp_path), "song.m4a")]
+
+class RecordingMetrics(ITaskMetrics):
+    def __init__(self):
+        self.stages = []
+        self.bytes = 0
+
+    def observe_stage(self, task, stage, seconds):
+        self.stages.append((task.id, stage))
+
+    def observe_bytes(self, task, count):
+        self.bytes += count
+
+@pytest.mark.asyncio
+async def test_stage_timings_and_bytes_count_only_the_transfer(tmp_path):
+    downloader = GatedDownloader()
+    metrics = RecordingMetrics()
+    use_case = DownloadTaskUseCase([downloader], metrics=metrics)
+    leader, follower = (Task(custom_keywords="a", target_dir=str(tmp_path)) for _ in range(2))
+
+    runs = [asyncio.create_task(use_case.execute(t)) for t in (leader, follower)]
+    for _ in range(5):
+        await asyncio.sleep(0)
+    downloader.release.set()
+    assert await asyncio.gather(*runs) == [True, True]
+
+    # 附加的任務同步了進度，但傳輸量只算一次
+    assert metrics.bytes == 1000
+    assert [s for t, s in metrics.stages if t == leader.id] == ["resolve", "transfer", "write"]
+    assert [s for t, s in metrics.stages if t == follower.id] == ["resolve"]
+    assert [s["name"] for s in leader.timeline.to_dict()["spans"]] == ["resolve", "transfer"]
+    follower_spans = follower.timeline.to_dict()["spans"]
+    assert [s["name"] for s in follower_spans] == ["resolve", "attached"]
+    assert follower_spans[0]["shared"] and follower_spans[1]["leader"] == leader.id
+
+class FileDownloader(IDownloader):
+    def get_source(self):
+        return Source.YOUTUBE
+
+    async def download(self, task):
+        await asyncio.sleep(0.01)
+        task.complete_transfer([f"{task.target_dir}/{task.id}.webm"])
+        return True
+
+class GatedPostProcessor(IPostProcessor):
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.started = []
+
+    async def process(self, task):
+        self.started.append(task.id)
+        await self.release.wait()
+        if task.custom_keywords == "bad":
+            raise RuntimeError("ffmpeg exited 1")
+        return [path.replace(".webm", ".mp3") for path in task.output_files]
+
+@pytest.mark.asyncio
+async def test_postprocess_overlaps_with_next_transfer(tmp_path):
+    post = GatedPostProcessor()
+    scheduler = DownloadScheduler(max_concurrency=1)
+    use_case = DownloadTaskUseCase([FileDownloader()], scheduler=scheduler, postprocessor=post)
+    options = PostProcessOptions(audio_codec="mp3")
+    tasks = [
+        Task(id=str(i), custom_keywords=k, target_dir=str(tmp_path / str(i)), postprocess=options)
+        for i, k in enumerate(("ok", "bad"))
+    ]
+    plain = Task(id="plain", custom_keywords="plain", target_dir=str(tmp_path))
+    for task in [*tasks, plain]:
+        use_case.submit(task)
+
+    # 只有一個下載名額，但後處理中的任務不佔名額，其餘任務照常下載
+    for _ in range(100):
+        if plain.status == TaskStatus.COMPLETED:
+            break
+        await asyncio.sleep(0.01)
+    assert [t.status for t in tasks] == [TaskStatus.POSTPROCESSING] * 2
+    assert plain.output_files == [f"{tmp_path}/plain.webm"]
+    assert scheduler.stats()["detached"] == 2
+
+    post.release.set()
+    while scheduler.stats()["detached"]:
+        await asyncio.sleep(0.01)
+    assert tasks[0].status == TaskStatus.COMPLETED
+    assert tasks[0].output_files == [f"{tmp_path}/0/0.mp3"]
+    assert tasks[1].status == TaskStatus.FAILED and "ffmpeg exited 1" in tasks[1].error_message
+    assert [s.name for s in tasks[0].timeline.spans][-1] == POSTPROCESS
+    await scheduler.stop()
+
+@pytest.mark.asyncio
+async def test_follower_detaches_and_gets_postprocessed_files(tmp_path):
+    post = GatedPostProcessor()
+    scheduler = DownloadScheduler(max_concurrency=2)
+    use_case = DownloadTaskUseCase([FileDownloader()], scheduler=scheduler, postprocessor=post)
+    options = PostProcessOptions(audio_codec="mp3")
+    leader, follower = (
+        Task(custom_keywords="ok", target_dir=str(tmp_path), postprocess=options) for _ in range(2)
+    )
+    plain = Task(custom_keywords="plain", target_dir=str(tmp_path / "plain"))
+    for task in (leader, follower, plain):
+        use_case.submit(task)
+
+    for _ in range(100):
+        if plain.status == TaskStatus.COMPLETED:
+            break
+        await asyncio.sleep(0.01)
+    # 後處理期間實際下載與附加的任務都不佔下載名額
+    assert scheduler.stats()["detached"] == 2
+
+    post.release.set()
+    while scheduler.stats()["detached"]:
+        await asyncio.sleep(0.01)
+    assert follower.status == TaskStatus.COMPLETED
+    assert follower.output_files == leader.output_files == [f"{tmp_path}/{leader.id}.mp3"]
+    assert follower.partial_files == []
+    await scheduler.stop()
+
+class PartialDownloader(ResolvingDownloader):
+    """寫入 .part 後停住，直到被取消；再次下載時從既有的 .part 接續。"""
+
+    def __init__(self):
+        super().__init__()
+        self.offsets = []
+
+    async def download(self, task):
+        part = os.path.join(task.target_dir, "song.m4a.part")
+        task.partial_files = [part]
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        self.offsets.append(offset)
+        with open(part, "ab") as f:
+            f.write(b"x" * 100)
+        task.update_status(TaskStatus.DOWNLOADING, downloaded_bytes=offset + 100)
+        await asyncio.Event().wait()
+
+@pytest.mark.asyncio
+async def test_pause_resume_and_cancel_stop_the_transfer(tmp_path):
+    downloader = PartialDownloader()
+    use_case = DownloadTaskUseCase([downloader], scheduler=DownloadScheduler(max_concurrency=1))
+    task = Task(target_dir=str(tmp_path), resolved_url="https://v/1")
+
+    use_case.submit(task)
+    await asyncio.sleep(0.01)
+    assert await use_case.pause(task)
+    assert task.status == TaskStatus.PAUSED
+    assert not use_case.scheduler.is_active(task.id)
+    assert not await use_case.pause(task)
+
+    use_case.submit(task)
+    await asyncio.sleep(0.01)
+    assert downloader.offsets == [0, 100]
+
+    assert await use_case.cancel(task)
+    assert not os.path.exists(tmp_path / "song.m4a.part")
+    assert use_case.scheduler.stats()["running"] == 0
+    await use_case.scheduler.stop()
+
+@pytest.mark.asyncio
+async def test_cancelled_leader_hands_transfer_to_follower(tmp_path):
+    downloader = GatedDownloader()
+    use_case = DownloadTaskUseCase([downloader], scheduler=DownloadScheduler(max_concurrency=2))
+    leader, follower = (Task(custom_keywords="a", target_dir=str(tmp_path)) for _ in range(2))
+    leader.partial_files = [str(tmp_path / "a.part")]
+
+    use_case.submit(leader)
+    await asyncio.sleep(0.01)
+    use_case.submit(follower)
+    await asyncio.sleep(0.01)
+    assert use_case.attached == 1
+
+    assert await use_case.pause(leader)
+    assert leader.status == TaskStatus.PAUSED and leader.partial_files == []
+    await asyncio.sleep(0.01)
+    assert len(downloader.seen_urls) == 2  # 附加的任務接手下載，沒有失敗
+
+    downloader.release.set()
+    while use_case.scheduler.is_active(follower.id):
+        await asyncio.sleep(0.01)
+    assert follower.status == TaskStatus.COMPLETED
+    await use_case.scheduler.stop()
@@ -0,0 +1,73 @@
+import os
+import httpx
+import pytest
+from sidecar.benchmarks.metrics import percentile
+from sidecar.benchmarks.runner import compare
+from sidecar.benchmarks.stand_ins import StandInConfig, bangumi_app, dmhy_app
+from sidecar.domain.models import DMHYSearchMode, DownloadMode, Metadata, Source, Task, TaskStatus
+from sidecar.infrastructure.bencode import decode
+from sidecar.infrastructure.dmhy_downloader import DMHYDownloader
+from sidecar.infrastructure.metadata_provider import BangumiMetadataProvider
+
+BANGUMI = "http://bangumi.test"
+DMHY = "http://dmhy.test"
+
+def _client(app, base_url):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url=base_url)
+
+@pytest.mark.asyncio
+async def test_bangumi_stand_in_replays_recording_per_title():
+    async with _client(bangumi_app(StandInConfig(latency=0)), BANGUMI) as client:
+        provider = BangumiMetadataProvider(base_url=BANGUMI, client=client)
+        first = await provider.get_metadata("Title A")
+        second = await provider.get_metadata("Title B")
+
+    assert [(m.anime_title, m.song_title, m.artist, m.type) for m in first] == [
+        ("Title A", "ALIVE", "ClariS", "OP"),
+        ("Title A", "花の塔", "さユり", "ED"),
+    ]
+    assert first[0].bangumi_id != second[0].bangumi_id
+
+@pytest.mark.asyncio
+async def test_dmhy_stand_in_serves_torrent_download(tmp_path):
+    config = StandInConfig(latency=0, torrent_size=40_000, bandwidth=1_000_000)
+    async with _client(dmhy_app(config, DMHY), DMHY) as client:
+        task = Task(
+            source=Source.DMHY,
+            dmhy_mode=DownloadMode.TORRENT,
+            dmhy_search=DMHYSearchMode.RSS,
+            target_dir=str(tmp_path),
+            metadata=Metadata(anime_title="Bench Anime", song_title="Song", artist="a", type="OP"),
+        )
+        assert await DMHYDownloader(base_url=DMHY, client=client).download(task)
+
+    assert task.status == TaskStatus.COMPLETED
+    [name] = os.listdir(tmp_path)
+    with open(tmp_path / name, "rb") as f:
+        data = f.read()
+    assert abs(len(data) - 40_000) < 100
+    assert decode(data)[b"info"][b"name"] == "Bench Anime Song.mkv".encode()
+
+@pytest.mark.asyncio
+async def test_error_injection_is_reproducible():
+    async def _statuses():
+        async with _client(bangumi_app(StandInConfig(latency=0, error_rate=0.5, seed=7)), BANGUMI) as client:
+            return [(await client.get(f"/v0/subjects/{i}")).status_code for i in range(20)]
+
+    statuses = await _statuses()
+    assert statuses == await _statuses()
+    assert {200, 503} == set(statuses)
+
+def test_compare_flags_regressions_beyond_tolerance():
+    def _report(throughput, p95, errors=0):
+        scenario = {
+            "errors": errors, "throughput": throughput, "p50": 0.1, "p95": p95, "p99": p95,
+            "loop_lag": {"p99": 0.005}, "peak_rss": 100,
+        }
+        return {"startup": {"health": 1.0, "ready": 2.0}, "scenarios": {"search": scenario}}
+
+    baseline = _report(50.0, 0.2)
+    assert compare(_report(45.0, 0.22), baseline) == []
+    regressions = compare(_report(30.0, 0.5, errors=1), baseline)
+    assert [r.split(":")[0] for r in regressions] == ["search.errors", "search.throughput", "search.p95", "search.p99"]
+    assert percentile([3, 1, 2, 4], 50) == 2 and percentile([], 99) is None
@@ -1,5 +1,6 @@
 import pytest
 from sidecar.domain.models import Task, Metadata, TaskStatus, Source, DownloadMode
+from sidecar.domain.stages import bind_timeline, record_span, span
 
 def test_task_initialization():
     task = Task(anime_title="Lycoris Recoil")
@@ -31,3 +32,28 @@ def test_dmhy_task_modes():
     task_torrent = Task(source=Source.DMHY, dmhy_mode=DownloadMode.TORRENT)
     assert task_video.dmhy_mode == DownloadMode.VIDEO
     assert task_torrent.dmhy_mode == DownloadMode.TORRENT
+
+def test_task_notifies_listeners_only_on_change():
+    task = Task(anime_title="Lycoris Recoil")
+    seen = []
+    task.subscribe(seen.append)
+    task.update_status(TaskStatus.DOWNLOADING, progress=10.0)
+    task.update_status(TaskStatus.DOWNLOADING, progress=10.0)
+    task.unsubscribe(seen.append)
+    task.update_status(TaskStatus.COMPLETED, progress=100.0)
+    assert seen == [task]
+
+def test_spans_are_recorded_only_on_bound_timeline():
+    task = Task(anime_title="Lycoris Recoil")
+    with span("search"):
+        pass
+    with bind_timeline(task.timeline):
+        with pytest.raises(ValueError):
+            with span("search", engine="dmhy"):
+                raise ValueError("boom")
+        record_span("queued", task.timeline.origin)
+
+    spans = task.timeline.to_dict()["spans"]
+    assert [s["name"] for s in spans] == ["queued", "search"]
+    assert spans[1]["engine"] == "dmhy" and spans[1]["error"] == "ValueError"
+    assert spans[0]["start"] == 0.0
@@ -0,0 +1,63 @@
+import json
+import zipfile
+
+from sidecar.infrastructure.bangumi_index import BangumiIndex, parse_infobox_names
+
+INFOBOX = "{{Infobox animanga/TVAnime\n|中文名= 莉可丽丝\n|别名={\n[Lycoris Recoil]\n[LycoReco]\n}\n|话数= 13\n}}"
+SUBJECTS = [
+    {"id": 1, "type": 2, "name": "リコリス・リコイル", "name_cn": "莉可丽丝", "infobox": INFOBOX, "score": 8.1},
+    {"id": 2, "type": 1, "name": "Lycoris Recoil 小説", "name_cn": ""},
+    {"id": 3, "type": 2, "name": "ぼっち・ざ・ろっく！", "name_cn": "孤独摇滚！", "infobox": "", "score": 8.9},
+]
+EPISODES = [
+    {"id": 10, "type": 2, "subject_id": 1, "sort": 1, "name": "ALIVE", "description": "ALIVE\nClariS"},
+    {"id": 11, "type": 3, "subject_id": 1, "sort": 1, "name": "花の塔", "description": "花の塔\nさユり"},
+    {"id": 12, "type": 0, "subject_id": 1, "sort": 1, "name": "Easy does it", "description": ""},
+]
+
+
+def _write_dump(path, subjects, episodes):
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("subject.jsonlines", "\n".join(json.dumps(s, ensure_ascii=False) for s in subjects))
+        zf.writestr("episode.jsonlines", "\n".join(json.dumps(e, ensure_ascii=False) for e in episodes))
+
+
+def test_parse_infobox_names():
+    assert parse_infobox_names(INFOBOX) == ["莉可丽丝", "Lycoris Recoil", "LycoReco"]
+    assert parse_infobox_names(None) == []
+
+
+def test_import_is_incremental(tmp_path):
+    dump = tmp_path / "dump.zip"
+    _write_dump(dump, SUBJECTS, EPISODES)
+    index = BangumiIndex(str(tmp_path / "index.sqlite3"))
+
+    first = index.import_dump(str(dump))
+    assert (first.subjects_added, first.episodes_added, first.skipped) == (2, 2, 2)
+
+    # 只有改名的條目會重新寫入
+    renamed = [dict(SUBJECTS[0], name_cn="莉可丽丝 第一季"), *SUBJECTS[1:]]
+    _write_dump(dump, renamed, EPISODES)
+    second = index.import_dump(str(dump))
+    assert (second.subjects_added, second.subjects_updated, second.subjects_unchanged) == (0, 1, 1)
+    assert (second.episodes_added, second.episodes_unchanged) == (0, 2)
+    assert index.find_subject("莉可丽丝 第一季").subject_id == "1"
+    assert index.get_stats()["subjects"] == 2
+    index.close()
+
+
+def test_find_subject_fuzzy(tmp_path):
+    dump = tmp_path / "dump.zip"
+    _write_dump(dump, SUBJECTS, EPISODES)
+    index = BangumiIndex(str(tmp_path / "index.sqlite3"))
+    index.import_dump(str(dump))
+
+    # 別名、大小寫與標點差異、錯字與部分標題都能命中
+    for title in ("Lycoris Recoil", "lycoris-recoil", "Lycoris Recoi", "リコリス リコイル"):
+        subject = index.find_subject(title)
+        assert subject.subject_id == "1"
+    assert [(ep.type, ep.name) for ep in subject.episodes] == [("OP", "ALIVE"), ("ED", "花の塔")]
+    assert index.find_subject("ぼっち").name_cn == "孤独摇滚！"
+    assert index.find_subject("Attack on Titan") is None
+    assert (index.stats.hits, index.stats.misses) == (5, 1)
+    index.close()
@@ -0,0 +1,138 @@
+import os
+import pytest
+from sidecar.infrastructure import bencode
+from sidecar.infrastructure.bittorrent import BitTorrentClient, BitTorrentError, TorrentMeta, parse_magnet
+from sidecar.tests.infrastructure.torrent_fixtures import Seeder, TorrentFixture, Tracker
+
+OP = "Show/[Sub] Show - NCOP.mkv"
+EPISODE = "Show/[Sub] Show - 01.mkv"
+
+
+def _fixture() -> TorrentFixture:
+    # 長度刻意不與 piece 對齊，讓 piece 橫跨兩個檔案
+    return TorrentFixture([(EPISODE, 150_000), (OP, 70_000), ("Show/readme.txt", 1_000)])
+
+
+def _select_op(files):
+    return [i for i, f in enumerate(files) if f.path == OP]
+
+
+async def _swarm(fixture, seeders):
+    started = [await s.start() for s in seeders]
+    tracker = await Tracker(fixture.info_hash, [("127.0.0.1", s.port) for s in started]).start()
+    return tracker
+
+
+async def _stop(tracker, seeders):
+    await tracker.stop()
+    for s in seeders:
+        await s.stop()
+
+
+def test_bencode_round_trip_and_info_hash():
+    fixture = _fixture()
+    meta = TorrentMeta.from_torrent(fixture.torrent("http://tracker/announce"))
+    assert bencode.decode(bencode.encode({"a": [1, b"x"]})) == {b"a": [1, b"x"]}
+    assert meta.info_hash == fixture.info_hash
+    assert meta.trackers == ("http://tracker/announce",)
+    assert [f.path for f in meta.files] == [EPISODE, OP, "Show/readme.txt"]
+    assert meta.files[1].offset == 150_000
+
+
+def test_parse_magnet_hex_and_base32():
+    link = parse_magnet("magnet:?xt=urn:btih:" + "ab" * 20 + "&tr=http://t/a&tr=udp://u:1")
+    assert link.info_hash == bytes.fromhex("ab" * 20)
+    assert link.trackers == ("http://t/a", "udp://u:1")
+    assert parse_magnet("magnet:?xt=urn:btih:" + "A" * 32).info_hash == bytes(20)
+    with pytest.raises(BitTorrentError):
+        parse_magnet("magnet:?dn=nothing")
+
+
+@pytest.mark.asyncio
+async def test_downloads_only_selected_file_from_multiple_peers(tmp_path):
+    fixture = _fixture()
+    seeders = [Seeder(fixture), Seeder(fixture)]
+    tracker = await _swarm(fixture, seeders)
+    progress = []
+    try:
+        paths = await BitTorrentClient(pipeline=4).download(
+            fixture.torrent(tracker.url), str(tmp_path), select_files=_select_op,
+            on_progress=lambda done, total: progress.append((done, total)),
+        )
+    finally:
+        await _stop(tracker, seeders)
+
+    assert paths == [os.path.join(tmp_path, "[Sub] Show - NCOP.mkv")]
+    with open(paths[0], "rb") as f:
+        assert f.read() == fixture.content(OP)
+    assert os.listdir(tmp_path) == ["[Sub] Show - NCOP.mkv"]
+
+    # 只請求與 OP 重疊的 piece (150000..220000 → piece 4..6)
+    served = set().union(*(s.served for s in seeders))
+    assert served == {4, 5, 6}
+    assert progress[-1][0] == progress[-1][1]
+
+
+@pytest.mark.asyncio
+async def test_magnet_fetches_metadata_from_peers(tmp_path):
+    fixture = _fixture()
+    seeders = [Seeder(fixture)]
+    tracker = await _swarm(fixture, seeders)
+    try:
+        paths = await BitTorrentClient().download(fixture.magnet(tracker.url), str(tmp_path), select_files=_select_op)
+    finally:
+        await _stop(tracker, seeders)
+
+    with open(paths[0], "rb") as f:
+        assert f.read() == fixture.content(OP)
+
+
+@pytest.mark.asyncio
+async def test_corrupt_pieces_are_refetched_from_another_peer(tmp_path):
+    fixture = _fixture()
+    seeders = [Seeder(fixture, corrupt={4, 5, 6}), Seeder(fixture)]
+    tracker = await _swarm(fixture, seeders)
+    try:
+        paths = await BitTorrentClient(pipeline=4).download(
+            fixture.torrent(tracker.url), str(tmp_path), select_files=_select_op
+        )
+    finally:
+        await _stop(tracker, seeders)
+
+    with open(paths[0], "rb") as f:
+        assert f.read() == fixture.content(OP)
+
+
+@pytest.mark.asyncio
+async def test_resumes_from_existing_part_file(tmp_path):
+    # 單檔 torrent：前兩個 piece 已在 .part 中
+    single = TorrentFixture([("op.mkv", 100_000)])
+    part = bytearray(100_000)
+    part[:65536] = single.content("op.mkv")[:65536]
+    with open(os.path.join(tmp_path, "op.mkv.part"), "wb") as f:
+        f.write(part)
+
+    seeders = [Seeder(single)]
+    tracker = await _swarm(single, seeders)
+    try:
+        paths = await BitTorrentClient().download(single.torrent(tracker.url), str(tmp_path))
+    finally:
+        await _stop(tracker, seeders)
+
+    assert set(seeders[0].served) == {2, 3}
+    with open(paths[0], "rb") as f:
+        assert f.read() == single.content("op.mkv")
+
+
+@pytest.mark.asyncio
+async def test_fails_when_no_peer_is_reachable(tmp_path):
+    fixture = _fixture()
+    tracker = await Tracker(fixture.info_hash, [("127.0.0.1", 1)]).start()
+    try:
+        with pytest.raises(BitTorrentError):
+            await BitTorrentClient(max_announce_rounds=2, retry_delay=0).download(
+                fixture.torrent(tracker.url), str(tmp_path)
+            )
+    finally:
+        await tracker.stop()
+    assert tracker.announces == 2
@@ -0,0 +1,141 @@
+import asyncio
+import os
+import httpx
+import pytest
+from sidecar.domain.models import Task, Metadata, Source, DownloadMode, DMHYSearchMode, TaskStatus, PostProcessOptions
+from sidecar.domain.stages import bind_timeline
+from sidecar.infrastructure.dmhy_downloader import DMHYDownloader, DMHYSearchResult
+from sidecar.tests.infrastructure.torrent_fixtures import Seeder, TorrentFixture
+
+MAGNET = "magnet:?xt=urn:btih:0123456789abcdef0123456789abcdef01234567"
+RSS = f"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0"><channel><title>DMHY</title>
+<item>
+  <title>[Sub] Lycoris Recoil OP ALIVE</title>
+  <link>https://share.dmhy.org/topics/view/1_alive.html</link>
+  <enclosure url="{MAGNET}" length="1" type="application/x-bittorrent"/>
+</item>
+</channel></rss>"""
+DETAIL = """<html><body><div id="tabs-1"><a href="//dl.dmhy.org/2022/alive.torrent">t</a></div>
+<a id="magnet">%s</a></body></html>""" % MAGNET
+
+def _task(tmp_path, mode):
+    return Task(
+        source=Source.DMHY,
+        dmhy_mode=mode,
+        dmhy_search=DMHYSearchMode.RSS,
+        target_dir=str(tmp_path),
+        metadata=Metadata(anime_title="Lycoris Recoil", song_title="ALIVE", artist="ClariS", type="OP"),
+    )
+
+@pytest.mark.asyncio
+async def test_rss_search_is_single_request_and_cached(tmp_path, respx_mock):
+    rss_route = respx_mock.get("https://share.dmhy.org/topics/rss/rss.xml").mock(
+        return_value=httpx.Response(200, text=RSS)
+    )
+    list_route = respx_mock.get("https://share.dmhy.org/topics/list")
+    downloader = DMHYDownloader()
+
+    tasks = [_task(tmp_path, DownloadMode.VIDEO) for _ in range(3)]
+    await asyncio.gather(*(downloader.download(t) for t in tasks))
+
+    assert rss_route.call_count == 1
+    assert not list_route.called
+    assert all(t.resolved_url == MAGNET for t in tasks)
+    with open(os.path.join(tmp_path, "magnet.txt")) as f:
+        assert f.read() == MAGNET
+
+@pytest.mark.asyncio
+async def test_rss_torrent_mode_uses_detail_page_only(tmp_path, respx_mock):
+    respx_mock.get("https://share.dmhy.org/topics/rss/rss.xml").mock(return_value=httpx.Response(200, text=RSS))
+    respx_mock.get("https://share.dmhy.org/topics/view/1_alive.html").mock(return_value=httpx.Response(200, text=DETAIL))
+    respx_mock.get("https://dl.dmhy.org/2022/alive.torrent").mock(return_value=httpx.Response(200, content=b"d4:infoe"))
+    list_route = respx_mock.get("https://share.dmhy.org/topics/list")
+
+    task = _task(tmp_path, DownloadMode.TORRENT)
+    task.postprocess = PostProcessOptions()
+    task.partial_files = [os.path.join(tmp_path, "stale.webm.part")]  # 先前嘗試留下的紀錄
+    assert await DMHYDownloader().download(task)
+
+    assert task.status == TaskStatus.COMPLETED
+    assert task.output_files == [os.path.join(tmp_path, "alive.torrent")]
+    assert task.partial_files == []
+    assert not list_route.called
+    with open(os.path.join(tmp_path, "alive.torrent"), "rb") as f:
+        assert f.read() == b"d4:infoe"
+
+@pytest.mark.asyncio
+async def test_rss_failure_falls_back_to_html(tmp_path, respx_mock):
+    respx_mock.get("https://share.dmhy.org/topics/rss/rss.xml").mock(return_value=httpx.Response(503))
+    respx_mock.get("https://share.dmhy.org/topics/list").mock(return_value=httpx.Response(200, text="""
+        <table id="topic_list"><tbody><tr><td class="title"><a href="/topics/view/1_alive.html">x</a></td></tr></tbody></table>
+    """))
+    respx_mock.get("https://share.dmhy.org/topics/view/1_alive.html").mock(return_value=httpx.Response(200, text=DETAIL))
+
+    task = _task(tmp_path, DownloadMode.VIDEO)
+    await DMHYDownloader().download(task)
+    assert task.resolved_url == MAGNET
+
+@pytest.mark.asyncio
+async def test_video_mode_downloads_op_file_over_bittorrent(tmp_path, respx_mock):
+    fixture = TorrentFixture([
+        ("Lycoris Recoil/[Sub] Lycoris Recoil - 01.mkv", 150_000),
+        ("Lycoris Recoil/[Sub] Lycoris Recoil NCOP ALIVE.mkv", 70_000),
+    ])
+    seeder = await Seeder(fixture).start()
+    magnet = fixture.magnet("http://tracker.test/announce")
+    rss = RSS.replace(MAGNET, magnet.replace("&", "&amp;"))
+    respx_mock.get("https://share.dmhy.org/topics/rss/rss.xml").mock(return_value=httpx.Response(200, text=rss))
+    peers = bytes([127, 0, 0, 1]) + seeder.port.to_bytes(2, "big")
+    respx_mock.get(url__startswith="http://tracker.test/announce").mock(
+        return_value=httpx.Response(200, content=b"d8:intervali60e5:peers6:" + peers + b"e")
+    )
+
+    task = _task(tmp_path, DownloadMode.VIDEO)
+    try:
+        assert await DMHYDownloader().download(task)
+    finally:
+        await seeder.stop()
+
+    assert task.status == TaskStatus.COMPLETED
+    assert task.resolved_url == magnet
+    assert task.downloaded_bytes == task.total_bytes
+    assert os.listdir(tmp_path) == ["[Sub] Lycoris Recoil NCOP ALIVE.mkv"]
+    with open(os.path.join(tmp_path, "[Sub] Lycoris Recoil NCOP ALIVE.mkv"), "rb") as f:
+        assert f.read() == fixture.content("Lycoris Recoil/[Sub] Lycoris Recoil NCOP ALIVE.mkv")
+
+@pytest.mark.asyncio
+async def test_search_and_detail_are_recorded_on_task_timeline(tmp_path, respx_mock):
+    respx_mock.get("https://share.dmhy.org/topics/rss/rss.xml").mock(return_value=httpx.Response(200, text=RSS))
+    respx_mock.get("https://share.dmhy.org/topics/view/1_alive.html").mock(return_value=httpx.Response(200, text=DETAIL))
+
+    task = _task(tmp_path, DownloadMode.TORRENT)
+    with bind_timeline(task.timeline):
+        assert await DMHYDownloader().resolve(task) == "https://dl.dmhy.org/2022/alive.torrent"
+
+    spans = task.timeline.to_dict()["spans"]
+    assert [s["name"] for s in spans] == ["search", "detail"]
+    assert spans[0]["mode"] == "rss" and spans[0]["duration"] >= 0
+
+@pytest.mark.asyncio
+async def test_cancelling_search_owner_does_not_cancel_waiters(tmp_path):
+    downloader = DMHYDownloader()
+    started = asyncio.Event()
+    calls = []
+
+    async def search_rss(query):
+        calls.append(query)
+        if len(calls) == 1:
+            started.set()
+            await asyncio.Event().wait()
+        return DMHYSearchResult(magnet_link=MAGNET)
+
+    downloader._search_rss = search_rss
+    owner = asyncio.create_task(downloader._search("ALIVE", DMHYSearchMode.RSS))
+    await started.wait()
+    waiter = asyncio.create_task(downloader._search("ALIVE", DMHYSearchMode.RSS))
+    await asyncio.sleep(0)
+    owner.cancel()
+
+    assert (await waiter).magnet_link == MAGNET
+    assert owner.cancelled() and len(calls) == 2
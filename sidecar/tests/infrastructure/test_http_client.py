@@ -0,0 +1,56 @@
+import pytest
+import httpx
+from sidecar.infrastructure.http_client import HttpClientPool, HttpClientConfig
+
+@pytest.mark.asyncio
+async def test_pool_reuses_client_per_host():
+    pool = HttpClientPool(HttpClientConfig(max_connections=5))
+    a = pool.get_client("https://api.bgm.tv")
+    b = pool.get_client("https://API.bgm.tv/search/subject/x")
+    c = pool.get_client("https://share.dmhy.org")
+    assert a is b
+    assert a is not c
+
+    await pool.aclose()
+    assert a.is_closed and c.is_closed
+    # 關閉後再次取得會重新建立
+    assert pool.get_client("https://api.bgm.tv") is not a
+    await pool.aclose()
+
+def test_config_from_env(monkeypatch):
+    monkeypatch.setenv("OPUSED_HTTP_MAX_CONNECTIONS", "42")
+    monkeypatch.setenv("OPUSED_HTTP_HTTP2", "false")
+    config = HttpClientConfig.from_env()
+    assert config.max_connections == 42
+    assert config.http2 is False
+    assert config.read_timeout == HttpClientConfig().read_timeout
+
+@pytest.mark.asyncio
+async def test_pool_applies_rate_limiter_to_each_host(respx_mock):
+    from sidecar.infrastructure.rate_limit import AdaptiveRateLimiter, RateLimitConfig
+
+    respx_mock.get("https://share.dmhy.org/topics/list").mock(side_effect=[
+        httpx.Response(503, headers={"Retry-After": "0"}), httpx.Response(200, text="ok"),
+    ])
+    limiter = AdaptiveRateLimiter(RateLimitConfig(backoff_base=0.01))
+    pool = HttpClientPool(rate_limiter=limiter)
+    response = await pool.get_client("https://share.dmhy.org").get("https://share.dmhy.org/topics/list")
+    assert response.text == "ok"
+    assert limiter.stats()["share.dmhy.org"]["retries"] == 1
+    await pool.aclose()
+
+@pytest.mark.asyncio
+async def test_later_callers_merge_headers_and_timeout():
+    pool = HttpClientPool()
+    bare = pool.get_client("https://api.bgm.tv")
+    client = pool.get_client("https://api.bgm.tv", headers={"User-Agent": "opused"}, read_timeout=12.0)
+    assert client is bare
+    assert client.headers["User-Agent"] == "opused"
+    assert client.timeout.read == 12.0
+
+    assert pool.get_client("https://api.bgm.tv", headers={"user-agent": "opused"}) is client
+    with pytest.raises(ValueError):
+        pool.get_client("https://api.bgm.tv", headers={"User-Agent": "other"})
+    with pytest.raises(ValueError):
+        pool.get_client("https://api.bgm.tv", read_timeout=30.0)
+    await pool.aclose()
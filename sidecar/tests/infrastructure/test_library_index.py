@@ -0,0 +1,148 @@
+import asyncio
+import os
+import threading
+import pytest
+from sidecar.domain.models import Metadata, Source, Task, TaskStatus
+from sidecar.domain.repositories import IDownloader
+from sidecar.application.use_cases import DownloadTaskUseCase
+from sidecar.infrastructure.library_index import SQLiteLibraryIndex
+
+METADATA = Metadata(anime_title="葬送のフリーレン", song_title="勇者", artist="YOASOBI", type="OP")
+
+class FakeTags:
+    def __init__(self, tags=None):
+        self.tags = tags or {}
+        self.reads = []
+
+    def __call__(self, path):
+        self.reads.append(os.path.basename(path))
+        return self.tags.get(os.path.basename(path), {})
+
+def _write(path, data=b"x" * 100):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+@pytest.mark.asyncio
+async def test_rescan_only_processes_changed_files(tmp_path):
+    root = tmp_path / "music"
+    _write(str(root / "a.mp3"))
+    _write(str(root / "sub" / "b.mkv"))
+    _write(str(root / "notes.txt"))
+    _write(str(root / "c.mp3.part"))
+    tags = FakeTags()
+    index = SQLiteLibraryIndex(":memory:", tag_reader=tags)
+
+    first = await index.refresh(str(root))
+    assert (first.files, first.updated, first.removed) == (2, 2, 0)
+    assert await index.refresh(str(root)) is None  # refresh_interval 內不重複掃描
+
+    _write(str(root / "sub" / "b.mkv"), b"y" * 200)
+    os.remove(root / "a.mp3")
+    tags.reads.clear()
+    second = await index.refresh(str(root), force=True)
+    assert (second.files, second.updated, second.removed) == (1, 1, 1)
+    assert tags.reads == ["b.mkv"]
+    files = await index.list_files(str(root))
+    assert [(os.path.basename(f["path"]), f["size"]) for f in files] == [("b.mkv", 200)]
+    index.close()
+
+@pytest.mark.asyncio
+async def test_find_matches_tags_and_filenames(tmp_path):
+    root = tmp_path / "music"
+    _write(str(root / "01.flac"))
+    _write(str(root / "葬送のフリーレン OP - 勇者.mkv"))
+    _write(str(root / "Other Show - 勇者.mp3"))
+    tags = FakeTags({
+        "01.flac": {"title": "勇者", "album": "葬送のフリーレン"},
+        "Other Show - 勇者.mp3": {"title": "勇者", "album": "Other Show", "artist": "Someone"},
+    })
+    index = SQLiteLibraryIndex(":memory:", tag_reader=tags)
+
+    found = await index.find(str(root), METADATA)
+    assert sorted(os.path.basename(p) for p in found) == ["01.flac", "葬送のフリーレン OP - 勇者.mkv"]
+    assert await index.find(str(root), Metadata("別の作品", "勇者", "誰か", "ED")) == []
+    assert index.get_stats()["hits"] == 1
+    index.close()
+
+@pytest.mark.asyncio
+async def test_title_only_tags_need_anime_or_artist_in_filename(tmp_path):
+    root = tmp_path / "music"
+    _write(str(root / "track01.mp3"))
+    _write(str(root / "YOASOBI - 勇者.mp3"))
+    tags = FakeTags({name: {"title": "勇者"} for name in ("track01.mp3", "YOASOBI - 勇者.mp3")})
+    index = SQLiteLibraryIndex(":memory:", tag_reader=tags)
+
+    found = await index.find(str(root), METADATA)
+    assert [os.path.basename(p) for p in found] == ["YOASOBI - 勇者.mp3"]
+    index.close()
+
+@pytest.mark.asyncio
+async def test_find_does_not_wait_for_slow_scan(tmp_path):
+    root = tmp_path / "music"
+    _write(str(root / "葬送のフリーレン OP - 勇者.mkv"))
+    gate = threading.Event()
+
+    def slow_tags(path):
+        gate.wait(5)
+        return {}
+
+    index = SQLiteLibraryIndex(":memory:", tag_reader=slow_tags, scan_wait=0.05)
+    assert await asyncio.wait_for(index.find(str(root), METADATA), 1) == []
+
+    gate.set()
+    await index.refresh(str(root))  # 與背景中的掃描共用同一次
+    assert len(await index.find(str(root), METADATA)) == 1
+    index.close()
+
+class FileDownloader(IDownloader):
+    def __init__(self):
+        self.downloads = 0
+
+    def get_source(self):
+        return Source.YOUTUBE
+
+    async def download(self, task):
+        self.downloads += 1
+        path = os.path.join(task.target_dir, "track.m4a")
+        _write(path)
+        task.complete_transfer([path])
+        return True
+
+@pytest.mark.asyncio
+async def test_downloaded_song_completes_instantly_next_time(tmp_path):
+    downloader = FileDownloader()
+    index = SQLiteLibraryIndex(":memory:", tag_reader=FakeTags())
+    use_case = DownloadTaskUseCase([downloader], library=index)
+    target = str(tmp_path / "out")
+
+    first = Task(target_dir=target, metadata=METADATA, resolved_url="https://v/1")
+    assert not await use_case.find_existing(first)
+    assert await use_case.execute(first)
+
+    again = Task(target_dir=target, metadata=METADATA)
+    assert await use_case.find_existing(again)
+    assert again.status == TaskStatus.COMPLETED
+    assert [os.path.basename(p) for p in again.output_files] == ["track.m4a"]
+    assert downloader.downloads == 1
+    index.close()
+
+@pytest.mark.asyncio
+async def test_nested_roots_share_rows(tmp_path):
+    outer = tmp_path / "Lib"
+    inner = outer / "Season1"
+    _write(str(inner / "葬送のフリーレン OP - 勇者.mkv"))
+    index = SQLiteLibraryIndex(":memory:", tag_reader=FakeTags())
+
+    assert (await index.refresh(str(inner), force=True)).updated == 1
+    for _ in range(2):
+        assert (await index.refresh(str(outer), force=True)).updated == 0
+        assert (await index.refresh(str(inner), force=True)).updated == 0
+    assert index.get_stats()["hashed"] == 1
+
+    assert len(await index.find(str(outer), METADATA)) == 1
+    assert len(await index.find(str(inner), METADATA)) == 1
+    files = await index.list_files(str(outer))
+    assert [f["root"] for f in files] == [os.path.normcase(os.path.abspath(inner))]
+    assert [r["files"] for r in await index.list_roots()] == [1, 1]
+    index.close()
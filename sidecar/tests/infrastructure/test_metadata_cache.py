@@ -0,0 +1,79 @@
+import asyncio
+import pytest
+from sidecar.domain.models import Metadata
+from sidecar.infrastructure.metadata_cache import (
+    CachedMetadataProvider, SQLiteMetadataStore, normalize_title, title_key,
+)
+from sidecar.infrastructure.metadata_provider import MetadataFetchResult
+
+ALIVE = Metadata(anime_title="莉可麗絲", song_title="ALIVE", artist="ClariS", type="OP", bangumi_id="345678")
+
+class FakeProvider:
+    def __init__(self):
+        self.calls = []
+        self.not_modified = False
+
+    async def get_metadata(self, anime_title, token=None):
+        return (await self.fetch_conditional(anime_title, token)).results
+
+    async def fetch_conditional(self, anime_title, token=None, etag=None, last_modified=None, subject_id_hint=None):
+        self.calls.append((anime_title, etag))
+        if self.not_modified and etag:
+            return MetadataFetchResult(not_modified=True, etag=etag)
+        return MetadataFetchResult(results=[ALIVE], subject_id="345678", etag='"v1"')
+
+def test_normalize_title():
+    assert normalize_title("  Lycoris　RECOIL ") == "lycoris recoil"
+
+@pytest.mark.asyncio
+async def test_memory_and_disk_hits(tmp_path):
+    db = str(tmp_path / "cache.sqlite3")
+    provider = FakeProvider()
+    cache = CachedMetadataProvider(provider, store=SQLiteMetadataStore(db))
+
+    assert await cache.get_metadata("Lycoris Recoil") == [ALIVE]
+    assert await cache.get_metadata("lycoris  recoil") == [ALIVE]
+    assert len(provider.calls) == 1
+    assert cache.get_subject_id("Lycoris Recoil") == "345678"
+    await cache.aclose()
+
+    # 新的實例應從 SQLite 讀回
+    restarted = CachedMetadataProvider(provider, store=SQLiteMetadataStore(db))
+    assert await restarted.get_metadata("Lycoris Recoil") == [ALIVE]
+    assert await restarted.get_by_subject_id("345678") == [ALIVE]
+    assert len(provider.calls) == 1
+    stats = restarted.get_stats()
+    assert stats["disk_hits"] == 1 and stats["misses"] == 0
+    await restarted.aclose()
+
+@pytest.mark.asyncio
+async def test_stale_entry_revalidates_with_etag():
+    provider = FakeProvider()
+    cache = CachedMetadataProvider(provider, ttl=0)
+
+    await cache.get_metadata("Lycoris Recoil")
+    provider.not_modified = True
+    assert await cache.get_metadata("Lycoris Recoil") == [ALIVE]
+    await asyncio.gather(*cache._background)
+
+    assert provider.calls[-1] == ("Lycoris Recoil", '"v1"')
+    assert cache.stats.stale_served == 1
+    assert cache.stats.not_modified == 1
+
+@pytest.mark.asyncio
+async def test_not_modified_search_still_refreshes_episodes():
+    new_ed = Metadata(anime_title="莉可麗絲", song_title="花の塔", artist="さユり", type="ED", bangumi_id="345678")
+
+    class EpisodeProvider(FakeProvider):
+        async def fetch_episodes(self, subject_id, anime_title, token=None):
+            return [ALIVE, new_ed]
+
+    provider = EpisodeProvider()
+    cache = CachedMetadataProvider(provider, ttl=0)
+    await cache.get_metadata("Lycoris Recoil")
+    provider.not_modified = True
+    await cache.get_metadata("Lycoris Recoil")
+    await asyncio.gather(*cache._background)
+
+    assert cache.stats.not_modified == 1
+    assert (await cache._lookup(title_key("Lycoris Recoil"))).results == [ALIVE, new_ed]
@@ -1,5 +1,6 @@
 import pytest
 import httpx
+import json
 from sidecar.infrastructure.metadata_provider import BangumiMetadataProvider
 
 @pytest.mark.asyncio
@@ -20,6 +21,16 @@ async def test_bangumi_provider_search(respx_mock):
         })
     )
     
+    # Mock Episodes API (OP / ED)
+    respx_mock.get("https://api.bgm.tv/v0/episodes", params={"type": "2"}).mock(
+        return_value=httpx.Response(200, json={
+            "data": [{"name": "ALIVE", "desc": "ALIVE\nClariS"}], "total": 1, "limit": 100, "offset": 0
+        })
+    )
+    respx_mock.get("https://api.bgm.tv/v0/episodes", params={"type": "3"}).mock(
+        return_value=httpx.Response(200, json={"data": [], "total": 0, "limit": 100, "offset": 0})
+    )
+
     provider = BangumiMetadataProvider()
     results = await provider.get_metadata("Lycoris Recoil")
     
@@ -28,3 +39,54 @@ async def test_bangumi_provider_search(respx_mock):
     assert results[0].bangumi_id == "345678"
     assert search_route.called
     assert subject_route.called
+
+@pytest.mark.asyncio
+async def test_bangumi_provider_fetches_all_episode_pages(respx_mock):
+    respx_mock.get("https://api.bgm.tv/search/subject/One Piece").mock(
+        return_value=httpx.Response(200, json={"list": [{"id": 975, "name_cn": "航海王"}]})
+    )
+
+    def episodes(request):
+        ep_type = request.url.params["type"]
+        offset = int(request.url.params["offset"])
+        total = 250 if ep_type == "2" else 3
+        page = [{"name": f"{ep_type}-{i}", "desc": ""} for i in range(offset, min(offset + 100, total))]
+        return httpx.Response(200, json={"data": page, "total": total, "limit": 100, "offset": offset})
+
+    episodes_route = respx_mock.get("https://api.bgm.tv/v0/episodes").mock(side_effect=episodes)
+
+    provider = BangumiMetadataProvider()
+    results = await provider.get_metadata("One Piece")
+
+    assert [m.type for m in results].count("OP") == 250
+    assert [m.type for m in results].count("ED") == 3
+    assert results[0].song_title == "2-0" and results[249].song_title == "2-249"
+    assert episodes_route.call_count == 4  # OP: 3 頁, ED: 1 頁
+
+@pytest.mark.asyncio
+async def test_bangumi_provider_hybrid_uses_local_index(respx_mock, tmp_path):
+    from sidecar.infrastructure.bangumi_index import BangumiIndex
+
+    (tmp_path / "subject.jsonlines").write_text(json.dumps(
+        {"id": 345678, "type": 2, "name": "リコリス・リコイル", "name_cn": "莉可麗絲",
+         "infobox": "|别名={\n[Lycoris Recoil]\n}"}, ensure_ascii=False))
+    (tmp_path / "episode.jsonlines").write_text(json.dumps(
+        {"id": 1, "type": 2, "subject_id": 345678, "sort": 1, "name": "ALIVE", "description": "ALIVE\nClariS"}))
+    index = BangumiIndex(str(tmp_path / "index.sqlite3"))
+    index.import_dump(str(tmp_path))
+    search_route = respx_mock.get("https://api.bgm.tv/search/subject/One Piece").mock(
+        return_value=httpx.Response(200, json={"list": []})
+    )
+
+    provider = BangumiMetadataProvider(index=index, mode="hybrid")
+    results = await provider.get_metadata("Lycoris Recoil")
+    assert [(r.anime_title, r.song_title, r.artist, r.type) for r in results] == [("莉可麗絲", "ALIVE", "ClariS", "OP")]
+    assert not respx_mock.calls
+
+    # 本機找不到時才查詢 API；offline 模式則不查詢
+    assert await provider.get_metadata("One Piece") == []
+    assert search_route.call_count == 1
+    offline = BangumiMetadataProvider(index=index, mode="offline")
+    assert await offline.get_metadata("One Piece") == []
+    assert search_route.call_count == 1
+    await provider.aclose()
@@ -0,0 +1,73 @@
+import asyncio
+
+import httpx
+import pytest
+import respx
+
+from sidecar.domain.models import Source, Task
+from sidecar.domain.stages import measure_writes, timed_write
+from sidecar.infrastructure.http_client import HttpClientPool
+from sidecar.infrastructure.metrics import Histogram, MetricsRegistry, SidecarMetrics, endpoint_label
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    hist = registry.register(Histogram("lat_seconds", "Latency", ("host",), buckets=(0.1, 1.0)))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        hist.observe(value, host='a"b')
+
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP lat_seconds Latency", "# TYPE lat_seconds histogram"]
+    assert 'lat_seconds_bucket{host="a\\"b",le="0.1"} 1' in lines
+    assert 'lat_seconds_bucket{host="a\\"b",le="1"} 3' in lines
+    assert 'lat_seconds_bucket{host="a\\"b",le="+Inf"} 4' in lines
+    assert 'lat_seconds_sum{host="a\\"b"} 4.05' in lines
+    assert 'lat_seconds_count{host="a\\"b"} 4' in lines
+
+
+def test_endpoint_label_drops_ids_and_queries():
+    assert endpoint_label("/search/subject/Some%20Title") == "/search/subject"
+    assert endpoint_label("/v0/subjects/12345") == "/v0/subjects"
+    assert endpoint_label("/dl/2024/01/01/abc.torrent") == "/dl"
+    assert endpoint_label("/topics/view/123_abc.html") == "/topics/view"
+    assert endpoint_label("/") == "/"
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_http_hooks_record_latency_per_host_and_endpoint():
+    respx.get("https://api.bgm.tv/v0/subjects/1").mock(return_value=httpx.Response(200, json={}))
+    respx.get("https://api.bgm.tv/v0/subjects/2").mock(return_value=httpx.Response(404))
+    metrics = SidecarMetrics()
+    pool = HttpClientPool(event_hooks=metrics.http_event_hooks())
+    client = pool.get_client("https://api.bgm.tv")
+
+    await client.get("https://api.bgm.tv/v0/subjects/1")
+    await client.get("https://api.bgm.tv/v0/subjects/2")
+    await pool.aclose()
+
+    assert metrics.http_duration.count(host="api.bgm.tv", endpoint="/v0/subjects", method="GET") == 2
+    assert metrics.http_requests.value(host="api.bgm.tv", endpoint="/v0/subjects", status="404") == 1
+
+
+@pytest.mark.asyncio
+async def test_write_time_accumulates_across_threads_and_rates_render():
+    metrics = SidecarMetrics()
+    task = Task(source=Source.DMHY)
+    with measure_writes() as writes:
+        with timed_write():
+            await asyncio.to_thread(lambda: None)
+    with timed_write():
+        pass  # 不在 measure_writes 內時不累計
+    metrics.observe_stage(task, "write", writes[0])
+    metrics.observe_bytes(task, 5000)
+    metrics.record_cache("metadata", 3, 1)
+    metrics.add_collector(lambda: metrics.record_scheduler({"sources": {"dmhy": {"queued": 2, "running": 1}}}))
+
+    text = metrics.render()
+    assert writes[0] > 0
+    assert 'opused_task_stage_seconds_count{source="dmhy",stage="write"} 1' in text
+    assert 'opused_transfer_bytes_total{source="dmhy"} 5000' in text
+    assert 'opused_transfer_bytes_per_second{source="dmhy"} 500' in text
+    assert 'opused_cache_hit_ratio{cache="metadata"} 0.75' in text
+    assert 'opused_tasks{source="dmhy",state="queued"} 2' in text
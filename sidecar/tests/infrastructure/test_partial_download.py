@@ -0,0 +1,52 @@
+import os
+import httpx
+import pytest
+from sidecar.infrastructure.partial_download import PartialDownload, fetch_resumable
+
+BODY = bytes(range(256)) * 40
+URL = "https://dl.dmhy.org/2024/abc.torrent"
+
+@pytest.mark.asyncio
+async def test_resume_with_range_and_atomic_rename(tmp_path, respx_mock):
+    final_path = str(tmp_path / "abc.torrent")
+    partial = PartialDownload(final_path)
+
+    # 模擬上次中斷：已有一半內容與 manifest
+    with open(partial.part_path, "wb") as f:
+        f.write(BODY[:4000])
+    await partial.save_manifest({"url": URL, "etag": '"e1"'})
+
+    def serve(request):
+        assert request.headers["Range"] == "bytes=4000-"
+        assert request.headers["If-Range"] == '"e1"'
+        return httpx.Response(
+            206,
+            content=BODY[4000:],
+            headers={"Content-Range": f"bytes 4000-{len(BODY) - 1}/{len(BODY)}", "ETag": '"e1"'},
+        )
+
+    respx_mock.get(URL).mock(side_effect=serve)
+    progress = []
+    async with httpx.AsyncClient() as client:
+        await fetch_resumable(client, URL, final_path, on_progress=lambda d, t: progress.append((d, t)))
+
+    with open(final_path, "rb") as f:
+        assert f.read() == BODY
+    assert not os.path.exists(partial.part_path)
+    assert not os.path.exists(partial.manifest_path)
+    assert progress[-1] == (len(BODY), len(BODY))
+
+@pytest.mark.asyncio
+async def test_full_download_when_server_ignores_range(tmp_path, respx_mock):
+    final_path = str(tmp_path / "abc.torrent")
+    partial = PartialDownload(final_path)
+    with open(partial.part_path, "wb") as f:
+        f.write(b"stale")
+    await partial.save_manifest({"url": URL, "etag": '"old"'})
+
+    respx_mock.get(URL).mock(return_value=httpx.Response(200, content=BODY, headers={"ETag": '"new"'}))
+    async with httpx.AsyncClient() as client:
+        await fetch_resumable(client, URL, final_path)
+
+    with open(final_path, "rb") as f:
+        assert f.read() == BODY
@@ -0,0 +1,101 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+
+from sidecar.domain.models import Metadata, PostProcessOptions, Task
+from sidecar.infrastructure.postprocess import (
+    PostProcessPool, build_ffmpeg_command, metadata_tags, process_file, render_filename,
+)
+
+METADATA = Metadata(anime_title="莉可麗絲", song_title="ALIVE", artist="ClariS", type="OP", bangumi_id="329906")
+
+
+def test_postprocess_options_are_validated():
+    with pytest.raises(ValueError):
+        PostProcessOptions(audio_codec="wma")
+    with pytest.raises(ValueError):
+        PostProcessOptions(filename_template="{title}")
+    PostProcessOptions(audio_codec="mp3", filename_template="{anime_title} {type} - {song_title}")
+
+
+def test_render_filename_strips_unsafe_characters():
+    metadata = Metadata(anime_title="Re:Zero", song_title="Redo/Styx", artist="鈴木このみ", type="OP")
+    assert render_filename("{anime_title} {type} - {song_title} ({artist})", metadata) == (
+        "Re_Zero OP - Redo_Styx (鈴木このみ)"
+    )
+
+
+def test_ffmpeg_command_extracts_audio_with_tags_and_cover():
+    cmd = build_ffmpeg_command("ffmpeg", "in.webm", "out.mp3", "mp3", "192k", metadata_tags(METADATA), "cover.jpg")
+    assert cmd[cmd.index("-map") + 1] == "0:a:0"
+    assert ["-i", "cover.jpg"] == cmd[cmd.index("cover.jpg") - 1:cmd.index("cover.jpg") + 1]
+    assert "attached_pic" in cmd and "libmp3lame" in cmd and "192k" in cmd
+    assert "title=ALIVE" in cmd and "album=莉可麗絲" in cmd
+    assert cmd[-1] == "out.mp3"
+
+    # 影片只寫標籤時保留所有串流，且不支援封面
+    video = build_ffmpeg_command("ffmpeg", "in.mkv", "out.mkv", None, None, {"title": "ALIVE"}, "cover.jpg")
+    assert ["-map", "0"] == video[video.index("-map"):video.index("-map") + 2]
+    assert "cover.jpg" not in video and ["-c", "copy"] == video[video.index("-c"):video.index("-c") + 2]
+
+
+def test_process_file_renames_without_ffmpeg(tmp_path):
+    src = tmp_path / "raw title.webm"
+    src.write_bytes(b"audio")
+    (tmp_path / "ALIVE.webm").write_bytes(b"existing")
+    result = process_file(str(src), {"audio_codec": None}, {}, None, "ALIVE")
+    assert result["path"] == str(tmp_path / "ALIVE (2).webm")
+    assert not src.exists() and result["output_bytes"] == 5
+
+
+def test_pool_spawns_workers_by_default():
+    pool = PostProcessPool(workers=1)
+    executor = pool._get_executor()
+    assert executor._mp_context.get_start_method() == "spawn"
+    pool.shutdown()
+
+@pytest.mark.asyncio
+async def test_pool_bounds_workers_and_reports_queue(tmp_path):
+    calls = []
+
+    def fake_worker(src, options, tags, cover, filename):
+        calls.append((os.path.basename(src), options["audio_codec"], tags["title"], filename))
+        time.sleep(0.05)
+        return {"path": src + ".mp3", "input_bytes": 10, "output_bytes": 4, "seconds": 0.05}
+
+    pool = PostProcessPool(workers=1, executor=ThreadPoolExecutor(1), worker=fake_worker)
+    options = PostProcessOptions(audio_codec="mp3", filename_template="{song_title}")
+    tasks = [
+        Task(metadata=METADATA, postprocess=options, output_files=[str(tmp_path / f"{i}.webm")]) for i in range(3)
+    ]
+    jobs = [asyncio.create_task(pool.process(t)) for t in tasks]
+    await asyncio.sleep(0.02)
+    assert (pool.stats()["running"], pool.stats()["queued"]) == (1, 2)
+
+    results = await asyncio.gather(*jobs)
+    assert results[0] == [str(tmp_path / "0.webm.mp3")]
+    assert calls[0] == ("0.webm", "mp3", "ALIVE", "ALIVE")
+    stats = pool.stats()
+    assert (stats["completed"], stats["queued"], stats["running"], stats["files_per_minute"]) == (3, 0, 0, 3.0)
+    assert (stats["input_bytes"], stats["output_bytes"]) == (30, 12)
+    pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_cover_write_failure_is_retried(tmp_path, respx_mock):
+    respx_mock.get("https://api.bgm.tv/v0/subjects/329906/image").mock(return_value=httpx.Response(200, content=b"jpg"))
+    cover_dir = tmp_path / "covers"
+    cover_dir.write_bytes(b"")  # 與資料夾同名的檔案，建立資料夾失敗
+    async with httpx.AsyncClient() as client:
+        pool = PostProcessPool(client=client, cover_dir=str(cover_dir))
+        assert await pool._cover("329906") is None
+
+        cover_dir.unlink()
+        path = await pool._cover("329906")
+    assert path == str(cover_dir / "329906.jpg")
+    with open(path, "rb") as f:
+        assert f.read() == b"jpg"
@@ -0,0 +1,30 @@
+import threading
+import time
+
+from sidecar.infrastructure.profiler import SamplingProfiler
+
+
+def _busy_wait(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sampling_profiler_finds_busy_thread():
+    stop = threading.Event()
+    worker = threading.Thread(target=_busy_wait, args=(stop,), name="busy_0")
+    worker.start()
+    profiler = SamplingProfiler(interval=0.001)
+    try:
+        profiler.start()
+        time.sleep(0.2)
+        profiler.stop()
+    finally:
+        stop.set()
+        worker.join()
+
+    stats = profiler.stats(limit=5)
+    assert stats["samples"] > 10 and not stats["running"]
+    assert stats["threads"]["busy"] > 0
+    hot = next(t for t in stats["top"] if t["thread"] == "busy")
+    assert any(frame.endswith(":_busy_wait") for frame in hot["stack"])
+    assert "busy;" in profiler.folded()
@@ -0,0 +1,90 @@
+import time
+
+import httpx
+import pytest
+
+from sidecar.infrastructure.rate_limit import (
+    AdaptiveRateLimiter, HostBucket, RateLimitConfig, RetryTransport, parse_retry_after,
+)
+
+FAST = RateLimitConfig(initial_rate=100, burst=10, backoff_base=0.01, decrease_cooldown=0)
+
+
+def _client(handler, config=FAST):
+    limiter = AdaptiveRateLimiter(config)
+    return httpx.AsyncClient(transport=RetryTransport(httpx.MockTransport(handler), limiter)), limiter
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:10 GMT", now=1445412480) == 10.0
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+
+@pytest.mark.asyncio
+async def test_retries_idempotent_requests_and_honors_retry_after():
+    calls = []
+
+    def handler(request):
+        calls.append(time.perf_counter())
+        if len(calls) < 3:
+            return httpx.Response(429, headers={"Retry-After": "0.1"})
+        return httpx.Response(200, json={"ok": True})
+
+    client, limiter = _client(handler)
+    response = await client.get("https://api.bgm.tv/search/subject/x")
+    assert response.json() == {"ok": True}
+    assert len(calls) == 3
+    assert calls[1] - calls[0] >= 0.1
+    stats = limiter.stats()["api.bgm.tv"]
+    assert (stats["throttled"], stats["retries"]) == (2, 2)
+    # 兩次 429 各減半
+    assert stats["rate"] == pytest.approx(25, abs=0.1)
+    await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_gives_up_after_max_retries_and_skips_non_idempotent():
+    calls = {"GET": 0, "POST": 0}
+
+    def handler(request):
+        calls[request.method] += 1
+        return httpx.Response(503)
+
+    client, _ = _client(handler, RateLimitConfig(initial_rate=100, burst=10, backoff_base=0.01, max_retries=2))
+    assert (await client.get("https://share.dmhy.org/")).status_code == 503
+    assert (await client.post("https://share.dmhy.org/")).status_code == 503
+    assert calls == {"GET": 3, "POST": 1}
+    await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_retries_timeouts():
+    attempts = []
+
+    def handler(request):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise httpx.ReadTimeout("slow", request=request)
+        return httpx.Response(200)
+
+    client, _ = _client(handler)
+    assert (await client.get("https://api.bgm.tv/v0/episodes")).status_code == 200
+    assert len(attempts) == 2
+    await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_bucket_paces_requests_and_increases_on_success():
+    bucket = HostBucket(RateLimitConfig(initial_rate=20, burst=1, max_rate=21, increase=1))
+    started = time.perf_counter()
+    for _ in range(5):
+        await bucket.acquire()
+    # 第一個用掉 burst，其餘每 50ms 一個
+    assert time.perf_counter() - started >= 0.18
+    for _ in range(100):
+        bucket.on_success(0.01)
+    assert bucket.rate == 21
+    bucket.on_success(10.0)
+    assert bucket.rate == pytest.approx(21 * 0.8)
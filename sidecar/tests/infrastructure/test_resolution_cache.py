@@ -0,0 +1,38 @@
+import pytest
+from sidecar.domain.models import Task, Metadata, Source, DownloadMode
+from sidecar.infrastructure.resolution_cache import SQLiteResolutionCache, resolution_key
+
+META = Metadata(anime_title="Lycoris Recoil", song_title="ALIVE", artist="ClariS", type="OP")
+
+def test_key_normalizes_query_and_separates_dmhy_modes():
+    a = Task(source=Source.YOUTUBE, metadata=META)
+    b = Task(source=Source.YOUTUBE, metadata=Metadata("ＬＹＣＯＲＩＳ  recoil", "alive", "x", "op"))
+    assert resolution_key(a) == resolution_key(b)
+    assert resolution_key(Task(source=Source.YOUTUBE, metadata=META, custom_keywords="ALIVE ClariS")) != resolution_key(a)
+
+    video = Task(source=Source.DMHY, dmhy_mode=DownloadMode.VIDEO, metadata=META)
+    torrent = Task(source=Source.DMHY, dmhy_mode=DownloadMode.TORRENT, metadata=META)
+    assert resolution_key(video) != resolution_key(torrent)
+
+@pytest.mark.asyncio
+async def test_persists_across_instances_and_invalidates(tmp_path):
+    db = str(tmp_path / "resolutions.sqlite3")
+    task = Task(source=Source.YOUTUBE, metadata=META)
+    cache = SQLiteResolutionCache(db)
+    await cache.put(task, "https://www.youtube.com/watch?v=abc")
+    cache.close()
+
+    cache = SQLiteResolutionCache(db)
+    assert await cache.get(Task(source=Source.YOUTUBE, metadata=META)) == "https://www.youtube.com/watch?v=abc"
+    await cache.invalidate(task)
+    assert await cache.get(task) is None
+    assert cache.get_stats() == {"hits": 1, "misses": 1, "stores": 0, "invalidations": 1}
+    cache.close()
+
+@pytest.mark.asyncio
+async def test_expired_entries_are_dropped(tmp_path):
+    cache = SQLiteResolutionCache(str(tmp_path / "r.sqlite3"), ttl=-1)
+    task = Task(source=Source.YOUTUBE, metadata=META)
+    await cache.put(task, "https://www.youtube.com/watch?v=abc")
+    assert await cache.get(task) is None
+    cache.close()
@@ -0,0 +1,113 @@
+import asyncio
+import os
+import time
+import httpx
+import pytest
+from sidecar.infrastructure import segmented_download
+from sidecar.infrastructure.bandwidth import BandwidthLimiter
+from sidecar.infrastructure.partial_download import PartialDownload
+from sidecar.infrastructure.segmented_download import fetch_segmented
+
+BODY = bytes(range(256)) * 40
+URL = "https://cdn.example.com/op.mkv"
+SEGMENT = 1000
+
+def _segments(first=0):
+    return [(i, min(i + SEGMENT, len(BODY)) - 1) for i in range(first, len(BODY), SEGMENT)]
+
+def _range_server(requests):
+    def serve(request):
+        start, end = map(int, request.headers["Range"][len("bytes="):].split("-"))
+        requests.append((start, end))
+        end = min(end, len(BODY) - 1)
+        return httpx.Response(
+            206,
+            content=BODY[start:end + 1],
+            headers={"Content-Range": f"bytes {start}-{end}/{len(BODY)}", "ETag": '"v1"'},
+        )
+    return serve
+
+@pytest.mark.asyncio
+async def test_segments_fetched_in_parallel(tmp_path, respx_mock, monkeypatch):
+    monkeypatch.setattr(segmented_download, "PROBE_INTERVAL", 0.001)
+    requests = []
+    respx_mock.get(URL).mock(side_effect=_range_server(requests))
+    final_path = str(tmp_path / "op.mkv")
+    progress = []
+    async with httpx.AsyncClient() as client:
+        await fetch_segmented(
+            client, URL, final_path, on_progress=lambda d, t: progress.append((d, t)),
+            max_connections=3, segment_size=SEGMENT,
+        )
+
+    with open(final_path, "rb") as f:
+        assert f.read() == BODY
+    assert sorted(requests) == _segments()
+    assert progress[-1] == (len(BODY), len(BODY))
+    assert not os.path.exists(PartialDownload(final_path).manifest_path)
+
+@pytest.mark.asyncio
+async def test_resume_fetches_only_missing_segments(tmp_path, respx_mock):
+    final_path = str(tmp_path / "op.mkv")
+    partial = PartialDownload(final_path)
+    with open(partial.part_path, "wb") as f:
+        f.write(BODY[:2 * SEGMENT] + bytes(len(BODY) - 2 * SEGMENT))
+    await partial.save_manifest({
+        "url": URL, "etag": '"v1"', "total_bytes": len(BODY), "segment_size": SEGMENT, "done": [0, 1],
+    })
+
+    requests = []
+    respx_mock.get(URL).mock(side_effect=_range_server(requests))
+    async with httpx.AsyncClient() as client:
+        await fetch_segmented(client, URL, final_path, max_connections=2, segment_size=SEGMENT)
+
+    with open(final_path, "rb") as f:
+        assert f.read() == BODY
+    # 第一個請求確認內容未變，之後只下載未完成的段
+    assert requests[0] == (0, 0)
+    assert sorted(requests[1:]) == _segments(2 * SEGMENT)
+
+@pytest.mark.asyncio
+async def test_single_stream_when_range_unsupported(tmp_path, respx_mock):
+    route = respx_mock.get(URL).mock(return_value=httpx.Response(200, content=BODY))
+    final_path = str(tmp_path / "op.mkv")
+    async with httpx.AsyncClient() as client:
+        await fetch_segmented(client, URL, final_path, segment_size=SEGMENT)
+
+    with open(final_path, "rb") as f:
+        assert f.read() == BODY
+    assert route.call_count == 1
+
+@pytest.mark.asyncio
+async def test_range_without_total_is_not_taken_as_whole_file(tmp_path, respx_mock):
+    ranges = []
+
+    def serve(request):
+        ranges.append(request.headers.get("Range"))
+        if "Range" in request.headers:
+            # 總長度未知：只回傳要求的第一段
+            return httpx.Response(206, content=BODY[:SEGMENT], headers={"Content-Range": f"bytes 0-{SEGMENT - 1}/*"})
+        return httpx.Response(200, content=BODY)
+
+    respx_mock.get(URL).mock(side_effect=serve)
+    final_path = str(tmp_path / "op.mkv")
+    async with httpx.AsyncClient() as client:
+        await fetch_segmented(client, URL, final_path, segment_size=SEGMENT)
+
+    with open(final_path, "rb") as f:
+        assert f.read() == BODY
+    assert ranges == [f"bytes=0-{SEGMENT - 1}", None]
+
+@pytest.mark.asyncio
+async def test_task_and_global_caps():
+    limiter = BandwidthLimiter(rate=20_000)
+    with limiter.throttle("a", rate=5_000) as a, limiter.throttle("b") as b:
+        assert a.share() == 5_000
+        assert b.share() == 10_000
+        started = time.perf_counter()
+        # 任務 a 的 bucket 先用掉一秒的額度，之後每 2500 bytes 要等約 0.5 秒
+        await a.consume(5_000)
+        await a.consume(2_500)
+        assert time.perf_counter() - started >= 0.45
+    assert limiter.stats()["active"] == 0
+    assert limiter.stats()["bytes"] == 7_500
@@ -0,0 +1,70 @@
+import asyncio
+import pytest
+from sidecar.domain.models import Task, TaskStatus
+from sidecar.infrastructure.task_manager import TaskManager
+from sidecar.infrastructure.task_events import TaskEventBus
+
+@pytest.fixture
+def manager():
+    TaskManager.reset_instance()
+    yield TaskManager.get_instance()
+    TaskManager.reset_instance()
+
+async def _collect(stream, count):
+    return [await asyncio.wait_for(stream.__anext__(), 1) for _ in range(count)]
+
+@pytest.mark.asyncio
+async def test_snapshot_then_throttled_deltas(manager):
+    bus = TaskEventBus(manager, max_events_per_second=10)
+    manager.add_task(Task(id="old"))
+    stream = bus.subscribe()
+    (snapshot,) = await _collect(stream, 1)
+    assert snapshot.kind == "snapshot"
+    assert [t["task_id"] for t in snapshot.data["tasks"]] == ["old"]
+
+    task = Task(id="t1")
+    manager.add_task(task)
+    task.update_status(TaskStatus.DOWNLOADING, progress=1.0)
+    for p in range(2, 50):
+        task.update_status(TaskStatus.DOWNLOADING, progress=float(p))
+
+    # added 與尚未送出的 updated 合併；之後的進度被節流合併為最後一筆
+    added, = await _collect(stream, 1)
+    assert added.kind == "added" and added.data["status"] == "downloading"
+    update, = await _collect(stream, 1)
+    assert update.kind == "updated" and update.data["progress"] == 49.0
+
+    task.update_status(TaskStatus.COMPLETED, progress=100.0)
+    done, = await _collect(stream, 1)
+    assert done.data["status"] == "completed"
+    assert done.version > update.version > added.version
+    await stream.aclose()
+
+@pytest.mark.asyncio
+async def test_resume_from_version(manager):
+    bus = TaskEventBus(manager)
+    manager.add_task(Task(id="a"))
+    checkpoint = bus.version
+    manager.add_task(Task(id="b"))
+    manager.remove_task("a")
+
+    stream = bus.subscribe(since=checkpoint)
+    events = await _collect(stream, 2)
+    assert [(e.kind, e.task_id) for e in events] == [("added", "b"), ("removed", "a")]
+    await stream.aclose()
+
+    # 超出歷史範圍時改送快照
+    assert bus.events_since(bus.version + 5) is None
+
+def test_event_ids_carry_boot_epoch(manager):
+    bus = TaskEventBus(manager)
+    manager.add_task(Task(id="a"))
+    event_id = bus.event_id(bus.snapshot())
+    assert bus.parse_event_id(event_id) == bus.version
+
+    # 重啟後的新 bus 不接受舊的 id 與沒有批次的舊格式，改送快照
+    rebooted = TaskEventBus(manager)
+    manager.add_task(Task(id="b"))
+    assert rebooted.parse_event_id(event_id) is None
+    assert rebooted.parse_event_id(str(bus.version)) is None
+    assert rebooted.parse_event_id(None) is None
@@ -0,0 +1,58 @@
+import pytest
+from sidecar.domain.models import Task, TaskStatus, Source
+from sidecar.infrastructure.task_manager import TaskManager
+
+@pytest.fixture
+def manager():
+    TaskManager.reset_instance()
+    yield TaskManager.get_instance()
+    TaskManager.reset_instance()
+
+def test_status_index_follows_updates(manager):
+    task = Task(id="a", source=Source.DMHY)
+    manager.add_task(task)
+    manager.add_task(Task(id="b"))
+    task.update_status(TaskStatus.DOWNLOADING, progress=10.0)
+
+    page = manager.query(statuses=[TaskStatus.DOWNLOADING])
+    assert [t.id for t in page.tasks] == ["a"]
+    assert [t.id for t in manager.query(sources=[Source.YOUTUBE]).tasks] == ["b"]
+    assert manager.count(TaskStatus.PENDING) == 1
+
+def test_cursor_pagination(manager):
+    for i in range(5):
+        manager.add_task(Task(id=f"t{i}"))
+
+    first = manager.query(limit=2)
+    second = manager.query(limit=2, cursor=first.next_cursor)
+    last = manager.query(limit=2, cursor=second.next_cursor)
+    assert [t.id for t in first.tasks + second.tasks + last.tasks] == [f"t{i}" for i in range(5)]
+    assert last.next_cursor is None
+
+def test_finished_tasks_are_evicted_by_count(manager):
+    manager.configure(terminal_ttl=None, max_terminal=2)
+    removed = []
+    manager.add_listener(lambda kind, t: kind == "removed" and removed.append(t.id))
+    for i in range(4):
+        task = Task(id=f"t{i}")
+        manager.add_task(task)
+        task.update_status(TaskStatus.COMPLETED, progress=100.0)
+    manager.add_task(Task(id="running"))
+
+    assert removed == ["t0", "t1"]
+    assert {t.id for t in manager.get_all_tasks()} == {"t2", "t3", "running"}
+
+def test_batch_index(manager):
+    events = []
+    manager.add_listener(lambda kind, t: events.append((kind, t.id)))
+    version = manager.version
+    manager.add_tasks([Task(id=f"t{i}", batch_id="B") for i in range(3)] + [Task(id="other")])
+
+    assert manager.version == version + 1
+    assert events == [("added", "t0"), ("added", "t1"), ("added", "t2"), ("added", "other")]
+    assert [t.id for t in manager.get_batch("B")] == ["t0", "t1", "t2"]
+    assert [t.id for t in manager.query(batch_id="B", limit=2).tasks] == ["t0", "t1"]
+
+    manager.remove_task("t1")
+    assert [t.id for t in manager.get_batch("B")] == ["t0", "t2"]
+    assert manager.get_batch("missing") == []
@@ -0,0 +1,22 @@
+import pytest
+
+from sidecar.domain.models import Source, Task
+from sidecar.infrastructure.task_trace import chrome_trace
+
+
+def test_chrome_trace_puts_each_task_on_its_own_row():
+    first, second = Task(anime_title="A"), Task(anime_title="B", source=Source.DMHY, batch_id="b1")
+    origin = first.timeline.origin
+    first.timeline.add("resolve", origin + 0.1, origin + 0.3, shared=False)
+    second.timeline.add("transfer", second.timeline.origin, second.timeline.origin + 1.0)
+
+    events = chrome_trace([second, first])["traceEvents"]
+
+    rows = {e["args"]["name"]: e["tid"] for e in events if e["name"] == "thread_name"}
+    assert rows == {"A [youtube]": 1, "B [dmhy]": 2}
+    resolve = next(e for e in events if e["name"] == "resolve")
+    task_box = next(e for e in events if e["name"] == "task" and e["tid"] == 1)
+    assert resolve["ph"] == "X" and resolve["dur"] == 200000.0
+    assert resolve["ts"] - task_box["ts"] == pytest.approx(100000.0, abs=1)
+    assert task_box["dur"] == 300000.0
+    assert resolve["args"]["shared"] is False
@@ -0,0 +1,108 @@
+import os
+import pytest
+from sidecar.domain.models import Task, Metadata, Source, TaskStatus
+from sidecar.infrastructure.youtube_downloader import YouTubeDownloader, YTDLP_OPTIONS
+from sidecar.infrastructure.ytdlp_pool import YtdlpProcessPool, YtdlpWorkerError
+
+# 以本機檔案代替網路來源
+OPTIONS = {**YTDLP_OPTIONS, "enable_file_urls": True}
+
+
+def _source(tmp_path, name="song.mp3", size=300_000):
+    path = tmp_path / "src" / name
+    path.parent.mkdir(exist_ok=True)
+    path.write_bytes(os.urandom(size))
+    return path
+
+
+@pytest.mark.asyncio
+async def test_runs_in_worker_process_and_reports_progress(tmp_path):
+    source = _source(tmp_path)
+    pool = YtdlpProcessPool(workers=1, warm_opts=OPTIONS)
+    pool.start()
+    progress = []
+    try:
+        await pool.run(source.as_uri(), str(tmp_path / "out"), OPTIONS, on_progress=progress.append)
+        stats = pool.stats()
+    finally:
+        pool.shutdown()
+
+    assert (tmp_path / "out" / "song.mp3").read_bytes() == source.read_bytes()
+    assert stats["workers"][0]["pid"] != os.getpid()
+    downloads = [p for p in progress if not p["status"].startswith("postprocessor_")]
+    assert downloads[-1]["status"] == "finished"
+    assert downloads[-1]["info_dict"]["webpage_url"] == source.as_uri()
+    # 後處理 (至少有搬移檔案) 也會回報，供任務時間軸使用
+    assert progress[-1] == {"status": "postprocessor_finished", "postprocessor": "MoveFiles"}
+
+
+@pytest.mark.asyncio
+async def test_workers_are_recycled_after_max_jobs(tmp_path):
+    sources = [_source(tmp_path, f"{i}.mp3", 10_000) for i in range(2)]
+    pool = YtdlpProcessPool(workers=1, max_jobs_per_worker=1)
+    pids = []
+    try:
+        for source in sources:
+            await pool.run(source.as_uri(), str(tmp_path / "out"), OPTIONS)
+            pids.append(pool.stats()["workers"][0]["pid"])
+    finally:
+        pool.shutdown()
+
+    assert len(set(pids)) == 2
+    assert sorted(os.listdir(tmp_path / "out")) == ["0.mp3", "1.mp3"]
+
+
+@pytest.mark.asyncio
+async def test_errors_propagate_and_worker_is_reused(tmp_path):
+    source = _source(tmp_path)
+    pool = YtdlpProcessPool(workers=1)
+    try:
+        with pytest.raises(YtdlpWorkerError):
+            await pool.run((tmp_path / "missing.mp3").as_uri(), str(tmp_path / "out"), OPTIONS)
+        pid = pool.stats()["workers"][0]["pid"]
+        await pool.run(source.as_uri(), str(tmp_path / "out"), OPTIONS)
+        assert pool.stats()["workers"][0]["pid"] == pid
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_youtube_downloader_uses_pool(tmp_path, monkeypatch):
+    source = _source(tmp_path)
+    monkeypatch.setitem(YTDLP_OPTIONS, "enable_file_urls", True)
+    pool = YtdlpProcessPool(workers=1)
+    task = Task(
+        source=Source.YOUTUBE,
+        target_dir=str(tmp_path / "out"),
+        resolved_url=source.as_uri(),
+        metadata=Metadata(anime_title="A", song_title="B", artist="C", type="OP"),
+    )
+    try:
+        assert await YouTubeDownloader(pool=pool).download(task)
+    finally:
+        pool.shutdown()
+
+    assert task.status == TaskStatus.COMPLETED
+    assert os.path.exists(tmp_path / "out" / "song.mp3")
+
+
+@pytest.mark.asyncio
+async def test_extract_resolves_url_without_downloading(tmp_path):
+    source = _source(tmp_path)
+    pool = YtdlpProcessPool(workers=1)
+    try:
+        assert await pool.extract(source.as_uri(), OPTIONS) == source.as_uri()
+    finally:
+        pool.shutdown()
+    assert not (tmp_path / "out").exists()
+
+
+@pytest.mark.asyncio
+async def test_started_workers_report_warm():
+    pool = YtdlpProcessPool(workers=2, warm_opts=OPTIONS)
+    try:
+        pool.start()
+        assert await pool.wait_warm(timeout=60) == 2
+        assert all(w["warm"] for w in pool.stats()["workers"])
+    finally:
+        pool.shutdown()
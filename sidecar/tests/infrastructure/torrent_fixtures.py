@@ -0,0 +1,149 @@
+"""本機 BT 測試環境：產生 torrent、HTTP tracker 與做種 peer，全部只聽 127.0.0.1。"""
+
+import asyncio
+import hashlib
+import os
+import struct
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import unquote_to_bytes, urlsplit
+
+from sidecar.infrastructure import bencode
+from sidecar.infrastructure.bittorrent import PROTOCOL
+
+
+class TorrentFixture:
+    """以隨機內容建立多檔案 torrent。"""
+
+    def __init__(self, files: List[Tuple[str, int]], piece_length: int = 32 * 1024, name: str = "release"):
+        self.files = [(path, os.urandom(length)) for path, length in files]
+        self.piece_length = piece_length
+        self.payload = b"".join(data for _, data in self.files)
+        pieces = b"".join(
+            hashlib.sha1(self.payload[i:i + piece_length]).digest()
+            for i in range(0, len(self.payload), piece_length)
+        )
+        self.info = bencode.encode({
+            "name": name,
+            "piece length": piece_length,
+            "pieces": pieces,
+            "files": [{"path": path.split("/"), "length": len(data)} for path, data in self.files],
+        })
+        self.info_hash = hashlib.sha1(self.info).digest()
+
+    def content(self, path: str) -> bytes:
+        return dict(self.files)[path]
+
+    def torrent(self, announce: str) -> bytes:
+        return b"d8:announce%d:%s4:info%se" % (len(announce), announce.encode(), self.info)
+
+    def magnet(self, announce: str) -> str:
+        return f"magnet:?xt=urn:btih:{self.info_hash.hex()}&dn=release&tr={announce}"
+
+
+class Seeder:
+    """擁有完整內容的 peer；支援 ut_metadata，可指定要送出壞資料的 piece。"""
+
+    def __init__(self, fixture: TorrentFixture, corrupt: Optional[Set[int]] = None):
+        self.fixture = fixture
+        self.corrupt = corrupt or set()
+        self.served: Dict[int, int] = {}  # piece -> 送出的區塊數
+        self.server: Optional[asyncio.base_events.Server] = None
+        self.port = 0
+
+    async def start(self) -> "Seeder":
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _send(self, writer, msg_id: int, payload: bytes = b"") -> None:
+        writer.write(struct.pack(">IB", len(payload) + 1, msg_id) + payload)
+        await writer.drain()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        fixture = self.fixture
+        try:
+            handshake = await reader.readexactly(68)
+            if handshake[28:48] != fixture.info_hash:
+                return
+            reserved = bytearray(8)
+            reserved[5] |= 0x10
+            writer.write(bytes([19]) + PROTOCOL + bytes(reserved) + fixture.info_hash + b"-SEED00-000000000000")
+            num_pieces = -(-len(fixture.payload) // fixture.piece_length)
+            bitfield = bytearray(-(-num_pieces // 8))
+            for i in range(num_pieces):
+                bitfield[i // 8] |= 0x80 >> (i % 8)
+            await self._send(writer, 5, bytes(bitfield))
+
+            remote_metadata_id = None
+            while True:
+                (length,) = struct.unpack(">I", await reader.readexactly(4))
+                if length == 0:
+                    continue
+                body = await reader.readexactly(length)
+                msg_id, payload = body[0], body[1:]
+                if msg_id == 2:  # interested
+                    await self._send(writer, 1)
+                elif msg_id == 6:  # request
+                    index, begin, size = struct.unpack(">III", payload)
+                    start = index * fixture.piece_length + begin
+                    block = fixture.payload[start:start + size]
+                    if index in self.corrupt:
+                        block = bytes(len(block))
+                    self.served[index] = self.served.get(index, 0) + 1
+                    await self._send(writer, 7, struct.pack(">II", index, begin) + block)
+                elif msg_id == 20 and payload[0] == 0:
+                    remote_metadata_id = bencode.decode(payload[1:])[b"m"][b"ut_metadata"]
+                    ext = bencode.encode({"m": {"ut_metadata": 1}, "metadata_size": len(fixture.info)})
+                    await self._send(writer, 20, b"\x00" + ext)
+                elif msg_id == 20 and payload[0] == 1:
+                    request = bencode.decode(payload[1:])
+                    piece = request[b"piece"]
+                    data = fixture.info[piece * 16384:(piece + 1) * 16384]
+                    header = bencode.encode({"msg_type": 1, "piece": piece, "total_size": len(fixture.info)})
+                    await self._send(writer, 20, bytes([remote_metadata_id]) + header + data)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+class Tracker:
+    """回傳固定 peer 清單 (compact 格式) 的 HTTP tracker。"""
+
+    def __init__(self, info_hash: bytes, peers: List[Tuple[str, int]]):
+        self.info_hash = info_hash
+        self.peers = peers
+        self.announces = 0
+        self.server: Optional[asyncio.base_events.Server] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}/announce"
+
+    async def start(self) -> "Tracker":
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self
+
+    async def stop(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        request_line = (await reader.readline()).decode()
+        while (await reader.readline()) not in (b"\r\n", b""):
+            pass
+        query = urlsplit(request_line.split(" ")[1]).query
+        params = {k: v for k, v in (p.split("=", 1) for p in query.split("&"))}
+        if unquote_to_bytes(params["info_hash"]) == self.info_hash:
+            self.announces += 1
+            peers = b"".join(bytes(map(int, ip.split("."))) + struct.pack(">H", port) for ip, port in self.peers)
+            body = bencode.encode({"interval": 60, "peers": peers})
+        else:
+            body = bencode.encode({"failure reason": "unknown torrent"})
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\nConnection: close\r\n\r\n%s" % (len(body), body))
+        await writer.drain()
+        writer.close()